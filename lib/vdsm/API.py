@@ -50,10 +50,11 @@ from vdsm.common import conv
 from vdsm.common.commands import terminating
 from vdsm.common.compat import subprocess
 from vdsm.host import api as hostapi
-from vdsm.host import caps
+from vdsm.host import capscache
 # TODO fix name conflict and use from vdsm.storage import sd
 import vdsm.storage.sd
 from vdsm.storage import clusterlock
+from vdsm.storage import locktrace
 from vdsm.storage import managedvolume
 from vdsm.storage import constants as sc
 from vdsm.virt import migration
@@ -1364,13 +1365,25 @@ class Global(APIBase):
         return response.success()
 
     @api.logged(on="api.host")
-    def getCapabilities(self):
+    def getCapabilities(self, ifChangedSince=None):
         """
         Report host capabilities.
+
+        If ifChangedSince is the generation of the current capabilities,
+        report only the generation. The generation is not reported if
+        after_get_caps hooks are installed, since they may modify the
+        report.
         """
         hooks.before_get_caps()
-        c = caps.get()
-        c['netConfigDirty'] = str(self._cif._netConfigDirty)
+        generation, c = capscache.get()
+        dirty = self._cif._netConfigDirty
+        if generation is not None and not hooks.has_scripts('after_get_caps'):
+            # netConfigDirty is not part of the cached report.
+            generation = '%s-%d' % (generation, dirty)
+            if generation == ifChangedSince:
+                return {'status': doneCode, 'info': {'generation': generation}}
+            c['generation'] = generation
+        c['netConfigDirty'] = str(dirty)
         c = hooks.after_get_caps(c)
 
         return {'status': doneCode, 'info': c}
@@ -1567,6 +1580,9 @@ class Global(APIBase):
         except exception.HookError as e:
             return response.error('hookError', 'Hook error: ' + str(e))
         finally:
+            # Also after failures, since the network may have changed before
+            # the setup was rolled back.
+            capscache.invalidate('network setup')
             self._cif._networkSemaphore.release()
 
     def setSafeNetworkConfig(self):
@@ -1607,6 +1623,9 @@ class Global(APIBase):
         return response.success(
             info=supervdsm.getProxy().get_lldp_info(filter))
 
+    def getLockStats(self):
+        return response.success(lockStats=locktrace.stats())
+
     # Top-level storage functions
     def getStorageDomains(self, storagepoolID=None, domainClass=None,
                           storageType=None, remotePath=None):
@@ -71,6 +71,13 @@ try:
 except ImportError:
     _glusterEnabled = False
 
+# Events repeated for every failed I/O request or write above the threshold,
+# which are coalesced while waiting to be handled.
+_COALESCED_EVENTS = frozenset([
+    libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON,
+    libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD,
+])
+
 
 class clientIF(object):
     """
@@ -656,6 +663,18 @@ class clientIF(object):
         if v is None:
             return
 
+        # Handlers may block, so they do not run in the event loop thread,
+        # delaying the events of other vms.
+        key = None
+        if eventid in _COALESCED_EVENTS:
+            # Storms of identical events are handled once; the last item of
+            # args is the event id.
+            key = (eventid,) + args[:-1]
+        events.dispatch(
+            v.id, partial(self._handle_libvirt_event, v, eventid, args),
+            key=key)
+
+    def _handle_libvirt_event(self, v, eventid, args):
         try:
             # pylint cannot tell that unpacking the args tuple is safe, so we
             # must disbale this check here.
@@ -691,6 +710,9 @@ class clientIF(object):
                 v.onWatchdogEvent(action)
             elif eventid == libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED:
                 v.onJobCompleted(args)
+            elif eventid == libvirt.VIR_DOMAIN_EVENT_ID_MIGRATION_ITERATION:
+                iteration, = args[:-1]
+                v.onMigrationIteration(iteration)
             elif eventid == libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED:
                 device_alias, = args[:-1]
                 v.onDeviceRemoved(device_alias)
@@ -22,6 +22,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
+import collections
 import glob
 import hashlib
 import itertools
@@ -30,15 +31,22 @@ import logging
 import os
 import os.path
 import pkgutil
+import select
 import subprocess
 import sys
 import tempfile
+import threading
 
 import six
 
 from vdsm.common import commands
+from vdsm.common import concurrent
 from vdsm.common import exception
+from vdsm.common import inotify
+from vdsm.common.config import config
 from vdsm.common.constants import P_VDSM_HOOKS, P_VDSM_RUN
+from vdsm.common.osutils import uninterruptible_poll
+from vdsm.common.time import monotonic_time
 
 _LAUNCH_FLAGS_FILE = 'launchflags'
 _LAUNCH_FLAGS_PATH = os.path.join(
@@ -63,15 +71,348 @@ def _scriptsPerDir(dir_name):
 _DOMXML_HOOK = 1
 _JSON_HOOK = 2
 
+_Script = collections.namedtuple("_Script", "path, python")
+
+# Returned for all hook points without scripts.
+_NO_SCRIPTS = ()
+
+_cache = None
+_workers = None
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def start():
+    """
+    Start caching hook scripts, and running python hook scripts in
+    persistent workers if enabled.
+    """
+    global _cache, _workers
+    cache = _ScriptsCache(P_VDSM_HOOKS)
+    try:
+        cache.start()
+    except Exception:
+        logging.exception("Cannot monitor %s, hook scripts will not be "
+                          "cached", P_VDSM_HOOKS)
+    else:
+        _cache = cache
+
+    max_workers = config.getint('vars', 'hooks_python_workers')
+    if max_workers > 0:
+        _workers = _WorkerPool(max_workers)
+
+
+def stop():
+    global _cache, _workers
+    cache, _cache = _cache, None
+    if cache is not None:
+        cache.stop()
+    workers, _workers = _workers, None
+    if workers is not None:
+        workers.stop()
+
+
+def stats():
+    """
+    Return hook scripts timing, indexed by hook point and script name.
+    """
+    with _stats_lock:
+        return {dir: {script: dict(info) for script, info in scripts.items()}
+                for dir, scripts in _stats.items()}
+
+
+def _record(dir, script, elapsed):
+    name = os.path.basename(script)
+    with _stats_lock:
+        info = _stats.setdefault(dir, {}).get(name)
+        if info is None:
+            info = _stats[dir][name] = {
+                'calls': 0, 'total_time': 0.0, 'max_time': 0.0}
+        info['calls'] += 1
+        info['total_time'] += elapsed
+        info['max_time'] = max(info['max_time'], elapsed)
+
+
+def _scripts(dir_name):
+    """
+    Return sorted tuple of scripts for hook point dir_name.
+    """
+    cache = _cache
+    if cache is not None and cache.root == P_VDSM_HOOKS:
+        return cache.get(dir_name)
+    return _list_scripts(dir_name)
+
+
+def has_scripts(dir_name):
+    """
+    Return True if hook point dir_name has scripts.
+    """
+    return bool(_scripts(dir_name))
+
+
+def _list_scripts(dir_name):
+    paths = _scriptsPerDir(dir_name)
+    if not paths:
+        return _NO_SCRIPTS
+    return tuple(_Script(path, _is_python(path)) for path in sorted(paths))
+
+
+def _is_python(path):
+    try:
+        with open(path, 'rb') as f:
+            line = f.readline(256)
+    except EnvironmentError:
+        return False
+    return line.startswith(b'#!') and b'python' in line
+
+
+class _ScriptsCache(object):
+    """
+    Cache hook scripts per hook point, invalidated when anything changes in
+    the hooks directory.
+    """
+
+    _EVENTS = (inotify.IN_CREATE |
+               inotify.IN_DELETE |
+               inotify.IN_MOVED_FROM |
+               inotify.IN_MOVED_TO |
+               inotify.IN_ATTRIB |
+               inotify.IN_CLOSE_WRITE |
+               inotify.IN_DELETE_SELF |
+               inotify.IN_MOVE_SELF |
+               inotify.IN_ONLYDIR)
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._scripts = {}
+        # Incremented on every change; listings started before a change
+        # are not cached.
+        self._epoch = 0
+        self._broken = False
+        self._inotify = None
+        self._root_wd = None
+        self._pipe = None
+        self._thread = concurrent.thread(self._run, name="hooks/monitor")
+
+    def start(self):
+        self._inotify = inotify.Inotify()
+        try:
+            self._watch()
+            self._pipe = os.pipe()
+        except:
+            self._inotify.close()
+            raise
+        self._thread.start()
+
+    def stop(self):
+        os.write(self._pipe[1], b'x')
+        self._thread.join()
+        os.close(self._pipe[0])
+        os.close(self._pipe[1])
+
+    def get(self, dir_name):
+        with self._lock:
+            scripts = self._scripts.get(dir_name)
+            if scripts is not None:
+                return scripts
+            epoch = self._epoch
+
+        scripts = _list_scripts(dir_name)
+
+        with self._lock:
+            if epoch == self._epoch and not self._broken:
+                self._scripts[dir_name] = scripts
+        return scripts
+
+    def _watch(self):
+        # Watching a directory again is harmless, so we can watch all the
+        # directories to watch new hook points.
+        self._root_wd = self._inotify.add_watch(self.root, self._EVENTS)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                try:
+                    self._inotify.add_watch(path, self._EVENTS)
+                except OSError as e:
+                    # Removed after we listed the directory; the next event
+                    # will update the cache.
+                    logging.debug("Cannot watch %s: %s", path, e)
+
+    def _run(self):
+        try:
+            poller = select.poll()
+            poller.register(self._inotify.fileno(), select.POLLIN)
+            poller.register(self._pipe[0], select.POLLIN)
+            while True:
+                events = dict(uninterruptible_poll(poller.poll))
+                if self._pipe[0] in events:
+                    break
+                self._handle(self._inotify.read())
+        except Exception:
+            logging.exception("Error monitoring %s, disabling hook scripts "
+                              "cache", self.root)
+            self._disable()
+        finally:
+            self._inotify.close()
+
+    def _handle(self, events):
+        if not events:
+            return
+        with self._lock:
+            self._epoch += 1
+            self._scripts.clear()
+
+        for event in events:
+            if event.wd == self._root_wd and event.mask & (
+                    inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+                raise RuntimeError("Hooks directory was removed")
+
+        if any(e.mask & (inotify.IN_ISDIR | inotify.IN_Q_OVERFLOW)
+               for e in events):
+            self._watch()
+
+    def _disable(self):
+        with self._lock:
+            self._broken = True
+            self._epoch += 1
+            self._scripts.clear()
+
+
+class _WorkerError(Exception):
+    """
+    The worker failed while running a script.
+    """
+
+
+class _WorkerStartError(Exception):
+    """
+    Cannot start a worker; the script was not run.
+    """
+
+
+class _Worker(object):
+    """
+    Persistent python process running python hook scripts, see
+    vdsm.hook.worker.
+    """
+
+    def __init__(self):
+        self._proc = commands.start(
+            [sys.executable, '-m', 'vdsm.hook.worker'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=_hooks_env(os.environ.copy()))
+
+    def run(self, script, env):
+        request = json.dumps({'script': script, 'env': env}) + '\n'
+        try:
+            self._proc.stdin.write(request.encode('utf-8'))
+            self._proc.stdin.flush()
+            line = self._proc.stdout.readline()
+        except EnvironmentError as e:
+            raise _WorkerError("Error communicating with worker: %s" % e)
+        if not line:
+            raise _WorkerError("Worker terminated")
+        response = json.loads(line)
+        return response['rc'], response['err'].encode('utf-8')
+
+    def close(self):
+        self._proc.stdin.close()
+        try:
+            self._proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc.stdout.close()
+
+
+class _WorkerPool(object):
+    """
+    Run python hook scripts in up to max_workers concurrent workers.
+    """
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []
+        self._workers = 0
+
+    def run(self, script, env):
+        worker = self._acquire()
+        try:
+            result = worker.run(script, env)
+        except Exception:
+            self._discard(worker)
+            raise
+        self._release(worker)
+        return result
+
+    def stop(self):
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._workers -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._workers >= self._max_workers:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._workers += 1
+        try:
+            return _Worker()
+        except Exception as e:
+            with self._cond:
+                self._workers -= 1
+                self._cond.notify()
+            raise _WorkerStartError("Cannot start worker: %s" % e)
+
+    def _release(self, worker):
+        with self._cond:
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker):
+        try:
+            worker.close()
+        except Exception:
+            logging.exception("Error closing hook worker")
+        with self._cond:
+            self._workers -= 1
+            self._cond.notify()
+
+
+def _hooks_env(env):
+    """
+    Allow hooks to import the hooking module.
+    """
+    ppath = env.get('PYTHONPATH', '')
+    hook = os.path.dirname(pkgutil.get_loader('vdsm.hook').get_filename())
+    env['PYTHONPATH'] = ':'.join(ppath.split(':') + [hook])
+    return env
+
+
+def _run_script(path, env):
+    p = commands.start([path], stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, env=env)
+
+    with commands.terminating(p):
+        (out, err) = p.communicate()
+
+    return p.returncode, err
+
 
 def _runHooksDir(data, dir, vmconf={}, raiseError=True, errors=None, params={},
                  hookType=_DOMXML_HOOK):
     if errors is None:
         errors = []
 
-    scripts = _scriptsPerDir(dir)
-    scripts.sort()
-
+    scripts = _scripts(dir)
     if not scripts:
         return data
 
@@ -103,23 +444,32 @@ def _runHooksDir(data, dir, vmconf={}, raiseError=True, errors=None, params={},
 
         if vmconf.get('vmId'):
             scriptenv['vmId'] = vmconf.get('vmId')
-        ppath = scriptenv.get('PYTHONPATH', '')
-        hook = os.path.dirname(pkgutil.get_loader('vdsm.hook').get_filename())
-        scriptenv['PYTHONPATH'] = ':'.join(ppath.split(':') + [hook])
+        _hooks_env(scriptenv)
         if hookType == _DOMXML_HOOK:
             scriptenv['_hook_domxml'] = data_filename
         elif hookType == _JSON_HOOK:
             scriptenv['_hook_json'] = data_filename
 
         for s in scripts:
-            p = commands.start([s], stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE, env=scriptenv)
-
-            with commands.terminating(p):
-                (out, err) = p.communicate()
-
-            rc = p.returncode
-            logging.info('%s: rc=%s err=%s', s, rc, err)
+            start = monotonic_time()
+            workers = _workers
+            if s.python and workers is not None:
+                try:
+                    rc, err = workers.run(s.path, scriptenv)
+                except _WorkerStartError as e:
+                    logging.warning("Cannot run %s in worker, running it in "
+                                    "a new process: %s", s.path, e)
+                    rc, err = _run_script(s.path, scriptenv)
+                except _WorkerError as e:
+                    # The script may have modified the data already, so
+                    # running it again is not safe.
+                    logging.error("Worker failed running %s: %s", s.path, e)
+                    rc, err = 1, str(e).encode('utf-8')
+            else:
+                rc, err = _run_script(s.path, scriptenv)
+            _record(dir, s.path, monotonic_time() - start)
+
+            logging.info('%s: rc=%s err=%s', s.path, rc, err)
             if rc != 0:
                 errors.append(err)
 
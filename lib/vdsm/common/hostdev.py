@@ -23,11 +23,11 @@ from __future__ import division
 
 import collections
 import functools
-import hashlib
 import json
 import logging
 import operator
 import os
+import threading
 import uuid
 import xml.etree.ElementTree as etree
 
@@ -80,9 +80,6 @@ _LIBVIRT_DEVICE_FLAGS = collections.defaultdict(
 )
 
 _DATA_PROCESSORS = collections.defaultdict(list)
-_last_alldevices_hash = None
-_device_tree_cache = {}
-_device_address_to_name_cache = {}
 
 
 class PCIHeaderType:
@@ -159,18 +156,6 @@ def _data_processors_map():
     return data_processors_map
 
 
-def __device_tree_hash(libvirt_devices):
-    """
-    The hash generation works iff the order of devices returned from libvirt is
-    stable.
-    """
-    current_hash = hashlib.sha256()
-    for _, xml in _each_device_xml(libvirt_devices):
-        current_hash.update(xml.encode('utf-8'))
-
-    return current_hash.hexdigest()
-
-
 def _data_processor(target_bus='_ANY'):
     """
     Register function as a data processor for device processing code.
@@ -555,46 +540,200 @@ def _get_device_ref_and_params(device_name):
     return libvirt_device, params
 
 
-def _process_all_devices(libvirt_devices):
-    devices = {}
-    for name, xml in _each_device_xml(libvirt_devices):
-        params = _process_device_params(xml)
-        devices[name] = params
+def _get_devices_from_libvirt(flags=0):
+    """
+    Returns all available host devices from libvirt processd to dict
+    """
+    devices, address_to_name = _device_cache.get()
+    if flags == 0:
+        return devices, address_to_name
+
+    names = set(name for name, _ in _each_device_xml(
+        libvirtconnection.get().listAllDevices(flags)))
+    devices = {name: params for name, params in devices.items()
+               if name in names}
+    address_to_name = {address: name
+                       for address, name in address_to_name.items()
+                       if name in names}
+    return devices, address_to_name
 
-    return devices
 
+_DeviceEntry = collections.namedtuple('_DeviceEntry', ['xml', 'params'])
 
-def _get_devices_from_libvirt(flags=0):
+
+class _DeviceCache(object):
     """
-    Returns all available host devices from libvirt processd to dict
+    Processed host devices reported by libvirt.
+
+    Processing device XML is expensive on hosts with many devices (e.g.
+    SR-IOV VFs or mdev capable cards), so processed parameters are kept per
+    device, and a device is processed again only when its XML changes.
+
+    When libvirt node device events are monitored, only devices reported by
+    events are looked up. Otherwise all devices are listed and their XML is
+    compared on every request.
     """
-    libvirt_devices = libvirtconnection.get().listAllDevices(flags)
-    global _last_alldevices_hash
-    global _device_tree_cache
-    global _device_address_to_name_cache
 
-    if (flags == 0 and
-            __device_tree_hash(libvirt_devices) == _last_alldevices_hash):
-        return _device_tree_cache, _device_address_to_name_cache
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Protects the fields below, used by the libvirt events thread. Never
+        # held when calling libvirt.
+        self._events_lock = threading.Lock()
+        self._monitoring = False
+        self._changed = set()
+
+        # Protected by _lock.
+        self._synced = False
+        self._entries = {}
+        self._devices = {}
+        self._address_to_name = {}
+
+    def start_monitoring(self):
+        with self._events_lock:
+            self._monitoring = True
+
+    def device_changed(self, name):
+        with self._events_lock:
+            self._changed.add(name)
+
+    def get(self):
+        """
+        Returns processed devices and address to device name map.
+        """
+        with self._lock:
+            with self._events_lock:
+                changed = self._changed
+                self._changed = set()
+                monitoring = self._monitoring
 
-    devices = _process_all_devices(libvirt_devices)
-    address_to_name = {}
+            try:
+                if monitoring and self._synced:
+                    modified = self._update(changed)
+                else:
+                    modified = self._sync()
+                    # Events received from now on were kept in _changed.
+                    self._synced = monitoring
+            except:
+                # We may have lost some of the changed devices.
+                self._synced = False
+                raise
+
+            if modified:
+                self._rebuild()
+            return self._devices, self._address_to_name
+
+    # Must be called when holding _lock.
+
+    def _sync(self):
+        entries = {}
+        processed = 0
+        libvirt_devices = libvirtconnection.get().listAllDevices(0)
+        for name, xml in _each_device_xml(libvirt_devices):
+            entry = self._entries.get(name)
+            if entry is None or entry.xml != xml:
+                entry = _DeviceEntry(xml, _process_device_params(xml))
+                processed += 1
+            entries[name] = entry
+
+        removed = len(six.viewkeys(self._entries) - six.viewkeys(entries))
+        self._entries = entries
+        if processed or removed:
+            logging.debug("Processed %d devices, removed %d devices",
+                          processed, removed)
+        return processed > 0 or removed > 0
+
+    def _update(self, names):
+        conn = libvirtconnection.get()
+        modified = False
+        pending = set(names)
+        checked = set()
+        while pending:
+            name = pending.pop()
+            checked.add(name)
+            try:
+                xml = conn.nodeDeviceLookupByName(name).XMLDesc(0)
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_NODE_DEVICE:
+                    raise
+                entry = self._entries.pop(name, None)
+                if entry is not None:
+                    logging.debug("Device %s removed", name)
+                    modified = True
+                    parent = entry.params.get('parent')
+                    if parent and parent not in checked:
+                        pending.add(parent)
+                continue
 
-    with _DeviceTreeCache(devices) as cache:
-        for device_name, device_params in devices.items():
-            if device_params['capability'] == 'scsi':
-                device_params.update(
-                    _process_scsi_device_params(device_name, cache))
+            entry = self._entries.get(name)
+            if entry is None or entry.xml != xml:
+                logging.debug("Processing device %s", name)
+                params = _process_device_params(xml)
+                self._entries[name] = _DeviceEntry(xml, params)
+                modified = True
+                # Adding a child may change the parent, for example adding
+                # a mdev changes the available instances of the parent, and
+                # adding a VF changes the PF.
+                parent = params.get('parent')
+                if entry is None and parent and parent not in checked:
+                    pending.add(parent)
+        return modified
+
+    def _rebuild(self):
+        """
+        Update parameters depending on other devices.
+        """
+        devices = {}
+        address_to_name = {}
+        for device_name, entry in self._entries.items():
+            params = entry.params
+            if params['capability'] == 'scsi':
+                # Modified below, keep the cached parameters intact.
+                params = dict(params)
+            devices[device_name] = params
+
+        with _DeviceTreeCache(devices) as cache:
+            for device_name, device_params in devices.items():
+                if device_params['capability'] == 'scsi':
+                    device_params.update(
+                        _process_scsi_device_params(device_name, cache))
+
+                _update_address_to_name_map(
+                    address_to_name, device_name, device_params
+                )
+
+        self._devices = devices
+        self._address_to_name = address_to_name
+
+
+_device_cache = _DeviceCache()
+
+
+def start_monitoring():
+    """
+    Keep the devices cache up to date using libvirt node device events,
+    instead of listing all the devices on every request.
+    """
+    conn = libvirtconnection.get()
+    try:
+        conn.nodeDeviceEventRegisterAny(
+            None, libvirt.VIR_NODE_DEVICE_EVENT_ID_LIFECYCLE,
+            _device_lifecycle_event, None)
+        conn.nodeDeviceEventRegisterAny(
+            None, libvirt.VIR_NODE_DEVICE_EVENT_ID_UPDATE,
+            _device_update_event, None)
+    except libvirt.libvirtError:
+        logging.warning("Cannot monitor node device events, devices will be "
+                        "listed on every request", exc_info=True)
+        return
+    _device_cache.start_monitoring()
 
-            _update_address_to_name_map(
-                address_to_name, device_name, device_params
-            )
 
-    if flags == 0:
-        _device_tree_cache = devices
-        _device_address_to_name_cache = address_to_name
-        _last_alldevices_hash = __device_tree_hash(libvirt_devices)
-    return devices, address_to_name
+def _device_lifecycle_event(conn, device, event, detail, opaque):
+    _device_cache.device_changed(device.name())
+
+
+def _device_update_event(conn, device, opaque):
+    _device_cache.device_changed(device.name())
 
 
 def _update_address_to_name_map(address_to_name, device_name, device_params):
@@ -793,6 +932,8 @@ def detach_detachable(device_name):
     if capability == 'pci' and conv.tobool(
             device_params['is_assignable']):
         libvirt_device.detachFlags(None)
+        # The device driver has changed.
+        _device_cache.device_changed(device_name)
     elif capability == 'scsi':
         if 'udev_path' not in device_params:
             raise UnsuitableSCSIDevice
@@ -808,6 +949,7 @@ def reattach_detachable(device_name, pci_reattach=True):
             device_params['is_assignable']):
         if pci_reattach:
             libvirt_device.reAttach()
+            _device_cache.device_changed(device_name)
     elif capability == 'scsi':
         if 'udev_path' not in device_params:
             raise UnsuitableSCSIDevice
@@ -0,0 +1,123 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Minimal inotify(7) binding.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+# include/uapi/linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT = struct.Struct("iIII")
+
+_BUFSIZE = 64 * 1024
+
+Event = collections.namedtuple("Event", "wd, mask, cookie, name")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+_libc.inotify_init1.argtypes = [ctypes.c_int]
+_libc.inotify_init1.restype = ctypes.c_int
+
+_libc.inotify_add_watch.argtypes = [
+    ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+_libc.inotify_add_watch.restype = ctypes.c_int
+
+
+class Inotify(object):
+    """
+    Non-blocking inotify instance; poll fileno() for readability, and call
+    read() to get the pending events.
+    """
+
+    def __init__(self):
+        fd = _libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if fd == -1:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        """
+        Watch path for events in mask, returning the watch descriptor.
+        """
+        if not isinstance(path, bytes):
+            path = path.encode("utf-8")
+        wd = _libc.inotify_add_watch(self._fd, path, mask)
+        if wd == -1:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self):
+        """
+        Return list of pending events, or an empty list if there are no
+        pending events.
+        """
+        try:
+            data = os.read(self._fd, _BUFSIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        return list(parse_events(data))
+
+    def close(self):
+        if self._fd != -1:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def parse_events(data):
+    offset = 0
+    while offset < len(data):
+        wd, mask, cookie, size = _EVENT.unpack_from(data, offset)
+        offset += _EVENT.size
+        name = data[offset:offset + size].rstrip(b"\0").decode(
+            "utf-8", "surrogateescape")
+        offset += size
+        yield Event(wd, mask, cookie, name)
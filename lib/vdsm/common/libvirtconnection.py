@@ -34,6 +34,7 @@ from vdsm.common import cache
 from vdsm.common import concurrent
 from vdsm.common import function
 from vdsm.common import pki
+from vdsm.common.config import config
 from vdsm.common.password import ProtectedPassword
 
 log = logging.getLogger()
@@ -85,6 +86,13 @@ def stop_event_loop(wait=True):
 
 __connections = {}
 __connectionLock = threading.Lock()
+__pool = None
+__stats = []
+
+# Affinities of pooled connections.
+MONITORING = "monitoring"
+CONTROL = "control"
+AFFINITIES = (MONITORING, CONTROL)
 
 
 def open_connection(uri=None, username=None, passwd=None):
@@ -111,8 +119,16 @@ def _clear():
     """
     For clearing connections during the tests.
     """
+    global __pool
     with __connectionLock:
         __connections.clear()
+        __pool = None
+        del __stats[:]
+
+
+def _register_stats(conn_stats):
+    with __connectionLock:
+        __stats.append(conn_stats)
 
 
 def get(target=None, killOnFailure=True):
@@ -124,9 +140,142 @@ def get(target=None, killOnFailure=True):
     Wrap methods of connection object so that they catch disconnection, and
     take the current process down.
     """
+    with __connectionLock:
+        conn = __connections.get(id(target))
+        if not conn:
+            name = "default" if target is None else "events"
+            conn = _open(name, killOnFailure)
+            __connections[id(target)] = conn
+            __stats.append(conn.stats)
+
+            if target is not None:
+                for ev in (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                           libvirt.VIR_DOMAIN_EVENT_ID_REBOOT,
+                           libvirt.VIR_DOMAIN_EVENT_ID_RTC_CHANGE,
+                           libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON,
+                           libvirt.VIR_DOMAIN_EVENT_ID_GRAPHICS,
+                           # Report stable drive name (e.g. vda) in block job
+                           # events instead of the drive path which may change
+                           # after active commit or block copy.  See
+                           # virConnectDomainEventBlockJobCallback in libvirt
+                           # docs.
+                           libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_JOB_2,
+                           libvirt.VIR_DOMAIN_EVENT_ID_WATCHDOG,
+                           libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED,
+                           libvirt.VIR_DOMAIN_EVENT_ID_MIGRATION_ITERATION,
+                           libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED,
+                           libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD):
+                    conn.domainEventRegisterAny(None,
+                                                ev,
+                                                target.dispatchLibvirtEvents,
+                                                ev)
+            # In case we're running into troubles with keeping the connections
+            # alive we should place here:
+            # conn.setKeepAlive(interval=5, count=3)
+            # However the values need to be considered wisely to not affect
+            # hosts which are hosting a lot of virtual machines
+
+        return conn
+
+
+def pooled(affinity):
+    """
+    Return a connection from the connection pool for blocking calls of kind
+    affinity (MONITORING or CONTROL), or None if the pool is disabled.
+
+    libvirt limits the number of concurrent calls on a connection, so
+    blocking calls on the shared connection delay all other calls, including
+    calls from the event loop. Calls of the same kind use a separate set of
+    connections, opened when needed, up to vars:libvirt_pool_size
+    connections. The connection with the least number of calls in flight is
+    returned.
+
+    Events are never registered on pooled connections; domain objects used
+    with a pooled connection must be looked up using the pooled connection.
+    """
+    if affinity not in AFFINITIES:
+        raise ValueError("Invalid affinity: %r" % affinity)
+    with __connectionLock:
+        global __pool
+        if __pool is None:
+            __pool = _Pool(config.getint('vars', 'libvirt_pool_size'))
+        pool = __pool
+    return pool.get(affinity)
+
+
+def stats():
+    """
+    Return a dict mapping connection name to number of calls in flight and
+    number of calls, for all connections opened by get() and pooled().
+    """
+    with __connectionLock:
+        conn_stats = list(__stats)
+    return {s.name: s.info() for s in conn_stats}
+
+
+class _Pool(object):
+
+    def __init__(self, size):
+        self._size = size
+        self._lock = threading.Lock()
+        self._conns = {affinity: [] for affinity in AFFINITIES}
+
+    def get(self, affinity):
+        if self._size == 0:
+            return None
+        with self._lock:
+            conns = self._conns[affinity]
+            if (len(conns) < self._size and
+                    all(conn.stats.in_flight > 0 for conn in conns)):
+                name = "%s/%d" % (affinity, len(conns))
+                conn = _open(name, killOnFailure=True)
+                _register_stats(conn.stats)
+                conns.append(conn)
+            return min(conns, key=lambda conn: conn.stats.in_flight)
+
+    def close(self):
+        with self._lock:
+            for conns in self._conns.values():
+                for conn in conns:
+                    conn.close()
+
+
+class _Stats(object):
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._calls = 0
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+            self._calls += 1
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def info(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "calls": self._calls}
+
+
+def _open(name, killOnFailure):
+    """
+    Open a new connection, wrapping its methods so they catch
+    disconnection, and count the calls in flight.
+    """
+    log.debug('trying to connect libvirt (%s)', name)
+    password = ProtectedPassword(libvirt_password())
+    conn = open_connection('qemu:///system', SASL_USERNAME, password)
+    conn.stats = _Stats(name)
+
     def wrapMethod(f):
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
+            conn.stats.started()
             try:
                 ret = f(*args, **kwargs)
                 if isinstance(ret, libvirt.virDomain):
@@ -147,7 +296,7 @@ def get(target=None, killOnFailure=True):
                           libvirt.VIR_ERR_INVALID_CONN)
                 if edom in EDOMAINS and ecode in ECODES:
                     try:
-                        __connections.get(id(target)).pingLibvirt()
+                        conn.pingLibvirt()
                     except libvirt.libvirtError as e:
                         edom = e.get_error_domain()
                         ecode = e.get_error_code()
@@ -160,49 +309,17 @@ def get(target=None, killOnFailure=True):
                             else:
                                 raise
                 raise
+            finally:
+                conn.stats.finished()
         return wrapper
 
-    with __connectionLock:
-        conn = __connections.get(id(target))
-        if not conn:
-            log.debug('trying to connect libvirt')
-            password = ProtectedPassword(libvirt_password())
-            conn = open_connection('qemu:///system', SASL_USERNAME, password)
-            __connections[id(target)] = conn
-
-            setattr(conn, 'pingLibvirt', getattr(conn, 'getLibVersion'))
-            for name in dir(libvirt.virConnect):
-                method = getattr(conn, name)
-                if callable(method) and name[0] != '_':
-                    setattr(conn, name,
-                            wrapMethod(function.weakmethod(method)))
-            if target is not None:
-                for ev in (libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
-                           libvirt.VIR_DOMAIN_EVENT_ID_REBOOT,
-                           libvirt.VIR_DOMAIN_EVENT_ID_RTC_CHANGE,
-                           libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON,
-                           libvirt.VIR_DOMAIN_EVENT_ID_GRAPHICS,
-                           # Report stable drive name (e.g. vda) in block job
-                           # events instead of the drive path which may change
-                           # after active commit or block copy.  See
-                           # virConnectDomainEventBlockJobCallback in libvirt
-                           # docs.
-                           libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_JOB_2,
-                           libvirt.VIR_DOMAIN_EVENT_ID_WATCHDOG,
-                           libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED,
-                           libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED,
-                           libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD):
-                    conn.domainEventRegisterAny(None,
-                                                ev,
-                                                target.dispatchLibvirtEvents,
-                                                ev)
-            # In case we're running into troubles with keeping the connections
-            # alive we should place here:
-            # conn.setKeepAlive(interval=5, count=3)
-            # However the values need to be considered wisely to not affect
-            # hosts which are hosting a lot of virtual machines
+    setattr(conn, 'pingLibvirt', getattr(conn, 'getLibVersion'))
+    for name in dir(libvirt.virConnect):
+        method = getattr(conn, name)
+        if callable(method) and name[0] != '_':
+            setattr(conn, name, wrapMethod(function.weakmethod(method)))
 
-        return conn
+    return conn
 
 
 @cache.memoized
@@ -214,5 +331,7 @@ def libvirt_password():
 def __close_connections():
     for conn in __connections.values():
         conn.close()
+    if __pool is not None:
+        __pool.close()
 
 atexit.register(__close_connections)
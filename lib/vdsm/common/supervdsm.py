@@ -23,12 +23,13 @@ from __future__ import absolute_import
 from __future__ import division
 
 import os
-from multiprocessing.managers import BaseManager, RemoteError
 import logging
 import threading
 
 from vdsm.common import constants
 from vdsm.common import function
+from vdsm.common import svdsmrpc
+from vdsm.common.config import config
 from vdsm.common.panic import panic
 
 _g_singletonSupervdsmInstance = None
@@ -38,10 +39,6 @@ _g_singletonSupervdsmInstance_lock = threading.Lock()
 ADDRESS = os.path.join(constants.P_VDSM_RUN, "svdsm.sock")
 
 
-class _SuperVdsmManager(BaseManager):
-    pass
-
-
 class ProxyCaller(object):
 
     def __init__(self, supervdsmProxy, funcName):
@@ -49,13 +46,12 @@ class ProxyCaller(object):
         self._supervdsmProxy = supervdsmProxy
 
     def __call__(self, *args, **kwargs):
-        callMethod = lambda: \
-            getattr(self._supervdsmProxy._svdsm, self._funcName)(*args,
-                                                                 **kwargs)
         try:
-            return callMethod()
-        except RemoteError:
-            self._supervdsmProxy._connect()
+            return self._supervdsmProxy._client.call(
+                self._funcName, *args, **kwargs)
+        except svdsmrpc.Error as e:
+            self._supervdsmProxy._log.error(
+                "Call to %s failed: %s", self._funcName, e)
             raise RuntimeError(
                 "Broken communication with supervdsm. Failed call to %s"
                 % self._funcName)
@@ -68,29 +64,20 @@ class SuperVdsmProxy(object):
     _log = logging.getLogger("SuperVdsmProxy")
 
     def __init__(self):
-        self._manager = None
-        self._svdsm = None
+        self._client = svdsmrpc.Client(
+            ADDRESS,
+            max_connections=config.getint('vars', 'supervdsm_connections'))
         self._connect()
 
-    def open(self, *args, **kwargs):
-        # pylint: disable=no-member
-        return self._manager.open(*args, **kwargs)
-
     def _connect(self):
-        self._manager = _SuperVdsmManager(address=ADDRESS, authkey=b'')
-        self._manager.register('instance')
-        self._manager.register('open')
         self._log.debug("Trying to connect to Super Vdsm")
         try:
             function.retry(
-                self._manager.connect, Exception, timeout=60, tries=3)
+                self._client.connect, Exception, timeout=60, tries=3)
         except Exception as ex:
             msg = "Connect to supervdsm service failed: %s" % ex
             panic(msg)
 
-        # pylint: disable=no-member
-        self._svdsm = self._manager.instance()
-
     def __getattr__(self, name):
         return ProxyCaller(self, name)
 
@@ -102,3 +89,14 @@ def getProxy():
             if _g_singletonSupervdsmInstance is None:
                 _g_singletonSupervdsmInstance = SuperVdsmProxy()
     return _g_singletonSupervdsmInstance
+
+
+def stats():
+    """
+    Return supervdsm transport statistics, or None if vdsm did not connect
+    to supervdsm yet.
+    """
+    proxy = _g_singletonSupervdsmInstance
+    if proxy is None:
+        return None
+    return proxy._client.stats()
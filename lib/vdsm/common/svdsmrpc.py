@@ -0,0 +1,393 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+RPC transport between vdsm and supervdsm.
+
+Messages are sent over a unix socket as frames:
+
+    +----------------+-------------------------+
+    | length (4, BE) | pickled message payload |
+    +----------------+-------------------------+
+
+A request is a (method, args, kwargs) tuple, and a response is a (success,
+value) tuple, where value is the result of the call or the exception raised
+by the method.
+
+Every connection serves one call at a time. The client keeps a pool of
+connections, so concurrent callers do not wait for each other, and the
+server serves every connection in its own thread.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import pickle
+import socket
+import struct
+import threading
+import traceback
+
+from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
+
+_HEADER = struct.Struct("!I")
+
+# Requests and responses are small, but some calls (e.g. network caps)
+# return big replies.
+MAX_MESSAGE_SIZE = 256 * 1024**2
+
+log = logging.getLogger("SuperVdsm.rpc")
+
+
+class Error(Exception):
+    """
+    Communication with the server failed; the result of the call is
+    unknown.
+    """
+
+
+class RemoteError(Error):
+    """
+    The server could not send the result of the call.
+    """
+
+
+def send_message(sock, obj):
+    _send(sock, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def recv_message(sock):
+    """
+    Return the next message, or None if the peer closed the connection
+    before sending a new message.
+    """
+    header = _recv(sock, _HEADER.size)
+    if header is None:
+        return None
+    size, = _HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise Error("Message too big: %d bytes" % size)
+    payload = _recv(sock, size)
+    if payload is None:
+        raise Error("Connection closed while receiving message")
+    return pickle.loads(payload)
+
+
+def _send(sock, payload):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            if pos == 0:
+                return None
+            raise Error("Connection closed while receiving message")
+        pos += n
+    return buf
+
+
+class Server(object):
+    """
+    Serve public methods of obj on a unix socket at address.
+    """
+
+    def __init__(self, address, obj, backlog=128):
+        self._address = address
+        self._obj = obj
+        self._backlog = backlog
+        self._sock = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._stopped = False
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.bind(self._address)
+            self._sock.listen(self._backlog)
+        except:
+            self._sock.close()
+            raise
+        self._thread = concurrent.thread(
+            self._serve, name="svdsm/accept", log=log)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            connections = list(self._connections)
+        # Wake up accept().
+        self._sock.shutdown(socket.SHUT_RDWR)
+        self._thread.join()
+        self._sock.close()
+        # Calls in progress are not waited for; the clients will get an
+        # error when the connection is closed.
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _serve(self):
+        log.debug("Accepting connections on %s", self._address)
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                with self._lock:
+                    if self._stopped:
+                        break
+                log.exception("Error accepting connection")
+                continue
+
+            with self._lock:
+                if self._stopped:
+                    conn.close()
+                    break
+                self._connections.add(conn)
+            t = concurrent.thread(
+                self._handle, args=(conn,), name="svdsm/conn", log=log)
+            t.start()
+        log.debug("Stopped accepting connections")
+
+    def _handle(self, conn):
+        try:
+            while True:
+                request = recv_message(conn)
+                if request is None:
+                    break
+                _send(conn, self._dispatch(*request))
+        except Exception:
+            with self._lock:
+                stopped = self._stopped
+            if not stopped:
+                log.exception("Error serving connection")
+        finally:
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+
+    def _dispatch(self, name, args, kwargs):
+        try:
+            if name.startswith("_"):
+                raise AttributeError("Method %r is not exposed" % name)
+            result = (True, getattr(self._obj, name)(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        try:
+            return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            log.exception("Cannot send result of %s", name)
+            error = RemoteError("Cannot send result of %s: %s" % (
+                name, traceback.format_exc()))
+            return pickle.dumps((False, error), pickle.HIGHEST_PROTOCOL)
+
+
+class _MethodStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def info(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "total_time": self.total_time,
+            "max_time": self.max_time,
+        }
+
+
+class Client(object):
+    """
+    Call methods on a server at address, keeping up to max_connections
+    connections.
+
+    Connections are created on demand and reused. A connection that failed
+    is closed, and a new connection is created for the next call.
+
+    When all connections are in use, a call waits up to wait_timeout seconds
+    for a connection, and then uses a new overflow connection, closed when
+    the call completes. Calls blocked in the server cannot block other
+    calls.
+    """
+
+    def __init__(self, address, max_connections=16, wait_timeout=1.0):
+        if max_connections < 1:
+            raise ValueError(
+                "Invalid max_connections %d (expecting value >= 1)"
+                % max_connections)
+        self._address = address
+        self._max_connections = max_connections
+        self._wait_timeout = wait_timeout
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []
+        self._connections = 0
+        self._waits = 0
+        self._overflows = 0
+        self._methods = {}
+
+    def connect(self):
+        """
+        Create a connection, raising if the server is not available.
+        """
+        sock = self._connect()
+        with self._cond:
+            self._connections += 1
+            self._idle.append(sock)
+            self._cond.notify()
+
+    def close(self):
+        """
+        Close idle connections.
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._connections -= len(idle)
+            self._cond.notify_all()
+        for sock in idle:
+            sock.close()
+
+    def call(self, name, *args, **kwargs):
+        # Raises the pickling error to the caller before using a connection.
+        request = pickle.dumps((name, args, kwargs), pickle.HIGHEST_PROTOCOL)
+
+        with self._cond:
+            stats = self._methods.get(name)
+            if stats is None:
+                stats = self._methods[name] = _MethodStats()
+            stats.calls += 1
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+
+        start = monotonic_time()
+        ok = False
+        try:
+            ok, value = self._roundtrip(request)
+        finally:
+            elapsed = monotonic_time() - start
+            with self._cond:
+                stats.in_flight -= 1
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+                if not ok:
+                    stats.errors += 1
+
+        if not ok:
+            raise value
+        return value
+
+    def stats(self):
+        """
+        Return connection pool and per-method statistics.
+        """
+        with self._cond:
+            return {
+                "connections": self._connections,
+                "idle": len(self._idle),
+                "max_connections": self._max_connections,
+                "waits": self._waits,
+                "overflows": self._overflows,
+                "methods": {name: stats.info()
+                            for name, stats in self._methods.items()},
+            }
+
+    def _roundtrip(self, request):
+        sock = self._acquire()
+        try:
+            _send(sock, request)
+            response = recv_message(sock)
+            if response is None:
+                raise Error("Connection closed by server")
+        except Exception as e:
+            self._discard(sock)
+            if isinstance(e, Error):
+                raise
+            raise Error("Communication with server failed: %s" % e)
+        self._release(sock)
+        return response
+
+    def _acquire(self):
+        with self._cond:
+            deadline = None
+            while not self._idle and \
+                    self._connections >= self._max_connections:
+                now = monotonic_time()
+                if deadline is None:
+                    self._waits += 1
+                    deadline = now + self._wait_timeout
+                elif now >= deadline:
+                    self._overflows += 1
+                    log.warning("All %d connections are busy, using overflow "
+                                "connection", self._connections)
+                    break
+                self._cond.wait(deadline - now)
+            else:
+                if self._idle:
+                    return self._idle.pop()
+            self._connections += 1
+
+        try:
+            return self._connect()
+        except Exception as e:
+            with self._cond:
+                self._connections -= 1
+                self._cond.notify()
+            raise Error("Cannot connect to %s: %s" % (self._address, e))
+
+    def _release(self, sock):
+        with self._cond:
+            if self._connections > self._max_connections:
+                # Overflow connection.
+                self._connections -= 1
+            else:
+                self._idle.append(sock)
+                self._cond.notify()
+                return
+        sock.close()
+
+    def _discard(self, sock):
+        sock.close()
+        with self._cond:
+            self._connections -= 1
+            self._cond.notify()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._address)
+        except:
+            sock.close()
+            raise
+        return sock
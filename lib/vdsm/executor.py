@@ -23,6 +23,7 @@ from __future__ import absolute_import
 Blocked tasks may be discarded, and the worker pool is automatically
 replenished."""
 
+import bisect
 import collections
 import functools
 import logging
@@ -33,6 +34,14 @@ from vdsm.common import exception
 from vdsm.common import time
 
 
+# Task priorities; tasks with higher priority are executed first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+
 class NotRunning(Exception):
     """Executor not yet started or shutting down."""
 
@@ -68,11 +77,23 @@ class Executor(object):
       the stuck task finishes.  This prevents creating an excessive number
       of threads when many tasks are stuck.
 
+    - Tasks are executed by priority; tasks with the same priority are
+      executed in the order they were dispatched.
+
+    - Tasks may be dispatched with keys, for example the storage domains
+      accessed by the task.  The number of queued and running tasks per key
+      is limited by `max_tasks_per_key`, so tasks blocked on one storage
+      domain cannot fill the queue.  The number of running tasks per key is
+      limited by `max_running_per_key`; when the limit is reached, workers
+      run other tasks, so tasks blocked on one storage domain cannot block
+      all the workers.
+
     """
     _log = logging.getLogger('Executor')
 
     def __init__(self, name, workers_count, max_tasks, scheduler,
-                 max_workers=None, log=None):
+                 max_workers=None, log=None, max_tasks_per_key=None,
+                 max_running_per_key=None):
         """
         :param name: Name of the executor; no special purpose, just for
           logging and debugging.
@@ -97,13 +118,21 @@ class Executor(object):
         :param log: logger instance to override the default logger. This is
           useful for testing
         :type log: logger as returned by logging.getLogger()
+        :param max_tasks_per_key: Maximum number of queued and running tasks
+          dispatched with the same key. If None, there is no limit.
+        :type max_tasks_per_key: int or None
+        :param max_running_per_key: Maximum number of running tasks with the
+          same key. If None, there is no limit.
+        :type max_running_per_key: int or None
 
         """
         self._name = name
         self._workers_count = workers_count
         self._max_workers = max_workers
         self._worker_id = 0
-        self._tasks = TaskQueue(name, max_tasks)
+        self._tasks = TaskQueue(name, max_tasks, max_tasks_per_key,
+                                max_running_per_key)
+        self._wait_stats = {}
         self._scheduler = scheduler
         if log is not None:
             self._log = log
@@ -139,12 +168,13 @@ class Executor(object):
             self._running = False
             self._tasks.clear()
             for _ in range(self._workers_count):
-                self._tasks.put(_STOP)
+                self._tasks.put(_STOP, force=True)
             workers = tuple(self._workers) if wait else ()
         for worker in workers:
             worker.join()
 
-    def dispatch(self, callable, timeout=None, discard=True):
+    def dispatch(self, callable, timeout=None, discard=True,
+                 priority=PRIORITY_NORMAL, keys=()):
         """
         Dispatches a new task to the executor.
 
@@ -165,10 +195,31 @@ class Executor(object):
           completed, emits a warning in the log if it didn't complete,
           and reschedules the check after `timeout` seconds.
         :type discard: boolean
+        :param priority: one of `PRIORITIES`; tasks with higher priority are
+          executed before waiting tasks with lower priority.
+        :type priority: int
+        :param keys: resources used by the task, for example storage domain
+          UUIDs. If there are `max_tasks_per_key` queued or running tasks
+          with one of these keys, raises `ResourceExhausted`. If there are
+          `max_running_per_key` running tasks with one of these keys, the
+          task waits while other tasks run.
+        :type keys: sequence of hashable objects
         """
         if not self._running:
             raise NotRunning()
-        self._tasks.put(Task(callable, timeout, discard))
+        self._tasks.put(Task(callable, timeout, discard, priority, keys))
+
+    def stats(self):
+        """
+        Return the number of queued tasks by priority, the number of tasks
+        by key, and histograms of the time tasks waited in the queue by task
+        type.
+        """
+        with self._lock:
+            wait_stats = list(self._wait_stats.items())
+        info = self._tasks.stats()
+        info["wait"] = {name: stats.info() for name, stats in wait_stats}
+        return info
 
     # Serving workers
 
@@ -243,8 +294,22 @@ class Executor(object):
         task = self._tasks.get()
         if task is _STOP:
             raise NotRunning()
+        self._record_wait(task)
         return task
 
+    def _task_done(self, task):
+        """
+        Called from the worker thread when a task has finished.
+        """
+        self._tasks.task_done(task)
+
+    def _record_wait(self, task):
+        stats = self._wait_stats.get(task.name)
+        if stats is None:
+            with self._lock:
+                stats = self._wait_stats.setdefault(task.name, WaitStats())
+        stats.record(task.wait_time)
+
     # Private
 
     def _add_worker(self):
@@ -317,6 +382,7 @@ class _Worker(object):
             self._log.exception("Unhandled exception in %s", task)
         finally:
             self._task = None
+            self._executor._task_done(task)
             # We want to discard workers that were too slow to disarm
             # the timer. It does not matter if the thread was still
             # blocked on callable when we discard it or it just finished.
@@ -374,12 +440,35 @@ class _Worker(object):
 
 class Task(object):
 
-    def __init__(self, callable, timeout, discard=True):
+    def __init__(self, callable, timeout, discard=True,
+                 priority=PRIORITY_NORMAL, keys=()):
         self._callable = callable
         self.timeout = timeout
         self.discard = discard
+        self.priority = priority
+        self.keys = tuple(keys)
+        self._queued = time.monotonic_time()
         self._start = None
 
+    @property
+    def name(self):
+        """
+        Task type, used for reporting queue wait time.
+        """
+        func = self._callable
+        if isinstance(func, functools.partial):
+            func = func.func
+        return getattr(func, "__name__", type(func).__name__)
+
+    @property
+    def wait_time(self):
+        """
+        Time the task waited in the queue before it was started.
+        """
+        if self._start is None:
+            return time.monotonic_time() - self._queued
+        return self._start - self._queued
+
     @property
     def duration(self):
         if self._start is None:
@@ -400,17 +489,55 @@ class Task(object):
         )
 
 
+class WaitStats(object):
+    """
+    Histogram of the time tasks waited in the executor queue.
+    """
+
+    # Upper bounds of the buckets in seconds. The last bucket counts the
+    # waits longer than the last bound.
+    BOUNDS = (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = [0] * (len(self.BOUNDS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, wait):
+        bucket = bisect.bisect_left(self.BOUNDS, wait)
+        with self._lock:
+            self._buckets[bucket] += 1
+            self._count += 1
+            self._total += wait
+            self._max = max(self._max, wait)
+
+    def info(self):
+        with self._lock:
+            return {
+                "count": self._count,
+                "total": self._total,
+                "max": self._max,
+                "bounds": list(self.BOUNDS),
+                "buckets": list(self._buckets),
+            }
+
+
 class TaskQueue(object):
     """
-    Replacement for Queue.Queue, with two important changes:
+    Replacement for Queue.Queue, with these important changes:
 
     * Queue.Queue blocks when full. We want to raise ResourceExhausted instead.
     * Queue.Queue lacks the clear() operation, which is needed to implement
       the 'poison pill' pattern (described for example in
       http://pymotw.com/2/multiprocessing/communication.html )
+    * Tasks are returned by priority, and the number of tasks per key is
+      limited.
     """
 
-    def __init__(self, name, max_tasks):
+    def __init__(self, name, max_tasks, max_tasks_per_key=None,
+                 max_running_per_key=None):
         """
         :param name: Name of the executor; no special purpose, just for
           logging and debugging.
@@ -418,51 +545,129 @@ class TaskQueue(object):
         :param max_tasks: Maximum number of tasks waiting for execution in the
           executor's task queue.
         :type max_tasks: int
+        :param max_tasks_per_key: Maximum number of queued and running tasks
+          with the same key.
+        :type max_tasks_per_key: int or None
+        :param max_running_per_key: Maximum number of running tasks with the
+          same key. Queued tasks with a key at the limit are skipped by get().
+        :type max_running_per_key: int or None
         """
         self._name = name
         self._max_tasks = max_tasks
-        self._tasks = collections.deque()
-        # Deque supports thread-safe append and pop from both ends. We need
-        # this condition for waking up threads waiting on an empty queue and
-        # protecting other methods which are not documented as thread-safe.
-        # https://docs.python.org/2/library/collections.html#deque-objects
+        self._max_tasks_per_key = max_tasks_per_key
+        self._max_running_per_key = max_running_per_key
+        self._queues = [collections.deque() for _ in PRIORITIES]
+        self._len = 0
+        # Number of queued and running tasks per key.
+        self._keys = collections.Counter()
+        # Number of running tasks per key.
+        self._running = collections.Counter()
         self._cond = threading.Condition(threading.Lock())
 
     def __repr__(self):
         return "<TaskQueue %s max_tasks=%i tasks(%i)=%s at 0x%x>" % (
             self._name,
             self._max_tasks,
-            len(self._tasks),
-            repr(self._tasks),
+            self._len,
+            repr([task for queue in self._queues for task in queue]),
             id(self)
         )
 
-    def put(self, task):
+    def put(self, task, force=False):
         """
         Put a new task in the queue.
         Do not block when full, raises ResourceExhausted instead.
+
+        If force is True, put the task first in the queue, even if the queue
+        is full.
         """
         with self._cond:
-            if len(self._tasks) == self._max_tasks:
-                raise exception.ResourceExhausted(
-                    "Too many tasks",
-                    resource=self._name,
-                    current_tasks=self._max_tasks)
-            self._tasks.append(task)
+            if force:
+                self._queues[PRIORITY_HIGH].appendleft(task)
+            else:
+                if self._len >= self._max_tasks:
+                    raise exception.ResourceExhausted(
+                        "Too many tasks",
+                        resource=self._name,
+                        current_tasks=self._max_tasks)
+                if self._max_tasks_per_key is not None:
+                    for key in task.keys:
+                        if self._keys[key] >= self._max_tasks_per_key:
+                            raise exception.ResourceExhausted(
+                                "Too many tasks for key",
+                                resource=self._name,
+                                key=key,
+                                current_tasks=self._keys[key])
+                self._keys.update(task.keys)
+                self._queues[task.priority].append(task)
+            self._len += 1
             self._cond.notify()
 
     def get(self):
         """
-        Get a new task. Blocks if empty.
+        Get the next task with the highest priority, skipping tasks with a
+        key at the running tasks limit. Blocks if there is no such task.
         """
-        while True:
-            try:
-                return self._tasks.popleft()
-            except IndexError:
-                with self._cond:
-                    if not self._tasks:
-                        self._cond.wait()
+        with self._cond:
+            while True:
+                task = self._pop_runnable()
+                if task is not None:
+                    return task
+                self._cond.wait()
+
+    def task_done(self, task):
+        """
+        Called when a task returned from get() has finished.
+        """
+        if task.keys:
+            with self._cond:
+                _remove_keys(self._keys, task.keys)
+                _remove_keys(self._running, task.keys)
+                # Tasks skipped because of this task may run now.
+                self._cond.notify_all()
+
+    def _pop_runnable(self):
+        if not self._len:
+            return None
+        for queue in self._queues:
+            for i, task in enumerate(queue):
+                keys = getattr(task, "keys", ())
+                if self._may_run(keys):
+                    del queue[i]
+                    self._len -= 1
+                    self._running.update(keys)
+                    return task
+        return None
+
+    def _may_run(self, keys):
+        if self._max_running_per_key is None:
+            return True
+        for key in keys:
+            if self._running[key] >= self._max_running_per_key:
+                return False
+        return True
 
     def clear(self):
         with self._cond:
-            self._tasks.clear()
+            for queue in self._queues:
+                for task in queue:
+                    _remove_keys(self._keys, getattr(task, "keys", ()))
+                queue.clear()
+            self._len = 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": {priority: len(queue)
+                           for priority, queue in zip(PRIORITIES,
+                                                      self._queues)},
+                "keys": dict(self._keys),
+                "running": dict(self._running),
+            }
+
+
+def _remove_keys(counter, keys):
+    for key in keys:
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
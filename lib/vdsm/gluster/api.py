@@ -32,12 +32,14 @@ from vdsm.common import cmdutils
 from vdsm.common import commands
 from vdsm.common import supervdsm as svdsm
 from vdsm.common.define import doneCode
+from vdsm.config import config
 from vdsm.gluster import exception as ge
 
 from vdsm.storage import mount
 from vdsm import constants
 from pwd import getpwnam
 
+from . import cache
 from . import fstab
 from . import gluster_mgmt_api
 from . import safeWrite
@@ -55,6 +57,12 @@ SNAP_SCHEDULER_FLAG_FILE = META_VOL_MOUNT_POINT + "/snaps/current_scheduler"
 FS_TYPE = "glusterfs"
 SNAP_SCHEDULER_ALREADY_DISABLED_RC = 7
 
+# Results of volume info, volume status and peer status, shared by all
+# GlusterApi instances.
+_cache = cache.Cache(
+    interval=config.getint("gluster", "cache_refresh_interval"),
+    max_age=config.getint("gluster", "cache_max_age"))
+
 
 _snapSchedulerPath = cmdutils.CommandPath(
     "snap_scheduler.py",
@@ -103,6 +111,20 @@ def exportAsVerb(func):
     return wrapper
 
 
+def invalidatesCache(func):
+    """
+    Drop cached results after func modifies volumes or peers.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _cache.clear()
+
+    return wrapper
+
+
 def glusterAdditionalFeatures():
     # Check if gluster additional features are supported by this Vdsm.
     # This Check is done by seeing if sample verbs for supporting
@@ -298,11 +320,17 @@ class GlusterApi(object):
         self.svdsmProxy = svdsm.getProxy()
 
     @exportAsVerb
-    def volumesList(self, volumeName=None, remoteServer=None, options=None):
-        return {'volumes': self.svdsmProxy.glusterVolumeInfo(volumeName,
-                                                             remoteServer)}
+    def volumesList(self, volumeName=None, remoteServer=None, force=False,
+                    options=None):
+        volumes, age = _cache.get(
+            ('volumeInfo', volumeName, remoteServer),
+            lambda: self.svdsmProxy.glusterVolumeInfo(volumeName,
+                                                      remoteServer),
+            force=force)
+        return {'volumes': volumes, 'age': age}
 
     @exportAsVerb
+    @invalidatesCache
     def volumeCreate(self, volumeName, brickList, replicaCount=0,
                      stripeCount=0, transportList=[],
                      force=False, arbiter=False, options=None):
@@ -312,18 +340,22 @@ class GlusterApi(object):
                                                    arbiter)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeStart(self, volumeName, force=False, options=None):
         self.svdsmProxy.glusterVolumeStart(volumeName, force)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeStop(self, volumeName, force=False, options=None):
         self.svdsmProxy.glusterVolumeStop(volumeName, force)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeDelete(self, volumeName, options=None):
         self.svdsmProxy.glusterVolumeDelete(volumeName)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeSet(self, volumeName, option, value, options=None):
         self.svdsmProxy.glusterVolumeSet(volumeName, option, value)
 
@@ -332,10 +364,12 @@ class GlusterApi(object):
         return {'volumeSetOptions': self.svdsmProxy.glusterVolumeSetHelpXml()}
 
     @exportAsVerb
+    @invalidatesCache
     def volumeReset(self, volumeName, option='', force=False, options=None):
         self.svdsmProxy.glusterVolumeReset(volumeName, option, force)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeBrickAdd(self, volumeName, brickList, replicaCount=0,
                        stripeCount=0, force=False, options=None):
         self.svdsmProxy.glusterVolumeAddBrick(volumeName,
@@ -345,6 +379,7 @@ class GlusterApi(object):
                                               force)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeRebalanceStart(self, volumeName, rebalanceType="",
                              force=False, options=None):
         return self.svdsmProxy.glusterVolumeRebalanceStart(volumeName,
@@ -352,6 +387,7 @@ class GlusterApi(object):
                                                            force)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeRebalanceStop(self, volumeName, force=False, options=None):
         return self.svdsmProxy.glusterVolumeRebalanceStop(volumeName, force)
 
@@ -360,6 +396,7 @@ class GlusterApi(object):
         return self.svdsmProxy.glusterVolumeRebalanceStatus(volumeName)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeReplaceBrickCommitForce(self, volumeName, existingBrick,
                                       newBrick, options=None):
         self.svdsmProxy.glusterVolumeReplaceBrickCommitForce(volumeName,
@@ -367,6 +404,7 @@ class GlusterApi(object):
                                                              newBrick)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeRemoveBrickStart(self, volumeName, brickList,
                                replicaCount=0, options=None):
         return self.svdsmProxy.glusterVolumeRemoveBrickStart(volumeName,
@@ -374,6 +412,7 @@ class GlusterApi(object):
                                                              replicaCount)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeRemoveBrickStop(self, volumeName, brickList,
                               replicaCount=0, options=None):
         return self.svdsmProxy.glusterVolumeRemoveBrickStop(volumeName,
@@ -388,6 +427,7 @@ class GlusterApi(object):
                                                               replicaCount)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeRemoveBrickCommit(self, volumeName, brickList,
                                 replicaCount=0, options=None):
         self.svdsmProxy.glusterVolumeRemoveBrickCommit(volumeName,
@@ -395,6 +435,7 @@ class GlusterApi(object):
                                                        replicaCount)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeRemoveBrickForce(self, volumeName, brickList,
                                replicaCount=0, options=None):
         self.svdsmProxy.glusterVolumeRemoveBrickForce(volumeName, brickList,
@@ -408,25 +449,35 @@ class GlusterApi(object):
                 'sizeFree': str(free),
                 'sizeUsed': str(used)}
 
-    @exportAsVerb
-    def volumeStatus(self, volumeName, brick=None, statusOption=None,
-                     options=None):
+    def _volumeStatus(self, volumeName, brick, statusOption):
         status = self.svdsmProxy.glusterVolumeStatus(volumeName, brick,
                                                      statusOption)
         if statusOption == 'detail':
             data = self.svdsmProxy.glusterVolumeStatvfs(volumeName)
             status['volumeStatsInfo'] = self._computeVolumeStats(data)
-        return {'volumeStatus': status}
+        return status
+
+    @exportAsVerb
+    def volumeStatus(self, volumeName, brick=None, statusOption=None,
+                     force=False, options=None):
+        status, age = _cache.get(
+            ('volumeStatus', volumeName, brick, statusOption),
+            lambda: self._volumeStatus(volumeName, brick, statusOption),
+            force=force)
+        return {'volumeStatus': status, 'age': age}
 
     @exportAsVerb
+    @invalidatesCache
     def hostAdd(self, hostName, options=None):
         self.svdsmProxy.glusterPeerProbe(hostName)
 
     @exportAsVerb
+    @invalidatesCache
     def hostRemove(self, hostName, force=False, options=None):
         self.svdsmProxy.glusterPeerDetach(hostName, force)
 
     @exportAsVerb
+    @invalidatesCache
     def hostRemoveByUuid(self, hostUuid, force=False, options=None):
         for hostInfo in self.svdsmProxy.glusterPeerStatus():
             if hostInfo['uuid'] == hostUuid:
@@ -437,14 +488,17 @@ class GlusterApi(object):
         self.svdsmProxy.glusterPeerDetach(hostName, force)
 
     @exportAsVerb
-    def hostsList(self, options=None):
+    def hostsList(self, force=False, options=None):
         """
         Returns:
             {'status': {'code': CODE, 'message': MESSAGE},
              'hosts' : [{'hostname': HOSTNAME, 'uuid': UUID,
-                         'status': STATE}, ...]}
+                         'status': STATE}, ...],
+             'age': SECONDS}
         """
-        return {'hosts': self.svdsmProxy.glusterPeerStatus()}
+        hosts, age = _cache.get(
+            ('peerStatus',), self.svdsmProxy.glusterPeerStatus, force=force)
+        return {'hosts': hosts, 'age': age}
 
     @exportAsVerb
     def volumeProfileStart(self, volumeName, options=None):
@@ -498,6 +552,7 @@ class GlusterApi(object):
         return {'uuid': self.svdsmProxy.glusterHostUUIDGet()}
 
     @exportAsVerb
+    @invalidatesCache
     def servicesAction(self, serviceNames, action, options=None):
         status = self.svdsmProxy.glusterServicesAction(serviceNames,
                                                        action)
@@ -650,6 +705,7 @@ class GlusterApi(object):
         self.svdsmProxy.glusterSnapshotDeactivate(snapName)
 
     @exportAsVerb
+    @invalidatesCache
     def snapshotRestore(self, snapName, options=None):
         status = self.svdsmProxy.glusterSnapshotRestore(snapName)
         return {'snapRestore': status}
@@ -775,6 +831,7 @@ class GlusterApi(object):
         self.svdsmProxy.glusterSnapshotScheduleFlagUpdate("none")
 
     @exportAsVerb
+    @invalidatesCache
     def processesStop(self):
         self.svdsmProxy.glusterProcessesStop()
 
@@ -799,12 +856,14 @@ class GlusterApi(object):
         self.svdsmProxy.glusterWebhookDelete(url)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeResetBrickStart(self, volumeName,
                               existingBrick, options=None):
         self.svdsmProxy.glusterVolumeResetBrickStart(volumeName,
                                                      existingBrick)
 
     @exportAsVerb
+    @invalidatesCache
     def volumeResetBrickCommitForce(self, volumeName,
                                     existingBrick, options=None):
         self.svdsmProxy.glusterVolumeResetBrickCommitForce(volumeName,
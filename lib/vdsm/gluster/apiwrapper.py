@@ -77,8 +77,8 @@ class GlusterHost(GlusterApiBase):
     def removeByUuid(self, hostUuid, force=False):
         return self._gluster.hostRemoveByUuid(hostUuid, force)
 
-    def list(self):
-        return self._gluster.hostsList()
+    def list(self, force=False):
+        return self._gluster.hostsList(force)
 
     def storageDevicesList(self, options=None):
         return self._gluster.storageDevicesList()
@@ -124,14 +124,15 @@ class GlusterVolume(GlusterApiBase):
     def __init__(self):
         GlusterApiBase.__init__(self)
 
-    def status(self, volumeName, brick=None, statusOption=None):
-        return self._gluster.volumeStatus(volumeName, brick, statusOption)
+    def status(self, volumeName, brick=None, statusOption=None, force=False):
+        return self._gluster.volumeStatus(volumeName, brick, statusOption,
+                                          force)
 
     def healInfo(self, volumeName):
         return self._gluster.volumeHealInfo(volumeName)
 
-    def list(self, volumeName=None, remoteServer=None):
-        return self._gluster.volumesList(volumeName, remoteServer)
+    def list(self, volumeName=None, remoteServer=None, force=False):
+        return self._gluster.volumesList(volumeName, remoteServer, force)
 
     def create(self, volumeName, brickList, replicaCount=0, stripeCount=0,
                transportList=[], force=False, arbiter=False):
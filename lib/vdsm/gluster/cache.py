@@ -0,0 +1,238 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Cache for results of slow gluster commands.
+
+Gluster commands like "gluster volume info" may take several seconds on
+large trusted pools, and engine polls them frequently. The cache keeps the
+last result of every command, refreshing it in the background while it is
+being used, so callers get a recent result without waiting for the gluster
+command.
+
+Concurrent requests for a result that is not cached are coalesced, running
+the command once for all callers.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import threading
+
+from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
+
+log = logging.getLogger("gluster.cache")
+
+
+class _Call(object):
+    """
+    A command in progress, shared by all callers waiting for the result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        # Set if the call was not run because the cache was stopped.
+        self.cancelled = False
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class _Entry(object):
+
+    def __init__(self, func):
+        self.func = func
+        self.value = None
+        self.time = None
+        self.used = None
+        self.call = None
+
+
+class Cache(object):
+    """
+    Cache results of functions by key.
+
+    A cached result is served if it is younger than max_age seconds. When
+    interval is set, results used in the last expire seconds are refreshed
+    in the background every interval seconds, so they rarely become too
+    old. The background thread is started on the first use of the cache.
+
+    If max_age is 0, results are not cached, but concurrent calls are still
+    coalesced.
+    """
+
+    def __init__(self, interval, max_age, expire=300, clock=monotonic_time):
+        self._interval = interval
+        self._max_age = max_age
+        self._expire = expire
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._thread = None
+        self._stopped = threading.Event()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._refreshes = 0
+        self._errors = 0
+
+    def get(self, key, func, force=False):
+        """
+        Return the result of func() cached under key and its age in seconds.
+
+        If force is True, or there is no recent result, call func and cache
+        the result. If func is already running for another caller, wait for
+        its result instead of calling it again.
+        """
+        with self._lock:
+            self._start()
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(func)
+            entry.used = now
+
+            if not force and entry.time is not None and \
+                    now - entry.time < self._max_age:
+                self._hits += 1
+                return entry.value, now - entry.time
+
+            if entry.call is not None:
+                self._coalesced += 1
+                call = entry.call
+                owner = False
+            else:
+                self._misses += 1
+                call = entry.call = _Call()
+                owner = True
+
+        if owner:
+            self._run(key, entry, call)
+
+        value = call.wait()
+        if call.cancelled:
+            # The refresh was stopped before running the command; run it
+            # ourselves.
+            return self.get(key, func, force=force)
+        return value, 0.0
+
+    def clear(self):
+        """
+        Drop all cached results, used when the cached data was modified.
+
+        Commands in progress are not affected, but their results are not
+        cached.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def refresh(self):
+        """
+        Refresh results used in the last expire seconds, and drop results
+        not used since then.
+        """
+        now = self._clock()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if now - entry.used > self._expire:
+                    del self._entries[key]
+            entries = [(key, entry) for key, entry in self._entries.items()
+                       if entry.call is None]
+            calls = []
+            for key, entry in entries:
+                entry.call = _Call()
+                calls.append((key, entry, entry.call))
+            self._refreshes += len(calls)
+
+        for i, (key, entry, call) in enumerate(calls):
+            if self._stopped.is_set():
+                self._cancel(calls[i:])
+                break
+            try:
+                self._run(key, entry, call)
+            except Exception:
+                log.warning("Error refreshing %s", key, exc_info=True)
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "refreshes": self._refreshes,
+                "errors": self._errors,
+            }
+
+    def _start(self):
+        # Must be called when holding the lock.
+        if self._thread is not None or not self._interval:
+            return
+        self._thread = concurrent.thread(
+            self._refresh_loop, name="gluster/cache", log=log)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self._interval):
+            self.refresh()
+
+    def _cancel(self, calls):
+        """
+        Complete calls that will not run, waking up callers waiting for
+        them.
+        """
+        with self._lock:
+            for key, entry, call in calls:
+                if entry.call is call:
+                    entry.call = None
+        for key, entry, call in calls:
+            call.cancelled = True
+            call.done.set()
+
+    def _run(self, key, entry, call):
+        try:
+            call.value = entry.func()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._errors += 1
+                entry.call = None
+            raise
+        else:
+            now = self._clock()
+            with self._lock:
+                entry.value = call.value
+                entry.time = now
+                entry.call = None
+        finally:
+            call.done.set()
@@ -26,6 +26,7 @@ import errno
 import logging
 import os
 import socket
+import tempfile
 import time
 import xml.etree.ElementTree as etree
 
@@ -154,6 +155,86 @@ def _execGlusterXmlWithTimeout(cmd, timeout=_DEFAULT_TIMEOUT):
     return _getTree(out)
 
 
+def _execGlusterXmlStream(cmd, parse):
+    """
+    Run gluster command, parsing the xml output with parse(source) while the
+    command is running, instead of reading the entire output before parsing
+    it. source is a file object, usually passed to _iterElements().
+
+    Returns the result of parse().
+    """
+    cmd.append('--xml')
+    error = None
+    # Using a file for stderr, so we can read stdout without reading stderr
+    # concurrently.
+    with tempfile.TemporaryFile() as errfile:
+        proc = commands.start(cmd, stdout=subprocess.PIPE, stderr=errfile)
+        with commands.terminating(proc):
+            try:
+                result = parse(proc.stdout)
+            except ge.GlusterException as e:
+                error = e
+            except _etreeExceptions as e:
+                error = ge.GlusterXmlErrorException(err=[str(e)])
+            if error is not None:
+                # If the command failed, we want to raise the command error.
+                proc.stdout.read()
+            proc.wait()
+        errfile.seek(0)
+        err = errfile.read()
+
+    logging.debug(cmdutils.retcode_log_line(proc.returncode, err))
+    if proc.returncode != 0:
+        raise ge.GlusterCmdFailedException(
+            rc=proc.returncode,
+            err=err.decode("utf-8", "replace").splitlines())
+    if error is not None:
+        raise error
+    return result
+
+
+def _iterElements(source, paths):
+    """
+    Parse gluster xml output incrementally from source, a file object,
+    yielding (path, element) for every complete element with one of paths
+    (e.g. "volProfile/brick"), relative to the root element.
+
+    Yielded elements are removed from the tree when the caller asks for the
+    next element, so memory usage does not grow with the number of
+    elements.
+
+    Raises GlusterCmdFailedException if the output reports a failure.
+    """
+    header = {}
+    elements = []
+    tags = []
+    try:
+        for event, el in etree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                elements.append(el)
+                tags.append(el.tag)
+                continue
+
+            path = "/".join(tags[1:])
+            elements.pop()
+            tags.pop()
+            if path in paths:
+                yield path, el
+                elements[-1].remove(el)
+            elif path in ("opRet", "opErrno", "opErrstr"):
+                header[path] = el.text
+
+        rv = int(header['opRet'])
+        errNo = int(header['opErrno'])
+    except (KeyError, TypeError) + _etreeExceptions as e:
+        raise ge.GlusterXmlErrorException(err=[str(e)])
+
+    if rv != 0:
+        if errNo != 0:
+            rv = errNo
+        raise ge.GlusterCmdFailedException(rc=rv, err=[header['opErrstr']])
+
+
 def _getLocalIpAddress():
     for ip in addresses.getIpAddresses():
         if not ip.startswith('127.'):
@@ -234,13 +315,17 @@ def _parseVolumeStatus(tree):
     return status
 
 
-def _parseVolumeStatusDetail(tree):
-    status = {'name': tree.find('volStatus/volumes/volume/volName').text,
-              'bricks': []}
-    for el in tree.findall('volStatus/volumes/volume/node'):
+def _parseVolumeStatusDetail(source):
+    status = {'name': None, 'bricks': []}
+    for path, el in _iterElements(source, ('volStatus/volumes/volume/volName',
+                                           'volStatus/volumes/volume/node')):
+        if path == 'volStatus/volumes/volume/volName':
+            status['name'] = el.text
+            continue
+
         value = {}
 
-        for ch in el.getchildren():
+        for ch in el:
             value[ch.tag] = ch.text or ''
 
         sizeTotal = int(value.get('sizeTotal', '0'))
@@ -382,14 +467,17 @@ def volumeStatus(volumeName, brick=None, option=None):
         command.append(brick)
     if option:
         command.append(option)
+    if option == 'detail':
+        try:
+            return _execGlusterXmlStream(command, _parseVolumeStatusDetail)
+        except ge.GlusterCmdFailedException as e:
+            raise ge.GlusterVolumeStatusFailedException(rc=e.rc, err=e.err)
     try:
         xmltree = _execGlusterXml(command)
     except ge.GlusterCmdFailedException as e:
         raise ge.GlusterVolumeStatusFailedException(rc=e.rc, err=e.err)
     try:
-        if option == 'detail':
-            return _parseVolumeStatusDetail(xmltree)
-        elif option == 'clients':
+        if option == 'clients':
             return _parseVolumeStatusClients(xmltree)
         elif option == 'mem':
             return _parseVolumeStatusMem(xmltree)
@@ -460,7 +548,8 @@ def _parseVolumeInfo(tree):
     return volumes
 
 
-def _parseVolumeProfileInfo(tree, nfs):
+def _parseVolumeProfileInfo(source, nfs):
+    volumeName = None
     bricks = []
     if nfs:
         brickKey = 'nfs'
@@ -468,7 +557,11 @@ def _parseVolumeProfileInfo(tree, nfs):
     else:
         brickKey = 'brick'
         bricksKey = 'bricks'
-    for brick in tree.findall('volProfile/brick'):
+    for path, brick in _iterElements(source, ('volProfile/volname',
+                                              'volProfile/brick')):
+        if path == 'volProfile/volname':
+            volumeName = brick.text
+            continue
         fopCumulative = []
         blkCumulative = []
         fopInterval = []
@@ -510,7 +603,7 @@ def _parseVolumeProfileInfo(tree, nfs):
                  'duration': brick.find('intervalStats/duration').text,
                  'totalRead': brick.find('intervalStats/totalRead').text,
                  'totalWrite': brick.find('intervalStats/totalWrite').text}})
-    status = {'volumeName': tree.find("volProfile/volname").text,
+    status = {'volumeName': volumeName,
               bricksKey: bricks}
     return status
 
@@ -1039,13 +1132,10 @@ def volumeProfileInfo(volumeName, nfs=False):
     if nfs:
         command += ["nfs"]
     try:
-        xmltree = _execGlusterXml(command)
+        return _execGlusterXmlStream(
+            command, lambda source: _parseVolumeProfileInfo(source, nfs))
     except ge.GlusterCmdFailedException as e:
         raise ge.GlusterVolumeProfileInfoFailedException(rc=e.rc, err=e.err)
-    try:
-        return _parseVolumeProfileInfo(xmltree, nfs)
-    except _etreeExceptions:  # pylint: disable=catching-non-exception
-        raise ge.GlusterXmlErrorException(err=[etree.tostring(xmltree)])
 
 
 def _parseVolumeTasks(tree):
@@ -1134,7 +1224,7 @@ def volumeGeoRepSessionStop(volumeName, remoteHost, remoteVolumeName,
                                                                err=e.err)
 
 
-def _parseGeoRepStatus(tree):
+def _parseGeoRepStatus(source):
     """
     Returns:
     {volume-name: [{sessionKey: 'key to identify the session',
@@ -1160,60 +1250,62 @@ def _parseGeoRepStatus(tree):
     }
     """
     status = {}
-    for volume in tree.findall('geoRep/volume'):
-        sessions = []
-        volumeDetail = {}
-        for session in volume.findall('sessions/session'):
-            pairs = []
-            sessionDetail = {}
-            sessionDetail['sessionKey'] = session.find('session_slave').text
-            sessionDetail['remoteVolumeName'] = sessionDetail[
-                'sessionKey'].split("::")[-1].split(":")[0]
-            for pair in session.findall('pair'):
-                pairDetail = {}
-                pairDetail['host'] = pair.find('master_node').text
-                pairDetail['hostUuid'] = pair.find(
-                    'master_node_uuid').text
-                pairDetail['brickName'] = pair.find('master_brick').text
-                pairDetail['remoteHost'] = pair.find('slave_node').text
-                pairDetail['remoteUserName'] = pair.find('slave_user').text
-                pairDetail['status'] = pair.find('status').text
-                pairDetail['crawlStatus'] = pair.find('crawl_status').text
-                pairDetail['timeZone'] = _TIME_ZONE
-                pairDetail['lastSynced'] = pair.find('last_synced').text
-                if pairDetail['lastSynced'] != 'N/A':
-                    pairDetail['lastSynced'] = calendar.timegm(
-                        time.strptime(pairDetail['lastSynced'],
-                                      "%Y-%m-%d %H:%M:%S"))
-
-                pairDetail['checkpointTime'] = pair.find(
-                    'checkpoint_time').text
-                if pairDetail['checkpointTime'] != 'N/A':
-                    pairDetail['checkpointTime'] = calendar.timegm(
-                        time.strptime(pairDetail['checkpointTime'],
-                                      "%Y-%m-%d %H:%M:%S"))
-
-                pairDetail['checkpointCompletionTime'] = pair.find(
-                    'checkpoint_completion_time').text
-                if pairDetail['checkpointCompletionTime'] != 'N/A':
-                    pairDetail['checkpointCompletionTime'] = calendar.timegm(
-                        time.strptime(pairDetail['checkpointCompletionTime'],
-                                      "%Y-%m-%d %H:%M:%S"))
-
-                pairDetail['entry'] = pair.find('entry').text
-                pairDetail['data'] = pair.find('data').text
-                pairDetail['meta'] = pair.find('meta').text
-                pairDetail['failures'] = pair.find('failures').text
-                pairDetail['checkpointCompleted'] = pair.find(
-                    'checkpoint_completed').text
-                pairs.append(pairDetail)
-            sessionDetail['bricks'] = pairs
-            sessions.append(sessionDetail)
-        volumeDetail['sessions'] = sessions
-        status[volume.find('name').text] = volumeDetail
+    for _, volume in _iterElements(source, ('geoRep/volume',)):
+        # Read the name first; it is not guaranteed to precede the sessions.
+        status[volume.find('name').text] = {
+            'sessions': [_parseGeoRepSession(el)
+                         for el in volume.findall('sessions/session')]}
     return status
 
 
+def _parseGeoRepSession(el):
+    pairs = []
+    sessionDetail = {}
+    sessionDetail['sessionKey'] = el.find('session_slave').text
+    sessionDetail['remoteVolumeName'] = sessionDetail[
+        'sessionKey'].split("::")[-1].split(":")[0]
+    for pair in el.findall('pair'):
+        pairDetail = {}
+        pairDetail['host'] = pair.find('master_node').text
+        pairDetail['hostUuid'] = pair.find(
+            'master_node_uuid').text
+        pairDetail['brickName'] = pair.find('master_brick').text
+        pairDetail['remoteHost'] = pair.find('slave_node').text
+        pairDetail['remoteUserName'] = pair.find('slave_user').text
+        pairDetail['status'] = pair.find('status').text
+        pairDetail['crawlStatus'] = pair.find('crawl_status').text
+        pairDetail['timeZone'] = _TIME_ZONE
+        pairDetail['lastSynced'] = pair.find('last_synced').text
+        if pairDetail['lastSynced'] != 'N/A':
+            pairDetail['lastSynced'] = calendar.timegm(
+                time.strptime(pairDetail['lastSynced'],
+                              "%Y-%m-%d %H:%M:%S"))
+
+        pairDetail['checkpointTime'] = pair.find(
+            'checkpoint_time').text
+        if pairDetail['checkpointTime'] != 'N/A':
+            pairDetail['checkpointTime'] = calendar.timegm(
+                time.strptime(pairDetail['checkpointTime'],
+                              "%Y-%m-%d %H:%M:%S"))
+
+        pairDetail['checkpointCompletionTime'] = pair.find(
+            'checkpoint_completion_time').text
+        if pairDetail['checkpointCompletionTime'] != 'N/A':
+            pairDetail['checkpointCompletionTime'] = calendar.timegm(
+                time.strptime(pairDetail['checkpointCompletionTime'],
+                              "%Y-%m-%d %H:%M:%S"))
+
+        pairDetail['entry'] = pair.find('entry').text
+        pairDetail['data'] = pair.find('data').text
+        pairDetail['meta'] = pair.find('meta').text
+        pairDetail['failures'] = pair.find('failures').text
+        pairDetail['checkpointCompleted'] = pair.find(
+            'checkpoint_completed').text
+        pairs.append(pairDetail)
+    sessionDetail['bricks'] = pairs
+    return sessionDetail
+
+
 @gluster_mgmt_api
 def volumeGeoRepStatus(volumeName=None, remoteHost=None,
                        remoteVolumeName=None, remoteUserName=None):
@@ -1229,13 +1321,9 @@ def volumeGeoRepStatus(volumeName=None, remoteHost=None,
     command.append("status")
 
     try:
-        xmltree = _execGlusterXml(command)
+        return _execGlusterXmlStream(command, _parseGeoRepStatus)
     except ge.GlusterCmdFailedException as e:
         raise ge.GlusterGeoRepStatusFailedException(rc=e.rc, err=e.err)
-    try:
-        return _parseGeoRepStatus(xmltree)
-    except _etreeExceptions:  # pylint: disable=catching-non-exception
-        raise ge.GlusterXmlErrorException(err=[etree.tostring(xmltree)])
 
 
 @gluster_mgmt_api
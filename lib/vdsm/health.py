@@ -28,7 +28,14 @@ import threading
 
 from vdsm.common import concurrent
 from vdsm.common import cpuarch
+from vdsm.common import hooks
+from vdsm.common import libvirtconnection
+from vdsm.common import supervdsm
 from vdsm.storage import lvm
+from vdsm.storage import resourceManager as rm
+from vdsm.storage import xlease
+from vdsm.virt import events
+from vdsm.virt import vmcreation
 
 from . config import config
 from . import metrics
@@ -94,6 +101,11 @@ class Monitor(object):
         self._check_garbage()
         self._check_resources()
         self._check_lvm_stats()
+        self._check_xlease_stats()
+        self._check_libvirt_stats()
+        self._check_event_stats()
+        self._check_vm_creation_stats()
+        self._check_supervdsm_stats()
         self._report_stats()
 
     def _check_garbage(self):
@@ -130,6 +142,48 @@ class Monitor(object):
         self.log.info("LVM cache hit ratio: %.2f%% (hits: %d misses: %d)",
                       stats["hit_ratio"], stats["hits"], stats["misses"])
 
+    def _check_xlease_stats(self):
+        stats = xlease.cache_stats()
+        self.log.info("xleases index cache hit ratio: %.2f%% "
+                      "(hits: %d misses: %d)",
+                      stats["hit_ratio"], stats["hits"], stats["misses"])
+
+    def _check_libvirt_stats(self):
+        for name, stats in sorted(libvirtconnection.stats().items()):
+            self.log.debug("libvirt connection %s: in flight: %d, calls: %d",
+                           name, stats["in_flight"], stats["calls"])
+
+    def _check_event_stats(self):
+        stats = events.stats()
+        if stats is None:
+            return
+        self.log.debug("libvirt events: pending: %d, vms: %d, max per vm: %d, "
+                       "coalesced: %d, inline: %d", stats["pending"],
+                       stats["vms"], stats["max_per_vm"], stats["coalesced"],
+                       stats["inline"])
+
+    def _check_vm_creation_stats(self):
+        stats = vmcreation.stats()
+        for name in ("prepare", "create"):
+            stage = stats[name]
+            self.log.debug("vm %s stage: limit: %d, vms: %d, total: %.2f, "
+                           "max: %.2f, max wait: %.2f", name, stage["limit"],
+                           stage["count"], stage["total"], stage["max"],
+                           stage["wait"]["max"])
+        drives = stats["drives"]
+        self.log.debug("vm drives: vms: %d, total: %.2f, max: %.2f",
+                       drives["count"], drives["total"], drives["max"])
+
+    def _check_supervdsm_stats(self):
+        stats = supervdsm.stats()
+        if stats is None:
+            return
+        self.log.info("Supervdsm connections: %d (idle: %d, max: %d, "
+                      "waits: %d, overflows: %d)", stats["connections"],
+                      stats["idle"], stats["max_connections"], stats["waits"],
+                      stats["overflows"])
+        self._stats['supervdsm'] = stats
+
     def _report_stats(self):
         prefix = "hosts.vdsm"
         report = {}
@@ -139,6 +193,32 @@ class Monitor(object):
         report[prefix + '.cpu.sys_pct'] = self._stats['stime_pct']
         report[prefix + '.memory.rss'] = self._stats['rss']
         report[prefix + '.threads_count'] = self._stats['threads']
+        svdsm_stats = self._stats.get('supervdsm')
+        if svdsm_stats:
+            svdsm_prefix = prefix + '.supervdsm'
+            report[svdsm_prefix + '.connections'] = \
+                svdsm_stats['connections']
+            report[svdsm_prefix + '.waits'] = svdsm_stats['waits']
+            for name, method in svdsm_stats['methods'].items():
+                method_prefix = svdsm_prefix + '.' + name
+                for key in ('calls', 'errors', 'max_in_flight', 'max_time'):
+                    report[method_prefix + '.' + key] = method[key]
+                if method['calls']:
+                    report[method_prefix + '.avg_time'] = \
+                        method['total_time'] / method['calls']
+        for namespace, info in rm.stats().items():
+            ns_prefix = '%s.resources.%s' % (prefix, namespace)
+            for key in ('acquired', 'queued', 'locked', 'waits',
+                        'max_wait_time'):
+                report[ns_prefix + '.' + key] = info[key]
+        for hook_point, scripts in hooks.stats().items():
+            for script, info in scripts.items():
+                script_prefix = '%s.hooks.%s.%s' % (
+                    prefix, hook_point, script.replace('.', '_'))
+                report[script_prefix + '.calls'] = info['calls']
+                report[script_prefix + '.max_time'] = info['max_time']
+                report[script_prefix + '.avg_time'] = \
+                    info['total_time'] / info['calls']
         metrics.send(report)
 
 
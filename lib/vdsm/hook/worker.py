@@ -0,0 +1,107 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Persistent worker running python hook scripts.
+
+Starting a python interpreter and importing the modules used by a hook
+(e.g. hooking, xml.dom.minidom) takes much more time than running most
+hooks. The worker runs hook scripts in the same interpreter, so modules
+are imported only once.
+
+The worker reads requests from stdin and writes responses to stdout, one
+json object per line:
+
+    request:  {"script": "/path/to/script", "env": {"NAME": "value", ...}}
+    response: {"rc": 0, "err": "text written to stderr"}
+
+Hooks access their data using the hooking module, which finds the data
+files using the environment, so hooks do not need any change to run in the
+worker.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import contextlib
+import io
+import json
+import os
+import runpy
+import sys
+import traceback
+
+
+def run(script, env):
+    """
+    Run script as __main__ with env, returning exit code and text written
+    to stderr.
+    """
+    os.environ.clear()
+    os.environ.update(env)
+    err = io.StringIO()
+    saved_argv = sys.argv
+    saved_path = sys.path[:]
+    sys.argv = [script]
+    # Like python does when running a script, allowing imports of modules
+    # installed with the hook.
+    sys.path.insert(0, os.path.dirname(script))
+    try:
+        with contextlib.redirect_stderr(err), \
+                contextlib.redirect_stdout(io.StringIO()):
+            try:
+                runpy.run_path(script, run_name="__main__")
+                rc = 0
+            except SystemExit as e:
+                rc = _exit_code(e.code, err)
+            except Exception:
+                traceback.print_exc(file=err)
+                rc = 1
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+    return rc, err.getvalue()
+
+
+def _exit_code(code, err):
+    # Same as sys.exit() in a new interpreter.
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    err.write("%s\n" % code)
+    return 1
+
+
+def main():
+    requests = sys.stdin
+    # Keep the protocol stream private; anything written to the standard
+    # streams by hooks or by child processes they run goes to stderr.
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for line in requests:
+        request = json.loads(line)
+        rc, err = run(request["script"], request["env"])
+        responses.write(json.dumps({"rc": rc, "err": err}) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
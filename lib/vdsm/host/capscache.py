@@ -0,0 +1,358 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Cache of host capabilities.
+
+Collecting host capabilities is expensive; the networking report is
+rebuilt from scratch in supervdsm, and CPU, NUMA and storage information is
+read again on every call. Capabilities change rarely, so the report is
+cached, and invalidated when:
+
+- the kernel reports a network change (netlink link, address or route
+  event)
+- the kernel reports a hardware change (CPU or memory hotplug, SCSI host
+  changes) via uevents
+- network setup completes
+- the cached report is older than caps_cache_max_age seconds, since some of
+  the capabilities (e.g. installed packages) are not covered by events.
+
+An invalidated report is collected again on the next request, so bursts of
+events cost nothing.
+
+Every report has a generation, changed only when the collected
+capabilities differ from the previous report. Clients can pass the
+generation they have to avoid receiving the same report again. Generations
+include a random instance id, so a generation reported before vdsm was
+restarted never matches the current one.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import copy
+import errno
+import logging
+import os
+import select
+import socket
+import threading
+import uuid
+
+from vdsm.common import concurrent
+from vdsm.common.config import config
+from vdsm.common.osutils import uninterruptible_poll
+from vdsm.common.time import monotonic_time
+from vdsm.host import caps
+from vdsm.network.netlink import monitor
+
+# Network changes affecting the networking report.
+NETLINK_GROUPS = (
+    'link',
+    'ipv4-ifaddr',
+    'ipv6-ifaddr',
+    'ipv4-route',
+    'ipv6-route',
+)
+
+# Hardware changes affecting cpu topology, NUMA, memory, HBA inventory and
+# random number sources.
+UEVENT_SUBSYSTEMS = frozenset([
+    'cpu',
+    'memory',
+    'node',
+    'scsi_host',
+    'fc_host',
+    'iscsi_host',
+    'misc',
+])
+
+# include/uapi/linux/netlink.h
+_NETLINK_KOBJECT_UEVENT = 15
+
+# Multicast group of uevents sent by the kernel (not by udev).
+_UEVENT_KERNEL_GROUP = 1
+
+_UEVENT_BUFSIZE = 64 * 1024
+
+# Uevents come in bursts when devices are added or removed; use a large
+# receive buffer to avoid losing events during a burst.
+_UEVENT_RCVBUF = 1024**2
+
+log = logging.getLogger('vds.caps')
+
+_cache = None
+_monitors = ()
+
+
+class Cache(object):
+    """
+    Cache a capabilities report returned by collect().
+
+    Concurrent requests for an invalid report are coalesced; the report is
+    collected once, and all callers get the same report.
+
+    Arguments:
+        collect (callable): Return a new capabilities report.
+        max_age (int): Maximum age of the cached report in seconds.
+    """
+
+    def __init__(self, collect, max_age, clock=monotonic_time):
+        self._collect = collect
+        self._max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+        self._caps = None
+        self._instance = uuid.uuid4().hex[:8]
+        self._counter = 0
+        self._collected = None
+        # Incremented on every invalidation; the cached report is valid if
+        # it was collected after the last invalidation.
+        self._epoch = 0
+        self._valid_epoch = None
+        self._broken = False
+
+    @property
+    def generation(self):
+        with self._lock:
+            return self._generation()
+
+    def invalidate(self, reason):
+        with self._lock:
+            if self._is_valid():
+                log.debug("Invalidating capabilities: %s", reason)
+            self._epoch += 1
+
+    def disable(self, reason):
+        """
+        Called when changes cannot be detected anymore; every request will
+        collect a new report.
+        """
+        log.warning("Disabling capabilities cache: %s", reason)
+        with self._lock:
+            self._broken = True
+            self._epoch += 1
+
+    def get(self):
+        """
+        Return generation and a copy of the capabilities report, collecting
+        a new report if needed.
+        """
+        with self._collect_lock:
+            with self._lock:
+                if self._is_valid():
+                    return self._generation(), copy.deepcopy(self._caps)
+                epoch = self._epoch
+
+            start = monotonic_time()
+            new_caps = self._collect()
+
+            with self._lock:
+                if new_caps != self._caps:
+                    self._counter += 1
+                    self._caps = new_caps
+                self._collected = self._clock()
+                # If an event was received while we were collecting, the
+                # new report may be stale already.
+                self._valid_epoch = epoch
+                log.debug("Collected capabilities generation %s in %.2f "
+                          "seconds", self._generation(),
+                          monotonic_time() - start)
+                return self._generation(), copy.deepcopy(self._caps)
+
+    # Must be called when holding the lock.
+
+    def _generation(self):
+        return '%s-%d' % (self._instance, self._counter)
+
+    def _is_valid(self):
+        if self._broken or self._valid_epoch != self._epoch:
+            return False
+        return self._clock() - self._collected < self._max_age
+
+
+class NetlinkMonitor(object):
+    """
+    Invalidate the cache on network changes.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._nl_monitor = monitor.object_monitor(groups=NETLINK_GROUPS)
+        self._thread = concurrent.thread(self._run, name='caps/netlink')
+
+    def start(self):
+        self._nl_monitor.start()
+        self._thread.start()
+
+    def stop(self):
+        if not self._nl_monitor.is_stopped():
+            self._nl_monitor.stop()
+        self._nl_monitor.wait()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            for event in self._nl_monitor:
+                self._cache.invalidate(
+                    'netlink event %s %s' % (
+                        event.get('event'),
+                        event.get('name', event.get('label', ''))))
+        except Exception as e:
+            self._cache.disable('netlink monitor failed: %s' % e)
+
+
+class UeventMonitor(object):
+    """
+    Invalidate the cache on hardware changes reported by the kernel.
+    """
+
+    def __init__(self, cache, subsystems=UEVENT_SUBSYSTEMS):
+        self._cache = cache
+        self._subsystems = subsystems
+        self._sock = None
+        self._pipe = None
+        self._thread = concurrent.thread(self._run, name='caps/uevent')
+
+    def start(self):
+        self._sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_KOBJECT_UEVENT)
+        try:
+            self._sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, _UEVENT_RCVBUF)
+            self._sock.bind((0, _UEVENT_KERNEL_GROUP))
+            self._pipe = os.pipe()
+        except:
+            self._sock.close()
+            raise
+        self._thread.start()
+
+    def stop(self):
+        os.write(self._pipe[1], b'x')
+        self._thread.join()
+        os.close(self._pipe[0])
+        os.close(self._pipe[1])
+
+    def _run(self):
+        try:
+            poller = select.poll()
+            poller.register(self._sock, select.POLLIN)
+            poller.register(self._pipe[0], select.POLLIN)
+            while True:
+                events = dict(uninterruptible_poll(poller.poll))
+                if self._pipe[0] in events:
+                    break
+                try:
+                    data = self._sock.recv(_UEVENT_BUFSIZE)
+                except EnvironmentError as e:
+                    if e.errno != errno.ENOBUFS:
+                        raise
+                    # The receive buffer overflowed and some events were
+                    # lost; we cannot tell what changed, but the socket is
+                    # still usable.
+                    self._cache.invalidate('uevent buffer overflow')
+                    continue
+                self._handle(data)
+        except Exception as e:
+            self._cache.disable('uevent monitor failed: %s' % e)
+        finally:
+            self._sock.close()
+
+    def _handle(self, data):
+        try:
+            event = parse_uevent(data)
+        except Exception:
+            log.exception("Cannot parse uevent %r", data)
+            self._cache.invalidate('invalid uevent')
+            return
+        if event.get('SUBSYSTEM') in self._subsystems:
+            self._cache.invalidate('uevent %s %s' % (
+                event.get('ACTION'), event.get('DEVPATH')))
+
+
+def parse_uevent(data):
+    """
+    Parse a kernel uevent message:
+
+        ACTION@DEVPATH\\0KEY=VALUE\\0KEY=VALUE\\0...
+
+    Returns dict of the message keys.
+    """
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            key = key.decode('utf-8', 'replace')
+            event[key] = value.decode('utf-8', 'replace')
+    return event
+
+
+def start():
+    global _cache, _monitors
+    max_age = config.getint('vars', 'caps_cache_max_age')
+    if max_age == 0:
+        log.info("Capabilities cache disabled")
+        return
+
+    cache = Cache(caps.get, max_age)
+    monitors = []
+    try:
+        for monitor_class in (NetlinkMonitor, UeventMonitor):
+            m = monitor_class(cache)
+            m.start()
+            monitors.append(m)
+    except Exception:
+        log.exception("Cannot monitor host changes, capabilities will not "
+                      "be cached")
+        for m in monitors:
+            m.stop()
+        return
+
+    log.info("Starting capabilities cache (max_age=%d)", max_age)
+    _monitors = tuple(monitors)
+    _cache = cache
+
+
+def stop():
+    global _cache, _monitors
+    if _cache is None:
+        return
+    log.info("Stopping capabilities cache")
+    _cache = None
+    for m in _monitors:
+        m.stop()
+    _monitors = ()
+
+
+def get():
+    """
+    Return generation and capabilities report. If the cache is not running,
+    a new report is collected and the generation is None.
+    """
+    cache = _cache
+    if cache is None:
+        return None, caps.get()
+    return cache.get()
+
+
+def invalidate(reason):
+    cache = _cache
+    if cache is not None:
+        cache.invalidate(reason)
@@ -20,16 +20,19 @@
 from __future__ import absolute_import
 
 import argparse
+import collections
 from contextlib import contextmanager
+import errno
+import fcntl
+import functools
 import libvirt
+import mmap
 import six
+import struct
 import sys
 import os
 import threading
 
-# TODO: Stop using internal modules.
-from ovirt_imageio._internal import directio
-
 from vdsm.common import concurrent
 from vdsm.common import libvirtconnection
 from vdsm.common import time
@@ -39,6 +42,20 @@ from vdsm.common import fileutils
 
 _start = None
 
+# include/uapi/linux/fs.h
+BLKZEROOUT = 0x127f
+
+# Alignment required for direct I/O and for zeroing block devices without
+# dropping cached data in the same page.
+ALIGNMENT = 4096
+
+# Default read size, the maximum size of a libvirt blockPeek call. Larger
+# reads and writes need fewer system calls and libvirt messages.
+BUFFER_SIZE = 4 * MiB
+
+# Serializes output from disk transfer threads.
+_output_lock = threading.Lock()
+
 
 class _Adapter(object):
     def readinto(self, b):
@@ -79,25 +96,181 @@ class StreamAdapter(_Adapter):
         self._stream.finish()
 
 
+class Destination(object):
+    """
+    Destination image, writing data and zeroing areas without data.
+
+    Areas without data are skipped if the destination is zeroed. An empty
+    regular file, just created or truncated, is zeroed. An existing file
+    may contain old data, and a block device may contain data from a
+    previous logical volume, so these areas are zeroed using BLKZEROOUT, or
+    by writing zeroes if the device does not support it.
+    """
+
+    def __init__(self, path, zeroed=False, truncate=False, direct=False):
+        self.direct = False
+        self._size = 0
+        self._zero_buf = None
+
+        # O_TRUNC is ignored for block devices.
+        flags = os.O_WRONLY | os.O_CREAT
+        if truncate:
+            flags |= os.O_TRUNC
+
+        if direct:
+            try:
+                self._fd = os.open(path, flags | os.O_DIRECT)
+                self.direct = True
+            except OSError as e:
+                # File system does not support direct I/O (e.g. tmpfs).
+                if e.errno != errno.EINVAL:
+                    raise
+        if not self.direct:
+            self._fd = os.open(path, flags)
+
+        self.block = fileutils.is_block_device(path)
+        self.zeroed = zeroed or (
+            not self.block and os.fstat(self._fd).st_size == 0)
+        self._zeroout = self.block
+
+    def write(self, offset, buf):
+        """
+        Write buf at offset. When using direct I/O, buf must be aligned to
+        page size.
+        """
+        if self.direct and (offset % ALIGNMENT or len(buf) % ALIGNMENT):
+            self._disable_direct_io()
+        buf = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            pos += os.pwrite(self._fd, buf[pos:], offset + pos)
+        self._size = max(self._size, offset + len(buf))
+
+    def zero(self, offset, length):
+        """
+        Make length bytes at offset read as zeroes.
+        """
+        if not self.zeroed and not self._blkzeroout(offset, length):
+            self._write_zeroes(offset, length)
+        self._size = max(self._size, offset + length)
+
+    def flush(self):
+        os.fsync(self._fd)
+
+    def close(self):
+        if self._fd == -1:
+            return
+        try:
+            # Skipping zeroes at the end of a file does not extend it.
+            if not self.block and os.fstat(self._fd).st_size < self._size:
+                os.ftruncate(self._fd, self._size)
+        finally:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _blkzeroout(self, offset, length):
+        if not self._zeroout or offset % ALIGNMENT or length % ALIGNMENT:
+            return False
+        try:
+            fcntl.ioctl(self._fd, BLKZEROOUT,
+                        struct.pack("QQ", offset, length))
+        except EnvironmentError as e:
+            if e.errno not in (errno.ENOTTY, errno.EOPNOTSUPP):
+                raise
+            self._zeroout = False
+            return False
+        return True
+
+    def _write_zeroes(self, offset, length):
+        if self._zero_buf is None:
+            # Anonymous mmap is zeroed and aligned for direct I/O.
+            self._zero_buf = mmap.mmap(-1, MiB)
+        end = offset + length
+        while offset < end:
+            count = min(end - offset, len(self._zero_buf))
+            self.write(offset, memoryview(self._zero_buf)[:count])
+            offset += count
+
+    def _disable_direct_io(self):
+        flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+        self.direct = False
+
+
+class Receive(object):
+    """
+    Copy data from src to dest path, skipping or zeroing blocks full of
+    zeroes instead of writing them.
+    """
+
+    def __init__(self, dest, src, size=None, buffersize=BUFFER_SIZE,
+                 zeroed=False):
+        self.done = 0
+        self._dest = dest
+        self._src = src
+        self._size = size
+        # Writes of whole buffers must be aligned for direct I/O.
+        self._buffersize = max(
+            ALIGNMENT, (buffersize + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT)
+        self._zeroed = zeroed
+
+    def run(self):
+        # Anonymous mmap is aligned for direct I/O.
+        buf = mmap.mmap(-1, self._buffersize)
+        zero_view = memoryview(b"\0" * self._buffersize)
+        with Destination(self._dest, zeroed=self._zeroed, direct=True) as dst:
+            while self._size is None or self.done < self._size:
+                count = self._buffersize
+                if self._size is not None:
+                    count = min(count, self._size - self.done)
+                chunk = memoryview(buf)[:self._fill(buf, count)]
+                if not chunk:
+                    break
+                if chunk == zero_view[:len(chunk)]:
+                    dst.zero(self.done, len(chunk))
+                else:
+                    dst.write(self.done, chunk)
+                self.done += len(chunk)
+            dst.flush()
+
+    def _fill(self, buf, count):
+        # Stream may return partial reads; fill the buffer so writes are
+        # aligned for direct I/O.
+        pos = 0
+        while pos < count:
+            n = self._src.readinto(memoryview(buf)[pos:count])
+            if n == 0:
+                break
+            pos += n
+        return pos
+
+
 class Sparseness(object):
-    def __init__(self, opaque, estimated_size):
+    def __init__(self, dest, estimated_size):
         self.done = 0
-        self.opaque = opaque
+        self.offset = 0
+        self.dest = dest
         self.estimated_size = estimated_size
 
 
 def bytesWriteHandler(stream, buf, opaque):
-    fd = opaque.opaque
-    return os.write(fd, buf)
+    opaque.dest.write(opaque.offset, buf)
+    opaque.offset += len(buf)
+    opaque.done += len(buf)
+    return len(buf)
 
 
 def recvSkipHandler(stream, length, opaque):
+    opaque.dest.zero(opaque.offset, length)
+    opaque.offset += length
     opaque.done += length
-    progress = min(99, opaque.done * 100 // opaque.estimated_size)
-    write_progress(progress)
-    fd = opaque.opaque
-    cur = os.lseek(fd, length, os.SEEK_CUR)
-    return os.ftruncate(fd, cur)
+    return 0
 
 
 def arguments(args):
@@ -117,20 +290,25 @@ def arguments(args):
                         required=True, help='Storage type (volume or path)')
     parser.add_argument('--vm-name', dest='vmname', required=True,
                         help='Libvirt source VM name')
-    parser.add_argument('--bufsize', dest='bufsize', default=MiB,
-                        type=int, help='Size of packets in bytes, default'
-                        '1048676')
+    parser.add_argument('--bufsize', dest='bufsize', default=BUFFER_SIZE,
+                        type=int, help='Size of packets in bytes, default '
+                        '%d' % BUFFER_SIZE)
     parser.add_argument('--verbose', action='store_true',
                         help='verbose output')
     parser.add_argument('--allocation', dest='allocation', default='',
                         help='Allocation Policy')
+    parser.add_argument('--parallel', dest='parallel', default=1,
+                        type=int, help='Number of disks to copy in '
+                        'parallel, default 1')
 
     return parser.parse_args(args)
 
 
 def write_output(msg):
-    sys.stdout.write('[%7.1f] %s\n' % (time.monotonic_time() - _start, msg))
-    sys.stdout.flush()
+    elapsed = time.monotonic_time() - _start
+    with _output_lock:
+        sys.stdout.write('[%7.1f] %s\n' % (elapsed, msg))
+        sys.stdout.flush()
 
 
 def write_error(e):
@@ -138,23 +316,35 @@ def write_error(e):
 
 
 def write_progress(progress):
-    sys.stdout.write('    (%d/100%%)\r' % progress)
-    sys.stdout.flush()
+    with _output_lock:
+        sys.stdout.write('    (%d/100%%)\r' % progress)
+        sys.stdout.flush()
 
 
-def volume_progress(op, done, estimated_size):
+def write_disk_progress(diskno, disk_count, progress):
+    """
+    Write progress of one of the disks copied in parallel.
+    """
+    with _output_lock:
+        sys.stdout.write('    (disk %d/%d: %d/100%%)\r' %
+                         (diskno, disk_count, progress))
+        sys.stdout.flush()
+
+
+def volume_progress(op, done, estimated_size, report):
     while op.done < estimated_size:
         progress = min(99, op.done * 100 // estimated_size)
-        write_progress(progress)
+        report(progress)
         if done.wait(1):
             break
-    write_progress(100)
+    report(100)
 
 
 @contextmanager
-def progress(op, estimated_size):
+def progress(op, estimated_size, report=write_progress):
     done = threading.Event()
-    th = concurrent.thread(volume_progress, args=(op, done, estimated_size))
+    th = concurrent.thread(volume_progress,
+                           args=(op, done, estimated_size, report))
     th.start()
     try:
         yield th
@@ -163,20 +353,22 @@ def progress(op, estimated_size):
         th.join()
 
 
-def download_disk(adapter, estimated_size, size, dest, bufsize):
-    op = directio.Receive(dest, adapter, size=size, buffersize=bufsize)
-    with progress(op, estimated_size):
+def download_disk(adapter, estimated_size, size, dest, bufsize,
+                  report=write_progress):
+    op = Receive(dest, adapter, size=size, buffersize=bufsize)
+    with progress(op, estimated_size, report):
         op.run()
     adapter.finish()
 
 
-def download_disk_sparse(stream, estimated_size, size, dest, bufsize):
-    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
-    op = Sparseness(fd, estimated_size)
-    with progress(op, estimated_size):
-        stream.sparseRecvAll(bytesWriteHandler, recvSkipHandler, op)
+def download_disk_sparse(stream, estimated_size, size, dest, bufsize,
+                         report=write_progress):
+    with Destination(dest, truncate=True) as dst:
+        op = Sparseness(dst, estimated_size)
+        with progress(op, estimated_size, report):
+            stream.sparseRecvAll(bytesWriteHandler, recvSkipHandler, op)
+        dst.flush()
     stream.finish()
-    os.close(fd)
 
 
 def get_password(options):
@@ -189,7 +381,7 @@ def get_password(options):
         return ProtectedPassword(f.read())
 
 
-def handle_volume(con, diskno, src, dst, options):
+def handle_volume(con, diskno, src, dst, options, report=write_progress):
     write_output('Copying disk %d/%d to %s' % (diskno, len(options.source),
                                                dst))
     vol = con.storageVolLookupByPath(src)
@@ -202,12 +394,8 @@ def handle_volume(con, diskno, src, dst, options):
     stream = con.newStream()
     preallocated = True
 
-    # Current code does not support writing to block storage using libvirt
-    # sparse stream API.
     # Libvirt sparseness is only supported from version 3004000 and up.
-    if options.allocation == "sparse" and \
-            not fileutils.is_block_device(dst) and \
-            con.getLibVersion() >= 3004000:
+    if options.allocation == "sparse" and con.getLibVersion() >= 3004000:
         try:
             preallocated = False
             vol.download(stream, 0, 0,
@@ -215,7 +403,7 @@ def handle_volume(con, diskno, src, dst, options):
             # No need to pass the size, volume download will return -1
             # when the stream finishes
             download_disk_sparse(stream, estimated_size, None, dst,
-                                 options.bufsize)
+                                 options.bufsize, report)
         except libvirt.libvirtError:
             preallocated = True
             write_output('WARN: sparseness is not supported')
@@ -225,10 +413,11 @@ def handle_volume(con, diskno, src, dst, options):
         sr = StreamAdapter(stream)
         # No need to pass the size, volume download will return -1
         # when the stream finishes
-        download_disk(sr, estimated_size, None, dst, options.bufsize)
+        download_disk(sr, estimated_size, None, dst, options.bufsize,
+                      report)
 
 
-def handle_path(con, diskno, src, dst, options):
+def handle_path(con, diskno, src, dst, options, report=write_progress):
     write_output('Copying disk %d/%d to %s' % (diskno, len(options.source),
                                                dst))
     vm = con.lookupByName(options.vmname)
@@ -240,7 +429,71 @@ def handle_path(con, diskno, src, dst, options):
                      (diskno, capacity, physical))
 
     vmAdapter = VMAdapter(vm, src)
-    download_disk(vmAdapter, physical, physical, dst, options.bufsize)
+    download_disk(vmAdapter, physical, physical, dst, options.bufsize,
+                  report)
+
+
+def handle_disk(con, diskno, src, dst, fmt, options, report=write_progress):
+    if fmt == 'volume':
+        handle_volume(con, diskno, src, dst, options, report)
+    elif fmt == 'path':
+        handle_path(con, diskno, src, dst, options, report)
+
+
+def copy_disks(options, password, disks):
+    con = libvirtconnection.open_connection(options.uri,
+                                            options.username,
+                                            password)
+    for diskno, (src, dst, fmt) in disks:
+        handle_disk(con, diskno, src, dst, fmt, options)
+
+
+def copy_disks_parallel(options, password, disks):
+    """
+    Copy disks using options.parallel threads. Every thread uses its own
+    libvirt connection, so transfers do not share the same socket.
+
+    If copying a disk fails, disks not started yet are not copied, and the
+    first error is raised after all threads finished. Errors of other
+    threads are written to the output.
+    """
+    disk_count = len(disks)
+    workers = min(options.parallel, disk_count)
+    write_output('Copying %d disks, %d in parallel' % (disk_count, workers))
+
+    lock = threading.Lock()
+    pending = collections.deque(disks)
+    errors = []
+
+    def worker():
+        try:
+            con = libvirtconnection.open_connection(options.uri,
+                                                    options.username,
+                                                    password)
+            while True:
+                with lock:
+                    if errors or not pending:
+                        return
+                    diskno, (src, dst, fmt) = pending.popleft()
+                report = functools.partial(
+                    write_disk_progress, diskno, disk_count)
+                handle_disk(con, diskno, src, dst, fmt, options, report)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    threads = [concurrent.thread(worker, name="kvm2ovirt/%d" % i)
+               for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        # The first error is reported by the caller.
+        for e in errors[1:]:
+            write_error(e)
+        raise errors[0]
 
 
 def validate_disks(options):
@@ -257,6 +510,10 @@ def validate_disks(options):
         write_output('>>> unsupported allocation policy. (supported: sparse, '
                      'preallocated)')
         sys.exit(1)
+    elif options.parallel < 1:
+        write_output('>>> invalid number of parallel disks: %d' %
+                     options.parallel)
+        sys.exit(1)
 
 
 def main(argv=None):
@@ -266,16 +523,14 @@ def main(argv=None):
     options = arguments(argv or sys.argv)
     validate_disks(options)
 
-    con = libvirtconnection.open_connection(options.uri,
-                                            options.username,
-                                            get_password(options))
+    password = get_password(options)
 
     write_output('preparing for copy')
-    disks = six.moves.zip(options.source, options.dest, options.storagetype)
-    for diskno, (src, dst, fmt) in enumerate(disks, start=1):
-        if fmt == 'volume':
-            handle_volume(con, diskno, src, dst, options)
-        elif fmt == 'path':
-            handle_path(con, diskno, src, dst, options)
-        diskno = diskno + 1
+    disks = list(enumerate(
+        six.moves.zip(options.source, options.dest, options.storagetype),
+        start=1))
+    if options.parallel > 1 and len(disks) > 1:
+        copy_disks_parallel(options, password, disks)
+    else:
+        copy_disks(options, password, disks)
     write_output('Finishing off')
@@ -21,19 +21,41 @@ from __future__ import absolute_import
 from __future__ import division
 
 import errno
+import logging
+import threading
 
+import six
+
+from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
 from vdsm.network.link import bond
 from vdsm.network.link import dpdk
 from vdsm.network.link import iface
 from vdsm.network.link import nic
 from vdsm.network.link import vlan
+from vdsm.network.netlink import link
+from vdsm.network.netlink import monitor
 
 
 def report():
+    """
+    Report statistics of all links.
+
+    Counters and state of all the kernel links are fetched by a single
+    netlink dump. Link type, speed and duplex are expensive to read and
+    rarely change, so they are cached until a netlink link event is
+    received.
+    """
     stats = {}
-    for iface_properties in iface.list():
+    for properties in link.iter_links_stats():
         try:
-            interface = iface.iface(iface_properties['name'])
+            stats[properties['name']] = _generate_link_stats(properties)
+        except IOError as e:
+            if e.errno != errno.ENODEV:
+                raise
+    for dev_name in six.viewkeys(dpdk.get_dpdk_devices()):
+        try:
+            interface = iface.iface(dev_name)
             stats[interface.device] = _generate_iface_stats(interface)
         except IOError as e:
             if e.errno != errno.ENODEV:
@@ -41,19 +63,134 @@ def report():
     return stats
 
 
+def _generate_link_stats(properties):
+    name = properties['name']
+    counters = properties['stats']
+    link_type, speed, duplex = _properties_cache.get(
+        name, properties.get('type')
+    )
+    is_up = link.is_link_up(properties['flags'], check_oper_status=True)
+    return {
+        'name': name,
+        'rx': counters['rx_bytes'],
+        'tx': counters['tx_bytes'],
+        'state': 'up' if is_up else 'down',
+        'rxDropped': counters['rx_dropped'],
+        'txDropped': counters['tx_dropped'],
+        'rxErrors': counters['rx_errors'],
+        'txErrors': counters['tx_errors'],
+        'speed': speed,
+        'duplex': duplex,
+    }
+
+
 def _generate_iface_stats(interface):
     stats = interface.statistics()
-    speed = 0
-    if interface.type() == iface.Type.NIC:
-        speed = nic.speed(interface.device)
-    elif interface.type() == iface.Type.BOND:
-        speed = bond.speed(interface.device)
-    elif interface.type() == iface.Type.VLAN:
-        speed = vlan.speed(interface.device)
-    elif interface.type() == iface.Type.DPDK:
-        speed = dpdk.speed(interface.device)
-
-    stats['speed'] = speed
+    stats['speed'] = _speed(interface.device, interface.type())
     stats['duplex'] = nic.duplex(interface.device)
-
     return stats
+
+
+def _speed(dev_name, link_type):
+    if link_type == iface.Type.NIC:
+        return nic.speed(dev_name)
+    elif link_type == iface.Type.BOND:
+        return bond.speed(dev_name)
+    elif link_type == iface.Type.VLAN:
+        return vlan.speed(dev_name)
+    elif link_type == iface.Type.DPDK:
+        return dpdk.speed(dev_name)
+    return 0
+
+
+class _LinkPropertiesCache(object):
+    """
+    Cache of link type, speed and duplex, read from sysfs and ethtool.
+
+    Link properties may change only when the kernel reports a link event
+    (e.g. link going up or down, enslaving a nic to a bond, or removing a
+    link), so the whole cache is dropped on any netlink link event. The
+    speed of bonds and vlans depends on other links, so invalidating single
+    entries is not enough.
+
+    The cache is used only while the netlink monitor is running; if the
+    monitor cannot be started or fails, properties are read every time.
+    After a failure, the monitor is restarted after a delay, doubled on
+    every failure up to MAX_RETRY_DELAY seconds.
+    """
+
+    MIN_RETRY_DELAY = 10
+    MAX_RETRY_DELAY = 600
+
+    def __init__(self, clock=monotonic_time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+        self._monitoring = False
+        self._monitor_thread = None
+        self._retry_at = None
+        self._retry_delay = self.MIN_RETRY_DELAY
+
+    def get(self, name, link_type):
+        with self._lock:
+            if not self._monitoring:
+                self._start_monitor()
+            try:
+                return self._entries[name]
+            except KeyError:
+                generation = self._generation
+
+        entry = _read_link_properties(name, link_type)
+
+        with self._lock:
+            # Do not cache properties read while a link event was received,
+            # they may be stale already.
+            if self._monitoring and generation == self._generation:
+                self._entries[name] = entry
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _start_monitor(self):
+        if self._monitor_thread is not None:
+            return
+        if self._retry_at is not None and self._clock() < self._retry_at:
+            return
+        self._monitor_thread = concurrent.thread(
+            self._monitor, name='netlink/stats'
+        )
+        self._monitor_thread.start()
+
+    def _monitor(self):
+        try:
+            with monitor.object_monitor(groups=('link',)) as mon:
+                with self._lock:
+                    self._monitoring = True
+                    self._retry_delay = self.MIN_RETRY_DELAY
+                for _ in mon:
+                    self.invalidate()
+        except Exception:
+            logging.exception('Link events monitor failed, retrying in %d '
+                              'seconds', self._retry_delay)
+        finally:
+            with self._lock:
+                self._monitoring = False
+                self._monitor_thread = None
+                self._entries.clear()
+                self._generation += 1
+                self._retry_at = self._clock() + self._retry_delay
+                self._retry_delay = min(
+                    self._retry_delay * 2, self.MAX_RETRY_DELAY)
+
+
+def _read_link_properties(name, link_type):
+    if link_type is None:
+        link_type = iface.get_alternative_type(name)
+    return link_type, _speed(name, link_type), nic.duplex(name)
+
+
+_properties_cache = _LinkPropertiesCache()
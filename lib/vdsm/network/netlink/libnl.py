@@ -43,6 +43,7 @@ from ctypes import c_char_p
 from ctypes import c_int
 from ctypes import c_size_t
 from ctypes import c_uint32
+from ctypes import c_uint64
 from ctypes import c_ushort
 from ctypes import c_void_p
 from ctypes import get_errno
@@ -186,6 +187,18 @@ class NlCbKind(object):
     NL_CB_CUSTOM = 3  # Customized handler specified by user
 
 
+# include/netlink/route/link.h
+class RtnlLinkStat(object):
+    RX_PACKETS = 0
+    TX_PACKETS = 1
+    RX_BYTES = 2
+    TX_BYTES = 3
+    RX_ERRORS = 4
+    TX_ERRORS = 5
+    RX_DROPPED = 6
+    TX_DROPPED = 7
+
+
 class RtnlObjectType(object):
     BASE = 'route'
     ADDR = BASE + '/addr'  # libnl/lib/route/addr.c
@@ -928,6 +941,24 @@ def rtnl_link_i2name(cache, ifindex):
     return conversion_util.to_str(name) if name else None
 
 
+def rtnl_link_get_stat(link, stat_id):
+    """Return statistical counter of link object.
+
+    The counters are filled from the link message (IFLA_STATS64 when
+    reported by the kernel), so reading them does not require any
+    additional request.
+
+    @arg link            Link object
+    @arg stat_id         Identifier of statistical counter (RtnlLinkStat)
+
+    @return Value of counter or 0 if not specified.
+    """
+    _rtnl_link_get_stat = _libnl_route(
+        'rtnl_link_get_stat', c_uint64, c_void_p, c_int
+    )
+    return _rtnl_link_get_stat(link, stat_id)
+
+
 def rtnl_link_operstate2str(operstate_code):
     """Convert operstate code to string.
 
@@ -52,6 +52,22 @@ def iter_links():
                 link = libnl.nl_cache_get_next(link)
 
 
+def iter_links_stats():
+    """Generator that yields an information dictionary for each link of the
+    system, including its statistics counters under the 'stats' key.
+
+    All the links and their counters are fetched by a single RTM_GETLINK
+    dump."""
+    with _pool.socket() as sock:
+        with _nl_link_cache(sock) as cache:
+            link = libnl.nl_cache_get_first(cache)
+            while link:
+                info = _link_info(link, cache=cache)
+                info['stats'] = _link_stats(link)
+                yield info
+                link = libnl.nl_cache_get_next(link)
+
+
 def is_link_up(link_flags, check_oper_status):
     """
     Check link status based on device status flags.
@@ -108,6 +124,30 @@ def _link_info(link, cache=None):
     return info
 
 
+def _link_stats(link):
+    """Returns a dictionary with the statistics counters of the link."""
+    return {
+        'rx_bytes': libnl.rtnl_link_get_stat(
+            link, libnl.RtnlLinkStat.RX_BYTES
+        ),
+        'tx_bytes': libnl.rtnl_link_get_stat(
+            link, libnl.RtnlLinkStat.TX_BYTES
+        ),
+        'rx_dropped': libnl.rtnl_link_get_stat(
+            link, libnl.RtnlLinkStat.RX_DROPPED
+        ),
+        'tx_dropped': libnl.rtnl_link_get_stat(
+            link, libnl.RtnlLinkStat.TX_DROPPED
+        ),
+        'rx_errors': libnl.rtnl_link_get_stat(
+            link, libnl.RtnlLinkStat.RX_ERRORS
+        ),
+        'tx_errors': libnl.rtnl_link_get_stat(
+            link, libnl.RtnlLinkStat.TX_ERRORS
+        ),
+    }
+
+
 def _link_index_to_name(link_index, cache=None):
     """Returns the textual name of the link with index equal to link_index."""
     if cache is None:
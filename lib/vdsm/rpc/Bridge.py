@@ -342,6 +342,7 @@ command_info = {
     'Host_getLldp': {'ret': 'info'},
     'Host_getHardwareInfo': {'ret': 'info'},
     'Host_getLVMVolumeGroups': {'ret': 'vglist'},
+    'Host_getLockStats': {'ret': 'lockStats'},
     'Host_getStats': {'ret': 'info'},
     'Host_getStorageDomains': {'ret': 'domlist'},
     'Host_getStorageRepoStats': {'ret': Host_getStorageRepoStats_Ret},
@@ -52,6 +52,14 @@ from Scheduler.schedule(), and cancel the task:
     ...
     scheduled_call.cancel()
 
+Canceled calls are kept by the scheduler until their deadline. If you schedule
+and cancel many calls with long delays, use a timer wheel, removing canceled
+calls immediately:
+
+    scheduler = schedule.Scheduler(queue="wheel")
+
+The timer wheel fires calls up to WHEEL_RESOLUTION seconds late.
+
 Finally, when the scheduler is not needed any more:
 
     scheduler.stop()
@@ -61,12 +69,17 @@ This will cancel any pending calls and terminate the scheduler thread.
 
 import heapq
 import logging
+import math
 import threading
 import time
 
 from vdsm.common import concurrent
 
 
+# Timer wheel resolution in seconds.
+WHEEL_RESOLUTION = 0.01
+
+
 class Scheduler(object):
     """
     Schedule calls for future execution in a background thread.
@@ -79,19 +92,25 @@ class Scheduler(object):
 
     _log = logging.getLogger("Scheduler")
 
-    def __init__(self, name="Scheduler", clock=time.time):
+    def __init__(self, name="Scheduler", clock=time.time, queue="heap"):
         """
         Initialize a scheduler.
 
         Arguments:
           name      Used as sheculer thread name
           clock     Callable returning current time (default time.time)
+          queue     "heap" (default) or "wheel"
         """
         self._name = name
         self._clock = clock
         self._cond = threading.Condition(threading.Lock())
         self._running = False
-        self._calls = []
+        if queue == "heap":
+            self._calls = _HeapQueue()
+        elif queue == "wheel":
+            self._calls = _TimerWheel(clock(), WHEEL_RESOLUTION)
+        else:
+            raise ValueError("Invalid scheduler queue: %r" % queue)
         self._thread = concurrent.thread(self._run, name=self._name,
                                          log=self._log)
 
@@ -132,11 +151,16 @@ class Scheduler(object):
         with self._cond:
             if not self._running:
                 raise AssertionError("Scheduler not running")
-            heapq.heappush(self._calls, call)
-            if self._calls[0] is call:
+            if self._calls.push(call):
                 self._cond.notify()
+            if self._calls.removable:
+                call._scheduler = self
         return call
 
+    def _remove(self, call):
+        with self._cond:
+            self._calls.remove(call)
+
     def _run(self):
         self._log.debug("started")
         try:
@@ -155,32 +179,237 @@ class Scheduler(object):
                     self._cond.wait(delay)
                     if not self._running:
                         return
-                expired = self._pop_expired_calls()
+                expired = self._calls.pop_expired(self._clock())
             for call in expired:
                 call._execute()
 
     def _time_until_deadline(self):
-        if len(self._calls) > 0:
-            return self._calls[0]._deadline - self._clock()
+        deadline = self._calls.next_deadline()
+        if deadline is not None:
+            return deadline - self._clock()
         return self.DEFAULT_DELAY
 
-    def _pop_expired_calls(self):
-        now = self._clock()
+    def _cancel_calls(self):
+        # Help the garbage collector by breaking reference cycles
+        with self._cond:
+            calls = self._calls.clear()
+        for call in calls:
+            call.cancel()
+
+
+class _HeapQueue(object):
+    """
+    Calls ordered by deadline. Canceled calls are dropped when they expire.
+    """
+
+    removable = False
+
+    def __init__(self):
+        self._heap = []
+
+    def push(self, call):
+        """
+        Add a call, returning True if it is the next call to expire.
+        """
+        heapq.heappush(self._heap, call)
+        return self._heap[0] is call
+
+    def remove(self, call):
+        pass
+
+    def next_deadline(self):
+        if self._heap:
+            return self._heap[0]._deadline
+        return None
+
+    def pop_expired(self, now):
         expired = []
-        while len(self._calls) > 0:
-            call = self._calls[0]
+        while self._heap:
+            call = self._heap[0]
             if call._deadline > now:
                 break
-            heapq.heappop(self._calls)
+            heapq.heappop(self._heap)
             if call.valid():
                 expired.append(call)
         return expired
 
-    def _cancel_calls(self):
-        # Help the garbage collector by breaking reference cycles
-        with self._cond:
-            for call in self._calls:
-                call.cancel()
+    def clear(self):
+        calls, self._heap = self._heap, []
+        return calls
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class _TimerWheel(object):
+    """
+    Hierarchical timer wheel, inserting and removing calls in O(1).
+
+    Time is divided into ticks of resolution seconds. A call expiring in
+    less than SLOTS ticks is kept in the first level, in the slot of its
+    tick. Calls expiring later are kept in higher levels, where every slot
+    holds SLOTS times more ticks than a slot in the previous level. When
+    the first level wraps around, the calls in the next slot of the second
+    level are moved to the first level, and so on.
+
+    Calls are called on the first tick after their deadline, up to
+    resolution seconds late.
+    """
+
+    removable = True
+
+    BITS = 6
+    SLOTS = 1 << BITS
+    MASK = SLOTS - 1
+    LEVELS = 4
+
+    # Calls expiring in less than _LIMITS[n] ticks are kept in level n.
+    _LIMITS = (1 << 6, 1 << 12, 1 << 18, 1 << 24)
+
+    def __init__(self, now, resolution):
+        self._resolution = resolution
+        # Next tick to process.
+        self._next = self._last_tick(now) + 1
+        self._wheel = [[set() for i in range(self.SLOTS)]
+                       for level in range(self.LEVELS)]
+        self._counts = [0] * self.LEVELS
+        # Tick returned by the last next_deadline() call.
+        self._wakeup = None
+
+    def push(self, call):
+        """
+        Add a call, returning True if it must be handled before the tick
+        returned by the last next_deadline() call.
+        """
+        tick = int(math.ceil(call._deadline / self._resolution))
+        if tick * self._resolution < call._deadline:
+            tick += 1
+        call._tick = tick
+        wakeup = self._place(call)
+        return self._wakeup is None or wakeup < self._wakeup
+
+    def remove(self, call):
+        if call._slot is not None:
+            call._slot.discard(call)
+            self._counts[call._level] -= 1
+            call._slot = None
+
+    def next_deadline(self):
+        """
+        Return the time of the first tick with calls, or the first tick
+        moving calls from higher levels, or None if there are no calls.
+        """
+        ticks = []
+        if self._counts[0]:
+            for tick in range(self._next, self._next + self.SLOTS):
+                if self._wheel[0][tick & self.MASK]:
+                    ticks.append(tick)
+                    break
+        for level in range(1, self.LEVELS):
+            if not self._counts[level]:
+                continue
+            shift = self.BITS * level
+            base = self._next >> shift
+            for i in range(self.SLOTS + 1):
+                tick = (base + i) << shift
+                if tick >= self._next and \
+                        self._wheel[level][(base + i) & self.MASK]:
+                    ticks.append(tick)
+                    break
+        if not ticks:
+            self._wakeup = None
+            return None
+        self._wakeup = min(ticks)
+        return self._wakeup * self._resolution
+
+    def pop_expired(self, now):
+        expired = []
+        last = self._last_tick(now)
+        while self._next <= last:
+            if not any(self._counts):
+                self._next = last + 1
+                break
+            if not self._counts[0] and self._next & self.MASK:
+                # Nothing to do until the next cascade.
+                self._next = min(last + 1,
+                                 (self._next | self.MASK) + 1)
+                continue
+            self._process_tick(expired)
+        return expired
+
+    def clear(self):
+        calls = []
+        for level in self._wheel:
+            for slot in level:
+                calls.extend(slot)
+                slot.clear()
+        for call in calls:
+            call._slot = None
+        self._counts = [0] * self.LEVELS
+        return calls
+
+    def __len__(self):
+        return sum(self._counts)
+
+    def _last_tick(self, now):
+        # Last tick starting at or before now, avoiding float rounding
+        # errors so next_deadline() and pop_expired() agree.
+        tick = int(now / self._resolution)
+        while (tick + 1) * self._resolution <= now:
+            tick += 1
+        while tick * self._resolution > now:
+            tick -= 1
+        return tick
+
+    def _place(self, call):
+        """
+        Place call in the wheel, returning the tick when the call is
+        expired or moved to a lower level.
+        """
+        delta = max(call._tick - self._next, 0)
+        for level, limit in enumerate(self._LIMITS):
+            if delta < limit:
+                break
+        else:
+            # Beyond the wheel range; moved back to the last level when
+            # the slot is cascaded, until it is in range.
+            delta = (1 << (self.BITS * self.LEVELS)) - 1
+        tick = self._next + delta
+        shift = self.BITS * level
+        slot = self._wheel[level][(tick >> shift) & self.MASK]
+        slot.add(call)
+        self._counts[level] += 1
+        call._level = level
+        call._slot = slot
+        return max(self._next, (tick >> shift) << shift)
+
+    def _process_tick(self, expired):
+        index = self._next & self.MASK
+        if index == 0:
+            for level in range(1, self.LEVELS):
+                cascade = (self._next >> (self.BITS * level)) & self.MASK
+                self._cascade(level, cascade)
+                if cascade != 0:
+                    break
+
+        slot = self._wheel[0][index]
+        if slot:
+            for call in slot:
+                call._slot = None
+                if call.valid():
+                    expired.append(call)
+            self._counts[0] -= len(slot)
+            slot.clear()
+        self._next += 1
+
+    def _cascade(self, level, index):
+        slot = self._wheel[level][index]
+        if slot:
+            calls = list(slot)
+            slot.clear()
+            self._counts[level] -= len(calls)
+            for call in calls:
+                self._place(call)
 
 
 class ScheduledCall(object):
@@ -195,16 +424,26 @@ class ScheduledCall(object):
     guarantee that the callback will not be run after cancel() is called.
     """
 
-    __slots__ = ('_deadline', '_callable')
+    __slots__ = ('_deadline', '_callable', '_scheduler', '_tick', '_level',
+                 '_slot')
 
     _log = logging.getLogger("Scheduler")
 
     def __init__(self, deadline, callable):
         self._deadline = deadline
         self._callable = callable
+        # Set if the scheduler can remove canceled calls.
+        self._scheduler = None
+        self._tick = None
+        self._level = None
+        self._slot = None
 
     def cancel(self):
         self._callable = _INVALID
+        scheduler = self._scheduler
+        if scheduler is not None:
+            self._scheduler = None
+            scheduler._remove(self)
 
     def valid(self):
         return self._callable is not _INVALID
@@ -216,6 +455,7 @@ class ScheduledCall(object):
             self._log.exception("Unhandled exception in %s", self._callable)
         finally:
             self._callable = _INVALID
+            self._scheduler = None
 
     # Rich comparison support (required for Python 3).  This is the minimal
     # implementation to allow pushing a call into a heap.
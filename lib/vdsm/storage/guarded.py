@@ -26,6 +26,8 @@ import sys
 
 import six
 
+from vdsm.storage import locktrace
+
 log = logging.getLogger('storage.guarded')
 
 
@@ -89,10 +91,19 @@ class context(object):
 
     def __enter__(self):
         for lock in self._locks:
+            since = None
+            if locktrace.enabled and not lock.traced:
+                # We cannot tell if the lock will block (e.g. a lease on
+                # storage), so every acquire is traced as a wait.
+                since = locktrace.waiting(
+                    _trace_kind(lock), _trace_name(lock), lock.mode)
             try:
                 lock.acquire()
             except:
                 exc = sys.exc_info()
+                if since is not None:
+                    locktrace.cancelled(
+                        _trace_kind(lock), _trace_name(lock), since)
                 log.error("Error acquiring lock %r", lock)
                 try:
                     self._release()
@@ -103,6 +114,9 @@ class context(object):
                 finally:
                     del exc
 
+            if since is not None:
+                locktrace.acquired(
+                    _trace_kind(lock), _trace_name(lock), lock.mode, since)
             self._held_locks.append(lock)
         return self
 
@@ -124,11 +138,27 @@ class context(object):
                 lock.release()
             except Exception as e:
                 errors.append(e)
+            else:
+                if locktrace.enabled and not lock.traced:
+                    locktrace.released(_trace_kind(lock), _trace_name(lock))
         if errors:
             raise ReleaseError(errors)
 
 
+def _trace_kind(lock):
+    return type(lock).__name__
+
+
+def _trace_name(lock):
+    return "%s.%s" % (lock.ns, lock.name)
+
+
 class AbstractLock(object):
+
+    # Locks reporting their own operations to locktrace set this to True, so
+    # they are not traced twice.
+    traced = False
+
     @property
     def ns(self):
         raise NotImplementedError
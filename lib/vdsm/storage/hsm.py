@@ -404,6 +404,8 @@ class HSM(object):
         except Exception:
             self.log.warn("Failed to clean Storage Repository.", exc_info=True)
 
+        oop.start()
+
         monitorInterval = config.getint('irs', 'sd_health_check_delay')
         self.mpathhealth_monitor = mpathhealth.Monitor(monitorInterval)
         self.mpathhealth_monitor.start()
@@ -3576,6 +3578,8 @@ class HSM(object):
         domains = frozenset(domains)
         repoStats = {}
         statsGenTime = time.time()
+        oop_stats = oop.stats()
+        cycle_stats = domainMonitor.getCycleStats()
 
         for sdUUID, domStatus in domainMonitor.getDomainsStatus():
             if domains and sdUUID not in domains:
@@ -3621,6 +3625,12 @@ class HSM(object):
                 'isoprefix': domStatus.isoPrefix,
             }
 
+            if sdUUID in oop_stats:
+                repoStats[sdUUID]['result']['ioprocess'] = oop_stats[sdUUID]
+
+            if sdUUID in cycle_stats:
+                repoStats[sdUUID]['result']['cycle'] = cycle_stats[sdUUID]
+
         return repoStats
 
     @public
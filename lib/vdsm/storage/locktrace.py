@@ -0,0 +1,331 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Optional tracing of storage locks.
+
+When tracing is enabled, storage locks (resource manager resources,
+rwlock.RWLock, and locks taken by guarded.context) report when a thread
+starts waiting for a lock, acquires it, and releases it. This module keeps
+the current owners and waiters of every lock, so it can report which thread
+waits for which thread, detect deadlocks, and flag locks held for too long.
+
+Locks call this module only if the module "enabled" flag is set::
+
+    if locktrace.enabled:
+        locktrace.acquired("rwlock", name, "shared")
+
+so when tracing is disabled, the only cost is checking the flag.
+
+Locks are identified by kind (e.g. "resource") and name (e.g.
+"00_storage.sd-uuid"). A thread waiting for a lock waits for all the
+threads holding the lock.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import threading
+
+from vdsm.common.time import monotonic_time
+from vdsm.config import config
+
+log = logging.getLogger("storage.locktrace")
+
+enabled = False
+
+_lock = threading.Lock()
+_long_hold = 300.0
+
+# (kind, name) -> list of _Hold
+_holds = {}
+
+# thread ident -> _Wait
+_waits = {}
+
+# kind -> _KindStats
+_kinds = {}
+
+
+class _Hold(object):
+
+    __slots__ = ("thread", "ident", "mode", "since")
+
+    def __init__(self, thread, mode, since):
+        self.thread = thread.name
+        self.ident = thread.ident
+        self.mode = mode
+        self.since = since
+
+
+class _Wait(object):
+
+    __slots__ = ("thread", "ident", "kind", "name", "mode", "since")
+
+    def __init__(self, thread, kind, name, mode, since):
+        self.thread = thread.name
+        self.ident = thread.ident
+        self.kind = kind
+        self.name = name
+        self.mode = mode
+        self.since = since
+
+
+class _KindStats(object):
+
+    def __init__(self):
+        self.acquired = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.long_holds = 0
+
+    def waited(self, seconds):
+        self.waits += 1
+        self.wait_time += seconds
+        self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def info(self):
+        return {
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "wait_time": self.wait_time,
+            "max_wait_time": self.max_wait_time,
+            "long_holds": self.long_holds,
+        }
+
+
+def start():
+    if config.getboolean("devel", "lock_tracing_enable"):
+        enable(config.getfloat("devel", "lock_tracing_long_hold"))
+
+
+def enable(long_hold=300.0):
+    """
+    Start tracing locks, flagging locks held longer than long_hold seconds.
+
+    Locks acquired before tracing was enabled are not reported.
+    """
+    global enabled, _long_hold
+    log.info("Enabling lock tracing (long_hold=%s)", long_hold)
+    with _lock:
+        _reset()
+        _long_hold = long_hold
+        enabled = True
+
+
+def disable():
+    global enabled
+    log.info("Disabling lock tracing")
+    with _lock:
+        enabled = False
+        _reset()
+
+
+def waiting(kind, name, mode):
+    """
+    Called by the current thread before it blocks waiting for a lock.
+
+    Returns the wait start time, to be passed to acquired() or cancelled().
+    """
+    thread = threading.current_thread()
+    now = monotonic_time()
+    with _lock:
+        if enabled:
+            _waits[thread.ident] = _Wait(thread, kind, name, mode, now)
+    return now
+
+
+def acquired(kind, name, mode, since=None):
+    """
+    Called by the current thread after acquiring a lock. If the thread had
+    to wait, since is the value returned from waiting().
+    """
+    thread = threading.current_thread()
+    now = monotonic_time()
+    with _lock:
+        if not enabled:
+            return
+        stats = _kind_stats(kind)
+        stats.acquired += 1
+        if since is not None:
+            _waits.pop(thread.ident, None)
+            stats.waited(now - since)
+        _holds.setdefault((kind, name), []).append(
+            _Hold(thread, mode, now))
+
+
+def cancelled(kind, name, since):
+    """
+    Called by the current thread if it stopped waiting for a lock without
+    acquiring it, for example on timeout.
+    """
+    thread = threading.current_thread()
+    now = monotonic_time()
+    with _lock:
+        if not enabled:
+            return
+        _waits.pop(thread.ident, None)
+        _kind_stats(kind).waited(now - since)
+
+
+def released(kind, name):
+    """
+    Called when a lock is released.
+
+    Some locks can be released by another thread (e.g. resource manager
+    autorelease). If the current thread does not hold the lock, the oldest
+    hold is released.
+    """
+    ident = threading.current_thread().ident
+    now = monotonic_time()
+    with _lock:
+        if not enabled:
+            return
+        holds = _holds.get((kind, name))
+        if not holds:
+            # Acquired before tracing was enabled.
+            return
+        for i, hold in enumerate(holds):
+            if hold.ident == ident:
+                break
+        else:
+            i = 0
+        hold = holds.pop(i)
+        if not holds:
+            del _holds[(kind, name)]
+
+        held = now - hold.since
+        long_hold = held > _long_hold
+        if long_hold:
+            _kind_stats(kind).long_holds += 1
+            threshold = _long_hold
+
+    if long_hold:
+        log.warning("Lock %s %s (%s) was held by %s for %.2f seconds "
+                    "(threshold %.2f seconds)",
+                    kind, name, hold.mode, hold.thread, held, threshold)
+
+
+def stats():
+    """
+    Return lock statistics, current holds and waits, the wait-for graph, and
+    deadlocks found in the graph.
+    """
+    now = monotonic_time()
+    with _lock:
+        holds = {key: list(value) for key, value in _holds.items()}
+        waits = list(_waits.values())
+        kinds = {kind: s.info() for kind, s in _kinds.items()}
+        long_hold = _long_hold
+        is_enabled = enabled
+
+    threads = {}
+    held = []
+    for (kind, name), key_holds in holds.items():
+        for hold in key_holds:
+            threads[hold.ident] = hold.thread
+            duration = now - hold.since
+            held.append({
+                "kind": kind,
+                "name": name,
+                "mode": hold.mode,
+                "thread": hold.thread,
+                "duration": duration,
+                "long": duration > long_hold,
+            })
+
+    waiting = []
+    wait_for = []
+    graph = {}
+    for wait in waits:
+        threads[wait.ident] = wait.thread
+        waiting.append({
+            "kind": wait.kind,
+            "name": wait.name,
+            "mode": wait.mode,
+            "thread": wait.thread,
+            "duration": now - wait.since,
+        })
+        for hold in holds.get((wait.kind, wait.name), ()):
+            if hold.ident == wait.ident:
+                continue
+            graph.setdefault(wait.ident, set()).add(hold.ident)
+            wait_for.append({
+                "waiter": wait.thread,
+                "owner": hold.thread,
+                "kind": wait.kind,
+                "name": wait.name,
+            })
+
+    deadlocks = [{"threads": [threads[ident] for ident in cycle]}
+                 for cycle in find_cycles(graph)]
+
+    return {
+        "enabled": is_enabled,
+        "long_hold": long_hold,
+        "kinds": kinds,
+        "held": held,
+        "waiting": waiting,
+        "wait_for": wait_for,
+        "deadlocks": deadlocks,
+    }
+
+
+def find_cycles(graph):
+    """
+    Return the cycles in graph, a dict mapping a node to the set of nodes it
+    points to. Every cycle is reported once, starting with its smallest
+    node.
+    """
+    cycles = set()
+
+    def visit(node, path, on_path):
+        for next_node in graph.get(node, ()):
+            if next_node in on_path:
+                cycle = path[path.index(next_node):]
+                start = cycle.index(min(cycle))
+                cycles.add(tuple(cycle[start:] + cycle[:start]))
+            elif next_node > path[0]:
+                # Cycles including smaller nodes are found when visiting
+                # the smaller node.
+                path.append(next_node)
+                on_path.add(next_node)
+                visit(next_node, path, on_path)
+                on_path.discard(next_node)
+                path.pop()
+
+    for node in sorted(graph):
+        visit(node, [node], {node})
+
+    return [list(cycle) for cycle in sorted(cycles)]
+
+
+def _kind_stats(kind):
+    stats = _kinds.get(kind)
+    if stats is None:
+        stats = _kinds[kind] = _KindStats()
+    return stats
+
+
+def _reset():
+    _holds.clear()
+    _waits.clear()
+    _kinds.clear()
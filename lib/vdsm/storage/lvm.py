@@ -927,6 +927,21 @@ class LVMCache(object):
         return [vg for vgName, vg in six.iteritems(self._reloadvgs(vgNames))
                 if vgName in vgNames]
 
+    def reloadStaleVgs(self, vgNames):
+        """
+        Reload the VGs in vgNames that are stale or missing from the cache,
+        using a single vgs command. VGs that are up to date are not reloaded.
+
+        Returns the names of the reloaded VGs.
+        """
+        with self._lock:
+            stale = [name for name in vgNames
+                     if name not in self._vgs or self._vgs[name].is_stale()]
+        if stale:
+            self.stats.miss()
+            self._reloadvgs(stale)
+        return stale
+
     def getAllVgs(self):
         # Get everything we have
         if self._stalevg:
@@ -1328,6 +1343,10 @@ def getAllVGs():
     return _lvminfo.getAllVgs()  # returns list
 
 
+def reloadStaleVGs(vgNames):
+    return _lvminfo.reloadStaleVgs(vgNames)  # returns list
+
+
 # TODO: lvm VG UUID should not be exposed.
 # Remove this function when hsm.public_createVG is removed.
 def getVGbyUUID(vgUUID):
@@ -20,18 +20,23 @@
 
 from __future__ import absolute_import
 
+import bisect
 import logging
+import random
 import threading
 import time
 
 
 from vdsm import utils
 from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
 from vdsm.config import config
 from vdsm.storage import check
 from vdsm.storage import clusterlock
 from vdsm.storage import exception as se
+from vdsm.storage import lvm
 from vdsm.storage import misc
+from vdsm.storage import sd
 from vdsm.storage.sdc import sdCache
 
 log = logging.getLogger('storage.Monitor')
@@ -139,6 +144,115 @@ class DomainStatus(object):
         self.version = -1
 
 
+class CycleStats(object):
+    """
+    Histogram of domain monitor cycle durations.
+    """
+
+    # Upper bounds of the buckets in seconds. The last bucket counts the
+    # cycles longer than the last bound.
+    BOUNDS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = [0] * (len(self.BOUNDS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._last = 0.0
+
+    def record(self, duration):
+        bucket = bisect.bisect_left(self.BOUNDS, duration)
+        with self._lock:
+            self._buckets[bucket] += 1
+            self._count += 1
+            self._total += duration
+            self._max = max(self._max, duration)
+            self._last = duration
+
+    def info(self):
+        with self._lock:
+            return {
+                "count": self._count,
+                "total": self._total,
+                "max": self._max,
+                "last": self._last,
+                "bounds": list(self.BOUNDS),
+                "buckets": list(self._buckets),
+            }
+
+
+class VGRefresh(object):
+    """
+    Reload the VGs of all monitored block domains using one lvm command per
+    monitor cycle.
+
+    Without this, every block domain monitor reloads the VG of its domain
+    when the cached VG is stale, running one vgs command per domain. Now the
+    first monitor checking a block domain in a cycle reloads all the stale
+    VGs, monitors arriving while the reload is in progress wait for it, and
+    monitors arriving later in the same cycle use the cache.
+
+    Monitors wait for a reload in progress only up to wait_timeout seconds,
+    so a reload blocked on one unresponsive VG cannot stall all monitors.
+    A monitor that stopped waiting reloads the VG of its domain when
+    accessing it, as if the reload failed.
+    """
+
+    def __init__(self, interval, wait_timeout=5, clock=monotonic_time):
+        self._interval = interval
+        self._wait_timeout = wait_timeout
+        self._clock = clock
+        self._cond = threading.Condition(threading.Lock())
+        self._vgs = set()
+        self._running = False
+        self._last = None
+
+    def add(self, vgName):
+        with self._cond:
+            self._vgs.add(vgName)
+
+    def remove(self, vgName):
+        with self._cond:
+            self._vgs.discard(vgName)
+
+    def refresh(self):
+        """
+        Reload the stale VGs, unless they were reloaded in this cycle. Errors
+        are logged; the monitor will reload the VG of its domain when
+        accessing it.
+        """
+        with self._cond:
+            if self._running:
+                # Notified once when the reload is done; a monitor woken
+                # early just reloads its own VG.
+                self._cond.wait(self._wait_timeout)
+                if self._running:
+                    log.warning("Timeout waiting for reload of vgs, "
+                                "reloading vg of domain")
+                return
+            now = self._clock()
+            if self._last is not None and now - self._last < self._interval:
+                return
+            # Set when starting, so a slow reload does not shift the next
+            # reload and monitors arriving later in this cycle do not start
+            # another one.
+            self._last = now
+            self._running = True
+            vgNames = sorted(self._vgs)
+
+        try:
+            reloaded = lvm.reloadStaleVGs(vgNames)
+            if reloaded:
+                log.debug("Reloaded stale vgs %s", reloaded)
+        except Exception:
+            log.exception("Error reloading vgs %s", vgNames)
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+
 class DomainMonitor(object):
 
     def __init__(self, interval):
@@ -146,6 +260,7 @@ class DomainMonitor(object):
         self._shutting_down = False
         self._monitors = {}
         self._interval = interval
+        self._vgRefresh = VGRefresh(interval)
         # NOTE: This must be used in asynchronous mode to prevent blocking of
         # the checker event loop thread.
         self.onDomainStateChange = misc.Event(
@@ -196,7 +311,8 @@ class DomainMonitor(object):
                 hostId,
                 self._interval,
                 self.onDomainStateChange,
-                self._checker)
+                self._checker,
+                vgRefresh=self._vgRefresh)
             monitor.poolDomain = poolDomain
             monitor.start()
             # The domain should be added only after it successfully started.
@@ -221,6 +337,11 @@ class DomainMonitor(object):
             return [(sdUUID, monitor.getStatus()) for sdUUID, monitor in
                     self._monitors.items()]
 
+    def getCycleStats(self):
+        with self._lock:
+            return {sdUUID: monitor.cycleStats.info() for sdUUID, monitor in
+                    self._monitors.items()}
+
     def getHostStatus(self, domains):
         status = {}
         for sdUUID, hostId in domains.items():
@@ -282,7 +403,8 @@ class DomainMonitor(object):
 
 class MonitorThread(object):
 
-    def __init__(self, sdUUID, hostId, interval, changeEvent, checker):
+    def __init__(self, sdUUID, hostId, interval, changeEvent, checker,
+                 vgRefresh=None):
         self.thread = concurrent.thread(self._run, log=log,
                                         name="monitor/" + sdUUID[:7])
         self.stopEvent = threading.Event()
@@ -292,6 +414,7 @@ class MonitorThread(object):
         self.interval = interval
         self.changeEvent = changeEvent
         self.checker = checker
+        self.vgRefresh = vgRefresh
         self.lock = threading.Lock()
         self.monitoringPath = None
         # For backward compatibility, we must present a fake status before
@@ -301,6 +424,12 @@ class MonitorThread(object):
                              DomainStatus(actual=False))
         self.isIsoDomain = None
         self.isoPrefix = None
+        self.isBlockDomain = None
+        # File domains are checked in their own threads; delaying the second
+        # cycle by a random part of the interval spreads the checks of
+        # domains started together, avoiding synchronized bursts of I/O.
+        self.stagger = random.uniform(0, interval)
+        self.cycleStats = CycleStats()
         self.lastRefresh = time.time()
         # Use float to allow short refresh internal during tests.
         self.refreshTime = \
@@ -392,6 +521,9 @@ class MonitorThread(object):
         if self.isIsoDomain is None:
             self._setIsoDomainInfo()
 
+        if self.isBlockDomain is None:
+            self._setBlockDomainInfo()
+
     @utils.cancelpoint
     def _setIsoDomainInfo(self):
         isIsoDomain = self.domain.isISO()
@@ -400,21 +532,32 @@ class MonitorThread(object):
             self.isoPrefix = self.domain.getIsoDomainImagesDir()
         self.isIsoDomain = isIsoDomain
 
+    @utils.cancelpoint
+    def _setBlockDomainInfo(self):
+        isBlockDomain = self.domain.getStorageType() in sd.BLOCK_DOMAIN_TYPES
+        if isBlockDomain and self.vgRefresh:
+            self.vgRefresh.add(self.sdUUID)
+        self.isBlockDomain = isBlockDomain
+
     # Monitoring
 
     def _monitorLoop(self):
         """
         Monitor the domain peroidically until the monitor is stopped.
         """
+        stagger = 0 if self.isBlockDomain else self.stagger
         while True:
+            start = monotonic_time()
             try:
                 self._monitorDomain()
             except Exception:
                 log.exception("Domain monitor for %s failed", self.sdUUID)
             finally:
+                self.cycleStats.record(monotonic_time() - start)
                 self.cycleCallback()
-            if self.stopEvent.wait(self.interval):
+            if self.stopEvent.wait(self.interval + stagger):
                 raise utils.Canceled
+            stagger = 0
 
     def _monitorDomain(self):
         # Pick up changes in the domain, for example, domain upgrade.
@@ -427,6 +570,11 @@ class MonitorThread(object):
     def _checkDomainStatus(self):
         domain_status = DomainStatus()
         try:
+            # Reload the stale VGs of all block domains using one lvm command,
+            # so selftest() and getStats() below use the cache.
+            if self.isBlockDomain and self.vgRefresh:
+                self.vgRefresh.refresh()
+
             # This may trigger a refresh of lvm cache. We have seen this taking
             # up to 90 seconds on overloaded machines.
             self.domain.selftest()
@@ -614,6 +762,8 @@ class MonitorThread(object):
         self.domain = domain
 
     def _teardownDomain(self):
+        if self.isBlockDomain and self.vgRefresh:
+            self.vgRefresh.remove(self.sdUUID)
         if not self.domain:
             return
         try:
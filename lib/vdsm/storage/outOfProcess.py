@@ -20,6 +20,7 @@
 
 from __future__ import absolute_import
 
+import collections
 import errno
 import grp
 import logging
@@ -34,7 +35,9 @@ import six
 
 from vdsm import constants
 from vdsm import utils
+from vdsm.common import concurrent
 from vdsm.common.osutils import get_umask
+from vdsm.common.time import monotonic_time
 from vdsm.config import config
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
@@ -44,16 +47,37 @@ DEFAULT_TIMEOUT = config.getint("irs", "process_pool_timeout")
 IOPROC_IDLE_TIME = config.getint("irs", "max_ioprocess_idle_time")
 HELPERS_PER_DOMAIN = config.getint("irs", "process_pool_max_slots_per_domain")
 MAX_QUEUED = config.getint("irs", "process_pool_max_queued_slots_per_domain")
+ADAPTIVE = config.getboolean("irs", "process_pool_adaptive")
+MAX_ADAPTIVE_HELPERS_PER_DOMAIN = config.getint(
+    "irs", "process_pool_max_adaptive_slots_per_domain")
+MONITOR_INTERVAL = config.getint("irs", "process_pool_monitor_interval")
+
+# Number of recent calls used to compute latency percentiles.
+LATENCY_SAMPLES = 1000
 
 _procPoolLock = threading.Lock()
 _procPool = {}
 _refProcPool = {}
+_monitor = None
 
 elapsed_time = lambda: os.times()[4]
 
 log = logging.getLogger('storage.oop')
 
 
+def start():
+    """
+    Start reaping idle ioprocesses and adapting the number of helper
+    threads in the background.
+    """
+    global _monitor
+    with _procPoolLock:
+        if _monitor is not None:
+            return
+        _monitor = _Monitor(MONITOR_INTERVAL)
+        _monitor.start()
+
+
 def stop():
     """
     Called during application shutdown to close all running ioprocesses.
@@ -61,6 +85,13 @@ def stop():
     Tests using oop should call this to ensure that stale ioprocess are not
     left when a tests ends.
     """
+    global _monitor
+    with _procPoolLock:
+        monitor = _monitor
+        _monitor = None
+    if monitor is not None:
+        monitor.stop()
+
     with _procPoolLock:
         for name, (eol, proc) in _procPool.items():
             log.debug("Closing ioprocess %s", name)
@@ -87,10 +118,7 @@ def getProcessPool(clientName):
         proc = _refProcPool.get(clientName, lambda: None)()
         if proc is None:
             log.debug("Creating ioprocess %s", clientName)
-            proc = ioprocess.IOProcess(max_threads=HELPERS_PER_DOMAIN,
-                                       timeout=DEFAULT_TIMEOUT,
-                                       max_queued_requests=MAX_QUEUED,
-                                       name=clientName)
+            proc = _MonitoredIOProcess(clientName, HELPERS_PER_DOMAIN)
             proc = _IOProcWrapper("oop", proc)
             _refProcPool[clientName] = weakref.ref(proc)
 
@@ -98,6 +126,229 @@ def getProcessPool(clientName):
         return proc
 
 
+def stats():
+    """
+    Return dict of ioprocess statistics, indexed by client name.
+    """
+    with _procPoolLock:
+        procs = [(name, ref()) for name, ref in six.iteritems(_refProcPool)]
+    return {name: proc._ioproc.stats() for name, proc in procs
+            if proc is not None}
+
+
+def _create_ioprocess(name, threads):
+    return ioprocess.IOProcess(max_threads=threads,
+                               timeout=DEFAULT_TIMEOUT,
+                               max_queued_requests=MAX_QUEUED,
+                               name=name)
+
+
+def _percentile(samples, p):
+    """
+    Return the p percentile of samples using the nearest rank method, or
+    None if there are no samples.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = -(-len(ordered) * p // 100)
+    return ordered[max(0, rank - 1)]
+
+
+class _MonitoredIOProcess(object):
+    """
+    Forward calls to an ioprocess.IOProcess, keeping call statistics.
+
+    The number of helper threads of a running ioprocess cannot be changed,
+    so adapting the number of threads starts a new ioprocess. New calls use
+    the new ioprocess, and the old ioprocess is closed when the calls using
+    it are finished.
+    """
+
+    def __init__(self, name, threads,
+                 max_threads=MAX_ADAPTIVE_HELPERS_PER_DOMAIN,
+                 timeout=DEFAULT_TIMEOUT, create=None, clock=monotonic_time):
+        self._name = name
+        # Never shrink below the initial number of threads; callers like
+        # fileSD.collectMetaFiles issue bursts of this size at once, and
+        # would fail with EAGAIN before we can grow again.
+        self._min_threads = threads
+        self._max_threads = max(max_threads, threads)
+        self._timeout = timeout
+        self._create = create or _create_ioprocess
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._threads = threads
+        self._current = self._create(name, threads)
+        # Number of calls in progress per ioprocess.
+        self._users = {id(self._current): 0}
+        self._retired = {}
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._calls = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._last_timeouts = 0
+        self._last_rejected = 0
+        self._latency = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        attr = getattr(self._current, name)
+        if not callable(attr):
+            return attr
+        return partial(self._call, name)
+
+    def close(self):
+        with self._lock:
+            procs = [self._current] + list(self._retired.values())
+            self._retired.clear()
+        for proc in procs:
+            proc.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threads": self._threads,
+                "in_flight": self._in_flight,
+                "queued": max(0, self._in_flight - self._threads),
+                "max_queued": MAX_QUEUED,
+                "calls": self._calls,
+                "timeouts": self._timeouts,
+                "rejected": self._rejected,
+                "p99": _percentile(self._latency, 99) or 0.0,
+            }
+
+    def adapt(self):
+        """
+        Adapt the number of helper threads to the load since the last call.
+
+        Grow when calls had to wait for a helper thread or were rejected
+        because the queue was full. Do not grow if calls timed out or are
+        close to the timeout; the storage is not responsive, and more threads
+        would only be blocked on it. Shrink back towards the initial number
+        of threads when most threads were idle.
+        """
+        with self._lock:
+            peak = self._peak_in_flight
+            self._peak_in_flight = self._in_flight
+            timeouts = self._timeouts - self._last_timeouts
+            self._last_timeouts = self._timeouts
+            rejected = self._rejected - self._last_rejected
+            self._last_rejected = self._rejected
+            p99 = _percentile(self._latency, 99)
+            threads = self._threads
+
+        if (rejected or peak > threads) and threads < self._max_threads:
+            if timeouts or (p99 is not None and p99 >= self._timeout / 2):
+                log.warning("ioprocess %s is overloaded, but storage is not "
+                            "responsive (timeouts=%d, p99=%.3f), not adding "
+                            "threads", self._name, timeouts, p99 or 0)
+                return
+            new_threads = min(self._max_threads, threads * 2)
+        elif peak <= threads // 4 and threads > self._min_threads:
+            new_threads = max(self._min_threads, threads // 2)
+        else:
+            return
+
+        log.info("Changing ioprocess %s threads from %d to %d (peak=%d, "
+                 "rejected=%d, p99=%s)", self._name, threads, new_threads,
+                 peak, rejected, p99)
+        self._resize(new_threads)
+
+    def _resize(self, threads):
+        proc = self._create(self._name, threads)
+        with self._lock:
+            old = self._current
+            self._current = proc
+            self._threads = threads
+            self._users[id(proc)] = 0
+            if self._users[id(old)] == 0:
+                del self._users[id(old)]
+            else:
+                self._retired[id(old)] = old
+                old = None
+        if old is not None:
+            old.close()
+
+    def _call(self, name, *args, **kwargs):
+        with self._lock:
+            proc = self._current
+            self._users[id(proc)] += 1
+            self._calls += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+        start = self._clock()
+        try:
+            return getattr(proc, name)(*args, **kwargs)
+        except ioprocess.Timeout:
+            with self._lock:
+                self._timeouts += 1
+            raise
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                with self._lock:
+                    self._rejected += 1
+            raise
+        finally:
+            elapsed = self._clock() - start
+            retired = None
+            with self._lock:
+                self._in_flight -= 1
+                self._latency.append(elapsed)
+                self._users[id(proc)] -= 1
+                if proc is not self._current and self._users[id(proc)] == 0:
+                    del self._users[id(proc)]
+                    retired = self._retired.pop(id(proc))
+            if retired is not None:
+                retired.close()
+
+
+class _Monitor(object):
+    """
+    Reap idle ioprocesses and adapt the number of helper threads.
+    """
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._done = threading.Event()
+        self._thread = concurrent.thread(self._run, name="oop/monitor",
+                                         log=log)
+
+    def start(self):
+        log.info("Starting ioprocess monitor (interval=%d, adaptive=%s)",
+                 self._interval, ADAPTIVE)
+        self._thread.start()
+
+    def stop(self):
+        log.info("Stopping ioprocess monitor")
+        self._done.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._done.wait(self._interval):
+            try:
+                self._check()
+            except Exception:
+                log.exception("Error checking ioprocesses")
+
+    def _check(self):
+        procs = []
+        with _procPoolLock:
+            cleanIdleIOProcesses(None)
+            for name, ref in list(six.iteritems(_refProcPool)):
+                proc = ref()
+                if proc is None:
+                    del _refProcPool[name]
+                else:
+                    procs.append(proc)
+        if ADAPTIVE:
+            for proc in procs:
+                proc._ioproc.adapt()
+
+
 class _IOProcessGlob(object):
     def __init__(self, iop):
         self._iop = iop
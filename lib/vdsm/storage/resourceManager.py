@@ -32,8 +32,10 @@ from six.moves import queue
 from vdsm import utils
 from vdsm.common import concurrent
 from vdsm.common.logutils import SimpleLogAdapter
+from vdsm.common.time import monotonic_time
 from vdsm.storage import exception as se
 from vdsm.storage import guarded
+from vdsm.storage import locktrace
 from vdsm.storage import rwlock
 
 
@@ -340,52 +342,68 @@ class _ResourceManager(object):
 
     This class is for internal usage only, clients should use the module
     interface.
+
+    Resources in a namespace are spread over lock stripes by name, so
+    requests for different resources do not wait for each other. Requests
+    that can be granted immediately are handled by acquireResource() under
+    the stripe lock, without creating a request.
     """
     _log = logging.getLogger("storage.ResourceManager")
     _namespaceValidator = re.compile(r"^[\w\d_-]+$")
     _resourceNameValidator = re.compile(r"^[^\s.]+$")
 
-    def __init__(self):
-        self._syncRoot = rwlock.RWLock()
+    def __init__(self, stripes=16):
+        self._stripes = stripes
+        # Protects namespace registration. Namespaces are never removed, and
+        # registration replaces the namespaces dict, so lookups do not need
+        # any lock.
+        self._syncRoot = threading.Lock()
         self._namespaces = {}
 
     def registerNamespace(self, namespace, factory):
         if not self._namespaceValidator.match(namespace):
             raise InvalidNamespace("Invalid namespace name %r" % namespace)
 
-        if namespace in self._namespaces:
-            raise NamespaceRegistered("Namespace '%s' already registered"
-                                      % namespace)
-
-        with self._syncRoot.exclusive:
+        with self._syncRoot:
             if namespace in self._namespaces:
                 raise NamespaceRegistered("Namespace '%s' already registered"
                                           % namespace)
 
             self._log.debug("Registering namespace '%s'", namespace)
 
-            self._namespaces[namespace] = Namespace(factory)
+            namespaces = dict(self._namespaces)
+            namespaces[namespace] = Namespace(factory, self._stripes)
+            self._namespaces = namespaces
+
+    def stats(self):
+        """
+        Return contention statistics per namespace.
+        """
+        return {name: namespaceObj.stats()
+                for name, namespaceObj in self._namespaces.items()}
+
+    def _getNamespace(self, namespace):
+        try:
+            return self._namespaces[namespace]
+        except KeyError:
+            raise ValueError("Namespace '%s' is not registered with this "
+                             "manager" % namespace)
 
     def getResourceStatus(self, namespace, name):
         if not self._resourceNameValidator.match(name):
             raise se.InvalidResourceName(name)
 
-        with self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager" % namespace)
-            resources = namespaceObj.resources
-            with namespaceObj.lock:
-                if not namespaceObj.factory.resourceExists(name):
-                    raise KeyError("No such resource '%s.%s'" % (namespace,
-                                                                 name))
+        namespaceObj = self._getNamespace(namespace)
+        stripe = namespaceObj.stripe(name)
+        with stripe.lock:
+            if not namespaceObj.factory.resourceExists(name):
+                raise KeyError("No such resource '%s.%s'" % (namespace,
+                                                             name))
 
-                if name not in resources:
-                    return STATUS_FREE
+            if name not in stripe.resources:
+                return STATUS_FREE
 
-                return _statusFromType(resources[name].currentLock)
+            return _statusFromType(stripe.resources[name].currentLock)
 
     def _switchLockType(self, resourceInfo, newLockType):
         switchLock = (resourceInfo.currentLock != newLockType)
@@ -422,6 +440,63 @@ class _ResourceManager(object):
                 self._log.warning("Couldn't close resource '%s'.",
                                   resourceInfo.full_name, exc_info=True)
 
+    def _validateRequest(self, name, lockType):
+        if not self._resourceNameValidator.match(name):
+            raise se.InvalidResourceName(name)
+
+        if lockType not in (SHARED, EXCLUSIVE):
+            raise InvalidLockType("Invalid locktype %r was used" % lockType)
+
+    def _tryLock(self, namespaceObj, stripe, namespace, name, lockType):
+        """
+        Lock a resource if it is free, or if both the resource and the
+        request are shared and nobody is waiting for the resource. Must be
+        called with stripe.lock held.
+
+        Returns the locked resource, or None if the request must wait.
+        Raises KeyError if the resource does not exist, and _CreateFailed if
+        the factory failed to create the resource.
+        """
+        resource = stripe.resources.get(name)
+
+        if resource is None:
+            if not namespaceObj.factory.resourceExists(name):
+                raise KeyError("No such resource '%s.%s'" % (namespace, name))
+
+            # TODO : Creating the object inside the stripe lock blocks other
+            #        resources in this stripe. As this is not currently a
+            #        problem I left it as it is to keep the code simple.
+            try:
+                obj = namespaceObj.factory.createResource(name, lockType)
+            except Exception:
+                self._log.warning(
+                    "Resource factory failed to create resource"
+                    " '%s.%s'. Canceling request.", namespace, name,
+                    exc_info=True)
+                raise _CreateFailed()
+
+            resource = ResourceInfo(obj, namespace, name)
+            resource.currentLock = lockType
+            resource.activeUsers = 1
+            stripe.resources[name] = resource
+            stripe.acquired += 1
+            self._log.debug("Resource '%s' is free. Now locking as '%s' "
+                            "(1 active user)", resource.full_name, lockType)
+            return resource
+
+        if (len(resource.queue) == 0 and
+                resource.currentLock == SHARED and
+                lockType == SHARED):
+            resource.activeUsers += 1
+            stripe.acquired += 1
+            self._log.debug("Resource '%s' found in shared state "
+                            "and queue is empty, Joining current "
+                            "shared lock (%d active users)",
+                            resource.full_name, resource.activeUsers)
+            return resource
+
+        return None
+
     def acquireResource(self, namespace, name, lockType, timeout=None):
         """
         Acquire a resource synchronously.
@@ -434,25 +509,64 @@ class _ResourceManager(object):
             except ValueError:
                 raise TypeError("'timeout' must be number")
 
+        self._validateRequest(name, lockType)
+        namespaceObj = self._getNamespace(namespace)
+        stripe = namespaceObj.stripe(name)
+
+        # Fast path - lock the resource if we don't need to wait.
+        with stripe.lock:
+            try:
+                resource = self._tryLock(
+                    namespaceObj, stripe, namespace, name, lockType)
+            except _CreateFailed:
+                raise se.ResourceAcqusitionFailed()
+            if resource is not None:
+                realObj = resource.realObj
+
+        if resource is not None:
+            if locktrace.enabled:
+                locktrace.acquired(
+                    "resource", "%s.%s" % (namespace, name), lockType)
+            return ResourceRef(namespace, name, realObj, str(uuid4()))
+
+        # Slow path - wait in the resource queue.
         resource = queue.Queue()
 
         def callback(req, res):
             resource.put(res)
 
-        request = self.registerResource(namespace, name, lockType, callback)
-        request.wait(timeout)
-        if not request.granted():
-            try:
-                request.cancel()
-                raise RequestTimedOutError("Request timed out. Could not "
-                                           "acquire resource '%s.%s'" %
-                                           (namespace, name))
-            except RequestAlreadyProcessedError:
-                # We might have acquired the resource between 'wait' and
-                # 'cancel'
-                if request.canceled():
-                    raise se.ResourceAcqusitionFailed()
+        since = None
+        if locktrace.enabled:
+            since = locktrace.waiting(
+                "resource", "%s.%s" % (namespace, name), lockType)
 
+        start = monotonic_time()
+        try:
+            request = self.registerResource(
+                namespace, name, lockType, callback)
+            request.wait(timeout)
+            if not request.granted():
+                try:
+                    request.cancel()
+                    raise RequestTimedOutError("Request timed out. Could "
+                                               "not acquire resource "
+                                               "'%s.%s'" % (namespace, name))
+                except RequestAlreadyProcessedError:
+                    # We might have acquired the resource between 'wait' and
+                    # 'cancel'
+                    if request.canceled():
+                        raise se.ResourceAcqusitionFailed()
+        except:
+            if since is not None:
+                locktrace.cancelled(
+                    "resource", "%s.%s" % (namespace, name), since)
+            raise
+        finally:
+            namespaceObj.waited(monotonic_time() - start)
+
+        if since is not None:
+            locktrace.acquired(
+                "resource", "%s.%s" % (namespace, name), lockType, since)
         return resource.get()
 
     def registerResource(self, namespace, name, lockType, callback):
@@ -461,74 +575,31 @@ class _ResourceManager(object):
 
         :returns: a request object that tracks the current request.
         """
-        full_name = "%s.%s" % (namespace, name)
-
-        if not self._resourceNameValidator.match(name):
-            raise se.InvalidResourceName(name)
-
-        if lockType not in (SHARED, EXCLUSIVE):
-            raise InvalidLockType("Invalid locktype %r was used" % lockType)
+        self._validateRequest(name, lockType)
 
         request = Request(namespace, name, lockType, callback)
         self._log.debug("Trying to register resource '%s' for lock type '%s'",
-                        full_name, lockType)
-        with utils.RollbackContext() as contextCleanup, self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager" % namespace)
-
-            resources = namespaceObj.resources
-            with namespaceObj.lock:
+                        request.full_name, lockType)
+        with utils.RollbackContext() as contextCleanup:
+            namespaceObj = self._getNamespace(namespace)
+            stripe = namespaceObj.stripe(name)
+            with stripe.lock:
                 try:
-                    resource = resources[name]
-                except KeyError:
-                    if not namespaceObj.factory.resourceExists(name):
-                        raise KeyError("No such resource '%s'" % (full_name))
-                else:
-                    if len(resource.queue) == 0 and \
-                            resource.currentLock == SHARED and \
-                            request.lockType == SHARED:
-                        resource.activeUsers += 1
-                        self._log.debug("Resource '%s' found in shared state "
-                                        "and queue is empty, Joining current "
-                                        "shared lock (%d active users)",
-                                        full_name, resource.activeUsers)
-                        request.grant()
-                        contextCleanup.defer(request.emit,
-                                             ResourceRef(namespace, name,
-                                                         resource.realObj,
-                                                         request.reqID))
-                        return RequestRef(request)
+                    resource = self._tryLock(
+                        namespaceObj, stripe, namespace, name, lockType)
+                except _CreateFailed:
+                    contextCleanup.defer(request.cancel)
+                    return RequestRef(request)
 
+                if resource is None:
+                    resource = stripe.resources[name]
                     resource.queue.insert(0, request)
+                    stripe.queued += 1
                     self._log.debug("Resource '%s' is currently locked, "
                                     "Entering queue (%d in queue)",
-                                    full_name, len(resource.queue))
-                    return RequestRef(request)
-
-                # TODO : Creating the object inside the namespace lock causes
-                #        the entire namespace to lock and might cause
-                #        performance issues. As this is no currently a problem
-                #        I left it as it is to keep the code simple. If there
-                #        is a bottleneck in the resource framework, its
-                #        probably here.
-                try:
-                    obj = namespaceObj.factory.createResource(name, lockType)
-                except:
-                    self._log.warning(
-                        "Resource factory failed to create resource"
-                        " '%s'. Canceling request.", full_name, exc_info=True)
-                    contextCleanup.defer(request.cancel)
+                                    resource.full_name, len(resource.queue))
                     return RequestRef(request)
 
-                resource = resources[name] = ResourceInfo(obj, namespace, name)
-                resource.currentLock = request.lockType
-                resource.activeUsers += 1
-
-                self._log.debug("Resource '%s' is free. Now locking as '%s' "
-                                "(1 active user)", full_name, request.lockType)
                 request.grant()
                 contextCleanup.defer(request.emit,
                                      ResourceRef(namespace, name,
@@ -541,24 +612,22 @@ class _ResourceManager(object):
         #        object and can CANCEL THE REQUEST at any time. Always use
         #        request.grant between try and except to properly handle such
         #        a case
-        full_name = "%s.%s" % (namespace, name)
-
-        self._log.debug("Trying to release resource '%s'", full_name)
-        with utils.RollbackContext() as contextCleanup, self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager", namespace)
-            resources = namespaceObj.resources
-
-            with namespaceObj.lock:
+        self._log.debug("Trying to release resource '%s.%s'", namespace, name)
+        if locktrace.enabled:
+            locktrace.released("resource", "%s.%s" % (namespace, name))
+        with utils.RollbackContext() as contextCleanup:
+            namespaceObj = self._getNamespace(namespace)
+            stripe = namespaceObj.stripe(name)
+            resources = stripe.resources
+
+            with stripe.lock:
                 try:
                     resource = resources[name]
                 except KeyError:
                     raise ValueError("Resource '%s.%s' is not currently "
                                      "registered" % (namespace, name))
 
+                full_name = resource.full_name
                 resource.activeUsers -= 1
                 self._log.debug("Released resource '%s' (%d active users)",
                                 full_name, resource.activeUsers)
@@ -611,6 +680,7 @@ class _ResourceManager(object):
                                                 nextRequest.reqID)))
 
                         resource.activeUsers += 1
+                        stripe.acquired += 1
 
                         self._log.debug("Request '%s' was granted",
                                         nextRequest)
@@ -645,19 +715,66 @@ class _ResourceManager(object):
                         continue
 
                     resource.activeUsers += 1
+                    stripe.acquired += 1
                     self._log.debug("Request '%s' was granted (%d "
                                     "active users)", nextRequest,
                                     resource.activeUsers)
 
 
+class _CreateFailed(Exception):
+    """ Raised internally if a resource factory failed to create a resource """
+
+
 class Namespace(object):
     """
     Namespace struct
     """
-    def __init__(self, factory):
-        self.resources = {}
-        self.lock = threading.Lock()  # rwlock.RWLock()
+    def __init__(self, factory, stripes=16):
         self.factory = factory
+        self.stripes = [Stripe() for i in range(stripes)]
+        # Protects the wait statistics.
+        self._lock = threading.Lock()
+        self._waits = 0
+        self._waitTime = 0.0
+        self._maxWaitTime = 0.0
+
+    def stripe(self, name):
+        return self.stripes[hash(name) % len(self.stripes)]
+
+    def waited(self, seconds):
+        with self._lock:
+            self._waits += 1
+            self._waitTime += seconds
+            self._maxWaitTime = max(self._maxWaitTime, seconds)
+
+    def stats(self):
+        """
+        Return the namespace statistics. The stripe counters are read
+        without locking; the values may be slightly outdated.
+        """
+        with self._lock:
+            stats = {
+                "waits": self._waits,
+                "wait_time": self._waitTime,
+                "max_wait_time": self._maxWaitTime,
+            }
+        stats["acquired"] = sum(s.acquired for s in self.stripes)
+        stats["queued"] = sum(s.queued for s in self.stripes)
+        stats["locked"] = sum(len(s.resources) for s in self.stripes)
+        return stats
+
+
+class Stripe(object):
+    """
+    Stripe struct - resources in a namespace sharing a lock
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources = {}
+        # Number of granted requests.
+        self.acquired = 0
+        # Number of requests that had to wait in the resource queue.
+        self.queued = 0
 
 
 class ResourceInfo(object):
@@ -785,6 +902,10 @@ class Lock(guarded.AbstractLock):
     """
     Extend AbstractLock to enable Resources to be used with guarded utilities.
     """
+
+    # The resource manager traces resources.
+    traced = True
+
     def __init__(self, ns, name, mode):
         self._ns = ns
         self._name = name
@@ -831,6 +952,10 @@ def releaseResource(namespace, name):
     _manager.releaseResource(namespace, name)
 
 
+def stats():
+    return _manager.stats()
+
+
 def getNamespace(*args):
     """
     Format namespace stirng from sequence of names.
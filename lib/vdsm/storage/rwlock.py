@@ -21,6 +21,8 @@
 from __future__ import absolute_import
 import threading
 
+from vdsm.storage import locktrace
+
 
 class RWLock(object):
     """
@@ -73,9 +75,13 @@ class RWLock(object):
     storage code locking same resource from different layers.
 
     Lock promotion or demotion is forbidden and will raise RuntimeError.
+
+    The optional name is used to identify the lock when lock tracing is
+    enabled (see locktrace).
     """
 
-    def __init__(self):
+    def __init__(self, name=None):
+        self._name = name
         self.shared = Context(self.acquire_read, self.release)
         self.exclusive = Context(self.acquire_write, self.release)
         self._lock = threading.Lock()
@@ -83,6 +89,11 @@ class RWLock(object):
         self._holders = {}
         self._writer = None
 
+    @property
+    def name(self):
+        # Formatted only when tracing, since RWLock is created often.
+        return self._name or "0x%x" % id(self)
+
     def acquire_write(self):
         me = threading.current_thread()
         if me is self._writer:
@@ -90,11 +101,16 @@ class RWLock(object):
             return
         if me in self._holders:
             raise RuntimeError("Lock promotion is forbidden")
+        since = None
         with self._lock:
             if self._holders or self._waiters:
+                if locktrace.enabled:
+                    since = locktrace.waiting("rwlock", self.name, "exclusive")
                 self._wait(True)
             self._holders[me] = 1
             self._writer = me
+        if locktrace.enabled:
+            locktrace.acquired("rwlock", self.name, "exclusive", since)
 
     def acquire_read(self):
         me = threading.current_thread()
@@ -103,12 +119,17 @@ class RWLock(object):
         if me in self._holders:
             self._holders[me] += 1
             return
+        since = None
         with self._lock:
             if self._writer or self._waiters:
+                if locktrace.enabled:
+                    since = locktrace.waiting("rwlock", self.name, "shared")
                 self._wait(False)
             self._holders[me] = 1
             if self._waiters:
                 self._grant_next_waiter()
+        if locktrace.enabled:
+            locktrace.acquired("rwlock", self.name, "shared", since)
 
     def release(self):
         me = threading.current_thread()
@@ -123,6 +144,8 @@ class RWLock(object):
             del self._holders[me]
             if self._waiters:
                 self._grant_next_waiter()
+        if locktrace.enabled:
+            locktrace.released("rwlock", self.name)
 
     def _wait(self, wants_write):
         waiter = Waiter(wants_write)
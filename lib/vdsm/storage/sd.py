@@ -346,6 +346,8 @@ class StorageDomainManifest(object):
         self._external_leases_lock = rwlock.RWLock()
         self._alignment = metadata.get(DMDK_ALIGNMENT, sc.ALIGNMENT_1M)
         self._block_size = metadata.get(DMDK_BLOCK_SIZE, sc.BLOCK_SIZE_512)
+        self._external_leases_cache = xlease.IndexCache(
+            alignment=self._alignment, block_size=self._block_size)
 
         # Validate alignment and block size.
 
@@ -726,6 +728,16 @@ class StorageDomainManifest(object):
         """
         return self._external_leases_lock
 
+    @property
+    def external_leases_cache(self):
+        """
+        Return the external leases index cache.
+
+        The cache must be invalidated after modifying the external leases
+        volume.
+        """
+        return self._external_leases_cache
+
     @contextmanager
     def external_leases_volume(self):
         """
@@ -751,8 +763,9 @@ class StorageDomainManifest(object):
         May be called on any host.
         """
         with self.external_leases_lock.shared:
-            with self.external_leases_volume() as vol:
-                return vol.lookup(lease_id)
+            path = self.external_leases_path()
+            with self.external_leases_backend(self.sdUUID, path) as backend:
+                return self.external_leases_cache.lookup(backend, lease_id)
 
 
 class StorageDomain(object):
@@ -1440,8 +1453,11 @@ class StorageDomain(object):
         Must be called only on the SPM.
         """
         with self._manifest.external_leases_lock.exclusive:
-            with self._manifest.external_leases_volume() as vol:
-                vol.add(lease_id)
+            try:
+                with self._manifest.external_leases_volume() as vol:
+                    vol.add(lease_id)
+            finally:
+                self._manifest.external_leases_cache.invalidate()
 
     def delete_lease(self, lease_id):
         """
@@ -1450,8 +1466,11 @@ class StorageDomain(object):
         Must be called only on the SPM.
         """
         with self._manifest.external_leases_lock.exclusive:
-            with self._manifest.external_leases_volume() as vol:
-                vol.remove(lease_id)
+            try:
+                with self._manifest.external_leases_volume() as vol:
+                    vol.remove(lease_id)
+            finally:
+                self._manifest.external_leases_cache.invalidate()
 
     def rebuild_external_leases(self):
         """
@@ -1462,12 +1481,15 @@ class StorageDomain(object):
         with self._manifest.external_leases_lock.exclusive:
             path = self.external_leases_path()
             backend = xlease.DirectFile(path)
-            with utils.closing(backend):
-                xlease.rebuild_index(
-                    self.sdUUID,
-                    backend,
-                    alignment=self._manifest.alignment,
-                    block_size=self._manifest.block_size)
+            try:
+                with utils.closing(backend):
+                    xlease.rebuild_index(
+                        self.sdUUID,
+                        backend,
+                        alignment=self._manifest.alignment,
+                        block_size=self._manifest.block_size)
+            finally:
+                self._manifest.external_leases_cache.invalidate()
 
     def dump_external_leases(self):
         """
@@ -1476,8 +1498,10 @@ class StorageDomain(object):
         May be called on any host.
         """
         with self._manifest.external_leases_lock.shared:
-            with self._manifest.external_leases_volume() as vol:
-                return vol.dump()
+            path = self.external_leases_path()
+            with self._manifest.external_leases_backend(
+                    self.sdUUID, path) as backend:
+                return self._manifest.external_leases_cache.leases(backend)
 
     # Images
 
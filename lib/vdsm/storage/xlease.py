@@ -111,6 +111,11 @@ have two records pointing to the same offset.
 To make debugging easier, the offset is also included in record itself,
 but the program managing the index should never use this value.
 
+The mtime is changed on every change to the index, so hosts caching the
+index can detect changes by reading only the metadata block. If the index
+is changed more than once in the same second, the mtime is incremented, so
+it may be ahead of the actual time.
+
 The sanlock internal resource slot
 ----------------------------------
 
@@ -131,6 +136,7 @@ import logging
 import mmap
 import os
 import struct
+import threading
 import time
 
 from collections import namedtuple
@@ -141,9 +147,11 @@ import six
 from vdsm import utils
 from vdsm.common import cmdutils
 from vdsm.common import commands
+from vdsm.common import concurrent
 from vdsm.common import constants
 from vdsm.common import errors
 from vdsm.common.osutils import uninterruptible
+from vdsm.common.time import monotonic_time
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
 from vdsm.storage import fsutils
@@ -191,6 +199,14 @@ MAX_RECORDS = (INDEX_SIZE - METADATA_SIZE) // RECORD_SIZE
 # Current index format
 INDEX_VERSION = 1
 
+# Hosts running older versions change the index without changing the mtime,
+# for example during a rolling upgrade. The index cache loads the index again
+# after this number of seconds, even if the mtime was not changed.
+INDEX_CACHE_MAX_AGE = 60
+
+# Number of concurrent sanlock resource reads when rebuilding the index.
+REBUILD_WORKERS = 8
+
 # magic \0 version \0 lockspace \0 mtime \0 updating \0...\n
 # Note: using big endian byte order (>) so index created on little endian and
 # big endian create the same format on storage.
@@ -603,6 +619,7 @@ class LeasesVolume(object):
 
         record = Record(lease_id, offset)
         self._write_record(recnum, record)
+        self._update_mtime()
 
         return LeaseInfo(self.lockspace, lease_id, self._file.name, offset)
 
@@ -636,6 +653,7 @@ class LeasesVolume(object):
             sector=self._block_size)
 
         self._write_record(recnum, EMPTY_RECORD)
+        self._update_mtime()
 
     def leases(self):
         """
@@ -684,6 +702,145 @@ class LeasesVolume(object):
             block.dump(self._file)
         self._index.write_record(recnum, record)
 
+    def _update_mtime(self):
+        """
+        Write new index mtime to storage, so hosts caching the index can
+        detect the change.
+        """
+        md = IndexMetadata(
+            self._md.version, self._md.lockspace, mtime=next_mtime(self._md))
+        block = self._index.copy_metadata_block()
+        with utils.closing(block):
+            block.write_metadata(md)
+            block.dump(self._file)
+        self._index.write_metadata(md)
+        self._md = md
+
+
+class IndexCache(object):
+    """
+    Cache of a leases volume index.
+
+    Loading the index reads the entire index using direct I/O. The cache
+    validates the cached index by reading only the index metadata block,
+    and loads the index again only if the index mtime was changed. The SPM
+    changes the index mtime on every change, so changes made by the SPM on
+    another host are detected.
+
+    An SPM running an older version does not change the mtime, so the index
+    is also loaded again if it was loaded more than max_age seconds ago.
+
+    The cache must be invalidated after changing the index on this host.
+    """
+
+    def __init__(self, alignment=sc.ALIGNMENT_1M,
+                 block_size=sc.BLOCK_SIZE_512, max_age=INDEX_CACHE_MAX_AGE,
+                 clock=monotonic_time):
+        self._alignment = alignment
+        self._block_size = block_size
+        self._max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._volume = None
+        self._loaded = None
+
+    def lookup(self, file, lease_id):
+        """
+        Lookup lease by lease_id and return LeaseInfo if found.
+
+        See LeasesVolume.lookup() for more info.
+        """
+        with self._lock:
+            return self._validate(file).lookup(lease_id)
+
+    def leases(self, file):
+        """
+        Return all leases in the index.
+        """
+        with self._lock:
+            return self._validate(file).leases()
+
+    def invalidate(self):
+        with self._lock:
+            self._close()
+
+    close = invalidate
+
+    def _validate(self, file):
+        md = read_metadata(file, self._alignment, self._block_size)
+        if md.updating:
+            self._close()
+            raise IndexIsUpdating(md)
+
+        vol = self._volume
+        now = self._clock()
+        if (vol is not None and
+                vol.path == file.name and
+                vol.lockspace == md.lockspace and
+                vol.mtime == md.mtime and
+                now - self._loaded < self._max_age):
+            _cache_stats.hit()
+            return vol
+
+        _cache_stats.miss()
+        self._close()
+        # LeasesVolume.lookup() and leases() use only the loaded index, so
+        # the volume can be used after file was closed.
+        self._volume = LeasesVolume(
+            file, alignment=self._alignment, block_size=self._block_size)
+        self._loaded = now
+        return self._volume
+
+    def _close(self):
+        if self._volume is not None:
+            self._volume.close()
+            self._volume = None
+
+
+class _CacheStats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def info(self):
+        with self._lock:
+            calls = self._hits + self._misses
+            hit_ratio = (100 * self._hits / calls) if calls > 0 else 0
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": hit_ratio
+            }
+
+    def clear(self):
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
+
+    def miss(self):
+        with self._lock:
+            self._misses += 1
+
+    def hit(self):
+        with self._lock:
+            self._hits += 1
+
+
+_cache_stats = _CacheStats()
+
+
+def cache_stats():
+    """
+    Return index cache statistics for all leases volumes.
+    """
+    return _cache_stats.info()
+
+
+def clear_stats():
+    _cache_stats.clear()
+
 
 def format_index(lockspace, file, alignment=sc.ALIGNMENT_1M,
                  block_size=sc.BLOCK_SIZE_512):
@@ -703,15 +860,14 @@ def format_index(lockspace, file, alignment=sc.ALIGNMENT_1M,
     with utils.closing(index):
         with index.updating(lockspace, file):
             # Write empty records
-            for recnum in range(MAX_RECORDS):
-                index.write_record(recnum, EMPTY_RECORD)
+            index.write_empty_records(0, MAX_RECORDS)
             # Attempt to write index to file
             index.dump(file)
 
 
 def rebuild_index(
         lockspace, file, alignment=sc.ALIGNMENT_1M,
-        block_size=sc.BLOCK_SIZE_512):
+        block_size=sc.BLOCK_SIZE_512, max_workers=REBUILD_WORKERS):
     """
     Rebuild xleases volume index from underlying storage.
 
@@ -719,6 +875,10 @@ def rebuild_index(
     storage, assuming that existing sanlock resources are the one and only
     truth.
 
+    Sanlock resources are read concurrently using up to max_workers threads.
+    Records for leases beyond the end of the volume are marked empty
+    without reading storage.
+
     Like format_index, if the operation fails the index is left in "updating"
     state.
 
@@ -728,27 +888,29 @@ def rebuild_index(
     """
     log.info("Rebuilding index for lockspace %r (version=%d)",
              lockspace, INDEX_VERSION)
+    mtime = next_mtime(_read_previous_metadata(file, alignment, block_size))
     index = VolumeIndex(alignment, block_size)
     with utils.closing(index):
-        with index.updating(lockspace, file):
+        with index.updating(lockspace, file, mtime=mtime):
+            # Records beyond the end of the volume are always empty.
+            count = _records_in_volume(file.size(), alignment)
+            index.write_empty_records(count, MAX_RECORDS - count)
+
             # Read resources and write records
-            max_offset = file.size() - alignment
-            for recnum in range(MAX_RECORDS):
-                offset = lease_offset(recnum, alignment)
-                if offset > max_offset:
-                    index.write_record(recnum, EMPTY_RECORD)
-                    continue
-                try:
-                    res = read_resource(
-                        file.name,
-                        offset,
-                        alignment=alignment,
-                        block_size=block_size)
-                except NoSuchResource:
-                    record = EMPTY_RECORD
-                else:
-                    log.debug("Restoring lease %s", res)
-                    record = Record(res.resource, offset)
+            def read_record(recnum):
+                return recnum, _read_record(
+                    file.name, recnum, alignment, block_size)
+
+            results = list(concurrent.tmap(
+                read_record,
+                range(count),
+                max_workers=max_workers,
+                name="xlease/rebuild"))
+
+            for res in results:
+                if not res.succeeded:
+                    raise res.value
+                recnum, record = res.value
                 index.write_record(recnum, record)
 
             # Attempt to write index to file
@@ -756,6 +918,69 @@ def rebuild_index(
             index.dump(file)
 
 
+def _records_in_volume(size, alignment):
+    """
+    Return the number of lease records that fit in volume of size bytes.
+    """
+    count = (size - alignment) // alignment - RESERVED_SLOTS + 1
+    return max(0, min(count, MAX_RECORDS))
+
+
+def _read_record(path, recnum, alignment, block_size):
+    """
+    Return the index record for the sanlock resource of record recnum.
+    """
+    offset = lease_offset(recnum, alignment)
+    try:
+        res = read_resource(
+            path,
+            offset,
+            alignment=alignment,
+            block_size=block_size)
+    except NoSuchResource:
+        return EMPTY_RECORD
+    log.debug("Restoring lease %s", res)
+    return Record(res.resource, offset)
+
+
+def read_metadata(file, alignment=sc.ALIGNMENT_1M,
+                  block_size=sc.BLOCK_SIZE_512):
+    """
+    Read index metadata from storage, reading only the first block of the
+    index.
+
+    Raises:
+    - InvalidIndex if the metadata is invalid or truncated
+    - OSError if I/O operation failed
+    """
+    buf = mmap.mmap(-1, block_size, mmap.MAP_SHARED)
+    with utils.closing(buf):
+        nread = file.pread(alignment, buf)
+        if nread < block_size:
+            raise TruncatedIndex(block_size, nread)
+        return IndexMetadata.fromebytes(buf[:METADATA_SIZE])
+
+
+def next_mtime(metadata):
+    """
+    Return the mtime for the next change of an index with metadata, which
+    may be None if the index was not formatted yet. The mtime must change
+    on every change, even if changed twice in the same second.
+    """
+    now = int(time.time())
+    if metadata is None:
+        return now
+    return max(now, metadata.mtime + 1)
+
+
+def _read_previous_metadata(file, alignment, block_size):
+    try:
+        return read_metadata(file, alignment, block_size)
+    except InvalidIndex as e:
+        log.debug("Cannot read previous index metadata: %s", e)
+        return None
+
+
 def read_resource(
         path, offset, alignment=sc.ALIGNMENT_1M, block_size=sc.BLOCK_SIZE_512):
     """
@@ -857,6 +1082,17 @@ class VolumeIndex(object):
         self._buf.seek(offset)
         self._buf.write(record.bytes())
 
+    def write_empty_records(self, recnum, count):
+        """
+        Write count empty records to index, starting at record recnum.
+
+        The caller is responsible for writing the records to storage before
+        updating the index, otherwise the index would not reflect the state on
+        storage.
+        """
+        self._buf.seek(self._record_offset(recnum))
+        self._buf.write(EMPTY_RECORD.bytes() * count)
+
     def read_metadata(self):
         """
         Read metadata block.
@@ -902,17 +1138,22 @@ class VolumeIndex(object):
         return ChangeBlock(
             self._offset, self._buf, block_start, self._block_size)
 
+    def copy_metadata_block(self):
+        return ChangeBlock(self._offset, self._buf, 0, self._block_size)
+
     @contextmanager
-    def updating(self, lockspace, file):
+    def updating(self, lockspace, file, mtime=None):
         """
         Context manager for index updates.
 
         Before entering the context, mark the index as updating. When exiting
-        cleanly from the context, clear the updating flag. If the user code
-        fails, the index will be left in updating state.
+        cleanly from the context, clear the updating flag and set the index
+        mtime. If the user code fails, the index will be left in updating
+        state.
         """
         # Mark as updating
-        metadata = IndexMetadata(INDEX_VERSION, lockspace, updating=True)
+        metadata = IndexMetadata(
+            INDEX_VERSION, lockspace, mtime=mtime, updating=True)
         self.write_metadata(metadata)
 
         # Call withotu try-finally intentionally, so failure in the caller code
@@ -920,12 +1161,12 @@ class VolumeIndex(object):
         yield
 
         # Clear updating flag.
-        metadata = IndexMetadata(INDEX_VERSION, lockspace)
+        metadata = IndexMetadata(INDEX_VERSION, lockspace, mtime=mtime)
         self.write_metadata(metadata)
 
         # And write the first block (which contains the metadata area) to
         # storage.
-        block = ChangeBlock(self._offset, self._buf, 0, self._block_size)
+        block = self.copy_metadata_block()
         with utils.closing(block):
             block.dump(file)
 
@@ -975,6 +1216,18 @@ class ChangeBlock(object):
         self._buf.seek(offset)
         self._buf.write(record.bytes())
 
+    def write_metadata(self, metadata):
+        """
+        Write index metadata.
+
+        Raises ValueError if this block does not contain the metadata.
+        """
+        if self._offset != 0:
+            raise ValueError("Block at offset %s does not contain metadata"
+                             % self._offset)
+        self._buf.seek(0)
+        self._buf.write(metadata.bytes())
+
     def dump(self, file):
         """
         Write the block to storage and wait until the data reach storage.
@@ -33,16 +33,15 @@ import syslog
 
 from contextlib import closing
 from functools import wraps
-from multiprocessing import connection
 from multiprocessing import Pipe
 from multiprocessing import Process
 
 import six
 
-from vdsm.common import concurrent
 from vdsm.common import constants
 from vdsm.common import lockfile
 from vdsm.common import sigutils
+from vdsm.common import svdsmrpc
 from vdsm.common import time
 from vdsm.common import zombiereaper
 
@@ -61,13 +60,11 @@ from vdsm.storage.fileUtils import chown, resolveGid, resolveUid
 from vdsm.storage.fileUtils import validateAccess as _validateAccess
 from vdsm.storage.iscsi import getDevIscsiInfo as _getdeviSCSIinfo
 from vdsm.storage.iscsi import readSessionInfo as _readSessionInfo
-from vdsm.common.supervdsm import _SuperVdsmManager
 
 from vdsm.network.initializer import init_privileged_network_components
 
 from vdsm.config import config
 
-_AUTHKEY = b""
 RUN_AS_TIMEOUT = config.getint("irs", "process_pool_timeout")
 
 _running = True
@@ -293,13 +290,9 @@ def main(args):
             signal.signal(signal.SIGTERM, terminate)
             signal.signal(signal.SIGINT, terminate)
 
-            log.debug("Creating remote object manager")
-            manager = _SuperVdsmManager(address=address, authkey=_AUTHKEY)
-            manager.register('instance', callable=_SuperVdsm)
-
-            server = manager.get_server()
-            server_thread = concurrent.thread(server.serve_forever)
-            server_thread.start()
+            log.debug("Creating rpc server")
+            server = svdsmrpc.Server(address, _SuperVdsm())
+            server.start()
 
             chown(address, args.user, args.group)
 
@@ -314,9 +307,7 @@ def main(args):
             log.debug("Terminated normally")
         finally:
             try:
-                with connection.Client(address, authkey=_AUTHKEY) as conn:
-                    server.shutdown(conn)
-                server_thread.join()
+                server.stop()
             except Exception:
                 # We ignore any errors here to avoid a situation where systemd
                 # restarts supervdsmd just at the end of shutdown stage. We're
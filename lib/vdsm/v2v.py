@@ -93,6 +93,8 @@ _RASD_NS = 'http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/' \
 ImportProgress = namedtuple('ImportProgress',
                             ['current_disk', 'disk_count', 'description'])
 DiskProgress = namedtuple('DiskProgress', ['progress'])
+ParallelDiskProgress = namedtuple('ParallelDiskProgress',
+                                  ['disk', 'progress'])
 
 
 class STATUS:
@@ -288,7 +290,8 @@ def get_jobs_status():
         ret[job_id] = {
             'status': job.status,
             'description': job.description.decode('utf-8'),
-            'progress': job.progress
+            'progress': job.progress,
+            'disksProgress': job.disks_progress,
         }
     return ret
 
@@ -677,7 +680,9 @@ class KVMCommand(V2VCommand):
         cmd = [EXT_KVM_2_OVIRT,
                '--uri', self._uri,
                '--bufsize',
-               str(config.getint('v2v', 'kvm2ovirt_buffer_size'))]
+               str(config.getint('v2v', 'kvm2ovirt_buffer_size')),
+               '--parallel',
+               str(config.getint('v2v', 'kvm2ovirt_parallel_disks'))]
         if self._username is not None:
             cmd.extend([
                 '--username', self._username,
@@ -821,6 +826,8 @@ class ImportVm(object):
         self._disk_progress = 0
         self._disk_count = 1
         self._current_disk = 1
+        # Progress of disks copied in parallel, by disk number.
+        self._disks_progress = {}
         self._aborted = False
         self._proc = None
 
@@ -852,9 +859,23 @@ class ImportVm(object):
         portion ie if we have 2 disks the first will take
         0-50 and the second 50-100
         '''
-        completed = (self._disk_count - 1) * 100
+        if self._disks_progress:
+            return sum(self._disks_progress.values()) // self._disk_count
+        completed = (self._current_disk - 1) * 100
         return (completed + self._disk_progress) // self._disk_count
 
+    @property
+    def disks_progress(self):
+        '''
+        Progress of every disk, between 0-100.
+        '''
+        if self._disks_progress:
+            return [self._disks_progress.get(disk, 0)
+                    for disk in range(1, self._disk_count + 1)]
+        return ([100] * (self._current_disk - 1) +
+                [self._disk_progress] +
+                [0] * (self._disk_count - self._current_disk))
+
     @traceback(msg="Error importing vm")
     def _run(self):
         try:
@@ -911,11 +932,19 @@ class ImportVm(object):
                 self._current_disk = event.current_disk
                 self._disk_count = event.disk_count
                 self._description = event.description
+                if self._disks_progress:
+                    self._disks_progress.setdefault(event.current_disk, 0)
             elif isinstance(event, DiskProgress):
                 self._disk_progress = event.progress
                 if event.progress % 10 == 0:
                     logging.info("Job %r copy disk %d progress %d/100",
                                  self._id, self._current_disk, event.progress)
+            elif isinstance(event, ParallelDiskProgress):
+                last = self._disks_progress.get(event.disk)
+                self._disks_progress[event.disk] = event.progress
+                if event.progress % 10 == 0 and event.progress != last:
+                    logging.info("Job %r copy disk %d progress %d/100",
+                                 self._id, event.disk, event.progress)
             else:
                 raise RuntimeError("Job %r got unexpected parser event: %s" %
                                    (self._id, event))
@@ -952,19 +981,46 @@ class ImportVm(object):
 class OutputParser(object):
     COPY_DISK_RE = re.compile(br'.*(Copying disk (\d+)/(\d+)).*')
     DISK_PROGRESS_RE = re.compile(br'\s+\((\d+).*')
+    PARALLEL_DISK_PROGRESS_RE = re.compile(br'\s+\(disk (\d+)/\d+: (\d+).*')
 
     def parse(self, stream):
         for line in stream:
             if b'Copying disk' in line:
-                description, current_disk, disk_count = self._parse_line(line)
-                yield ImportProgress(int(current_disk), int(disk_count),
-                                     description)
-                for chunk in self._iter_progress(stream):
-                    progress = self._parse_progress(chunk)
-                    if progress is not None:
-                        yield DiskProgress(progress)
-                    if progress == 100:
+                event = self._parse_import_progress(line)
+                yield event
+                for event in self._parse_disk_progress(stream,
+                                                       event.disk_count):
+                    yield event
+
+    def _parse_disk_progress(self, stream, disk_count):
+        """
+        Parse progress until the current disk was copied. When disks are
+        copied in parallel, parse progress until all disks were copied.
+        """
+        copied = set()
+        for chunk in self._iter_progress(stream):
+            if b'Copying disk' in chunk:
+                # Another disk was started when copying disks in parallel.
+                yield self._parse_import_progress(chunk)
+                continue
+            parallel = self._parse_parallel_progress(chunk)
+            if parallel is not None:
+                yield parallel
+                if parallel.progress == 100:
+                    copied.add(parallel.disk)
+                    if len(copied) == disk_count:
                         break
+                continue
+            progress = self._parse_progress(chunk)
+            if progress is not None:
+                yield DiskProgress(progress)
+            if progress == 100:
+                break
+
+    def _parse_import_progress(self, line):
+        description, current_disk, disk_count = self._parse_line(line)
+        return ImportProgress(int(current_disk), int(disk_count),
+                              description)
 
     def _parse_line(self, line):
         m = self.COPY_DISK_RE.match(line)
@@ -984,6 +1040,12 @@ class OutputParser(object):
                 yield chunk
                 chunk = b''
 
+    def _parse_parallel_progress(self, chunk):
+        m = self.PARALLEL_DISK_PROGRESS_RE.match(chunk)
+        if m is None:
+            return None
+        return ParallelDiskProgress(int(m.group(1)), int(m.group(2)))
+
     def _parse_progress(self, chunk):
         m = self.DISK_PROGRESS_RE.match(chunk)
         if m is None:
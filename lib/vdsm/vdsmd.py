@@ -40,6 +40,7 @@ from vdsm.common import cmdutils
 from vdsm.common import commands
 from vdsm.common import dsaversion
 from vdsm.common import hooks
+from vdsm.common import hostdev
 from vdsm.common import lockfile
 from vdsm.common import libvirtconnection
 from vdsm.common import sigutils
@@ -48,11 +49,14 @@ from vdsm.common import time
 from vdsm.common import zombiereaper
 from vdsm.common.panic import panic
 from vdsm.config import config
+from vdsm.host import capscache
 from vdsm.network.initializer import init_unprivileged_network_components
 from vdsm.network.initializer import stop_unprivileged_network_components
 from vdsm.profiling import profile
+from vdsm.storage import locktrace
 from vdsm.storage.hsm import HSM
 from vdsm.storage.dispatcher import Dispatcher
+from vdsm.virt import events
 from vdsm.virt import periodic
 
 
@@ -89,6 +93,8 @@ def serve_clients(log):
 
     profile.start()
     metrics.start()
+    hooks.start()
+    locktrace.start()
 
     libvirtconnection.start_event_loop()
 
@@ -99,10 +105,16 @@ def serve_clients(log):
             except:
                 panic("Error initializing IRS")
 
-        scheduler = schedule.Scheduler(name="vdsm.Scheduler",
-                                       clock=time.monotonic_time)
+        scheduler = schedule.Scheduler(
+            name="vdsm.Scheduler",
+            clock=time.monotonic_time,
+            queue=config.get('vars', 'scheduler_queue'))
         scheduler.start()
 
+        events.start(scheduler,
+                     config.getint('vars', 'libvirt_event_workers'),
+                     config.getint('vars', 'libvirt_event_max_pending'))
+
         from vdsm.clientIF import clientIF  # must import after config is read
         cif = clientIF.getInstance(irs, log, scheduler)
 
@@ -113,6 +125,8 @@ def serve_clients(log):
         cif.start()
 
         init_unprivileged_network_components(cif, supervdsm.getProxy())
+        capscache.start()
+        hostdev.start_monitoring()
 
         periodic.start(cif, scheduler)
         health.start()
@@ -122,14 +136,17 @@ def serve_clients(log):
 
             profile.stop()
         finally:
+            capscache.stop()
             stop_unprivileged_network_components()
             metrics.stop()
             health.stop()
             periodic.stop()
             cif.prepareForShutdown()
+            events.stop()
             jobs.stop()
             scheduler.stop()
             run_stop_hook()
+            hooks.stop()
     finally:
         libvirtconnection.stop_event_loop(wait=False)
 
@@ -23,7 +23,11 @@ from __future__ import division
 
 import libvirt
 
+from vdsm.common import libvirtconnection
+from vdsm.common.time import monotonic_time
+from vdsm.common.units import MiB
 from vdsm.config import config
+from vdsm.virt import extendpolicy
 from vdsm.virt.vmdevices import lookup
 from vdsm.virt.vmdevices import storage
 
@@ -44,6 +48,17 @@ class DriveMonitor(object):
         self._enabled = enabled
         self._events_enabled = config.getboolean(
             'irs', 'enable_block_threshold_event')
+        # Samples older than the monitoring interval are not used.
+        self._max_sample_age = config.getint('vars', 'vm_watermark_interval')
+        # drive path -> (BlockInfo, timestamp)
+        self._samples = {}
+        # Samples taken before a drive was resized are not used.
+        self._resized = 0.0
+        self._policy = extendpolicy.create(
+            config.get('irs', 'volume_extension_policy'),
+            config.getint('irs', 'volume_extension_max_chunk_mb') * MiB)
+        # drive name -> time the extension was requested
+        self._extensions = {}
 
     def events_enabled(self):
         return self._events_enabled
@@ -108,7 +123,7 @@ class DriveMonitor(object):
         # 0  is valid, but should be used only in clear_threshold
         # <0 means that apparentsize is too low, likely storage issue
         # that should be already handled -or at least notified- elsewhere.
-        threshold = max(1, apparentsize - drive.watermarkLimit)
+        threshold = max(1, apparentsize - self._policy.watermark_limit(drive))
 
         self._log.info(
             'setting block threshold to %d bytes for drive %r '
@@ -116,9 +131,8 @@ class DriveMonitor(object):
             threshold, drive.name, apparentsize
         )
         try:
-            # TODO: find a good way to expose Vm._dom as public property.
-            # we are running out of names in Vm class.
-            self._vm._dom.setBlockThreshold(drive.name, threshold)
+            dom = self._vm.pooled_dom(libvirtconnection.MONITORING)
+            dom.setBlockThreshold(drive.name, threshold)
         except libvirt.libvirtError as exc:
             # The drive threshold_state can be UNSET or EXCEEDED, and
             # this ensures that we will attempt to set the threshold later.
@@ -153,7 +167,8 @@ class DriveMonitor(object):
         # we receive with monitoring disabled (flag at either Vm/drive
         # level). We will have races anyway.
         # TODO: file a libvirt documentation bug
-        self._vm._dom.setBlockThreshold(target, 0)
+        dom = self._vm.pooled_dom(libvirtconnection.MONITORING)
+        dom.setBlockThreshold(target, 0)
 
     def on_block_threshold(self, dev, path, threshold, excess):
         """
@@ -177,6 +192,8 @@ class DriveMonitor(object):
                 dev, self._vm.id)
         else:
             drive.on_block_threshold(path)
+            if path == drive.path:
+                self.sample_allocation(drive, threshold + excess)
 
     def monitored_drives(self):
         """
@@ -190,6 +207,83 @@ class DriveMonitor(object):
         return [drive for drive in self._vm.getDiskDevices()
                 if drive.needs_monitoring(self._events_enabled)]
 
+    def update_block_stats(self, stats, timestamp):
+        """
+        Keep the block stats sampled for this vm with libvirt bulk stats,
+        replacing the previous sample. The next monitoring cycle uses the
+        sample instead of calling virDomain.blockInfo() for every drive.
+
+        Args:
+            stats: dict of libvirt bulk stats for this vm, including
+                   VIR_DOMAIN_STATS_BLOCK stats
+            timestamp: monotonic time before the stats were sampled
+        """
+        samples = {}
+        for i in range(stats.get('block.count', 0)):
+            prefix = 'block.%d.' % i
+            try:
+                path = stats[prefix + 'path']
+                info = storage.BlockInfo(
+                    stats[prefix + 'capacity'],
+                    stats[prefix + 'allocation'],
+                    stats[prefix + 'physical'])
+            except KeyError:
+                # Network drives or old libvirt; fall back to blockInfo().
+                continue
+            samples[path] = (info, timestamp)
+        self._samples = samples
+
+    def sampled_block_info(self, drive):
+        """
+        Return the storage.BlockInfo sampled for drive, or None if the drive
+        was not sampled, or the sample is stale.
+
+        A sample is used once, so a sample is never used after the drive was
+        checked, and possibly extended.
+        """
+        sample = self._samples.pop(drive.path, None)
+        if sample is None:
+            return None
+        info, timestamp = sample
+        if timestamp < self._resized:
+            return None
+        if monotonic_time() - timestamp > self._max_sample_age:
+            return None
+        return info
+
+    def volume_resized(self, drive):
+        """
+        Called when a drive volume was resized, invalidating the samples
+        taken before the resize.
+        """
+        self._resized = monotonic_time()
+        self._samples.pop(drive.path, None)
+
+    def sample_allocation(self, drive, alloc):
+        """
+        Report the current allocation of drive to the extension policy.
+        """
+        self._policy.sample(drive, alloc, monotonic_time())
+
+    def next_volume_size(self, drive, cur_size, capacity):
+        """
+        Return the size of the next extension of drive, and start timing
+        the extension. Call extension_completed() when the extension has
+        completed. Repeated requests for a pending extension do not restart
+        the timing.
+        """
+        self._extensions.setdefault(drive.name, monotonic_time())
+        return self._policy.next_size(drive, cur_size, capacity)
+
+    def extension_completed(self, drive):
+        """
+        Report the time it took to extend drive to the extension policy.
+        """
+        started = self._extensions.pop(drive.name, None)
+        if started is not None:
+            self._policy.extension_completed(
+                drive, monotonic_time() - started)
+
     def should_extend_volume(self, drive, volumeID, capacity, alloc, physical):
         nextPhysSize = drive.getNextVolumeSize(physical, capacity)
 
@@ -222,7 +316,7 @@ class DriveMonitor(object):
             # next lvm extent.
             return False
 
-        if physical - alloc < drive.watermarkLimit:
+        if physical - alloc < self._policy.watermark_limit(drive):
             return True
         return False
 
@@ -21,8 +21,16 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import collections
+import functools
+import logging
+import threading
+
 import libvirt
 
+from vdsm import executor
+from vdsm.common import exception
+
 LIBVIRT_EVENTS = {
     libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE: 'LIFECYCLE',
     libvirt.VIR_DOMAIN_EVENT_ID_REBOOT: 'REBOOT',
@@ -33,7 +41,8 @@ LIBVIRT_EVENTS = {
     libvirt.VIR_DOMAIN_EVENT_GRAPHICS_INITIALIZE: 'GRAPHICS_INITIALIZE',
     libvirt.VIR_DOMAIN_EVENT_GRAPHICS_DISCONNECT: 'GRAPHICS_DISCONNECT',
     libvirt.VIR_DOMAIN_EVENT_ID_WATCHDOG: 'WATCHDOG',
-    libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED: 'JOB_COMPLETED'
+    libvirt.VIR_DOMAIN_EVENT_ID_JOB_COMPLETED: 'JOB_COMPLETED',
+    libvirt.VIR_DOMAIN_EVENT_ID_MIGRATION_ITERATION: 'MIGRATION_ITERATION',
 }
 
 
@@ -42,3 +51,157 @@ def event_name(event_id):
         return LIBVIRT_EVENTS[event_id]
     except KeyError:
         return "Unknown id {!r}".format(event_id)
+
+
+# Time to wait for an event handler before replacing its worker.
+_TIMEOUT = 30
+
+log = logging.getLogger("virt.events")
+
+_dispatcher = None
+
+
+def start(scheduler, workers, max_tasks):
+    """
+    Start dispatching events to a pool of workers. Until started, event
+    handlers run in the caller thread.
+    """
+    global _dispatcher
+    if workers:
+        _dispatcher = Dispatcher(scheduler, workers, max_tasks)
+        _dispatcher.start()
+
+
+def stop():
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+        _dispatcher = None
+
+
+def dispatch(vm_id, handler, key=None):
+    """
+    Run handler for an event of vm vm_id, in the caller thread if the
+    dispatcher is not running.
+
+    If key is not None, the event is ignored if an event with the same key
+    is already waiting to be handled for this vm.
+    """
+    dispatcher = _dispatcher
+    if dispatcher is None:
+        handler()
+    else:
+        dispatcher.dispatch(vm_id, handler, key=key)
+
+
+def stats():
+    """
+    Return the dispatcher stats, or None if the dispatcher is not running.
+    """
+    dispatcher = _dispatcher
+    if dispatcher is None:
+        return None
+    return dispatcher.stats()
+
+
+class Dispatcher(object):
+    """
+    Run event handlers in an executor, so a slow handler of one vm does not
+    delay the events of other vms.
+
+    Events are never dropped. Every vm with pending events has a queue, and
+    one executor task handling the queued events serially, in the order they
+    were dispatched. A handler blocked for more than timeout seconds keeps
+    blocking the events of its vm, but its worker is replaced, so the events
+    of other vms are handled.
+
+    The number of tasks is limited by max_tasks, the number of vms with
+    pending events. When the limit is reached, the events of a new vm are
+    handled in the caller thread, as if the dispatcher was not running.
+
+    Repeated events, like I/O errors reported for every failed request, are
+    coalesced: an event is ignored if the last event waiting in the vm queue
+    has the same key. Events are never coalesced across other events, so the
+    order of events is kept.
+    """
+
+    def __init__(self, scheduler, workers, max_tasks, timeout=_TIMEOUT):
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        # vm id -> deque of (key, handler) waiting to be handled.
+        self._queues = {}
+        self._coalesced = 0
+        self._inline = 0
+        self._executor = executor.Executor(
+            name="events",
+            workers_count=workers,
+            max_tasks=max_tasks,
+            scheduler=scheduler,
+            max_workers=workers * 4,
+            log=log)
+
+    def start(self):
+        self._executor.start()
+
+    def stop(self):
+        self._executor.stop(wait=False)
+
+    def dispatch(self, vm_id, handler, key=None):
+        with self._lock:
+            queue = self._queues.get(vm_id)
+            if queue is not None:
+                # The task of this vm will handle the event.
+                if key is not None and queue and queue[-1][0] == key:
+                    self._coalesced += 1
+                    return
+                queue.append((key, handler))
+                return
+            self._queues[vm_id] = collections.deque([(key, handler)])
+
+        try:
+            self._executor.dispatch(
+                functools.partial(self._handle_events, vm_id),
+                timeout=self._timeout)
+        except exception.ResourceExhausted:
+            with self._lock:
+                self._inline += 1
+            log.warning("Too many vms with pending events, handling events "
+                        "of vm %s inline", vm_id)
+            self._handle_events(vm_id)
+        except executor.NotRunning:
+            # Stopping, handle the events as if we were not running.
+            self._handle_events(vm_id)
+
+    def stats(self):
+        """
+        Return the number of events waiting to be handled, the number of vms
+        with pending events, the waiting events of the vm with the longest
+        queue, the number of coalesced events, the number of vms handled
+        inline, and the histograms of the time tasks waited for a worker.
+        """
+        with self._lock:
+            per_vm = [len(queue) for queue in self._queues.values()]
+            coalesced = self._coalesced
+            inline = self._inline
+        return {
+            "pending": sum(per_vm),
+            "vms": len(per_vm),
+            "max_per_vm": max(per_vm) if per_vm else 0,
+            "coalesced": coalesced,
+            "inline": inline,
+            "wait": self._executor.stats()["wait"],
+        }
+
+    def _handle_events(self, vm_id):
+        while True:
+            with self._lock:
+                queue = self._queues[vm_id]
+                if not queue:
+                    del self._queues[vm_id]
+                    return
+                _, handler = queue.popleft()
+            try:
+                handler()
+            except Exception:
+                log.exception("Unhandled error handling event of vm %s",
+                              vm_id)
@@ -0,0 +1,173 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Policies for sizing thin provisioned volume extensions.
+
+A policy is used by the drive monitor of a vm. The drive monitor reports
+the allocation of the drives when checking them, and the time it took to
+extend a drive volume. The drive monitor asks the policy for the minimal
+free space before a volume must be extended, and for the next size of the
+volume.
+
+The "fixed" policy uses Drive.watermarkLimit and Drive.volExtensionChunk.
+The "write-rate" policy estimates the write rate of every drive, extends
+early enough so the drive does not run out of space before the extension
+completes, and extends enough to keep up with the writes until the next
+extension completes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from vdsm import utils
+from vdsm.common.units import MiB
+
+FIXED = "fixed"
+WRITE_RATE = "write-rate"
+
+
+def create(name, max_chunk, latency=5.0):
+    """
+    Create an extension policy.
+
+    Arguments:
+        name (str): FIXED or WRITE_RATE
+        max_chunk (int): maximum extension size in bytes, used by the
+            WRITE_RATE policy.
+        latency (float): initial estimate of the time to extend a volume in
+            seconds, used by the WRITE_RATE policy until an extension
+            completes.
+    """
+    if name == FIXED:
+        return FixedChunk()
+    elif name == WRITE_RATE:
+        return WriteRate(max_chunk, latency)
+    else:
+        raise ValueError("Unknown extension policy: %r" % name)
+
+
+class FixedChunk(object):
+    """
+    Extend by Drive.volExtensionChunk when the free space is below
+    Drive.watermarkLimit.
+    """
+
+    def sample(self, drive, alloc, now):
+        pass
+
+    def extension_completed(self, drive, seconds):
+        pass
+
+    def watermark_limit(self, drive):
+        return drive.watermarkLimit
+
+    def next_size(self, drive, cur_size, capacity):
+        return drive.getNextVolumeSize(cur_size, capacity)
+
+
+class WriteRate(object):
+    """
+    Extend when the free space is below the amount of data the drive is
+    expected to write while the extension is in progress, at least
+    Drive.watermarkLimit.
+
+    Extend by the amount of data the drive is expected to write while this
+    extension and the next extension are in progress, at least by
+    Drive.volExtensionChunk, and at most by max_chunk.
+
+    The write rate of a drive is estimated from successive allocation
+    samples, and the extension latency from the extensions completed by
+    this policy. Both are averaged using exponentially weighted moving
+    average, giving weight to recent values.
+    """
+
+    # Weight of the last value in the averages.
+    ALPHA = 0.5
+
+    def __init__(self, max_chunk, latency):
+        self._max_chunk = max_chunk
+        self._latency = latency
+        # drive name -> _Rate
+        self._rates = {}
+
+    @property
+    def latency(self):
+        return self._latency
+
+    def rate(self, drive):
+        """
+        Return the estimated write rate of drive in bytes per second, or
+        None if there are not enough samples.
+        """
+        rate = self._rates.get(drive.name)
+        return None if rate is None else rate.value
+
+    def sample(self, drive, alloc, now):
+        rate = self._rates.get(drive.name)
+        if rate is None:
+            rate = self._rates[drive.name] = _Rate(self.ALPHA)
+        rate.sample(alloc, now)
+
+    def extension_completed(self, drive, seconds):
+        self._latency = _average(self.ALPHA, self._latency, seconds)
+
+    def watermark_limit(self, drive):
+        limit = drive.watermarkLimit
+        rate = self.rate(drive)
+        if rate is not None:
+            expected = int(rate * self._latency)
+            limit = max(limit, min(expected, self._max_chunk))
+        return limit
+
+    def next_size(self, drive, cur_size, capacity):
+        chunk = drive.volExtensionChunk
+        rate = self.rate(drive)
+        if rate is not None:
+            # Writes during this extension, and during the next one.
+            expected = int(rate * self._latency * 2)
+            chunk = max(chunk, min(expected, self._max_chunk))
+        next_size = utils.round(cur_size + chunk, MiB)
+        return min(next_size, drive.getMaxVolumeSize(capacity))
+
+
+class _Rate(object):
+
+    def __init__(self, alpha):
+        self._alpha = alpha
+        self._alloc = None
+        self._time = None
+        self.value = None
+
+    def sample(self, alloc, now):
+        if self._alloc is not None and alloc < self._alloc:
+            # The top volume was replaced, for example after a snapshot.
+            self.value = None
+        elif self._time is not None and now > self._time:
+            rate = (alloc - self._alloc) / (now - self._time)
+            if self.value is None:
+                self.value = rate
+            else:
+                self.value = _average(self._alpha, self.value, rate)
+        self._alloc = alloc
+        self._time = now
+
+
+def _average(alpha, average, value):
+    return alpha * value + (1 - alpha) * average
@@ -23,6 +23,7 @@ from __future__ import division
 
 import io
 import collections
+import logging
 import re
 import threading
 import time
@@ -30,6 +31,7 @@ import libvirt
 
 from vdsm.common import concurrent
 from vdsm.common import conv
+from vdsm.common import libvirtconnection
 from vdsm.common import logutils
 from vdsm.common import response
 from vdsm import sslutils
@@ -40,9 +42,11 @@ from vdsm.common import xmlutils
 from vdsm.common.compat import pickle
 from vdsm.common.define import NORMAL
 from vdsm.common.network.address import normalize_literal_addr
+from vdsm.common.time import monotonic_time
 from vdsm.common.units import MiB
 from vdsm.virt.utils import DynamicBoundedSemaphore
 
+from vdsm.virt import migrationscheduler
 from vdsm.virt import virdomain
 from vdsm.virt import vmexitreason
 from vdsm.virt import vmstatus
@@ -101,13 +105,48 @@ class DomainAdapter(object):
         self._vm = vm
 
 
+@virdomain.expose(
+    "migrateSetMaxSpeed",
+    "migrateSetMaxDowntime",
+)
+class ControlDomainAdapter(object):
+    """
+    VM wrapper class that exposes libvirt migration control operations,
+    called while migrateToURI3() is in progress.
+    """
+
+    affinity = libvirtconnection.CONTROL
+
+    def __init__(self, vm):
+        self._vm = vm
+
+
+def _scheduling_policy():
+    """
+    Return the configured scheduling policy, or the default policy if the
+    configured value is invalid, so a bad value does not break loading
+    this module.
+    """
+    policy = config.get('vars', 'migration_scheduling_policy')
+    if policy not in migrationscheduler.POLICIES:
+        logging.getLogger('virt.migration').warning(
+            "Invalid migration_scheduling_policy %r, using %r",
+            policy, migrationscheduler.POLICY_FIFO)
+        return migrationscheduler.POLICY_FIFO
+    return policy
+
+
 class SourceThread(object):
     """
     A thread that takes care of migration on the source vdsm.
     """
     _RECOVERY_LOOP_PAUSE = 10
 
-    ongoingMigrations = DynamicBoundedSemaphore(1)
+    ongoingMigrations = migrationscheduler.MigrationScheduler(
+        1,
+        policy=_scheduling_policy(),
+        adaptive=config.getboolean('vars', 'migration_adaptive_concurrency'),
+        host_bandwidth=config.getint('vars', 'migration_host_max_bandwidth'))
 
     def __init__(self, vm, dst='', dstparams='',
                  mode=MODE_REMOTE, method=METHOD_ONLINE,
@@ -118,6 +157,7 @@ class SourceThread(object):
         self.log = vm.log
         self._vm = vm
         self._dom = DomainAdapter(self._vm)
+        self._control_dom = ControlDomainAdapter(self._vm)
         self._dst = dst
         self._mode = mode
         self._dstparams = dstparams
@@ -131,6 +171,9 @@ class SourceThread(object):
             kwargs.get('maxBandwidth') or
             config.getint('vars', 'migration_max_bandwidth')
         )
+        # Bandwidth assigned by the migration scheduler when sharing host
+        # bandwidth between migrations.
+        self._bandwidth = None
         self._incomingLimit = kwargs.get('incomingLimit')
         self._outgoingLimit = kwargs.get('outgoingLimit')
         self.status = {
@@ -193,6 +236,18 @@ class SourceThread(object):
     def started(self):
         return self._started
 
+    @property
+    def vm_id(self):
+        return self._vm.id
+
+    @property
+    def memory(self):
+        return self._vm.mem_size_mb()
+
+    @property
+    def requested_bandwidth(self):
+        return self._maxBandwidth
+
     @property
     def hibernating(self):
         return self._mode == MODE_FILE
@@ -223,6 +278,11 @@ class SourceThread(object):
         """
         self._update_progress()
         self.status['progress'] = self._progress
+        queue = SourceThread.ongoingMigrations.queue_info(self._vm.id)
+        if queue is None:
+            self.status.pop('queue', None)
+        else:
+            self.status['queue'] = queue
         return self.status
 
     def _createClient(self, port):
@@ -422,7 +482,7 @@ class SourceThread(object):
             while not self._started:
                 try:
                     self.log.info("Migration semaphore: acquiring")
-                    with SourceThread.ongoingMigrations:
+                    with SourceThread.ongoingMigrations.admitted(self):
                         self.log.info("Migration semaphore: acquired")
                         timeout = config.getint(
                             'vars', 'guest_lifecycle_event_reply_timeout')
@@ -550,7 +610,11 @@ class SourceThread(object):
             self._raiseAbortError()
 
     def _migration_params(self, muri):
-        params = {libvirt.VIR_MIGRATE_PARAM_BANDWIDTH: self._maxBandwidth}
+        if self._bandwidth is not None:
+            bandwidth = self._bandwidth
+        else:
+            bandwidth = self._maxBandwidth
+        params = {libvirt.VIR_MIGRATE_PARAM_BANDWIDTH: bandwidth}
         if not self.tunneled:
             params[libvirt.VIR_MIGRATE_PARAM_URI] = str(muri)
         if self._consoleAddress:
@@ -640,10 +704,32 @@ class SourceThread(object):
                          'limit': -1})
         return {'init': init, 'stalling': stalling}
 
+    def on_migration_iteration(self, iteration):
+        monitor_thread = self._monitorThread
+        if monitor_thread is not None:
+            monitor_thread.on_iteration(iteration)
+
     def set_max_bandwidth(self, bandwidth):
         self._vm.log.debug('setting migration max bandwidth to %d', bandwidth)
         self._maxBandwidth = bandwidth
-        self._dom.migrateSetMaxSpeed(bandwidth)  # pylint: disable=no-member
+        if SourceThread.ongoingMigrations.host_bandwidth:
+            # The scheduler will apply our share of the host bandwidth.
+            SourceThread.ongoingMigrations.rebalance()
+        else:
+            # pylint: disable=no-member
+            self._control_dom.migrateSetMaxSpeed(bandwidth)
+
+    def apply_bandwidth(self, bandwidth):
+        """
+        Called by the migration scheduler when the bandwidth share of this
+        migration changes.
+        """
+        self._vm.log.debug('applying migration bandwidth share %d MiBps',
+                           bandwidth)
+        self._bandwidth = bandwidth
+        if self._started and not self.hibernating:
+            # pylint: disable=no-member
+            self._control_dom.migrateSetMaxSpeed(bandwidth)
 
     def stop(self):
         # if its locks we are before the migrateToURI3()
@@ -704,11 +790,18 @@ class MonitorThread(object):
     def __init__(self, vm, startTime, conv_schedule):
         super(MonitorThread, self).__init__()
         self._stop = threading.Event()
+        # Set when the thread should look at the migration before the next
+        # poll, e.g. on libvirt migration iteration event or when stopping.
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._reported_iteration = None
         self._vm = vm
         self._dom = DomainAdapter(self._vm)
+        self._control_dom = ControlDomainAdapter(self._vm)
         self._startTime = startTime
         self.daemon = True
         self.progress = None
+        self.timeline = Timeline()
         self._conv_schedule = conv_schedule
         self._thread = concurrent.thread(
             self.run, name='migmon/' + self._vm.id[:8])
@@ -742,17 +835,50 @@ class MonitorThread(object):
             self._vm.log.info('migration monitor thread disabled'
                               ' (monitoring interval set to 0)')
 
+    def on_iteration(self, iteration):
+        """
+        Called from libvirt event thread when libvirt reports a new
+        migration iteration.
+
+        We only record the iteration and wake up the monitor thread, so the
+        convergence schedule is handled immediately instead of on the next
+        poll, without blocking the event thread.
+        """
+        with self._lock:
+            if (self._reported_iteration is None or
+                    iteration > self._reported_iteration):
+                self._reported_iteration = iteration
+        self._wakeup.set()
+
     def monitor_migration(self):
         lowmark = None
-        initial_iteration = last_iteration = None
+        self._initial_iteration = self._last_iteration = None
 
         self._execute_init(self._conv_schedule['init'])
 
+        next_poll = monotonic_time() + self._MIGRATION_MONITOR_INTERVAL
+
         while not self._stop.isSet():
-            stopped = self._stop.wait(self._MIGRATION_MONITOR_INTERVAL)
-            if stopped:
+            timeout = max(0, next_poll - monotonic_time())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if self._stop.isSet():
                 break
 
+            with self._lock:
+                iteration = self._reported_iteration
+                self._reported_iteration = None
+
+            if iteration is not None and self._initial_iteration is not None:
+                self._handle_iteration(iteration)
+
+            if monotonic_time() < next_poll and \
+                    self._initial_iteration is not None:
+                # Iteration event handled, no need to poll libvirt yet.
+                continue
+
+            next_poll = monotonic_time() + self._MIGRATION_MONITOR_INTERVAL
+
             try:
                 job_stats = self._vm.job_stats()
             except libvirt.libvirtError as e:
@@ -766,12 +892,16 @@ class MonitorThread(object):
                 continue
 
             progress = Progress.from_job_stats(job_stats)
-            if initial_iteration is None:
+            if self._initial_iteration is None:
                 # The initial iteration number from libvirt is not
                 # fixed, since it may include iterations from
                 # previously cancelled migrations.
-                initial_iteration = last_iteration = progress.mem_iteration
+                self._initial_iteration = self._last_iteration = \
+                    progress.mem_iteration
 
+            self.progress = progress
+            SourceThread.ongoingMigrations.report_throughput(
+                self._vm.id, progress.mem_bps)
             self._vm.send_migration_status_event()
 
             if self._vm.post_copy != PostCopyPhase.NONE:
@@ -800,22 +930,31 @@ class MonitorThread(object):
                     ' > lowmark (%sMiB).',
                     progress.data_remaining // MiB, lowmark // MiB)
 
-            if not self._vm.post_copy and\
-               progress.mem_iteration > last_iteration:
-                last_iteration = progress.mem_iteration
-                current_iteration = last_iteration - initial_iteration
-                self._vm.log.debug('new iteration: %i', current_iteration)
-                self._next_action(current_iteration)
+            self._handle_iteration(progress.mem_iteration)
 
             if self._stop.isSet():
                 break
 
-            self.progress = progress
             self._vm.log.info('%s', progress)
 
+        self._vm.log.info('Migration timeline: %s', self.timeline)
+
+    def _handle_iteration(self, iteration):
+        if self._vm.post_copy or iteration <= self._last_iteration:
+            return
+        self._last_iteration = iteration
+        current_iteration = iteration - self._initial_iteration
+        self._vm.log.debug('new iteration: %i', current_iteration)
+        self.timeline.add_iteration(
+            current_iteration,
+            self.progress,
+            monotonic_time() - self.timeline.start)
+        self._next_action(current_iteration)
+
     def stop(self):
         self._vm.log.debug('stopping migration monitor thread')
         self._stop.set()
+        self._wakeup.set()
 
     def _next_action(self, stalling):
         head = self._conv_schedule['stalling'][0]
@@ -840,7 +979,8 @@ class MonitorThread(object):
             downtime = int(action_with_params['params'][0])
             vm.log.debug('Setting downtime to %d', downtime)
             # pylint: disable=no-member
-            self._dom.migrateSetMaxDowntime(downtime, 0)
+            self._control_dom.migrateSetMaxDowntime(downtime, 0)
+            self.timeline.downtime = downtime
         elif action == CONVERGENCE_SCHEDULE_POST_COPY:
             if not self._vm.switch_migration_to_post_copy():
                 # Do nothing for now; the next action will be invoked after a
@@ -852,6 +992,51 @@ class MonitorThread(object):
             self.stop()
 
 
+TimelineEntry = collections.namedtuple('TimelineEntry', [
+    'time', 'iteration', 'dirty_rate', 'data_remaining', 'downtime'
+])
+
+
+class Timeline(object):
+    """
+    Per-migration record of memory iterations, for analysis of migration
+    convergence.
+
+    Every entry records the time since the monitor was started, the
+    iteration number (relative to the start of the migration), the last
+    known dirty rate and remaining data, and the maximum downtime in effect
+    when the iteration started. Values not reported yet are -1.
+    """
+
+    def __init__(self):
+        self.start = monotonic_time()
+        self.downtime = -1
+        self.entries = []
+
+    def add_iteration(self, iteration, progress, elapsed):
+        if progress is None:
+            dirty_rate = data_remaining = -1
+        else:
+            dirty_rate = progress.dirty_rate
+            data_remaining = progress.data_remaining
+        self.entries.append(TimelineEntry(
+            round(elapsed, 1), iteration, dirty_rate, data_remaining,
+            self.downtime))
+
+    def info(self):
+        return [entry._asdict() for entry in self.entries]
+
+    def __str__(self):
+        return ', '.join(
+            '%.1fs: iteration=%d dirty_rate=%d remaining=%dMiB '
+            'downtime=%d' % (
+                e.time, e.iteration, e.dirty_rate,
+                e.data_remaining // MiB if e.data_remaining > 0
+                else e.data_remaining,
+                e.downtime)
+            for e in self.entries) or 'no iterations'
+
+
 _Progress = collections.namedtuple('_Progress', [
     'job_type', 'time_elapsed', 'data_total',
     'data_processed', 'data_remaining',
@@ -0,0 +1,372 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Admission scheduling of outgoing migrations.
+
+When a host is evacuated, the engine starts many migrations at once, and
+only a limited number of them may run concurrently. The scheduler decides
+which of the waiting migrations is admitted next, may adapt the number of
+concurrent migrations to the measured aggregate throughput, and may split
+a host-wide bandwidth budget between the running migrations.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+
+from vdsm.common.time import monotonic_time
+from vdsm.common.units import MiB
+
+# Admit migrations in arrival order.
+POLICY_FIFO = 'fifo'
+
+# Admit migrations of VMs with smaller memory first; small VMs finish
+# quickly, freeing the host sooner from most of the VMs.
+POLICY_MEMORY = 'memory'
+
+POLICIES = (POLICY_FIFO, POLICY_MEMORY)
+
+
+class MigrationScheduler(object):
+    """
+    Replacement for a bounded semaphore guarding outgoing migrations.
+
+    Migrations are expected to provide:
+
+    - vm_id: the VM UUID
+    - memory: VM memory size in MiB, used by POLICY_MEMORY
+    - requested_bandwidth: requested maximum bandwidth in MiBps, 0 means
+      unlimited
+    - apply_bandwidth(bandwidth): called when the scheduler changes the
+      bandwidth of an admitted migration
+
+    Arguments:
+        bound (int): Maximum number of concurrent migrations.
+        policy (str): One of POLICIES.
+        adaptive (bool): If True, the number of concurrent migrations is
+            adapted to the measured aggregate throughput, up to bound.
+        host_bandwidth (int): Bandwidth in MiBps shared by all the running
+            migrations. 0 disables bandwidth redistribution.
+    """
+
+    log = logging.getLogger('virt.migration.scheduler')
+
+    def __init__(self, bound, policy=POLICY_FIFO, adaptive=False,
+                 host_bandwidth=0, clock=monotonic_time):
+        if policy not in POLICIES:
+            raise ValueError("Invalid migration scheduling policy: %r"
+                             % policy)
+        self._cond = threading.Condition(threading.Lock())
+        self._bound = bound
+        self._policy = policy
+        self._host_bandwidth = host_bandwidth
+        if adaptive:
+            self._controller = ConcurrencyController(bound, clock=clock)
+        else:
+            self._controller = None
+        self._seq = itertools.count()
+        self._queued = {}
+        self._active = {}
+
+    @property
+    def bound(self):
+        return self._bound
+
+    @bound.setter
+    def bound(self, value):
+        with self._cond:
+            self._bound = value
+            if self._controller:
+                self._controller.bound = value
+            self._cond.notify_all()
+
+    @property
+    def limit(self):
+        """
+        Current number of migrations allowed to run concurrently.
+        """
+        if self._controller:
+            return self._controller.limit
+        return self._bound
+
+    @property
+    def host_bandwidth(self):
+        return self._host_bandwidth
+
+    @contextmanager
+    def admitted(self, migration):
+        self.acquire(migration)
+        try:
+            yield
+        finally:
+            self.release(migration)
+
+    def acquire(self, migration):
+        ticket = _Ticket(next(self._seq), migration)
+        with self._cond:
+            self._queued[migration.vm_id] = ticket
+            while not self._can_admit(ticket):
+                self._cond.wait()
+            del self._queued[migration.vm_id]
+            ticket.admitted = monotonic_time()
+            self._active[migration.vm_id] = ticket
+            self.log.debug("Admitted migration of VM %s (active=%d, "
+                           "queued=%d, limit=%d)", migration.vm_id,
+                           len(self._active), len(self._queued), self.limit)
+            changes = self._bandwidth_changes()
+        self._apply(changes)
+
+    def release(self, migration):
+        with self._cond:
+            ticket = self._active.pop(migration.vm_id)
+            if self._controller:
+                self._controller.forget()
+            changes = self._bandwidth_changes()
+            self._cond.notify_all()
+        self.log.debug("Migration of VM %s released after %.1f seconds",
+                       migration.vm_id, monotonic_time() - ticket.admitted)
+        self._apply(changes)
+
+    def rebalance(self):
+        """
+        Redistribute the host bandwidth after requested bandwidth of a
+        migration has changed.
+        """
+        with self._cond:
+            changes = self._bandwidth_changes()
+        self._apply(changes)
+
+    def report_throughput(self, vm_id, bps):
+        """
+        Called periodically by the migration monitor with the current
+        memory transfer rate of a running migration.
+        """
+        with self._cond:
+            ticket = self._active.get(vm_id)
+            if ticket is None:
+                return
+            ticket.bps = bps
+            if self._controller is None:
+                return
+            if any(t.bps is None for t in self._active.values()):
+                # Wait until all running migrations report.
+                return
+            aggregate = sum(t.bps for t in self._active.values())
+            old_limit = self._controller.limit
+            self._controller.update(len(self._active), aggregate)
+            if self._controller.limit != old_limit:
+                self.log.info("Changing concurrent migrations limit from "
+                              "%d to %d (aggregate throughput %d MiBps)",
+                              old_limit, self._controller.limit,
+                              aggregate // MiB)
+                self._cond.notify_all()
+
+    def queue_info(self, vm_id):
+        """
+        Return queue state for migration of VM vm_id if it is waiting for
+        admission, None otherwise.
+        """
+        with self._cond:
+            ticket = self._queued.get(vm_id)
+            if ticket is None:
+                return None
+            position = self._ordered_queue().index(ticket) + 1
+            return {
+                'position': position,
+                'queued': len(self._queued),
+                'active': len(self._active),
+                'limit': self.limit,
+            }
+
+    # Private, must be called when holding the condition lock.
+
+    def _can_admit(self, ticket):
+        if len(self._active) >= self.limit:
+            return False
+        return self._ordered_queue()[0] is ticket
+
+    def _ordered_queue(self):
+        return sorted(self._queued.values(), key=self._sort_key)
+
+    def _sort_key(self, ticket):
+        if self._policy == POLICY_MEMORY:
+            return (ticket.memory, ticket.seq)
+        return ticket.seq
+
+    def _bandwidth_changes(self):
+        if not self._host_bandwidth or not self._active:
+            return []
+        requested = {vm_id: t.migration.requested_bandwidth
+                     for vm_id, t in self._active.items()}
+        shares = bandwidth_shares(self._host_bandwidth, requested)
+        changes = []
+        for vm_id, share in shares.items():
+            ticket = self._active[vm_id]
+            if ticket.bandwidth != share:
+                ticket.bandwidth = share
+                changes.append((ticket.migration, share))
+        return changes
+
+    # Private, must be called without holding the lock, since applying
+    # bandwidth calls libvirt.
+
+    def _apply(self, changes):
+        for migration, bandwidth in changes:
+            try:
+                migration.apply_bandwidth(bandwidth)
+            except Exception:
+                self.log.exception("Cannot set bandwidth of VM %s "
+                                   "migration to %d MiBps",
+                                   migration.vm_id, bandwidth)
+
+
+class _Ticket(object):
+
+    def __init__(self, seq, migration):
+        self.seq = seq
+        self.migration = migration
+        self.memory = migration.memory
+        self.admitted = None
+        self.bandwidth = None
+        self.bps = None
+
+
+def bandwidth_shares(budget, requested):
+    """
+    Split budget MiBps between migrations, so that no migration gets more
+    than requested, and bandwidth not used by migrations requesting less
+    than their fair share is given to the others (max-min fairness).
+
+    Arguments:
+        budget (int): Total bandwidth in MiBps.
+        requested (dict): Mapping of key to requested bandwidth in MiBps,
+            0 means unlimited.
+
+    Returns:
+        dict mapping key to bandwidth share in MiBps.
+    """
+    shares = {}
+    remaining = budget
+    pending = sorted(requested.items(),
+                     key=lambda item: item[1] or float('inf'))
+    while pending:
+        key, wanted = pending.pop(0)
+        fair = max(1, remaining // (len(pending) + 1))
+        share = min(wanted, fair) if wanted else fair
+        shares[key] = share
+        remaining = max(0, remaining - share)
+    return shares
+
+
+class ConcurrencyController(object):
+    """
+    Adapt number of concurrent migrations to measured throughput.
+
+    Throughput is tracked separately for every number of running
+    migrations. The limit is increased while running one more migration
+    increases the aggregate throughput by at least gain, and decreased when
+    the last increase did not pay off, for example because the migration
+    network is saturated. Measurements expire after ttl seconds, so the
+    controller probes again when conditions change.
+    """
+
+    def __init__(self, bound, gain=0.1, min_samples=2, ttl=60,
+                 clock=monotonic_time):
+        self._bound = bound
+        self._gain = gain
+        self._min_samples = min_samples
+        self._ttl = ttl
+        self._clock = clock
+        self._limit = min(2, bound)
+        self._levels = {}
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def bound(self):
+        return self._bound
+
+    @bound.setter
+    def bound(self, value):
+        self._bound = value
+        self._limit = max(1, min(self._limit, value))
+
+    def forget(self):
+        """
+        Called when a migration ends; the measurement of the current level
+        mixed the finished migration and is no longer relevant.
+        """
+        self._levels.pop(self._limit, None)
+
+    def update(self, active, aggregate_bps):
+        now = self._clock()
+        level = self._levels.get(active)
+        if level is None or now - level.updated > self._ttl:
+            level = self._levels[active] = _Level()
+        level.add(aggregate_bps, now)
+
+        if active != self._limit or level.samples < self._min_samples:
+            # Not saturated, or not enough data to decide.
+            return
+
+        lower = self._measured(active - 1, now)
+        if lower is not None and \
+                level.bps < lower * (1 + self._gain):
+            # The last migration added did not improve throughput.
+            self._limit = max(1, self._limit - 1)
+            return
+
+        if self._limit < self._bound:
+            higher = self._measured(active + 1, now)
+            if higher is None or higher >= level.bps * (1 + self._gain):
+                self._limit += 1
+
+    def _measured(self, active, now):
+        level = self._levels.get(active)
+        if level is None or level.samples < self._min_samples:
+            return None
+        if now - level.updated > self._ttl:
+            return None
+        return level.bps
+
+
+class _Level(object):
+
+    # Weight of a new sample in exponential moving average.
+    ALPHA = 0.5
+
+    def __init__(self):
+        self.bps = 0
+        self.samples = 0
+        self.updated = None
+
+    def add(self, bps, now):
+        if self.samples == 0:
+            self.bps = bps
+        else:
+            self.bps = self.ALPHA * bps + (1 - self.ALPHA) * self.bps
+        self.samples += 1
+        self.updated = now
@@ -34,15 +34,19 @@ import six
 from vdsm import executor
 from vdsm import host
 from vdsm import throttledlog
+from vdsm.common import concurrent
 from vdsm.common import errors
 from vdsm.common import exception
 from vdsm.common import libvirtconnection
+from vdsm.common.time import monotonic_time
 from vdsm.config import config
 from vdsm.virt import migration
 from vdsm.virt import recovery
 from vdsm.virt import sampling
 from vdsm.virt import virdomain
 from vdsm.virt import vmstatus
+from vdsm.virt.utils import ExpiringCache
+from vdsm.virt.utils import isVdsmImage
 
 
 # Just a made up number. Maybe should be equal to number of cores?
@@ -51,7 +55,12 @@ _WORKERS = config.getint('sampling', 'periodic_workers')
 _TASK_PER_WORKER = config.getint('sampling', 'periodic_task_per_worker')
 _TASKS = _WORKERS * _TASK_PER_WORKER
 _MAX_WORKERS = config.getint('sampling', 'max_workers')
+_TASKS_PER_DOMAIN = config.getint('sampling', 'periodic_tasks_per_domain')
+_RUNNING_PER_DOMAIN = config.getint('sampling', 'periodic_running_per_domain')
+_VMS_PER_TASK = config.getint('sampling', 'periodic_vms_per_task')
 _THROTTLING_INTERVAL = 10  # seconds
+_NOWAIT_ENABLED = config.getboolean('vars', 'nowait_domain_stats')
+_SKIP_DOMS_TTL = 40.0  # seconds
 
 _operations = []
 _executor = None
@@ -92,7 +101,9 @@ def start(cif, scheduler):
                                   workers_count=_WORKERS,
                                   max_tasks=_TASKS,
                                   scheduler=scheduler,
-                                  max_workers=_MAX_WORKERS)
+                                  max_workers=_MAX_WORKERS,
+                                  max_tasks_per_key=_TASKS_PER_DOMAIN,
+                                  max_running_per_key=_RUNNING_PER_DOMAIN)
 
     _executor.start()
 
@@ -235,11 +246,18 @@ class VmDispatcher(object):
     """
     Adapter class. Dispatch an Operation to all VMs, to improve
     isolation among them.
+
+    To minimize the number of executor tasks, the operations of up to
+    batch_size VMs are run sequentially in one task. If the operation of a
+    VM takes more than timeout seconds, the VM is moved to the slow lane,
+    and its operations are dispatched in a separate task until an operation
+    completes in time.
     """
 
     _log = logging.getLogger("virt.periodic.VmDispatcher")
 
-    def __init__(self, get_vms, executor, create, timeout):
+    def __init__(self, get_vms, executor, create, timeout, batch_size=1,
+                 clock=monotonic_time):
         """
         get_vms: callable which will return a dict which maps
                  vm_ids to vm_instances
@@ -248,15 +266,29 @@ class VmDispatcher(object):
                 dispatch, with its timeout
         timeout: per-vm operation timeout, in seconds
                  (fractions allowed).
+        batch_size: maximum number of vms handled by one executor task.
+        clock: callable returning the current time, for testing.
         """
         self._get_vms = get_vms
         self._executor = executor
         self._create = create
         self._timeout = timeout
+        self._batch_size = batch_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Ids of vms dispatched in a separate task.
+        self._slow = set()
+        # Batches of the last cycle.
+        self._batches = []
+        self._cycle = None
+        self._last_cycle_time = None
 
     def __call__(self):
         vms = self._get_vms()
+        self._check_blocked(vms)
         skipped = []
+        ops = []
+        slow_ops = []
 
         for vm_id, vm_obj in six.viewitems(vms):
             try:
@@ -279,26 +311,230 @@ class VmDispatcher(object):
                 # we want to make sure to have VM UUID logged
                 self._log.exception("while dispatching %s", op)
             else:
-                try:
-                    self._executor.dispatch(op, self._timeout)
-                except exception.ResourceExhausted:
-                    skipped.append(vm_id)
+                if vm_id in self._slow:
+                    slow_ops.append(op)
+                else:
+                    ops.append(op)
+
+        batches = [_Batch(self, [op]) for op in slow_ops]
+        for i in range(0, len(ops), self._batch_size):
+            batches.append(_Batch(self, ops[i:i + self._batch_size]))
+
+        cycle = _Cycle(self._clock(), len(batches))
+        with self._lock:
+            self._cycle = cycle
+            self._batches = list(batches)
+
+        for batch in batches:
+            skipped.extend(self._dispatch(batch, cycle))
 
         if skipped:
             self._log.warning('could not run %s on %s',
                               self._create, skipped)
         return skipped  # for testing purposes
 
+    def stats(self):
+        """
+        Return dispatching statistics for the last cycle.
+        """
+        with self._lock:
+            return {
+                "vms": sum(len(b.ops) for b in self._batches),
+                "tasks": len(self._batches),
+                "slow": len(self._slow),
+                "cycle_time": self._last_cycle_time,
+            }
+
+    def _dispatch(self, batch, cycle):
+        """
+        Dispatch batch to the executor, returning the ids of the vms which
+        could not be dispatched.
+        """
+        batch.cycle = cycle
+        try:
+            self._executor.dispatch(batch, batch.timeout,
+                                    priority=batch.priority,
+                                    keys=batch.keys)
+        except exception.ResourceExhausted:
+            self._batch_done(batch)
+            return [op.vm_id for op in batch.ops]
+        return []
+
+    def _check_blocked(self, vms):
+        """
+        Move vms blocked in the previous cycle to the slow lane, and cancel
+        the rest of their batch, since the vms will be handled in this
+        cycle.
+        """
+        now = self._clock()
+        with self._lock:
+            self._slow.intersection_update(vms)
+            for batch in self._batches:
+                vm_id = batch.blocked_vm(now, self._timeout)
+                if vm_id is not None:
+                    self._log.warning("%s blocked on vm %s, moving vm to "
+                                      "the slow lane", self._create, vm_id)
+                    self._slow.add(vm_id)
+                    batch.cancel()
+
+    def _split(self, batch, ops):
+        """
+        Called by batch running for more than timeout seconds, dispatching
+        the operations not started yet in a new batch.
+        """
+        new_batch = _Batch(self, ops)
+        with self._lock:
+            cycle = batch.cycle
+            if cycle is not self._cycle:
+                # The vms were dispatched again in the current cycle.
+                return
+            cycle.pending += 1
+            self._batches.append(new_batch)
+        skipped = self._dispatch(new_batch, cycle)
+        if skipped:
+            self._log.warning('could not run %s on %s',
+                              self._create, skipped)
+
+    def _op_done(self, op, elapsed):
+        if elapsed > self._timeout:
+            with self._lock:
+                self._slow.add(op.vm_id)
+        elif op.vm_id in self._slow:
+            with self._lock:
+                self._slow.discard(op.vm_id)
+
+    def _batch_done(self, batch):
+        cycle = batch.cycle
+        with self._lock:
+            cycle.pending -= 1
+            if cycle.pending > 0 or cycle is not self._cycle:
+                return
+            self._last_cycle_time = self._clock() - cycle.start
+            cycle_time = self._last_cycle_time
+            tasks = len(self._batches)
+        self._log.debug("%s cycle completed in %.3f seconds (tasks=%d)",
+                        self._create, cycle_time, tasks)
+
     def __repr__(self):
         return '<VmDispatcher operation=%s at 0x%x>' % (
             self._create, id(self)
         )
 
 
+class _Cycle(object):
+
+    def __init__(self, start, pending):
+        self.start = start
+        self.pending = pending
+
+
+class _Batch(object):
+    """
+    Operations on several vms, run sequentially in one executor task.
+    """
+
+    _log = logging.getLogger("virt.periodic.VmDispatcher")
+
+    def __init__(self, dispatcher, ops):
+        self._dispatcher = dispatcher
+        self.ops = ops
+        # Report the executor queue wait time per operation type.
+        self.__name__ = getattr(
+            dispatcher._create, '__name__', self.__class__.__name__)
+        self.cycle = None
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._current = None
+        self._started = None
+
+    @property
+    def priority(self):
+        # Lower values are more urgent; run with the most urgent operation.
+        return min(op.priority for op in self.ops)
+
+    @property
+    def timeout(self):
+        """
+        Executor timeout of the batch. The batch starts a new operation only
+        while it runs less than the operation timeout, so the last operation
+        may start when the batch budget is nearly used up.
+        """
+        return self._dispatcher._timeout * min(len(self.ops), 2)
+
+    @property
+    def keys(self):
+        keys = set()
+        for op in self.ops:
+            keys.update(op.keys)
+        return tuple(keys)
+
+    def blocked_vm(self, now, timeout):
+        """
+        Return the id of the vm whose operation is running for more than
+        timeout seconds, or None.
+        """
+        with self._lock:
+            if self._current is not None and now - self._started > timeout:
+                return self._current.vm_id
+            return None
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+
+    def __call__(self):
+        clock = self._dispatcher._clock
+        timeout = self._dispatcher._timeout
+        start = clock()
+        try:
+            for i, op in enumerate(self.ops):
+                now = clock()
+                if i > 0 and now - start > timeout:
+                    # Do not delay the rest of the vms.
+                    self.cancel()
+                    self._dispatcher._split(self, self.ops[i:])
+                    return
+                with self._lock:
+                    if self._cancelled:
+                        return
+                    self._current = op
+                    self._started = now
+                try:
+                    op()
+                except Exception:
+                    self._log.exception("%s operation failed", op)
+                finally:
+                    with self._lock:
+                        self._current = None
+                    self._dispatcher._op_done(op, clock() - now)
+        finally:
+            self._dispatcher._batch_done(self)
+
+    def __repr__(self):
+        return '<%s ops=%s at 0x%x>' % (
+            self.__class__.__name__, self.ops, id(self)
+        )
+
+
 class _RunnableOnVm(object):
+
+    priority = executor.PRIORITY_NORMAL
+
     def __init__(self, vm):
         self._vm = vm
 
+    @property
+    def vm_id(self):
+        return self._vm.id
+
+    @property
+    def keys(self):
+        """
+        Storage domains accessed by the operation, limiting the number of
+        operations blocked on the same domain.
+        """
+        return ()
+
     @property
     def required(self):
         # Disable everything until the migration destination VM
@@ -343,6 +579,14 @@ class _RunnableOnVm(object):
 
 class UpdateVolumes(_RunnableOnVm):
 
+    # Updating volume size is only informative.
+    priority = executor.PRIORITY_LOW
+
+    @property
+    def keys(self):
+        return tuple({drive.domainID for drive in self._vm.getDiskDevices()
+                      if not drive.readonly and isVdsmImage(drive)})
+
     @property
     def required(self):
         return (super(UpdateVolumes, self).required and
@@ -374,6 +618,9 @@ class BlockjobMonitor(_RunnableOnVm):
 
 class DriveWatermarkMonitor(_RunnableOnVm):
 
+    # Delaying drive extension may pause the VM.
+    priority = executor.PRIORITY_HIGH
+
     @property
     def required(self):
         return (super(DriveWatermarkMonitor, self).required and
@@ -383,6 +630,107 @@ class DriveWatermarkMonitor(_RunnableOnVm):
         self._vm.monitor_drives()
 
 
+class DriveWatermarkSampler(object):
+    """
+    Sample the block stats of all the vms needing drive monitoring with one
+    libvirt call, and dispatch the drive monitoring to every vm.
+
+    Drive monitoring uses the sampled allocation instead of calling
+    virDomain.blockInfo() for every drive, and falls back to blockInfo() if
+    a drive was not sampled.
+
+    Like VMBulkstatsMonitor, sampling skips domains not ready for commands,
+    does not wait for domain jobs if possible, and is skipped while a
+    previous sampling call is stuck. Sampling runs in its own thread, and
+    drive monitoring is dispatched when sampling is done, or after timeout
+    seconds, so a stuck libvirt call cannot delay drive monitoring.
+    """
+
+    _log = logging.getLogger("virt.periodic.DriveWatermarkSampler")
+
+    def __init__(self, conn, get_vms, dispatch, timeout=1.0,
+                 ttl=_SKIP_DOMS_TTL):
+        """
+        conn: libvirt connection
+        get_vms: callable which will return a dict which maps
+                 vm_ids to vm_instances
+        dispatch: callable dispatching DriveWatermarkMonitor to the vms,
+                  typically a VmDispatcher.
+        timeout: seconds to wait for sampling before dispatching
+        ttl: seconds to skip a domain which was not ready for commands
+        """
+        self._conn = conn
+        self._get_vms = get_vms
+        self._dispatch = dispatch
+        self._timeout = timeout
+        self._skip_doms = ExpiringCache(ttl)
+        self._sampling = threading.Semaphore()  # used as glorified counter
+
+    def __call__(self):
+        if self._sampling.acquire(blocking=False):
+            done = threading.Event()
+            t = concurrent.thread(
+                self._sample_vms, args=(done,), name="periodic/sample",
+                log=self._log)
+            t.start()
+            if not done.wait(self._timeout):
+                throttledlog.warning(
+                    repr(self), "Drive sampling did not finish in %.2f "
+                    "seconds, dispatching drive monitoring", self._timeout)
+        else:
+            # Drive monitoring will use blockInfo().
+            throttledlog.warning(
+                repr(self), "Previous drive sampling is stuck, skipping "
+                "sampling")
+        return self._dispatch()
+
+    def _sample_vms(self, done):
+        try:
+            self._sample()
+        except Exception:
+            # Drive monitoring will use blockInfo().
+            self._log.exception("drive sampling failed")
+        finally:
+            self._sampling.release()
+            done.set()
+
+    def _sample(self):
+        vms = {}
+        for vm_id, vm_obj in six.viewitems(self._get_vms()):
+            if self._skip_doms.get(vm_id, False):
+                continue
+            op = DriveWatermarkMonitor(vm_obj)
+            if not op.required:
+                continue
+            # Unresponsive domains may block the libvirt call.
+            if not op.runnable:
+                self._skip_doms[vm_id] = True
+                continue
+            vms[vm_id] = vm_obj
+        if not vms:
+            return
+
+        flags = libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_BACKING
+        if _NOWAIT_ENABLED:
+            flags |= libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_NOWAIT
+
+        timestamp = monotonic_time()
+        bulk_stats = self._conn.domainListGetStats(
+            [vm_obj._dom._dom for vm_obj in vms.values()],
+            stats=libvirt.VIR_DOMAIN_STATS_BLOCK,
+            flags=flags)
+
+        for dom, stats in bulk_stats:
+            vm_obj = vms.get(dom.UUIDString())
+            if vm_obj is not None:
+                vm_obj.drive_monitor.update_block_stats(stats, timestamp)
+
+    def __repr__(self):
+        return '<DriveWatermarkSampler dispatch=%s at 0x%x>' % (
+            self._dispatch, id(self)
+        )
+
+
 def _kill_long_paused_vms(cif):
     log = logging.getLogger("virt.periodic")
     log.debug("Looking for stale paused VMs")
@@ -395,7 +743,8 @@ def _kill_long_paused_vms(cif):
 def _create(cif, scheduler):
     def per_vm_operation(func, period):
         disp = VmDispatcher(
-            cif.getVMs, _executor, func, _timeout_from(period))
+            cif.getVMs, _executor, func, _timeout_from(period),
+            batch_size=_VMS_PER_TASK)
         return Operation(disp, period, scheduler)
 
     ops = [
@@ -413,9 +762,18 @@ def _create(cif, scheduler):
         # We do this only until we get high water mark notifications
         # from QEMU. It accesses storage and/or QEMU monitor, so can block,
         # thus we need dispatching.
-        per_vm_operation(
-            DriveWatermarkMonitor,
-            config.getint('vars', 'vm_watermark_interval')),
+        Operation(
+            DriveWatermarkSampler(
+                libvirtconnection.get(cif),
+                cif.getVMs,
+                VmDispatcher(
+                    cif.getVMs, _executor, DriveWatermarkMonitor,
+                    _timeout_from(
+                        config.getint('vars', 'vm_watermark_interval')),
+                    batch_size=_VMS_PER_TASK),
+                timeout=config.getint('vars', 'vm_watermark_interval') / 2),
+            config.getint('vars', 'vm_watermark_interval'),
+            scheduler),
 
         Operation(
             lambda: recovery.lookup_external_vms(cif),
@@ -38,6 +38,7 @@ import time
 from vdsm import utils
 from vdsm import executor
 from vdsm.common import exception
+from vdsm.common import libvirtconnection
 from vdsm.common.time import monotonic_time
 from vdsm.config import config
 from vdsm.virt import periodic
@@ -124,6 +125,10 @@ _DISK_DEVICE_RE = re.compile('^(/dev/[hsv]d[a-z]+)[0-9]+$')
 @virdomain.expose("guestInfo", "interfaceAddresses")
 class QemuGuestAgentDomain(object):
     """Wrapper object exposing libvirt API."""
+
+    # Guest agent commands may block until the agent responds.
+    affinity = libvirtconnection.MONITORING
+
     def __init__(self, vm):
         self._vm = vm
 
@@ -139,6 +139,9 @@ def expose(*method_names):
 
         backup_id =  backup_dom.backupBegin(backup_xml, checkopoint_xml)
 
+    If the decorated class has an "affinity" attribute, the methods are
+    called on the domain returned by Vm.pooled_dom(affinity), using a pooled
+    libvirt connection for blocking calls.
     """
     def class_decorator(cls):
         for name in method_names:
@@ -156,6 +159,11 @@ def _call(name):
 
     @functools.wraps(orig_meth)
     def call(self, *a, **kw):
-        return getattr(self._vm._dom, name)(*a, **kw)
+        affinity = getattr(self, "affinity", None)
+        if affinity is None:
+            dom = self._vm._dom
+        else:
+            dom = self._vm.pooled_dom(affinity)
+        return getattr(dom, name)(*a, **kw)
 
     return call
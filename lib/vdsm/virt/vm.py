@@ -93,6 +93,7 @@ from vdsm.virt import saslpasswd2
 from vdsm.virt import vmchannels
 from vdsm.virt import vmexitreason
 from vdsm.virt import virdomain
+from vdsm.virt import vmcreation
 from vdsm.virt import vmstats
 from vdsm.virt import vmstatus
 from vdsm.virt import vmtune
@@ -337,8 +338,6 @@ class Vm(object):
     """
 
     log = logging.getLogger("virt.vm")
-    # limit threads number until the libvirt lock will be fixed
-    _ongoingCreations = threading.BoundedSemaphore(4)
 
     def _makeChannelPath(self, device_name):
         for name, path in self._domain.all_channels():
@@ -396,6 +395,9 @@ class Vm(object):
             self.conf['xml'] = self._src_domain_xml
         self.log = SimpleLogAdapter(self.log, {"vmId": self.id})
         self._dom = virdomain.Disconnected(self.id)
+        # Domains looked up on pooled libvirt connections, see pooled_dom().
+        self._pooled_doms = {}
+        self._pooled_doms_for = None
         self.cif = cif
         self._custom = {'vmId': self.id}
         self._exit_info = {}
@@ -837,23 +839,21 @@ class Vm(object):
 
         self._vmStartEvent.set()
         try:
-            with self._ongoingCreations:
-                self._vmCreationEvent.set()
-                try:
-                    with domain_required():
-                        self._run()
-                except MissingLibvirtDomainError:
-                    # always bubble up this exception.
-                    # we cannot continue without a libvirt domain object,
-                    # not even on recovery, to avoid state desync or worse
-                    # split-brain scenarios.
+            try:
+                with domain_required():
+                    self._run()
+            except MissingLibvirtDomainError:
+                # always bubble up this exception.
+                # we cannot continue without a libvirt domain object,
+                # not even on recovery, to avoid state desync or worse
+                # split-brain scenarios.
+                raise
+            except Exception as e:
+                if not self.recovering:
                     raise
-                except Exception as e:
-                    if not self.recovering:
-                        raise
-                    else:
-                        self.log.info("Skipping errors on recovery",
-                                      exc_info=True)
+                else:
+                    self.log.info("Skipping errors on recovery",
+                                  exc_info=True)
 
             if self._altered_state and self.lastStatus != vmstatus.DOWN:
                 self._completeIncomingMigration()
@@ -1005,32 +1005,37 @@ class Vm(object):
         self._preparePathsForDrives(drives)
 
     def _preparePathsForDrives(self, drives):
-        for drive in drives:
-            with self._volPrepareLock:
-                if self._destroy_requested.is_set():
-                    # A destroy request has been issued, exit early
-                    break
-                if self._altered_state.origin is not None:
-                    # We must use the original payload path in
-                    # incoming migrations, otherwise the generated
-                    # payload path may not match the one from the
-                    # domain XML (when migrating from Vdsm versions
-                    # using different payload paths).
-                    path = drive.get('path')
-                else:
-                    path = None
-                drive['path'] = self.cif.prepareVolumePath(
-                    drive, self.id, path=path
-                )
-                if isVdsmImage(drive):
-                    # This is the only place we support manipulation of a
-                    # prepared image, required for the localdisk hook. The hook
-                    # may change drive's diskType, path and format.
-                    modified = hooks.after_disk_prepare(drive, self._custom)
-                    drive.update(modified)
+        # The drives are prepared concurrently, so a destroy request waits
+        # until all the drives in progress are prepared.
+        with self._volPrepareLock:
+            vmcreation.prepare_drives(drives, self._prepareDrive, self.log)
+            if self._destroy_requested.is_set():
+                return
+        # Now we got all the resources we needed
+        self.drive_monitor.enable()
+
+    def _prepareDrive(self, drive):
+        if self._destroy_requested.is_set():
+            # A destroy request has been issued, exit early
+            return
+        if self._altered_state.origin is not None:
+            # We must use the original payload path in
+            # incoming migrations, otherwise the generated
+            # payload path may not match the one from the
+            # domain XML (when migrating from Vdsm versions
+            # using different payload paths).
+            path = drive.get('path')
         else:
-            # Now we got all the resources we needed
-            self.drive_monitor.enable()
+            path = None
+        drive['path'] = self.cif.prepareVolumePath(
+            drive, self.id, path=path
+        )
+        if isVdsmImage(drive):
+            # This is the only place we support manipulation of a
+            # prepared image, required for the localdisk hook. The hook
+            # may change drive's diskType, path and format.
+            modified = hooks.after_disk_prepare(drive, self._custom)
+            drive.update(modified)
 
     def _prepareTransientDisks(self, drives):
         for drive in drives:
@@ -1170,12 +1175,21 @@ class Vm(object):
                 if (drive.chunked or drive.replicaChunked) and not
                 drive.readonly]
 
-    def _getExtendInfo(self, drive):
+    def _getExtendInfo(self, drive, sampled=False):
         """
         Return extension info for a chunked drive or drive replicating to
         chunked replica volume.
+
+        If sampled is True, use the block stats sampled by the periodic
+        drive monitoring if available, instead of calling libvirt.
         """
-        capacity, alloc, physical = self._dom.blockInfo(drive.path, 0)
+        blockinfo = None
+        if sampled:
+            blockinfo = self.drive_monitor.sampled_block_info(drive)
+        if blockinfo is None:
+            dom = self.pooled_dom(libvirtconnection.MONITORING)
+            blockinfo = dom.blockInfo(drive.path, 0)
+        capacity, alloc, physical = blockinfo
 
         # Libvirt reports watermarks only for the source drive, but for
         # file-based drives it reports the same alloc and physical, which
@@ -1241,12 +1255,15 @@ class Vm(object):
             return
 
         try:
-            capacity, alloc, physical = self._getExtendInfo(drive)
+            capacity, alloc, physical = self._getExtendInfo(
+                drive, sampled=True)
         except libvirt.libvirtError as e:
             self.log.error("Unable to get watermarks for drive %s: %s",
                            drive.name, e)
             return False
 
+        self.drive_monitor.sample_allocation(drive, alloc)
+
         if drive.threshold_state == BLOCK_THRESHOLD.UNSET:
             self.drive_monitor.set_threshold(drive, physical)
 
@@ -1278,7 +1295,8 @@ class Vm(object):
 
         Must be called only when the drive or its replica are chunked.
         """
-        newSize = vmDrive.getNextVolumeSize(curSize, capacity)
+        newSize = self.drive_monitor.next_volume_size(
+            vmDrive, curSize, capacity)
 
         # If drive is replicated to a block device, we extend first the
         # replica, and handle drive later in __afterReplicaExtension.
@@ -1328,6 +1346,7 @@ class Vm(object):
             self.getDiskDevices()[:], volInfo['name'])
         if not vmDrive.chunked:
             # This was a replica only extension, we are done.
+            self.drive_monitor.extension_completed(vmDrive)
             clock.stop("total")
             self.log.info("Extend replica %s completed %s",
                           volInfo["volumeID"], clock)
@@ -1396,6 +1415,7 @@ class Vm(object):
         if not volInfo['internal']:
             drive = lookup.drive_by_name(
                 self.getDiskDevices()[:], volInfo['name'])
+            self.drive_monitor.extension_completed(drive)
             self._update_drive_volume_size(drive, volSize)
 
         self._resume_if_needed()
@@ -1412,6 +1432,7 @@ class Vm(object):
         """
         drive.apparentsize = volsize.apparentsize
         drive.truesize = volsize.truesize
+        self.drive_monitor.volume_resized(drive)
         self.drive_monitor.set_threshold(drive, volsize.apparentsize)
 
     def _resume_if_needed(self):
@@ -2038,6 +2059,9 @@ class Vm(object):
             # effort base).
             self._finish_migration_recovery()
 
+    def onMigrationIteration(self, iteration):
+        self._migrationSourceThread.on_migration_iteration(iteration)
+
     def _finish_migration_recovery(self):
         try:
             state, reason = self._dom.state(0)
@@ -2558,6 +2582,24 @@ class Vm(object):
         return devices_conf
 
     def _run(self):
+        # Preparing the next vms overlaps with creating the domains of the
+        # previous vms, see vmcreation.
+        with vmcreation.PREPARE.run(self.log):
+            self._vmCreationEvent.set()
+            self._prepare_run()
+
+        if not self.recovering and \
+           self._altered_state.origin == _MIGRATION_ORIGIN:
+            self._incoming_migration_prepared.set()
+            # self._dom will be disconnected until migration ends.
+            # we need to complete the initialization, including
+            # domDependentInit, after the migration is completed.
+            return
+
+        with vmcreation.CREATE.run(self.log):
+            self._create_domain()
+
+    def _prepare_run(self):
         self.log.info("VM wrapper has started")
         if not self.recovering and \
            self._altered_state.origin != _MIGRATION_ORIGIN:
@@ -2577,13 +2619,10 @@ class Vm(object):
             list(self._domain.get_device_elements('memballoon'))
         )
 
-        initDomain = self._altered_state.origin != _MIGRATION_ORIGIN
-        # we need to complete the initialization, including
-        # domDependentInit, after the migration is completed.
-
         if not self.recovering:
             self._setup_devices()
 
+    def _create_domain(self):
         if self.recovering:
             dom = self._connection.lookupByUUIDString(self.id)
             state, reason = dom.state(0)
@@ -2593,9 +2632,6 @@ class Vm(object):
             self._dom = virdomain.Notifying(dom, self._timeoutExperienced)
             for dev in self._devices[hwclass.NIC]:
                 dev.recover()
-        elif self._altered_state.origin == _MIGRATION_ORIGIN:
-            self._incoming_migration_prepared.set()
-            # self._dom will be disconnected until migration ends.
         elif self._altered_state.origin == _FILE_ORIGIN:
             if self.hugepages:
                 self._prepare_hugepages()
@@ -2678,7 +2714,7 @@ class Vm(object):
             finally:
                 hooks.remove_vm_launch_flags_file(self.id)
 
-        if initDomain:
+        if self._altered_state.origin != _MIGRATION_ORIGIN:
             self._domDependentInit()
 
     def _remove_domain_artifacts(self):
@@ -3750,6 +3786,29 @@ class Vm(object):
         else:
             return state == libvirt.VIR_DOMAIN_CONTROL_OK
 
+    def pooled_dom(self, affinity):
+        """
+        Return the libvirt domain for blocking calls of kind affinity.
+
+        If the libvirt connection pool is enabled, return the domain looked
+        up on a pooled connection, so the call does not delay other calls
+        using the shared connection. Otherwise return Vm._dom.
+        """
+        dom = self._dom
+        conn = libvirtconnection.pooled(affinity)
+        if conn is None or not dom.connected:
+            return dom
+        if self._pooled_doms_for is not dom:
+            # The domain was replaced, drop domains looked up for the old one.
+            self._pooled_doms = {}
+            self._pooled_doms_for = dom
+        pooled = self._pooled_doms.get(conn.stats.name)
+        if pooled is None:
+            pooled = virdomain.Notifying(
+                conn.lookupByUUIDString(self.id), self._timeoutExperienced)
+            self._pooled_doms[conn.stats.name] = pooled
+        return pooled
+
     def _timeoutExperienced(self, timeout):
         if timeout:
             self._monitorResponse = -1
@@ -5759,7 +5818,7 @@ class Vm(object):
         self._dom.snapshotCreateXML(snapxml, snap_flags)
 
     def job_stats(self):
-        return self._dom.jobStats()
+        return self.pooled_dom(libvirtconnection.MONITORING).jobStats()
 
     def update_snapshot_metadata(self, data):
         self._snapshot_job = data
@@ -0,0 +1,254 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Pipeline for starting vms.
+
+Starting a vm has two stages:
+
+- prepare: prepare the vm drives and set up the devices. This mostly waits
+  for storage.
+- create: define and start the libvirt domain, and initialize the vm. This
+  mostly waits for libvirt and qemu.
+
+Every stage has its own limit, so when starting many vms, the drives of
+the next vms are prepared while the domains of the previous vms are
+created.
+
+The limits are adaptive. When a stage takes more than the target time, its
+limit is halved, since running more vms concurrently would make every vm
+slower. When the stage is fast again, its limit grows by one for every
+completed vm, up to the configured maximum.
+
+The drives of a vm are prepared concurrently, limiting the number of drives
+prepared concurrently on the same storage domain by all vms.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import contextlib
+import functools
+import logging
+import threading
+
+from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
+from vdsm.config import config
+from vdsm.virt.utils import DynamicBoundedSemaphore
+
+# Maximum number of threads preparing the drives of a single vm.
+DRIVE_WORKERS = 8
+
+log = logging.getLogger("virt.vmcreation")
+
+
+class Stats(object):
+    """
+    Number of completed operations, and their total and maximum duration.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, elapsed):
+        with self._lock:
+            self._count += 1
+            self._total += elapsed
+            self._max = max(self._max, elapsed)
+
+    def info(self):
+        with self._lock:
+            return {
+                "count": self._count,
+                "total": self._total,
+                "max": self._max,
+            }
+
+
+class Stage(object):
+    """
+    A stage of the pipeline, limiting the number of vms running it
+    concurrently.
+    """
+
+    def __init__(self, name, max_concurrency, target, min_concurrency=1,
+                 clock=monotonic_time):
+        self.name = name
+        self._max_concurrency = max_concurrency
+        # A single slow vm must not serialize starting all other vms.
+        self._min_concurrency = max(1, min(min_concurrency, max_concurrency))
+        self._target = target
+        self._clock = clock
+        self._sem = DynamicBoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._stats = Stats()
+        self._wait_stats = Stats()
+
+    @property
+    def limit(self):
+        return self._sem.bound
+
+    @contextlib.contextmanager
+    def run(self, vm_log):
+        """
+        Context manager running a stage for a vm, waiting until the stage
+        limit allows it.
+        """
+        queued = self._clock()
+        with self._sem:
+            started = self._clock()
+            try:
+                yield
+            finally:
+                elapsed = self._clock() - started
+                waited = started - queued
+                self._wait_stats.record(waited)
+                self._stats.record(elapsed)
+                vm_log.info("Completed %s stage in %.2f seconds "
+                            "(waited %.2f seconds)",
+                            self.name, elapsed, waited)
+                self._adapt(elapsed)
+
+    def stats(self):
+        info = self._stats.info()
+        info["limit"] = self.limit
+        info["wait"] = self._wait_stats.info()
+        return info
+
+    def _adapt(self, elapsed):
+        with self._lock:
+            limit = self._sem.bound
+            if elapsed > self._target:
+                new_limit = max(self._min_concurrency, limit // 2)
+            else:
+                new_limit = min(self._max_concurrency, limit + 1)
+            if new_limit == limit:
+                return
+            self._sem.bound = new_limit
+
+        log.info("Changed %s stage limit from %d to %d (last vm: %.2f "
+                 "seconds, target: %.2f seconds)",
+                 self.name, limit, new_limit, elapsed, self._target)
+
+
+class DriveLimiter(object):
+    """
+    Limit the number of drives prepared concurrently on the same storage
+    domain by all vms.
+    """
+
+    def __init__(self, per_domain):
+        self._per_domain = per_domain
+        self._lock = threading.Lock()
+        self._domains = {}
+
+    def get(self, sd_id):
+        with self._lock:
+            sem = self._domains.get(sd_id)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self._per_domain)
+                self._domains[sd_id] = sem
+            return sem
+
+
+_target = config.getint('vars', 'vm_start_stage_target')
+_min_concurrency = config.getint('vars', 'vm_start_stage_min_concurrency')
+
+PREPARE = Stage(
+    "prepare", max(1, config.getint('vars', 'vm_prepare_concurrency')),
+    _target, min_concurrency=_min_concurrency)
+
+CREATE = Stage(
+    "create", max(1, config.getint('vars', 'vm_create_concurrency')),
+    _target, min_concurrency=_min_concurrency)
+
+_drive_limiter = DriveLimiter(
+    max(1, config.getint('vars', 'drive_prepare_per_domain')))
+
+_drive_stats = Stats()
+
+
+def prepare_drives(drives, prepare, vm_log, limiter=None):
+    """
+    Call prepare(drive) for every drive in drives concurrently.
+
+    Drives of vdsm images are limited by their storage domain. If preparing
+    a drive failed, drives not started yet are skipped, and the error of
+    the first failed drive is raised when the drives in progress are done.
+    """
+    if not drives:
+        return
+
+    if limiter is None:
+        limiter = _drive_limiter
+
+    errors = [None] * len(drives)
+    func = functools.partial(_prepare_drive, prepare, limiter, errors)
+    start = monotonic_time()
+
+    if len(drives) == 1:
+        func((0, drives[0]))
+    else:
+        workers = min(len(drives), DRIVE_WORKERS)
+        for _ in concurrent.tmap(
+                func, enumerate(drives), max_workers=workers,
+                name="vm/drives"):
+            pass
+
+    elapsed = monotonic_time() - start
+    _drive_stats.record(elapsed)
+    vm_log.info("Prepared %d drives in %.2f seconds", len(drives), elapsed)
+
+    for error in errors:
+        if error is not None:
+            raise error
+
+
+def stats():
+    """
+    Return the stats of the stages and of drive preparation.
+    """
+    return {
+        PREPARE.name: PREPARE.stats(),
+        CREATE.name: CREATE.stats(),
+        "drives": _drive_stats.info(),
+    }
+
+
+def _prepare_drive(prepare, limiter, errors, item):
+    index, drive = item
+    sd_id = drive.get("domainID")
+    try:
+        if sd_id is None:
+            _prepare_unless_failed(prepare, errors, drive)
+        else:
+            with limiter.get(sd_id):
+                _prepare_unless_failed(prepare, errors, drive)
+    except Exception as e:
+        errors[index] = e
+
+
+def _prepare_unless_failed(prepare, errors, drive):
+    if any(e is not None for e in errors):
+        return
+    prepare(drive)
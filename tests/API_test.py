@@ -132,6 +132,52 @@ class TestVMCreate(TestCaseBase):
         self.assertEqual(expected_memory_conf, memory_conf)
 
 
+class TestGetCapabilities(TestCaseBase):
+
+    def setUp(self):
+        self.cif = FakeClientIF()
+        self.cif._netConfigDirty = False
+        self.hook_scripts = ()
+        with MonkeyPatchScope([(API, 'clientIF', self.cif)]):
+            self.api = API.Global()
+
+    def getCapabilities(self, ifChangedSince=None):
+        with MonkeyPatchScope([
+            (API.capscache, 'get', lambda: ('instance-1', {'caps': 1})),
+            (API.hooks, 'before_get_caps', lambda: None),
+            (API.hooks, 'after_get_caps', self.after_get_caps),
+            (API.hooks, 'has_scripts', lambda name: bool(self.hook_scripts)),
+        ]):
+            res = self.api.getCapabilities(ifChangedSince=ifChangedSince)
+        self.assertEqual(res['status']['code'], 0)
+        return res['info']
+
+    def after_get_caps(self, caps):
+        if self.hook_scripts:
+            caps['hook'] = True
+        return caps
+
+    def test_not_changed(self):
+        generation = self.getCapabilities()['generation']
+        info = self.getCapabilities(ifChangedSince=generation)
+        self.assertEqual(info, {'generation': generation})
+
+    def test_net_config_dirty_changed(self):
+        generation = self.getCapabilities()['generation']
+        self.cif._netConfigDirty = True
+        info = self.getCapabilities(ifChangedSince=generation)
+        self.assertNotEqual(info['generation'], generation)
+        self.assertEqual(info['netConfigDirty'], 'True')
+
+    def test_hooks_installed(self):
+        self.hook_scripts = ('hook',)
+        info = self.getCapabilities()
+        self.assertNotIn('generation', info)
+        # The report modified by the hooks is always returned.
+        info = self.getCapabilities(ifChangedSince='instance-1-0')
+        self.assertTrue(info['hook'])
+
+
 class FakeClientIF(object):
 
     def __init__(self):
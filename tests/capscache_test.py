@@ -0,0 +1,265 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import errno
+import os
+import socket
+import threading
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.host import capscache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCollector(object):
+
+    def __init__(self):
+        self.caps = {'nics': {'eth0': {}}}
+        self.calls = 0
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+        self.during_collect = None
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.proceed.wait()
+        if self.during_collect:
+            self.during_collect()
+        return dict(self.caps)
+
+
+@pytest.fixture
+def collector():
+    return FakeCollector()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(collector, clock):
+    return capscache.Cache(collector, max_age=300, clock=clock)
+
+
+def test_cached(cache, collector):
+    gen1, caps1 = cache.get()
+    gen2, caps2 = cache.get()
+    assert collector.calls == 1
+    assert gen1 == gen2
+    assert caps1 == caps2 == collector.caps
+
+
+def test_returns_copy(cache):
+    _, caps = cache.get()
+    caps['nics']['eth0']['modified'] = True
+    _, caps = cache.get()
+    assert caps['nics'] == {'eth0': {}}
+
+
+def test_invalidate_unchanged(cache, collector):
+    gen1, _ = cache.get()
+    cache.invalidate('test')
+    gen2, _ = cache.get()
+    assert collector.calls == 2
+    assert gen1 == gen2
+
+
+def test_invalidate_changed(cache, collector):
+    gen1, _ = cache.get()
+    collector.caps['nics'] = {'eth0': {}, 'eth1': {}}
+    cache.invalidate('test')
+    gen2, caps = cache.get()
+    assert gen1 != gen2
+    assert caps['nics'] == {'eth0': {}, 'eth1': {}}
+
+
+def test_expired(cache, collector, clock):
+    cache.get()
+    clock.now += 299
+    cache.get()
+    assert collector.calls == 1
+    clock.now += 1
+    cache.get()
+    assert collector.calls == 2
+
+
+def test_invalidate_while_collecting(cache, collector):
+    collector.during_collect = lambda: cache.invalidate('test')
+    cache.get()
+    collector.during_collect = None
+    cache.get()
+    assert collector.calls == 2
+    cache.get()
+    assert collector.calls == 2
+
+
+def test_disable(cache, collector):
+    cache.get()
+    cache.disable('test')
+    cache.get()
+    cache.get()
+    assert collector.calls == 3
+
+
+def test_generation_unique_per_instance(collector, clock):
+    gen1, _ = capscache.Cache(collector, 300, clock=clock).get()
+    gen2, _ = capscache.Cache(collector, 300, clock=clock).get()
+    assert gen1 != gen2
+
+
+def test_concurrent_requests_coalesced(cache, collector):
+    collector.proceed.clear()
+    results = []
+
+    def get():
+        results.append(cache.get())
+
+    threads = [concurrent.thread(get) for _ in range(4)]
+    for t in threads:
+        t.start()
+    collector.started.wait(1)
+    collector.proceed.set()
+    for t in threads:
+        t.join()
+
+    assert collector.calls == 1
+    assert len(results) == 4
+    assert len(set(gen for gen, _ in results)) == 1
+
+
+def test_parse_uevent():
+    data = (b'online@/devices/system/cpu/cpu3\0'
+            b'ACTION=online\0'
+            b'DEVPATH=/devices/system/cpu/cpu3\0'
+            b'SUBSYSTEM=cpu\0'
+            b'SEQNUM=4242\0')
+    assert capscache.parse_uevent(data) == {
+        'ACTION': 'online',
+        'DEVPATH': '/devices/system/cpu/cpu3',
+        'SUBSYSTEM': 'cpu',
+        'SEQNUM': '4242',
+    }
+
+
+def test_parse_uevent_invalid_utf8():
+    data = b'change@/devices/fake\0K\xffEY=V\xffALUE\0'
+    assert capscache.parse_uevent(data) == {
+        u'K\ufffdEY': u'V\ufffdALUE',
+    }
+
+
+@pytest.mark.parametrize('subsystem,invalidated', [
+    (b'cpu', True),
+    (b'memory', True),
+    (b'scsi_host', True),
+    (b'block', False),
+    (b'usb', False),
+])
+def test_uevent_invalidates(cache, collector, subsystem, invalidated):
+    cache.get()
+    monitor = capscache.UeventMonitor(cache)
+    monitor._handle(b'add@/devices/fake\0ACTION=add\0SUBSYSTEM=' +
+                    subsystem + b'\0')
+    cache.get()
+    assert collector.calls == (2 if invalidated else 1)
+
+
+class FakeCache(object):
+
+    def __init__(self):
+        self.invalidated = []
+        self.disabled = []
+        self.changed = threading.Event()
+
+    def invalidate(self, reason):
+        self.invalidated.append(reason)
+        self.changed.set()
+
+    def disable(self, reason):
+        self.disabled.append(reason)
+        self.changed.set()
+
+
+class OverflowingSocket(object):
+    """
+    Wrap a socket, failing the first recv with ENOBUFS, like a netlink socket
+    whose receive buffer overflowed.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._overflow = True
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv(self, bufsize):
+        data = self._sock.recv(bufsize)
+        if self._overflow:
+            self._overflow = False
+            raise socket.error(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+        return data
+
+    def close(self):
+        self._sock.close()
+
+
+def test_uevent_monitor_keeps_running():
+    cache = FakeCache()
+    monitor = capscache.UeventMonitor(cache)
+    reader, writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    monitor._sock = OverflowingSocket(reader)
+    monitor._pipe = os.pipe()
+    monitor._thread.start()
+    try:
+        for data in (b'overflow',
+                     b'add@/devices/bad\0K\xff=V\0SUBSYSTEM=cpu\0',
+                     b'online@/devices/system/cpu/cpu3\0ACTION=online\0'
+                     b'DEVPATH=/devices/system/cpu/cpu3\0SUBSYSTEM=cpu\0'):
+            cache.changed.clear()
+            writer.send(data)
+            assert cache.changed.wait(5)
+    finally:
+        monitor.stop()
+        writer.close()
+
+    assert cache.disabled == []
+    assert cache.invalidated == [
+        'uevent buffer overflow',
+        'uevent None None',
+        'uevent online /devices/system/cpu/cpu3',
+    ]
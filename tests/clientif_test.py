@@ -31,6 +31,7 @@ import xml.etree.ElementTree as etree
 
 from vdsm import clientIF
 from vdsm.common import libvirtconnection, response
+from vdsm.virt import events
 from vdsm.virt import recovery
 from vdsm.virt.vm import VolumeError
 
@@ -389,6 +390,68 @@ class FakeVm(object):
         return response.success()
 
 
+class EventVm(object):
+
+    def __init__(self, vm_id):
+        self.id = vm_id
+        self.events = []
+
+    def onReboot(self):
+        self.events.append("reboot")
+
+    def onRTCUpdate(self, utcoffset):
+        self.events.append(("rtc", utcoffset))
+
+
+class TestDispatchLibvirtEvents(TestCaseBase):
+
+    def setUp(self):
+        self.cif = FakeClientIF()
+        self.cif._unknown_vm_ids = set()
+        self.vm = EventVm('1')
+        self.cif.vmContainer['1'] = self.vm
+        self.dom = collections.namedtuple('Dom', 'UUIDString')(
+            UUIDString=lambda: '1')
+        self.dispatched = []
+        self.keys = []
+
+    def dispatch(self, vm_id, handler, key=None):
+        self.dispatched.append((vm_id, handler))
+        self.keys.append(key)
+
+    def test_dispatch_to_vm_queue(self):
+        with MonkeyPatchScope([(events, 'dispatch', self.dispatch)]):
+            self.cif.dispatchLibvirtEvents(
+                None, self.dom, libvirt.VIR_DOMAIN_EVENT_ID_REBOOT)
+            self.cif.dispatchLibvirtEvents(
+                None, self.dom, 3600, libvirt.VIR_DOMAIN_EVENT_ID_RTC_CHANGE)
+
+        # Nothing is handled until the dispatcher runs the handlers.
+        self.assertEqual(self.vm.events, [])
+        self.assertEqual([vm_id for vm_id, _ in self.dispatched], ['1', '1'])
+        for _, handler in self.dispatched:
+            handler()
+        self.assertEqual(self.vm.events, ["reboot", ("rtc", 3600)])
+        self.assertEqual(self.keys, [None, None])
+
+    def test_coalesce_io_errors(self):
+        with MonkeyPatchScope([(events, 'dispatch', self.dispatch)]):
+            self.cif.dispatchLibvirtEvents(
+                None, self.dom, "/path", "vda", 1, "eio",
+                libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON)
+        self.assertEqual(self.keys, [
+            (libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON,
+             "/path", "vda", 1, "eio")])
+
+    def test_dispatch_unknown_vm(self):
+        dom = collections.namedtuple('Dom', 'UUIDString')(
+            UUIDString=lambda: '2')
+        with MonkeyPatchScope([(events, 'dispatch', self.dispatch)]):
+            self.cif.dispatchLibvirtEvents(
+                None, dom, libvirt.VIR_DOMAIN_EVENT_ID_REBOOT)
+        self.assertEqual(self.dispatched, [])
+
+
 class TestExternalVMTracking(TestCaseBase):
 
     def setUp(self):
@@ -27,7 +27,9 @@ import os
 
 from vdsm.common import libvirtconnection
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import make_config
 from monkeypatch import MonkeyPatch
+from monkeypatch import MonkeyPatchScope
 
 
 class TerminationException(Exception):
@@ -76,6 +78,9 @@ class LibvirtMock(object):
             else:
                 return ''
 
+        def getHostname(self):
+            return libvirtconnection.stats()
+
         def close(self):
             pass
 
@@ -155,3 +160,84 @@ class testLibvirtconnection(TestCaseBase):
             LibvirtMock.virConnect.failGetLibVersion = True
             self.assertRaises(TerminationException,
                               connection.nodeDeviceLookupByName)
+
+
+@contextlib.contextmanager
+def pool_size(size):
+    cfg = make_config([('vars', 'libvirt_pool_size', str(size))])
+    with MonkeyPatchScope([(libvirtconnection, 'config', cfg)]):
+        yield
+
+
+class testConnectionPool(TestCaseBase):
+
+    def tearDown(self):
+        libvirtconnection._clear()
+
+    @MonkeyPatch(libvirtconnection, 'libvirt', LibvirtMock())
+    @MonkeyPatch(libvirtconnection, 'libvirt_password', lambda: '/dev/null')
+    def test_disabled(self):
+        with pool_size(0):
+            for affinity in libvirtconnection.AFFINITIES:
+                self.assertIsNone(libvirtconnection.pooled(affinity))
+
+    @MonkeyPatch(libvirtconnection, 'libvirt', LibvirtMock())
+    @MonkeyPatch(libvirtconnection, 'libvirt_password', lambda: '/dev/null')
+    def test_invalid_affinity(self):
+        with pool_size(2):
+            with self.assertRaises(ValueError):
+                libvirtconnection.pooled("invalid")
+
+    @MonkeyPatch(libvirtconnection, 'libvirt', LibvirtMock())
+    @MonkeyPatch(libvirtconnection, 'libvirt_password', lambda: '/dev/null')
+    def test_affinity(self):
+        with pool_size(2):
+            shared = libvirtconnection.get()
+            monitoring = libvirtconnection.pooled(libvirtconnection.MONITORING)
+            control = libvirtconnection.pooled(libvirtconnection.CONTROL)
+            self.assertIsNot(monitoring, shared)
+            self.assertIsNot(control, shared)
+            self.assertIsNot(monitoring, control)
+
+            # Idle connections are reused.
+            self.assertIs(
+                libvirtconnection.pooled(libvirtconnection.MONITORING),
+                monitoring)
+
+    @MonkeyPatch(libvirtconnection, 'libvirt', LibvirtMock())
+    @MonkeyPatch(libvirtconnection, 'libvirt_password', lambda: '/dev/null')
+    def test_open_when_busy(self):
+        with pool_size(2):
+            first = libvirtconnection.pooled(libvirtconnection.MONITORING)
+            # Simulate a blocked call on the first connection.
+            first.stats.started()
+            second = libvirtconnection.pooled(libvirtconnection.MONITORING)
+            self.assertIsNot(second, first)
+
+            # When all connections are busy, the least busy is used.
+            second.stats.started()
+            first.stats.started()
+            self.assertIs(
+                libvirtconnection.pooled(libvirtconnection.MONITORING),
+                second)
+            self.assertEqual(
+                sorted(libvirtconnection.stats()),
+                ["monitoring/0", "monitoring/1"])
+
+    @MonkeyPatch(libvirtconnection, 'libvirt', LibvirtMock())
+    @MonkeyPatch(libvirtconnection, 'libvirt_password', lambda: '/dev/null')
+    def test_stats(self):
+        with pool_size(1):
+            shared = libvirtconnection.get()
+            conn = libvirtconnection.pooled(libvirtconnection.CONTROL)
+
+            # getHostname() returns the stats during the call.
+            during = conn.getHostname()
+            self.assertEqual(during["control/0"], {"in_flight": 1, "calls": 1})
+            self.assertEqual(during["default"], {"in_flight": 0, "calls": 0})
+
+            shared.getLibVersion()
+            self.assertEqual(libvirtconnection.stats(), {
+                "default": {"in_flight": 0, "calls": 1},
+                "control/0": {"in_flight": 0, "calls": 1},
+            })
@@ -0,0 +1,330 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from multiprocessing.managers import BaseManager
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.common import svdsmrpc
+
+
+class Unpicklable(object):
+
+    def __reduce__(self):
+        raise TypeError("Cannot pickle me")
+
+
+class Service(object):
+
+    def __init__(self):
+        self.barrier = None
+        self.event = threading.Event()
+
+    def echo(self, *args, **kwargs):
+        return args, kwargs
+
+    def fail(self, msg):
+        raise ValueError(msg)
+
+    def unpicklable(self):
+        return Unpicklable()
+
+    def big(self, size):
+        return b"x" * size
+
+    def rendezvous(self):
+        self.barrier.wait(timeout=5)
+
+    def block(self):
+        self.event.wait(5)
+
+    def _private(self):
+        return "secret"
+
+
+@pytest.fixture
+def address():
+    # Unix socket path is limited to 108 bytes, pytest tmpdir can be too long.
+    tmpdir = tempfile.mkdtemp(prefix="svdsmrpc-")
+    try:
+        yield os.path.join(tmpdir, "sock")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.fixture
+def service():
+    return Service()
+
+
+@pytest.fixture
+def server(address, service):
+    server = svdsmrpc.Server(address, service)
+    server.start()
+    try:
+        yield server
+    finally:
+        service.event.set()
+        server.stop()
+
+
+@pytest.fixture
+def client(address, server):
+    client = svdsmrpc.Client(address, max_connections=4, wait_timeout=10)
+    client.connect()
+    try:
+        yield client
+    finally:
+        client.close()
+
+
+def test_call(client):
+    assert client.call("echo", 1, "two", three=[3]) == (
+        (1, "two"), {"three": [3]})
+
+
+def test_exception(client):
+    with pytest.raises(ValueError) as e:
+        client.call("fail", "error message")
+    assert str(e.value) == "error message"
+
+    # Connection is still usable.
+    assert client.call("echo") == ((), {})
+
+
+def test_no_such_method(client):
+    with pytest.raises(AttributeError):
+        client.call("no_such_method")
+
+
+def test_private_method(client):
+    with pytest.raises(AttributeError):
+        client.call("_private")
+
+
+def test_unpicklable_result(client):
+    with pytest.raises(svdsmrpc.RemoteError):
+        client.call("unpicklable")
+    assert client.call("echo") == ((), {})
+
+
+def test_unpicklable_argument(client):
+    with pytest.raises(TypeError):
+        client.call("echo", Unpicklable())
+    assert client.stats()["methods"] == {}
+
+
+def test_big_result(client):
+    size = 8 * 1024**2
+    assert client.call("big", size) == b"x" * size
+
+
+def test_connect_no_server(address):
+    client = svdsmrpc.Client(address)
+    with pytest.raises(EnvironmentError):
+        client.connect()
+
+
+def test_invalid_max_connections(address):
+    with pytest.raises(ValueError):
+        svdsmrpc.Client(address, max_connections=0)
+
+
+def test_server_restart(address, service):
+    server = svdsmrpc.Server(address, service)
+    server.start()
+    client = svdsmrpc.Client(address)
+    client.connect()
+    client.call("echo")
+    server.stop()
+
+    with pytest.raises(svdsmrpc.Error):
+        client.call("echo")
+
+    # The broken connection was discarded.
+    assert client.stats()["connections"] == 0
+
+    os.unlink(address)
+    server = svdsmrpc.Server(address, service)
+    server.start()
+    try:
+        assert client.call("echo", 1) == ((1,), {})
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_concurrent_calls(client, service):
+    # All calls must be in flight at the same time to pass the barrier.
+    service.barrier = threading.Barrier(4)
+    errors = []
+
+    def call():
+        try:
+            client.call("rendezvous")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [concurrent.thread(call) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    stats = client.stats()
+    assert stats["connections"] == 4
+    assert stats["methods"]["rendezvous"]["max_in_flight"] == 4
+
+
+def test_max_connections(client, service):
+    threads = [concurrent.thread(client.call, args=("block",))
+               for _ in range(6)]
+    for t in threads:
+        t.start()
+
+    deadline = time.monotonic() + 5
+    while client.stats()["waits"] < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    stats = client.stats()
+    assert stats["connections"] == 4
+    assert stats["methods"]["block"]["in_flight"] == 6
+
+    service.event.set()
+    for t in threads:
+        t.join()
+
+    stats = client.stats()
+    assert stats["connections"] == 4
+    assert stats["idle"] == 4
+    assert stats["methods"]["block"]["calls"] == 6
+    assert stats["methods"]["block"]["in_flight"] == 0
+    assert stats["methods"]["block"]["max_in_flight"] == 6
+
+
+def test_overflow(address, server, service):
+    client = svdsmrpc.Client(address, max_connections=1, wait_timeout=0.1)
+    try:
+        blocked = concurrent.thread(client.call, args=("block",))
+        blocked.start()
+        deadline = time.monotonic() + 5
+        while client.stats()["connections"] < 1:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        # A blocked call does not block other calls.
+        assert client.call("echo", 1) == ((1,), {})
+        stats = client.stats()
+        assert stats["overflows"] == 1
+        # The overflow connection was closed.
+        assert stats["connections"] == 1
+        assert stats["idle"] == 0
+
+        service.event.set()
+        blocked.join()
+        assert client.stats()["idle"] == 1
+    finally:
+        client.close()
+
+
+def test_stats(client):
+    client.call("echo")
+    client.call("echo")
+    with pytest.raises(ValueError):
+        client.call("fail", "error")
+
+    methods = client.stats()["methods"]
+    assert methods["echo"]["calls"] == 2
+    assert methods["echo"]["errors"] == 0
+    assert methods["echo"]["in_flight"] == 0
+    assert methods["echo"]["max_time"] <= methods["echo"]["total_time"]
+    assert methods["fail"]["calls"] == 1
+    assert methods["fail"]["errors"] == 1
+
+
+class _ServerManager(BaseManager):
+    pass
+
+
+class _ClientManager(BaseManager):
+    pass
+
+
+def run_calls(call, threads, calls):
+    per_thread = calls // threads
+
+    def worker():
+        for i in range(per_thread):
+            call(i)
+
+    workers = [concurrent.thread(worker) for _ in range(threads)]
+    start = time.monotonic()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.monotonic() - start
+
+
+@pytest.mark.slow
+def test_benchmark(address, service, server):
+    threads = 16
+    calls = 10000
+
+    client = svdsmrpc.Client(address, max_connections=threads)
+    client.connect()
+    try:
+        rpc_time = run_calls(
+            lambda i: client.call("echo", i), threads, calls)
+    finally:
+        client.close()
+
+    # The previous transport, for comparison.
+    manager_address = address + ".manager"
+    _ServerManager.register("instance", callable=lambda: service)
+    manager = _ServerManager(address=manager_address, authkey=b"")
+    manager_server = manager.get_server()
+    server_thread = concurrent.thread(manager_server.serve_forever)
+    server_thread.start()
+    try:
+        _ClientManager.register("instance")
+        manager = _ClientManager(address=manager_address, authkey=b"")
+        manager.connect()
+        proxy = manager.instance()
+        manager_time = run_calls(lambda i: proxy.echo(i), threads, calls)
+    finally:
+        manager_server.stop_event.set()
+        manager_server.listener.close()
+
+    print("%d calls from %d threads: svdsmrpc=%.3fs manager=%.3fs" % (
+        calls, threads, rpc_time, manager_time))
+    assert client.stats()["methods"]["echo"]["calls"] == calls
@@ -22,6 +22,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
 import logging
 import threading
 import time
@@ -330,6 +331,200 @@ class ExecutorTaskTests(TestCaseBase):
         self.assertTrue(msg.startswith('<Task discardable'))
 
 
+class TaskQueueTests(TestCaseBase):
+
+    def setUp(self):
+        self.queue = executor.TaskQueue("test", 4, max_tasks_per_key=2,
+                                        max_running_per_key=1)
+
+    def task(self, priority=executor.PRIORITY_NORMAL, keys=()):
+        return executor.Task(lambda: None, None, priority=priority,
+                             keys=keys)
+
+    def test_priority(self):
+        low = self.task(executor.PRIORITY_LOW)
+        normal1 = self.task()
+        high = self.task(executor.PRIORITY_HIGH)
+        normal2 = self.task()
+        for task in (low, normal1, high, normal2):
+            self.queue.put(task)
+        got = [self.queue.get() for _ in range(4)]
+        self.assertEqual(got, [high, normal1, normal2, low])
+
+    def test_full(self):
+        for _ in range(4):
+            self.queue.put(self.task())
+        with self.assertRaises(exception.ResourceExhausted):
+            self.queue.put(self.task(executor.PRIORITY_HIGH))
+
+    def test_force(self):
+        for _ in range(4):
+            self.queue.put(self.task())
+        stop = object()
+        self.queue.put(stop, force=True)
+        self.assertIs(self.queue.get(), stop)
+
+    def test_key_limit(self):
+        self.queue.put(self.task(keys=["sd-1"]))
+        self.queue.put(self.task(keys=["sd-1", "sd-2"]))
+        with self.assertRaises(exception.ResourceExhausted):
+            self.queue.put(self.task(keys=["sd-1"]))
+        with self.assertRaises(exception.ResourceExhausted):
+            self.queue.put(self.task(keys=["sd-2", "sd-1"]))
+        # Other keys are not affected.
+        self.queue.put(self.task(keys=["sd-2"]))
+        self.assertEqual(self.queue.stats()["keys"], {"sd-1": 2, "sd-2": 2})
+
+    def test_key_released_when_done(self):
+        self.queue.put(self.task(keys=["sd-1"]))
+        self.queue.put(self.task(keys=["sd-1"]))
+        task = self.queue.get()
+        # Running task still counts.
+        with self.assertRaises(exception.ResourceExhausted):
+            self.queue.put(self.task(keys=["sd-1"]))
+        self.queue.task_done(task)
+        self.queue.put(self.task(keys=["sd-1"]))
+
+    def test_running_limit(self):
+        sd1 = self.task(keys=["sd-1"])
+        sd1_sd2 = self.task(keys=["sd-1", "sd-2"])
+        sd2 = self.task(keys=["sd-2"])
+        for task in (sd1, sd1_sd2, sd2):
+            self.queue.put(task)
+        # sd-1 has a running task, so the next runnable task is sd2.
+        self.assertIs(self.queue.get(), sd1)
+        self.assertIs(self.queue.get(), sd2)
+        self.assertEqual(self.queue.stats()["running"], {"sd-1": 1, "sd-2": 1})
+        self.queue.task_done(sd1)
+        self.queue.task_done(sd2)
+        self.assertIs(self.queue.get(), sd1_sd2)
+
+    def test_running_limit_wakeup(self):
+        sd1 = self.task(keys=["sd-1"])
+        waiting = self.task(keys=["sd-1"])
+        self.queue.put(sd1)
+        self.queue.put(waiting)
+        self.assertIs(self.queue.get(), sd1)
+        got = []
+        t = concurrent.thread(lambda: got.append(self.queue.get()))
+        t.start()
+        try:
+            time.sleep(0.05)
+            self.assertEqual(got, [])
+        finally:
+            self.queue.task_done(sd1)
+            t.join()
+        self.assertEqual(got, [waiting])
+
+    def test_clear_releases_keys(self):
+        self.queue.put(self.task(keys=["sd-1"]))
+        self.queue.put(self.task(keys=["sd-1"]))
+        self.queue.clear()
+        self.assertEqual(self.queue.stats()["keys"], {})
+        self.queue.put(self.task(keys=["sd-1"]))
+
+    def test_stats(self):
+        self.queue.put(self.task(executor.PRIORITY_HIGH))
+        self.queue.put(self.task(executor.PRIORITY_LOW, keys=["sd-1"]))
+        self.assertEqual(self.queue.stats(), {
+            "queued": {
+                executor.PRIORITY_HIGH: 1,
+                executor.PRIORITY_NORMAL: 0,
+                executor.PRIORITY_LOW: 1,
+            },
+            "keys": {"sd-1": 1},
+            "running": {},
+        })
+
+
+class ExecutorPriorityTests(TestCaseBase):
+
+    def setUp(self):
+        self.scheduler = schedule.Scheduler()
+        self.scheduler.start()
+        self.executor = executor.Executor('test',
+                                          workers_count=2,
+                                          max_tasks=100,
+                                          scheduler=self.scheduler,
+                                          max_workers=4,
+                                          max_tasks_per_key=4,
+                                          max_running_per_key=2)
+        self.executor.start()
+
+    def tearDown(self):
+        self.executor.stop(wait=False)
+        self.scheduler.stop()
+
+    def test_wait_stats(self):
+        tasks = [Task() for _ in range(3)]
+        for task in tasks:
+            self.executor.dispatch(task)
+        for task in tasks:
+            self.assertTrue(task.executed.wait(1))
+        self.executor.dispatch(noop)
+        wait = self.executor.stats()["wait"]
+        self.assertEqual(wait["Task"]["count"], 3)
+        self.assertEqual(sum(wait["Task"]["buckets"]), 3)
+
+    def test_priority(self):
+        # Block both workers, so next tasks are queued.
+        blocked = threading.Event()
+        blockers = [Task(event=blocked) for _ in range(2)]
+        for task in blockers:
+            self.executor.dispatch(task)
+        for task in blockers:
+            self.assertTrue(task.started.wait(1))
+
+        order = []
+        for name, priority in [("low", executor.PRIORITY_LOW),
+                               ("normal", executor.PRIORITY_NORMAL),
+                               ("high", executor.PRIORITY_HIGH)]:
+            self.executor.dispatch(functools.partial(order.append, name),
+                                   priority=priority)
+        blocked.set()
+
+        deadline = time.monotonic() + 1
+        while len(order) < 3:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        # Both workers start together, so the first two may finish in any
+        # order, but the low priority task must be last.
+        self.assertEqual(order[-1], "low")
+
+    @slowtest
+    def test_blocked_storage(self):
+        # Tasks accessing a blocked storage domain are discarded, but cannot
+        # fill the queue or block all the workers, delaying tasks accessing
+        # other domains.
+        blocked = threading.Event()
+        rejected = 0
+        try:
+            for _ in range(20):
+                try:
+                    self.executor.dispatch(Task(event=blocked), timeout=0.1,
+                                           keys=["blocked-sd"])
+                except exception.ResourceExhausted:
+                    rejected += 1
+            self.assertEqual(rejected, 16)
+
+            # Wait until the blocked tasks discarded the initial workers.
+            time.sleep(0.3)
+
+            tasks = [Task() for _ in range(10)]
+            for i, task in enumerate(tasks):
+                self.executor.dispatch(task, timeout=1,
+                                       keys=["good-sd-%d" % (i % 3)],
+                                       priority=executor.PRIORITY_HIGH)
+            for task in tasks:
+                self.assertTrue(task.executed.wait(1))
+        finally:
+            blocked.set()
+
+
+def noop():
+    pass
+
+
 class Task(object):
 
     def __init__(self, wait=None, error=None, event=None, start_barrier=None):
@@ -0,0 +1,254 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301  USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+import time
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.gluster import cache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Command(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.error = None
+        self.started = threading.Event()
+        self.release = None
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return "result-%d" % self.calls
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cmd():
+    return Command()
+
+
+def test_cached(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    assert c.get("key", cmd) == ("result-1", 0.0)
+    clock.now += 10
+    assert c.get("key", cmd) == ("result-1", 10.0)
+    assert cmd.calls == 1
+    stats = c.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_expired(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    c.get("key", cmd)
+    clock.now += 30
+    assert c.get("key", cmd) == ("result-2", 0.0)
+
+
+def test_force(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    c.get("key", cmd)
+    assert c.get("key", cmd, force=True) == ("result-2", 0.0)
+
+
+def test_disabled(clock, cmd):
+    c = cache.Cache(interval=0, max_age=0, clock=clock)
+    c.get("key", cmd)
+    c.get("key", cmd)
+    assert cmd.calls == 2
+
+
+def test_keys(clock):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    assert c.get("a", lambda: "a") == ("a", 0.0)
+    assert c.get("b", lambda: "b") == ("b", 0.0)
+    assert c.get("a", lambda: "x") == ("a", 0.0)
+
+
+def test_clear(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    c.get("key", cmd)
+    c.clear()
+    assert c.get("key", cmd) == ("result-2", 0.0)
+
+
+def test_error_not_cached(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    cmd.error = RuntimeError("gluster failed")
+    with pytest.raises(RuntimeError):
+        c.get("key", cmd)
+    cmd.error = None
+    assert c.get("key", cmd) == ("result-2", 0.0)
+    assert c.stats()["errors"] == 1
+
+
+def test_coalesce(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    cmd.release = threading.Event()
+    results = []
+
+    def get():
+        results.append(c.get("key", cmd))
+
+    threads = [concurrent.thread(get) for _ in range(4)]
+    threads[0].start()
+    cmd.started.wait(5)
+    for t in threads[1:]:
+        t.start()
+
+    deadline = time.monotonic() + 5
+    while c.stats()["coalesced"] < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    cmd.release.set()
+    for t in threads:
+        t.join()
+
+    assert cmd.calls == 1
+    assert results == [("result-1", 0.0)] * 4
+
+
+def test_coalesce_error(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, clock=clock)
+    cmd.release = threading.Event()
+    cmd.error = RuntimeError("gluster failed")
+    errors = []
+
+    def get():
+        try:
+            c.get("key", cmd)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [concurrent.thread(get) for _ in range(2)]
+    threads[0].start()
+    cmd.started.wait(5)
+    threads[1].start()
+
+    deadline = time.monotonic() + 5
+    while c.stats()["coalesced"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    cmd.release.set()
+    for t in threads:
+        t.join()
+
+    assert cmd.calls == 1
+    assert len(errors) == 2
+
+
+def test_refresh(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, expire=60, clock=clock)
+    c.get("key", cmd)
+    clock.now += 20
+    c.refresh()
+    assert cmd.calls == 2
+    clock.now += 20
+    assert c.get("key", cmd) == ("result-2", 20.0)
+
+
+def test_refresh_drops_unused(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, expire=60, clock=clock)
+    c.get("key", cmd)
+    clock.now += 61
+    c.refresh()
+    assert cmd.calls == 1
+    assert c.stats()["entries"] == 0
+
+
+def test_refresh_error_keeps_result(clock, cmd):
+    c = cache.Cache(interval=0, max_age=30, expire=60, clock=clock)
+    c.get("key", cmd)
+    clock.now += 10
+    cmd.error = RuntimeError("gluster failed")
+    c.refresh()
+    assert c.get("key", cmd) == ("result-1", 10.0)
+
+
+def test_stop_during_refresh(clock):
+    c = cache.Cache(interval=0, max_age=30, expire=60, clock=clock)
+    cmd_a = Command()
+    cmd_b = Command()
+    c.get("a", cmd_a)
+    c.get("b", cmd_b)
+    cmd_a.started.clear()
+    cmd_a.release = threading.Event()
+
+    refresh = concurrent.thread(c.refresh)
+    refresh.start()
+    cmd_a.started.wait(5)
+
+    # Waits for the refresh of "b", which will never run.
+    results = []
+    getter = concurrent.thread(
+        lambda: results.append(c.get("b", cmd_b, force=True)))
+    getter.start()
+    deadline = time.monotonic() + 5
+    while c.stats()["coalesced"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    c.stop()
+    cmd_a.release.set()
+    refresh.join()
+    getter.join(5)
+
+    assert not getter.is_alive()
+    assert results == [("result-2", 0.0)]
+    assert cmd_b.calls == 2
+
+
+def test_background_refresh(cmd):
+    c = cache.Cache(interval=0.05, max_age=30)
+    try:
+        c.get("key", cmd)
+        deadline = time.monotonic() + 5
+        while c.stats()["refreshes"] < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        c.stop()
+    value, age = c.get("key", cmd)
+    assert value != "result-1"
@@ -21,12 +21,21 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import io
 import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as etree
+
 import pytest
 
 from vdsm.gluster import cli
 from vdsm.gluster import exception as ge
 
+FAKE_GLUSTER_CLI = os.path.join(
+    os.path.dirname(__file__), "..", "fake-gluster-cli")
+
 
 def test_exec_gluster_empty_cmd():
     with pytest.raises(ge.GlusterCmdFailedException):
@@ -51,3 +60,164 @@ def test_getTree(relative_filepath, expected):
 def test_get_tree_empty_input():
     with pytest.raises(ge.GlusterXmlErrorException):
         cli._getTree("")
+
+
+def test_exec_gluster_xml_stream():
+    volumes = cli._execGlusterXmlStream(
+        [sys.executable, FAKE_GLUSTER_CLI],
+        lambda source: [el.text for path, el in cli._iterElements(
+            source, ('volStatus/volumes/volume/volName',))])
+    assert volumes == ['vol-2']
+
+
+def test_exec_gluster_xml_stream_cmd_failed():
+    with pytest.raises(ge.GlusterCmdFailedException) as e:
+        cli._execGlusterXmlStream(
+            [sys.executable, "-c",
+             "import sys; sys.stderr.write('line 1\\nline 2\\n'); "
+             "sys.exit(2)"],
+            lambda source: list(cli._iterElements(source, ())))
+    assert e.value.rc == 2
+    assert e.value.err == ["line 1", "line 2"]
+
+
+def test_iter_elements():
+    xml = b"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput>
+  <opRet>0</opRet>
+  <opErrno>0</opErrno>
+  <opErrstr/>
+  <volProfile>
+    <volname>vol</volname>
+    <brick><brickName>a</brickName></brick>
+    <brick><brickName>b</brickName></brick>
+  </volProfile>
+</cliOutput>"""
+    result = []
+    for path, el in cli._iterElements(
+            io.BytesIO(xml), ('volProfile/volname', 'volProfile/brick')):
+        if path == 'volProfile/volname':
+            result.append(el.text)
+        else:
+            result.append(el.find('brickName').text)
+    assert result == ['vol', 'a', 'b']
+
+
+def test_iter_elements_op_failed():
+    xml = b"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput>
+  <opRet>-1</opRet>
+  <opErrno>30800</opErrno>
+  <opErrstr>Volume vol does not exist</opErrstr>
+</cliOutput>"""
+    with pytest.raises(ge.GlusterCmdFailedException) as e:
+        list(cli._iterElements(io.BytesIO(xml), ()))
+    assert e.value.rc == 30800
+    assert e.value.err == ['Volume vol does not exist']
+
+
+@pytest.mark.parametrize("xml", [
+    b"",
+    b"<cliOutput><opRet>0</opRet>",
+    b"<cliOutput><volProfile/></cliOutput>",
+])
+def test_iter_elements_invalid_xml(xml):
+    with pytest.raises(ge.GlusterXmlErrorException):
+        list(cli._iterElements(io.BytesIO(xml), ()))
+
+
+BRICK_PROFILE = """
+    <brick>
+      <brickName>host-{0}:/bricks/brick-{0}</brickName>
+      <cumulativeStats>
+        <blockStats>{1}</blockStats>
+        <fopStats>{2}</fopStats>
+        <duration>3600</duration>
+        <totalRead>1073741824</totalRead>
+        <totalWrite>1073741824</totalWrite>
+      </cumulativeStats>
+      <intervalStats>
+        <blockStats>{1}</blockStats>
+        <fopStats>{2}</fopStats>
+        <duration>60</duration>
+        <totalRead>1048576</totalRead>
+        <totalWrite>1048576</totalWrite>
+      </intervalStats>
+    </brick>"""
+
+BLOCK = """
+          <block>
+            <size>{0}</size>
+            <reads>100</reads>
+            <writes>200</writes>
+          </block>"""
+
+FOP = """
+          <fop>
+            <name>FOP-{0}</name>
+            <hits>1000</hits>
+            <avgLatency>100.0</avgLatency>
+            <minLatency>10.0</minLatency>
+            <maxLatency>1000.0</maxLatency>
+          </fop>"""
+
+
+def profile_info_xml(bricks):
+    blocks = "".join(BLOCK.format(2**i) for i in range(18))
+    fops = "".join(FOP.format(i) for i in range(40))
+    return ("""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput>
+  <opRet>0</opRet>
+  <opErrno>0</opErrno>
+  <opErrstr/>
+  <volProfile>
+    <volname>vol</volname>
+    <profileOp>3</profileOp>
+    <brickCount>{0}</brickCount>{1}
+  </volProfile>
+</cliOutput>""".format(
+        bricks,
+        "".join(BRICK_PROFILE.format(i, blocks, fops)
+                for i in range(bricks)))).encode("utf-8")
+
+
+def measure(func):
+    """
+    Return func() result, run time, and peak memory usage. Memory is
+    measured in a second run, since tracing memory slows down func().
+    """
+    start = time.monotonic()
+    result = func()
+    elapsed = time.monotonic() - start
+    del result
+
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+@pytest.mark.slow
+def test_profile_info_benchmark():
+    bricks = 1000
+    xml = profile_info_xml(bricks)
+
+    # Parsing the entire output before walking the tree, as done before
+    # parsing the output incrementally.
+    tree, tree_time, tree_peak = measure(lambda: etree.fromstring(xml))
+    del tree
+
+    status, stream_time, stream_peak = measure(
+        lambda: cli._parseVolumeProfileInfo(io.BytesIO(xml), False))
+
+    print("profile info with %d bricks (%.1f MiB): tree=%.3fs %.1f MiB, "
+          "stream=%.3fs %.1f MiB" % (
+              bricks, len(xml) / 1024**2,
+              tree_time, tree_peak / 1024**2,
+              stream_time, stream_peak / 1024**2))
+
+    assert len(status['bricks']) == bricks
+    assert len(status['bricks'][0]['cumulativeStats']['fopStats']) == 40
@@ -21,6 +21,7 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import io
 import sys
 import six
 
@@ -379,7 +380,6 @@ class GlusterCliTests(TestCaseBase):
     </volumes>
   </volStatus>
 </cliOutput>"""
-        tree = etree.fromstring(out)
         oStatus = \
             {'bricks': [{'blockSize': '4096',
                          'brick': '192.168.122.2:/tmp/music-b1',
@@ -400,7 +400,8 @@ class GlusterCliTests(TestCaseBase):
                          'sizeFree': '4271.328',
                          'sizeTotal': '7982.934'}],
              'name': 'music'}
-        status = gcli._parseVolumeStatusDetail(tree)
+        status = gcli._parseVolumeStatusDetail(
+            io.BytesIO(out.encode('utf-8')))
         self.assertEqual(status, oStatus)
 
     def _parseVolumeStatusClients_test(self):
@@ -1138,17 +1139,13 @@ class GlusterCliTests(TestCaseBase):
         self._parseVolumeStatusMem_test()
 
     def _parseVolumeProfileInfo_test(self):
-        with open("glusterVolumeProfileInfo.xml") as f:
-            out = f.read()
-        tree = etree.fromstring(out)
-        status = gcli._parseVolumeProfileInfo(tree, False)
+        with open("glusterVolumeProfileInfo.xml", "rb") as f:
+            status = gcli._parseVolumeProfileInfo(f, False)
         self.assertEqual(status, glusterTestData.PROFILE_INFO)
 
     def _parseVolumeProfileInfoNfs_test(self):
-        with open("glusterVolumeProfileInfoNfs.xml") as f:
-            out = f.read()
-        tree = etree.fromstring(out)
-        status = gcli._parseVolumeProfileInfo(tree, True)
+        with open("glusterVolumeProfileInfoNfs.xml", "rb") as f:
+            status = gcli._parseVolumeProfileInfo(f, True)
         self.assertEqual(status, glusterTestData.PROFILE_INFO_NFS)
 
     def test_parseVolumeProfileInfo(self):
@@ -1180,11 +1177,18 @@ class GlusterCliTests(TestCaseBase):
         self.assertEqual(status, glusterTestData.GLUSTER_VOLUME_TASKS)
 
     def test_parseGeoRepStatus(self):
-        with open("glusterGeoRepStatus.xml") as f:
-            out = f.read()
-        tree = etree.fromstring(out)
         gcli._TIME_ZONE = 'IST'
-        status = gcli._parseGeoRepStatus(tree)
+        with open("glusterGeoRepStatus.xml", "rb") as f:
+            status = gcli._parseGeoRepStatus(f)
+        self.assertEqual(status, glusterTestData.GLUSTER_GEOREP_STATUS)
+
+    def test_parseGeoRepStatus_name_after_sessions(self):
+        gcli._TIME_ZONE = 'IST'
+        with open("glusterGeoRepStatus.xml", "rb") as f:
+            out = f.read()
+        out = out.replace(b"<name>vol1</name>", b"")
+        out = out.replace(b"</sessions>", b"</sessions><name>vol1</name>")
+        status = gcli._parseGeoRepStatus(io.BytesIO(out))
         self.assertEqual(status, glusterTestData.GLUSTER_GEOREP_STATUS)
 
     def test_parseVolumeGeoRepConfig(self):
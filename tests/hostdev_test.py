@@ -21,6 +21,9 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import time
+
+import pytest
 import six
 
 from vdsm.common import exception
@@ -37,6 +40,7 @@ from vdsm.common import hostdev
 from vdsm.common import libvirtconnection
 
 import hostdevlib
+import vmfakecon
 
 
 @expandPermutations
@@ -272,3 +276,236 @@ class TestMdev(TestCaseBase):
                 exception.ResourceUnavailable,
                 hostdev.spawn_mdev, 'unsupported', '1234', placement, self.log
             )
+
+
+_VF_XML = """<device>
+  <name>{name}</name>
+  <path>/sys/devices/pci0000:00/0000:00:03.0/0000:{bus:02x}:{slot:02x}.{function:x}</path>
+  <parent>pci_0000_00_03_0</parent>
+  <driver>
+    <name>{driver}</name>
+  </driver>
+  <capability type='pci'>
+    <domain>0</domain>
+    <bus>{bus}</bus>
+    <slot>{slot}</slot>
+    <function>{function}</function>
+    <product id='0x10ca'>82576 Virtual Function</product>
+    <vendor id='0x8086'>Intel Corporation</vendor>
+    <capability type='phys_function'>
+      <address domain='0x0000' bus='0x05' slot='0x00' function='0x1'/>
+    </capability>
+    <iommuGroup number='{index}'>
+      <address domain='0x0000' bus='0x{bus:02x}' slot='0x{slot:02x}' function='0x{function:x}'/>
+    </iommuGroup>
+    <numa node='0'/>
+  </capability>
+</device>
+"""  # NOQA: E501 (long line)
+
+_PF_NAME = 'pci_0000_00_03_0'
+
+_PF_XML = """<device>
+  <name>pci_0000_00_03_0</name>
+  <path>/sys/devices/pci0000:00/0000:00:03.0</path>
+  <parent>computer</parent>
+  <capability type='pci'>
+    <domain>0</domain>
+    <bus>0</bus>
+    <slot>3</slot>
+    <function>0</function>
+    <product id='0x10c9'>82576 Gigabit Network Connection</product>
+    <vendor id='0x8086'>Intel Corporation</vendor>
+    <capability type='virt_functions' maxCount='{count}'/>
+  </capability>
+</device>
+"""
+
+
+def _vf_name(index):
+    bus, rest = divmod(index, 256)
+    slot, function = divmod(rest, 8)
+    return 'pci_0000_{:02x}_{:02x}_{:x}'.format(bus + 16, slot, function)
+
+
+def _vf_xml(index, driver='igbvf'):
+    bus, rest = divmod(index, 256)
+    slot, function = divmod(rest, 8)
+    return _VF_XML.format(name=_vf_name(index), bus=bus + 16, slot=slot,
+                          function=function, index=index, driver=driver)
+
+
+class FakeDeviceConnection(object):
+    """
+    Connection reporting a PF with many VFs, counting libvirt calls.
+    """
+
+    def __init__(self, count):
+        self.devices = {_PF_NAME: _PF_XML.format(count=count)}
+        for i in range(count):
+            self.devices[_vf_name(i)] = _vf_xml(i)
+        self.listed = 0
+        self.lookups = 0
+
+    def listAllDevices(self, flags=0):
+        self.listed += 1
+        return [vmfakecon.VirNodeDeviceStub(xml)
+                for xml in self.devices.values()]
+
+    def nodeDeviceLookupByName(self, name):
+        self.lookups += 1
+        return vmfakecon.VirNodeDeviceStub(self.devices.get(name))
+
+
+class ProcessingCounter(object):
+
+    def __init__(self, process):
+        self._process = process
+        self.calls = 0
+
+    def __call__(self, device_xml):
+        self.calls += 1
+        return self._process(device_xml)
+
+
+def _device_env(monkeypatch, count):
+    conn = FakeDeviceConnection(count)
+    counter = ProcessingCounter(hostdev._process_device_params)
+    monkeypatch.setattr(libvirtconnection, 'get', lambda: conn)
+    monkeypatch.setattr(hostdev, '_sriov_totalvfs', hostdevlib.fake_totalvfs)
+    monkeypatch.setattr(hostdev, '_pci_header_type', lambda _: 0)
+    monkeypatch.setattr(hostdev, '_process_device_params', counter)
+    monkeypatch.setattr(hostdev, '_device_cache', hostdev._DeviceCache())
+    return conn, counter
+
+
+@pytest.fixture
+def device_env(monkeypatch):
+    return _device_env(monkeypatch, 10)
+
+
+def test_cache_process_only_changed_devices(device_env):
+    conn, counter = device_env
+    devices, _ = hostdev._get_devices_from_libvirt()
+    assert len(devices) == 11
+    assert counter.calls == 11
+
+    hostdev._get_devices_from_libvirt()
+    assert counter.calls == 11
+
+    conn.devices[_vf_name(3)] = _vf_xml(3, driver='vfio-pci')
+    devices, _ = hostdev._get_devices_from_libvirt()
+    assert counter.calls == 12
+    assert devices[_vf_name(3)]['driver'] == 'vfio-pci'
+
+
+def test_cache_removed_device(device_env):
+    conn, counter = device_env
+    hostdev._get_devices_from_libvirt()
+    del conn.devices[_vf_name(3)]
+    devices, address_to_name = hostdev._get_devices_from_libvirt()
+    assert _vf_name(3) not in devices
+    assert _vf_name(3) not in address_to_name.values()
+    assert counter.calls == 11
+
+
+def test_cache_monitoring_skips_listing(device_env):
+    conn, counter = device_env
+    hostdev._device_cache.start_monitoring()
+    hostdev._get_devices_from_libvirt()
+    hostdev._get_devices_from_libvirt()
+    assert conn.listed == 1
+    assert conn.lookups == 0
+    assert counter.calls == 11
+
+
+def test_cache_monitoring_changed_device(device_env):
+    conn, counter = device_env
+    hostdev._device_cache.start_monitoring()
+    hostdev._get_devices_from_libvirt()
+
+    conn.devices[_vf_name(3)] = _vf_xml(3, driver='vfio-pci')
+    hostdev._device_update_event(conn, conn.nodeDeviceLookupByName(
+        _vf_name(3)), None)
+    conn.lookups = 0
+    devices, _ = hostdev._get_devices_from_libvirt()
+
+    assert devices[_vf_name(3)]['driver'] == 'vfio-pci'
+    assert conn.listed == 1
+    assert conn.lookups == 1
+    assert counter.calls == 12
+
+
+def test_cache_monitoring_added_device_updates_parent(device_env):
+    conn, counter = device_env
+    hostdev._device_cache.start_monitoring()
+    hostdev._get_devices_from_libvirt()
+
+    conn.devices[_vf_name(10)] = _vf_xml(10)
+    conn.devices[_PF_NAME] = _PF_XML.format(count=11)
+    hostdev._device_cache.device_changed(_vf_name(10))
+    devices, _ = hostdev._get_devices_from_libvirt()
+
+    assert _vf_name(10) in devices
+    assert conn.listed == 1
+    # The new VF and its PF.
+    assert counter.calls == 13
+
+
+def test_cache_monitoring_removed_device(device_env):
+    conn, counter = device_env
+    hostdev._device_cache.start_monitoring()
+    hostdev._get_devices_from_libvirt()
+
+    del conn.devices[_vf_name(3)]
+    hostdev._device_cache.device_changed(_vf_name(3))
+    devices, address_to_name = hostdev._get_devices_from_libvirt()
+
+    assert _vf_name(3) not in devices
+    assert _vf_name(3) not in address_to_name.values()
+    assert conn.listed == 1
+
+
+def test_cache_monitoring_started_after_sync(device_env):
+    conn, counter = device_env
+    hostdev._get_devices_from_libvirt()
+    hostdev._device_cache.start_monitoring()
+
+    # Events may have been missed before monitoring was started.
+    hostdev._get_devices_from_libvirt()
+    assert conn.listed == 2
+
+    hostdev._get_devices_from_libvirt()
+    assert conn.listed == 2
+
+
+def test_benchmark_2k_devices(monkeypatch):
+    conn, counter = _device_env(monkeypatch, 2000)
+
+    start = time.monotonic()
+    hostdev._get_devices_from_libvirt()
+    full = time.monotonic() - start
+    assert counter.calls == 2001
+
+    # Without events, every request lists and compares all devices.
+    start = time.monotonic()
+    hostdev._get_devices_from_libvirt()
+    listing = time.monotonic() - start
+    assert counter.calls == 2001
+
+    # With events, only changed devices are looked up.
+    hostdev._device_cache.start_monitoring()
+    hostdev._get_devices_from_libvirt()
+    conn.devices[_vf_name(42)] = _vf_xml(42, driver='vfio-pci')
+    hostdev._device_cache.device_changed(_vf_name(42))
+    start = time.monotonic()
+    hostdev._get_devices_from_libvirt()
+    incremental = time.monotonic() - start
+    assert counter.calls == 2002
+
+    start = time.monotonic()
+    hostdev._get_devices_from_libvirt()
+    cached = time.monotonic() - start
+
+    print("2000 devices: full=%.3fs listing=%.3fs incremental=%.3fs "
+          "cached=%.6fs" % (full, listing, incremental, cached))
@@ -30,7 +30,12 @@ from testlib import VdsmTestCase as TestCaseBase, namedTemporaryDir
 from testlib import permutations, expandPermutations
 from v2v_testlib import VM_SPECS, MockVirDomain, MockVirConnect, FakeVolume
 from vdsm import kvm2ovirt
+from vdsm.common import fileutils
+from vdsm.common.units import KiB, MiB
+import io
 import os
+import pytest
+import threading
 import uuid
 
 
@@ -112,6 +117,37 @@ class TestKvm2Ovirt(TestCaseBase):
                 actual = f.read()
             self.assertEqual(actual, FakeVolume().data())
 
+    def test_download_parallel(self):
+        conn = MockVirConnect(vms=self._vms)
+
+        def connect(uri, username, password):
+            return conn
+
+        with MonkeyPatchScope([
+            (libvirtconnection, 'open_connection', connect),
+        ]), make_env() as env:
+            dests = [env.destination + str(i) for i in range(3)]
+            for dest in dests:
+                open(dest, 'wb').close()
+            args = ['kvm2ovirt',
+                    '--uri', 'qemu+tcp://domain',
+                    '--username', 'user',
+                    '--password-file', env.password,
+                    '--source', '/fake/source1', '/fake/source2',
+                    '/fake/source3']
+            args += ['--dest'] + dests
+            args += ['--storage-type', 'volume', 'volume', 'volume',
+                     '--vm-name', self._vms[0].name(),
+                     '--allocation', 'preallocated',
+                     '--parallel', '2']
+
+            kvm2ovirt.main(args)
+
+            for dest in dests:
+                with open(dest, 'rb') as f:
+                    actual = f.read()
+                self.assertEqual(actual, FakeVolume().data())
+
     @permutations([
                   [None, None],
                   ['root', 'passwd'],
@@ -138,3 +174,180 @@ class TestKvm2Ovirt(TestCaseBase):
             with open(env.destination) as f:
                 actual = f.read()
             self.assertEqual(actual, FakeVolume().data())
+
+
+class PartialStream(object):
+    """
+    Stream returning short reads, like libvirt streams.
+    """
+
+    def __init__(self, data, chunk=1000):
+        self._data = io.BytesIO(data)
+        self._chunk = chunk
+
+    def recv(self, nbytes):
+        return self._data.read(min(nbytes, self._chunk))
+
+    def finish(self):
+        pass
+
+
+class SparseStream(object):
+    """
+    Synthetic libvirt sparse stream, made of data and holes.
+    """
+
+    def __init__(self, extents):
+        # List of (data, length); data is None for holes.
+        self._extents = extents
+
+    def sparseRecvAll(self, handler, hole_handler, opaque):
+        for data, length in self._extents:
+            if data is None:
+                hole_handler(self, length, opaque)
+            else:
+                handler(self, data, opaque)
+
+    def finish(self):
+        pass
+
+
+# Data, zeroes, and unaligned data at the end.
+IMAGE = b"x" * 4 * KiB + b"\0" * 2 * MiB + b"y" * 100
+
+
+def no_progress(progress):
+    pass
+
+
+@pytest.fixture
+def block_device(monkeypatch, tmpdir):
+    """
+    File pretending to be a block device full of junk, like a logical
+    volume that was used by a removed volume.
+    """
+    path = str(tmpdir.join("lv"))
+    with open(path, "wb") as f:
+        f.write(b"\xff" * len(IMAGE))
+    monkeypatch.setattr(fileutils, "is_block_device", lambda path: True)
+    return path
+
+
+def test_receive_file(tmpdir):
+    dest = str(tmpdir.join("dest"))
+    op = kvm2ovirt.Receive(dest, kvm2ovirt.StreamAdapter(
+        PartialStream(IMAGE)), buffersize=MiB)
+    op.run()
+    assert op.done == len(IMAGE)
+    with open(dest, "rb") as f:
+        assert f.read() == IMAGE
+
+
+def test_receive_existing_file(tmpdir):
+    dest = str(tmpdir.join("dest"))
+    with open(dest, "wb") as f:
+        f.write(b"\xff" * len(IMAGE))
+    op = kvm2ovirt.Receive(dest, kvm2ovirt.StreamAdapter(
+        PartialStream(IMAGE)), buffersize=MiB)
+    op.run()
+    # The file is not zeroed, so zero blocks must be written.
+    with open(dest, "rb") as f:
+        assert f.read() == IMAGE
+
+
+def test_receive_unaligned_buffersize(tmpdir):
+    dest = str(tmpdir.join("dest"))
+    op = kvm2ovirt.Receive(dest, kvm2ovirt.StreamAdapter(
+        PartialStream(IMAGE)), buffersize=MiB + 1000)
+    op.run()
+    with open(dest, "rb") as f:
+        assert f.read() == IMAGE
+
+
+def test_receive_file_size(tmpdir):
+    dest = str(tmpdir.join("dest"))
+    op = kvm2ovirt.Receive(dest, kvm2ovirt.StreamAdapter(
+        PartialStream(IMAGE)), size=MiB, buffersize=64 * KiB)
+    op.run()
+    with open(dest, "rb") as f:
+        assert f.read() == IMAGE[:MiB]
+
+
+def test_receive_block_device(block_device):
+    op = kvm2ovirt.Receive(block_device, kvm2ovirt.StreamAdapter(
+        PartialStream(IMAGE)), buffersize=MiB)
+    op.run()
+    with open(block_device, "rb") as f:
+        assert f.read() == IMAGE
+
+
+def test_receive_block_device_zeroed(block_device):
+    op = kvm2ovirt.Receive(block_device, kvm2ovirt.StreamAdapter(
+        PartialStream(IMAGE)), buffersize=MiB, zeroed=True)
+    op.run()
+    # Zero blocks were skipped, keeping the previous content.
+    with open(block_device, "rb") as f:
+        data = f.read()
+    assert data[:4 * KiB] == IMAGE[:4 * KiB]
+    assert data[MiB:2 * MiB] == b"\xff" * MiB
+    assert data[-100:] == IMAGE[-100:]
+
+
+@pytest.mark.parametrize("extents", [
+    # Holes at the start and in the middle.
+    [(None, MiB), (b"x" * 100, 100), (None, 4 * KiB - 100),
+     (b"y" * MiB, MiB)],
+    # Hole at the end.
+    [(b"x" * 4 * KiB, 4 * KiB), (None, MiB + 512)],
+])
+def test_download_sparse_block_device(block_device, extents):
+    expected = b"".join(b"\0" * length if data is None else data
+                        for data, length in extents)
+    kvm2ovirt.download_disk_sparse(
+        SparseStream(extents), len(expected), None, block_device, MiB,
+        report=no_progress)
+    with open(block_device, "rb") as f:
+        assert f.read(len(expected)) == expected
+
+
+def test_download_sparse_file(tmpdir):
+    dest = str(tmpdir.join("dest"))
+    with open(dest, "wb") as f:
+        f.write(b"\xff" * 3 * MiB)
+    extents = [(b"x" * 100, 100), (None, MiB), (b"y" * 100, 100),
+               (None, MiB)]
+    expected = b"x" * 100 + b"\0" * MiB + b"y" * 100 + b"\0" * MiB
+    kvm2ovirt.download_disk_sparse(
+        SparseStream(extents), len(expected), None, dest, MiB,
+        report=no_progress)
+    # The file was truncated, and extended to the size of the image.
+    with open(dest, "rb") as f:
+        assert f.read() == expected
+
+
+def test_copy_disks_parallel_errors(monkeypatch):
+    output = []
+    # Both disks fail while being copied.
+    barrier = threading.Barrier(2)
+
+    def handle_disk(con, diskno, src, dst, fmt, options, report):
+        barrier.wait(5)
+        raise RuntimeError("disk %d failed" % diskno)
+
+    monkeypatch.setattr(libvirtconnection, "open_connection",
+                        lambda uri, username, password: None)
+    monkeypatch.setattr(kvm2ovirt, "handle_disk", handle_disk)
+    monkeypatch.setattr(kvm2ovirt, "write_output", output.append)
+    options = namedtuple("Options", "uri,username,parallel")(
+        uri="qemu+tcp://domain", username="user", parallel=2)
+    disks = [(1, ("/src1", "/dst1", "path")),
+             (2, ("/src2", "/dst2", "path"))]
+
+    with pytest.raises(RuntimeError) as e:
+        kvm2ovirt.copy_disks_parallel(options, None, disks)
+
+    # The raised error is not written; the error of the other thread is.
+    errors = [line for line in output if line.startswith("ERROR: ")]
+    assert errors == ["ERROR: %s" % err for err in ("disk 1 failed",
+                                                    "disk 2 failed")
+                      if err != str(e.value)]
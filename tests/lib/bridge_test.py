@@ -62,7 +62,7 @@ class Host():
         else:
             return {'status': {'code': -1, 'message': 'Failed'}}
 
-    def getCapabilities(self):
+    def getCapabilities(self, ifChangedSince=None):
         return {'status': {'code': 0, 'message': 'Done'},
                 'info': {'My caps': 'My capabilites'}}
 
@@ -31,6 +31,7 @@ import os.path
 import pickle
 import pytest
 import sys
+import time
 
 from collections import namedtuple
 
@@ -594,3 +595,232 @@ def test_vm_launch_flags(flag_file, flag, vm_id):
     hooks.remove_vm_launch_flags_file(vm_id)
 
     assert not os.path.exists(flag_file)
+
+
+@pytest.fixture
+def scripts_cache(monkeypatch, fake_hooks_root):
+    cache = hooks._ScriptsCache(str(fake_hooks_root) + "/")
+    cache.start()
+    monkeypatch.setattr(hooks, "_cache", cache)
+    try:
+        yield cache
+    finally:
+        cache.stop()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def script_paths(dir_name):
+    return [s.path for s in hooks._scripts(dir_name)]
+
+
+def test_cache_empty_hook_point(scripts_cache, hooks_dir):
+    data = {"key": "value"}
+    assert hooks._scripts(hooks_dir.basename) is hooks._NO_SCRIPTS
+    assert hooks._runHooksDir(data, hooks_dir.basename,
+                              hookType=hooks._JSON_HOOK) is data
+
+
+def test_cache_missing_hook_point(scripts_cache, fake_hooks_root):
+    assert hooks._scripts("no_such_hook") is hooks._NO_SCRIPTS
+
+
+def test_cache_reuse_listing(scripts_cache, hooks_dir, monkeypatch):
+    appender_script("1.sh").apply(hooks_dir)
+    scripts = hooks._scripts(hooks_dir.basename)
+
+    def fail(dir_name):
+        raise AssertionError("Unexpected listing of %s" % dir_name)
+
+    monkeypatch.setattr(hooks, "_scriptsPerDir", fail)
+    assert hooks._scripts(hooks_dir.basename) is scripts
+
+
+def test_cache_invalid_hook_point(scripts_cache):
+    with pytest.raises(ValueError):
+        hooks._scripts("../escape")
+
+
+def test_cache_add_script(scripts_cache, hooks_dir):
+    appender_script("1.sh").apply(hooks_dir)
+    assert script_paths(hooks_dir.basename) == [str(hooks_dir.join("1.sh"))]
+
+    appender_script("2.sh").apply(hooks_dir)
+    wait_for(lambda: len(script_paths(hooks_dir.basename)) == 2)
+    assert hooks._runHooksDir(u"", hooks_dir.basename) == u"1.sh\n2.sh\n"
+
+
+def test_cache_remove_script(scripts_cache, hooks_dir):
+    appender_script("1.sh").apply(hooks_dir)
+    assert len(script_paths(hooks_dir.basename)) == 1
+
+    hooks_dir.join("1.sh").remove()
+    wait_for(lambda: script_paths(hooks_dir.basename) == [])
+
+
+def test_cache_script_not_executable(scripts_cache, hooks_dir):
+    appender_script("1.sh").apply(hooks_dir)
+    assert len(script_paths(hooks_dir.basename)) == 1
+
+    hooks_dir.join("1.sh").chmod(0o644)
+    wait_for(lambda: script_paths(hooks_dir.basename) == [])
+
+
+def test_cache_new_hook_point(scripts_cache, fake_hooks_root):
+    assert hooks._scripts("new_hook_point") is hooks._NO_SCRIPTS
+
+    new_dir = fake_hooks_root.mkdir("new_hook_point")
+    wait_for(lambda: "new_hook_point" not in scripts_cache._scripts)
+    assert hooks._scripts("new_hook_point") is hooks._NO_SCRIPTS
+
+    appender_script("1.sh").apply(new_dir)
+    wait_for(lambda: len(script_paths("new_hook_point")) == 1)
+
+
+def test_cache_other_root(scripts_cache, monkeypatch, tmpdir):
+    other = tmpdir.mkdir("other")
+    appender_script("1.sh").apply(other.mkdir("hook_point"))
+    monkeypatch.setattr(hooks, "P_VDSM_HOOKS", str(other) + "/")
+    assert len(script_paths("hook_point")) == 1
+    assert scripts_cache._scripts == {}
+
+
+def python_script(script_name, exit_code=0):
+    code = textwrap.dedent(
+        """\
+        #!{python}
+        import os
+        import sys
+
+        import hooking
+
+        with open(os.environ["_hook_domxml"], "a") as f:
+            f.write("%s:%d\\n" % (os.path.basename(sys.argv[0]),
+                                  os.getpid()))
+        hooking.log("{name}")
+        sys.exit({exit_code})
+        """).format(python=sys.executable, name=script_name,
+                    exit_code=exit_code)
+    return FileEntry(script_name, 0o755, code)
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    pool = hooks._WorkerPool(2)
+    monkeypatch.setattr(hooks, "_workers", pool)
+    try:
+        yield pool
+    finally:
+        pool.stop()
+
+
+def run_python_hooks(hooks_dir, **kwargs):
+    out = hooks._runHooksDir(u"", hooks_dir.basename, **kwargs)
+    return [line.split(":") for line in out.splitlines()]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            python_script("1.py"),
+            python_script("2.py"),
+        ],
+        id="python scripts"
+    ),
+])
+def test_workers_run_python_hooks(workers, hooks_dir):
+    first = run_python_hooks(hooks_dir)
+    second = run_python_hooks(hooks_dir)
+
+    assert [name for name, _ in first] == ["1.py", "2.py"]
+    # All scripts ran in the same persistent process.
+    pids = {pid for _, pid in first + second}
+    assert len(pids) == 1
+    assert int(pids.pop()) != os.getpid()
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            python_script("1.py"),
+            python_script("2.py", exit_code=2),
+            python_script("3.py"),
+        ],
+        id="fatal error"
+    ),
+])
+def test_workers_hook_errors(workers, hooks_dir):
+    with pytest.raises(exception.HookError) as e:
+        run_python_hooks(hooks_dir)
+    assert "2.py" in str(e.value)
+
+    result = run_python_hooks(hooks_dir, raiseError=False)
+    assert [name for name, _ in result] == ["1.py", "2.py"]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            FileEntry("raise.py", 0o755, textwrap.dedent(
+                """\
+                #!{}
+                raise RuntimeError("hook failed")
+                """).format(sys.executable)),
+        ],
+        id="unhandled exception"
+    ),
+])
+def test_workers_hook_exception(workers, hooks_dir):
+    with pytest.raises(exception.HookError) as e:
+        hooks._runHooksDir(u"", hooks_dir.basename)
+    assert "hook failed" in str(e.value)
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            python_script("1.py"),
+            appender_script("2.sh"),
+        ],
+        id="python and shell scripts"
+    ),
+])
+def test_workers_shell_hooks(workers, hooks_dir):
+    out = hooks._runHooksDir(u"", hooks_dir.basename)
+    assert out.startswith(u"1.py:")
+    assert out.endswith(u"2.sh\n")
+
+
+def test_workers_assemble_environment(workers, hooks_dir, env_dump):
+    hooks._runHooksDir(u"", hooks_dir.basename, {"vmId": "myvm"},
+                       params={"abc": "def"})
+    with open(env_dump, "rb") as f:
+        env = pickle.load(f)
+    assert env["vmId"] == "myvm"
+    assert env["abc"] == "def"
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            appender_script("1.sh"),
+            appender_script("2.sh"),
+        ],
+        id="two scripts"
+    ),
+])
+def test_stats(monkeypatch, hooks_dir):
+    monkeypatch.setattr(hooks, "_stats", {})
+    hooks._runHooksDir(u"", hooks_dir.basename)
+    hooks._runHooksDir(u"", hooks_dir.basename)
+
+    stats = hooks.stats()[hooks_dir.basename]
+    assert sorted(stats) == ["1.sh", "2.sh"]
+    for info in stats.values():
+        assert info["calls"] == 2
+        assert 0 < info["max_time"] <= info["total_time"]
@@ -0,0 +1,238 @@
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import errno
+
+import pytest
+
+from network.compat import mock
+
+from vdsm.network.link import iface
+from vdsm.network.link import stats
+from vdsm.network.netlink import link
+
+IFF_UP = 1 << 0
+IFF_RUNNING = 1 << 6
+
+NIC = 'eth0'
+BOND = 'bond0'
+
+
+def _link(name, link_type, flags=IFF_UP | IFF_RUNNING):
+    return {
+        'name': name,
+        'type': link_type,
+        'flags': flags,
+        'stats': {
+            'rx_bytes': 100,
+            'tx_bytes': 200,
+            'rx_dropped': 1,
+            'tx_dropped': 2,
+            'rx_errors': 3,
+            'tx_errors': 4,
+        },
+    }
+
+
+class FakeCache(stats._LinkPropertiesCache):
+    """
+    Link properties cache with a monitor controlled by the test.
+    """
+
+    def _start_monitor(self):
+        self._monitoring = True
+
+
+@pytest.fixture
+def links():
+    links = [_link(NIC, iface.Type.NIC), _link(BOND, iface.Type.BOND)]
+    with mock.patch.object(link, 'iter_links_stats', lambda: iter(links)):
+        yield links
+
+
+@pytest.fixture
+def speed_readers():
+    with mock.patch.object(
+        stats.nic, 'speed', return_value=10000
+    ) as nic_speed, mock.patch.object(
+        stats.bond, 'speed', return_value=20000
+    ) as bond_speed, mock.patch.object(
+        stats.nic, 'duplex', return_value='full'
+    ):
+        yield nic_speed, bond_speed
+
+
+@pytest.fixture
+def cache():
+    cache = FakeCache()
+    with mock.patch.object(stats, '_properties_cache', cache):
+        with mock.patch.object(
+            stats.dpdk, 'get_dpdk_devices', return_value={}
+        ):
+            yield cache
+
+
+@pytest.mark.usefixtures('links', 'speed_readers', 'cache')
+def test_report():
+    report = stats.report()
+    assert report == {
+        NIC: {
+            'name': NIC,
+            'rx': 100,
+            'tx': 200,
+            'state': 'up',
+            'rxDropped': 1,
+            'txDropped': 2,
+            'rxErrors': 3,
+            'txErrors': 4,
+            'speed': 10000,
+            'duplex': 'full',
+        },
+        BOND: {
+            'name': BOND,
+            'rx': 100,
+            'tx': 200,
+            'state': 'up',
+            'rxDropped': 1,
+            'txDropped': 2,
+            'rxErrors': 3,
+            'txErrors': 4,
+            'speed': 20000,
+            'duplex': 'full',
+        },
+    }
+
+
+@pytest.mark.usefixtures('speed_readers', 'cache')
+def test_link_down(links):
+    links[0]['flags'] = IFF_UP
+    report = stats.report()
+    assert report[NIC]['state'] == 'down'
+
+
+@pytest.mark.usefixtures('links')
+def test_properties_cached_until_link_event(speed_readers, cache):
+    nic_speed, bond_speed = speed_readers
+    stats.report()
+    stats.report()
+    assert nic_speed.call_count == 1
+    assert bond_speed.call_count == 1
+
+    cache.invalidate()
+    stats.report()
+    assert nic_speed.call_count == 2
+    assert bond_speed.call_count == 2
+
+
+@pytest.mark.usefixtures('links')
+def test_properties_not_cached_without_monitor(speed_readers, cache):
+    nic_speed, _ = speed_readers
+    with mock.patch.object(cache, '_start_monitor'):
+        stats.report()
+        stats.report()
+    assert nic_speed.call_count == 2
+
+
+@pytest.mark.usefixtures('links', 'cache')
+def test_properties_not_cached_when_event_races_read(speed_readers):
+    nic_speed, _ = speed_readers
+
+    def speed_changed(name):
+        stats._properties_cache.invalidate()
+        return 10000
+
+    nic_speed.side_effect = speed_changed
+    stats.report()
+    stats.report()
+    assert nic_speed.call_count == 2
+
+
+@pytest.mark.usefixtures('links', 'cache')
+def test_removed_link_ignored(speed_readers):
+    nic_speed, _ = speed_readers
+    nic_speed.side_effect = IOError(errno.ENODEV, 'No such device')
+    report = stats.report()
+    assert set(report) == {BOND}
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeThreads(object):
+    """
+    Record started threads, run by the test.
+    """
+
+    def __init__(self):
+        self.started = []
+
+    def __call__(self, func, name=None):
+        thread = mock.Mock()
+        thread.start.side_effect = lambda: self.started.append(func)
+        return thread
+
+    def run(self):
+        while self.started:
+            self.started.pop(0)()
+
+
+def test_monitor_failure_backoff():
+    clock = FakeClock()
+    threads = FakeThreads()
+    cache = stats._LinkPropertiesCache(clock=clock)
+    object_monitor = mock.Mock(side_effect=OSError('netlink failed'))
+    with mock.patch.object(stats.concurrent, 'thread', threads), \
+            mock.patch.object(stats.monitor, 'object_monitor',
+                              object_monitor), \
+            mock.patch.object(stats, '_read_link_properties',
+                              return_value=('nic', 1000, 'full')):
+
+        def get():
+            cache.get(NIC, iface.Type.NIC)
+            threads.run()
+
+        get()
+        assert object_monitor.call_count == 1
+
+        # Use direct reads without restarting the monitor.
+        get()
+        clock.now += cache.MIN_RETRY_DELAY - 1
+        get()
+        assert object_monitor.call_count == 1
+
+        clock.now += 1
+        get()
+        assert object_monitor.call_count == 2
+
+        # The delay is doubled after another failure.
+        clock.now += cache.MIN_RETRY_DELAY
+        get()
+        assert object_monitor.call_count == 2
+        clock.now += cache.MIN_RETRY_DELAY
+        get()
+        assert object_monitor.call_count == 3
@@ -22,8 +22,12 @@ from __future__ import absolute_import
 from __future__ import division
 
 from __future__ import print_function
+import random
 import threading
 import time
+import tracemalloc
+
+import pytest
 
 import vdsm.common.time
 from vdsm import schedule
@@ -41,7 +45,12 @@ class SchedulerTests(VdsmTestCase):
     GRACETIME = 0.1
 
     MAX_TASKS = 1000
-    PERMUTATIONS = ((time.time,), (vdsm.common.time.monotonic_time,))
+    PERMUTATIONS = (
+        (time.time, "heap"),
+        (vdsm.common.time.monotonic_time, "heap"),
+        (time.time, "wheel"),
+        (vdsm.common.time.monotonic_time, "wheel"),
+    )
 
     def setUp(self):
         self.scheduler = None
@@ -52,8 +61,8 @@ class SchedulerTests(VdsmTestCase):
 
     @broken_on_ci("timing sensitive, may fail on overloaded machine")
     @permutations(PERMUTATIONS)
-    def test_schedule_after(self, clock):
-        self.create_scheduler(clock)
+    def test_schedule_after(self, clock, queue):
+        self.create_scheduler(clock, queue)
         delay = 0.3
         task1 = Task(clock)
         task2 = Task(clock)
@@ -67,8 +76,8 @@ class SchedulerTests(VdsmTestCase):
 
     @broken_on_ci("timing sensitive, may fail on overloaded machine")
     @permutations(PERMUTATIONS)
-    def test_schedule_before(self, clock):
-        self.create_scheduler(clock)
+    def test_schedule_before(self, clock, queue):
+        self.create_scheduler(clock, queue)
         delay = 0.3
         task1 = Task(clock)
         task2 = Task(clock)
@@ -82,8 +91,8 @@ class SchedulerTests(VdsmTestCase):
 
     @broken_on_ci("timing sensitive, may fail on overloaded machine")
     @permutations(PERMUTATIONS)
-    def test_continue_after_failures(self, clock):
-        self.create_scheduler(clock)
+    def test_continue_after_failures(self, clock, queue):
+        self.create_scheduler(clock, queue)
         self.scheduler.schedule(0.3, FailingTask())
         task = Task(clock)
         self.scheduler.schedule(0.4, task)
@@ -91,8 +100,8 @@ class SchedulerTests(VdsmTestCase):
         self.assertTrue(task.call_time is not None)
 
     @permutations(PERMUTATIONS)
-    def test_cancel_call(self, clock):
-        self.create_scheduler(clock)
+    def test_cancel_call(self, clock, queue):
+        self.create_scheduler(clock, queue)
         delay = 0.3
         task = Task(clock)
         call = self.scheduler.schedule(delay, task)
@@ -104,8 +113,8 @@ class SchedulerTests(VdsmTestCase):
 
     @stresstest
     @permutations(PERMUTATIONS)
-    def test_cancel_call_many(self, clock):
-        self.create_scheduler(clock)
+    def test_cancel_call_many(self, clock, queue):
+        self.create_scheduler(clock, queue)
         delay = 0.3
         tasks = []
         for i in range(self.MAX_TASKS):
@@ -120,8 +129,8 @@ class SchedulerTests(VdsmTestCase):
             self.assertEqual(task.call_time, None)
 
     @permutations(PERMUTATIONS)
-    def test_stop_scheduler(self, clock):
-        self.create_scheduler(clock)
+    def test_stop_scheduler(self, clock, queue):
+        self.create_scheduler(clock, queue)
         delay = 0.3
         task = Task(clock)
         self.scheduler.schedule(delay, task)
@@ -131,8 +140,8 @@ class SchedulerTests(VdsmTestCase):
 
     @stresstest
     @permutations(PERMUTATIONS)
-    def test_stop_scheduler_many(self, clock):
-        self.create_scheduler(clock)
+    def test_stop_scheduler_many(self, clock, queue):
+        self.create_scheduler(clock, queue)
         delay = 0.3
         tasks = []
         for i in range(self.MAX_TASKS):
@@ -147,12 +156,12 @@ class SchedulerTests(VdsmTestCase):
 
     @stresstest
     @permutations(PERMUTATIONS)
-    def test_latency(self, clock):
+    def test_latency(self, clock, queue):
         # Test how the scheduler cope with load of 1000 calls per seconds.
         # This is not the typical use but it is interesting to see how good we
         # can do this. This may also reveal bad changes to the scheduler code
         # that otherwise may be hidden in the noise.
-        self.create_scheduler(clock)
+        self.create_scheduler(clock, queue)
         interval = 1.0
         tickers = []
         for i in range(self.MAX_TASKS):
@@ -175,9 +184,9 @@ class SchedulerTests(VdsmTestCase):
 
     # Helpers
 
-    def create_scheduler(self, clock):
+    def create_scheduler(self, clock, queue):
         self.clock = clock
-        self.scheduler = schedule.Scheduler(clock=clock)
+        self.scheduler = schedule.Scheduler(clock=clock, queue=queue)
         self.scheduler.start()
 
 
@@ -257,3 +266,176 @@ class TestScheduledCall(VdsmTestCase):
         call_soon = schedule.ScheduledCall(now, self.callback)
         call_later = schedule.ScheduledCall(now + 1, self.callback)
         self.assertLess(call_soon, call_later)
+
+
+class TestTimerWheel(VdsmTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.wheel = schedule._TimerWheel(self.now, 0.01)
+        self.called = []
+
+    def push(self, delay):
+        call = schedule.ScheduledCall(
+            self.now + delay, lambda: self.called.append(delay))
+        self.wheel.push(call)
+        return call
+
+    def advance(self, seconds):
+        self.now += seconds
+        for call in self.wheel.pop_expired(self.now):
+            call._execute()
+
+    def test_empty(self):
+        self.assertEqual(self.wheel.next_deadline(), None)
+        self.advance(100)
+        self.assertEqual(self.called, [])
+
+    def test_expire(self):
+        self.push(0.5)
+        self.advance(0.49)
+        self.assertEqual(self.called, [])
+        self.advance(0.01)
+        self.assertEqual(self.called, [0.5])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_expire_past(self):
+        self.push(-1)
+        self.push(0)
+        # Expired calls are called on the next tick.
+        self.advance(0.01)
+        self.assertEqual(sorted(self.called), [-1, 0])
+
+    def test_order(self):
+        delays = [0.02, 0.7, 0.64, 30, 300, 3000, 100000, 2.5]
+        for delay in delays:
+            self.push(delay)
+        for i in range(len(delays)):
+            self.advance(self.wheel.next_deadline() - self.now)
+            # Next deadline may be a tick moving calls to a lower level.
+            while len(self.called) == i:
+                self.advance(self.wheel.next_deadline() - self.now)
+        self.assertEqual(self.called, sorted(delays))
+
+    def test_remove(self):
+        call = self.push(30)
+        self.assertEqual(len(self.wheel), 1)
+        self.wheel.remove(call)
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.wheel.next_deadline(), None)
+        # Removing twice does nothing.
+        self.wheel.remove(call)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_next_deadline(self):
+        self.push(0.5)
+        self.assertAlmostEqual(self.wheel.next_deadline(), self.now + 0.5)
+        self.push(0.1)
+        self.assertAlmostEqual(self.wheel.next_deadline(), self.now + 0.1)
+
+    def test_push_earlier(self):
+        def push(delay):
+            call = schedule.ScheduledCall(self.now + delay, lambda: None)
+            return self.wheel.push(call)
+
+        self.assertTrue(push(30))
+        self.wheel.next_deadline()
+        self.assertFalse(push(40))
+        self.assertTrue(push(1))
+
+    def test_random(self):
+        rnd = random.Random(0)
+        calls = {}
+        for i in range(2000):
+            delay = rnd.choice([0.1, 1, 10, 100, 10000, 1000000]) * \
+                rnd.random()
+            calls[self.push(delay)] = delay
+        canceled = rnd.sample(list(calls), 500)
+        for call in canceled:
+            call.cancel()
+            self.wheel.remove(call)
+            del calls[call]
+
+        expired = []
+        while len(self.wheel):
+            self.now = self.wheel.next_deadline()
+            for call in self.wheel.pop_expired(self.now):
+                # Never early, at most one tick late.
+                self.assertTrue(call._deadline <= self.now)
+                self.assertTrue(self.now - call._deadline <= 0.01 + 1e-6)
+                expired.append(call)
+
+        self.assertEqual(set(expired), set(calls))
+
+    def test_clear(self):
+        calls = [self.push(delay) for delay in (0.1, 10, 1000)]
+        self.assertEqual(set(self.wheel.clear()), set(calls))
+        self.assertEqual(len(self.wheel), 0)
+        self.advance(1000)
+        self.assertEqual(self.called, [])
+
+
+class TestSchedulerRemove(VdsmTestCase):
+
+    def test_heap_keeps_canceled_calls(self):
+        scheduler = schedule.Scheduler(queue="heap")
+        scheduler.start()
+        try:
+            scheduler.schedule(60, lambda: None).cancel()
+            self.assertEqual(len(scheduler._calls), 1)
+        finally:
+            scheduler.stop(wait=True)
+
+    def test_wheel_removes_canceled_calls(self):
+        scheduler = schedule.Scheduler(queue="wheel")
+        scheduler.start()
+        try:
+            scheduler.schedule(60, lambda: None).cancel()
+            self.assertEqual(len(scheduler._calls), 0)
+        finally:
+            scheduler.stop(wait=True)
+
+    def test_invalid_queue(self):
+        with self.assertRaises(ValueError):
+            schedule.Scheduler(queue="list")
+
+
+def schedule_and_cancel(queue, count):
+    scheduler = schedule.Scheduler(
+        clock=vdsm.common.time.monotonic_time, queue=queue)
+    scheduler.start()
+    try:
+        start = time.monotonic()
+        calls = [scheduler.schedule(60 + i % 60, lambda: None)
+                 for i in range(count)]
+        scheduled = time.monotonic() - start
+        pending = tracemalloc.get_traced_memory()[0]
+
+        start = time.monotonic()
+        for call in calls:
+            call.cancel()
+        canceled = time.monotonic() - start
+        del calls
+        after_cancel = tracemalloc.get_traced_memory()[0]
+
+        return scheduled, canceled, pending, after_cancel
+    finally:
+        scheduler.stop(wait=True)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("queue", ["heap", "wheel"])
+def test_benchmark(queue):
+    count = 100000
+    scheduled, canceled, _, _ = schedule_and_cancel(queue, count)
+
+    tracemalloc.start()
+    try:
+        _, _, pending, after_cancel = schedule_and_cancel(queue, count)
+    finally:
+        tracemalloc.stop()
+
+    print("%s: %d calls, schedule: %.3fs (%d calls/s), cancel: %.3fs "
+          "(%d calls/s), memory pending: %.1f MiB, after cancel: %.1f MiB"
+          % (queue, count, scheduled, count / scheduled, canceled,
+             count / canceled, pending / 1024**2, after_cancel / 1024**2))
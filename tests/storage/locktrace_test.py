@@ -0,0 +1,266 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+import time
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.storage import guarded
+from vdsm.storage import locktrace
+from vdsm.storage import resourceManager as rm
+from vdsm.storage.rwlock import RWLock
+
+from storage.storagetestlib import FakeGuardedLock
+
+
+@pytest.fixture
+def tracing():
+    locktrace.enable()
+    try:
+        yield
+    finally:
+        locktrace.disable()
+
+
+@pytest.fixture
+def tmp_manager(monkeypatch):
+    manager = rm._ResourceManager()
+    manager.registerNamespace("storage", rm.SimpleResourceFactory())
+    monkeypatch.setattr(rm, "_manager", manager)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timeout waiting for condition"
+        time.sleep(0.01)
+
+
+def test_disabled():
+    lock = RWLock(name="lock")
+    with lock.exclusive:
+        pass
+    stats = locktrace.stats()
+    assert not stats["enabled"]
+    assert stats["held"] == []
+    assert stats["kinds"] == {}
+
+
+def test_rwlock_held(tracing):
+    lock = RWLock(name="lock")
+    with lock.shared:
+        # Recursive locking is not traced.
+        with lock.shared:
+            held = locktrace.stats()["held"]
+            assert len(held) == 1
+            assert held[0]["kind"] == "rwlock"
+            assert held[0]["name"] == "lock"
+            assert held[0]["mode"] == "shared"
+            assert held[0]["thread"] == threading.current_thread().name
+            assert not held[0]["long"]
+
+    stats = locktrace.stats()
+    assert stats["held"] == []
+    assert stats["kinds"]["rwlock"]["acquired"] == 1
+    assert stats["kinds"]["rwlock"]["waits"] == 0
+
+
+def test_rwlock_unnamed(tracing):
+    lock = RWLock()
+    with lock.exclusive:
+        held = locktrace.stats()["held"]
+        assert held[0]["name"] == "0x%x" % id(lock)
+
+
+def test_rwlock_wait_for(tracing):
+    lock = RWLock(name="lock")
+    lock.acquire_write()
+    t = concurrent.thread(
+        lambda: lock.shared.__enter__() and lock.release(), name="waiter")
+    t.start()
+    try:
+        wait_for(lambda: locktrace.stats()["waiting"])
+        stats = locktrace.stats()
+        assert stats["waiting"][0]["thread"] == "waiter"
+        assert stats["waiting"][0]["mode"] == "shared"
+        assert stats["wait_for"] == [{
+            "waiter": "waiter",
+            "owner": threading.current_thread().name,
+            "kind": "rwlock",
+            "name": "lock",
+        }]
+        assert stats["deadlocks"] == []
+    finally:
+        lock.release()
+        t.join()
+
+    stats = locktrace.stats()
+    assert stats["waiting"] == []
+    assert stats["wait_for"] == []
+    assert stats["kinds"]["rwlock"]["acquired"] == 2
+    assert stats["kinds"]["rwlock"]["waits"] == 1
+
+
+def test_deadlock(tracing):
+    ready = threading.Barrier(2)
+    done = threading.Event()
+
+    def worker(first, second):
+        locktrace.acquired("test", first, "exclusive")
+        ready.wait(5)
+        since = locktrace.waiting("test", second, "exclusive")
+        done.wait(5)
+        locktrace.cancelled("test", second, since)
+        locktrace.released("test", first)
+
+    t1 = concurrent.thread(worker, args=("a", "b"), name="t1")
+    t2 = concurrent.thread(worker, args=("b", "a"), name="t2")
+    t1.start()
+    t2.start()
+    try:
+        wait_for(lambda: len(locktrace.stats()["waiting"]) == 2)
+        deadlocks = locktrace.stats()["deadlocks"]
+        assert len(deadlocks) == 1
+        assert sorted(deadlocks[0]["threads"]) == ["t1", "t2"]
+    finally:
+        done.set()
+        t1.join()
+        t2.join()
+
+    assert locktrace.stats()["deadlocks"] == []
+
+
+@pytest.mark.parametrize("graph,cycles", [
+    ({}, []),
+    ({1: {2}}, []),
+    ({1: {2}, 2: {1}}, [[1, 2]]),
+    ({2: {3}, 3: {1}, 1: {2}}, [[1, 2, 3]]),
+    ({1: {2}, 2: {1, 3}, 3: {2}}, [[1, 2], [2, 3]]),
+    ({1: {2}, 2: {3}, 3: {3}}, [[3]]),
+])
+def test_find_cycles(graph, cycles):
+    assert locktrace.find_cycles(graph) == cycles
+
+
+def test_long_hold(caplog):
+    locktrace.enable(long_hold=0)
+    try:
+        lock = RWLock(name="lock")
+        with lock.exclusive:
+            time.sleep(0.01)
+            assert locktrace.stats()["held"][0]["long"]
+        stats = locktrace.stats()
+        assert stats["kinds"]["rwlock"]["long_holds"] == 1
+        assert "was held by" in caplog.text
+    finally:
+        locktrace.disable()
+
+
+def test_resource(tracing, tmp_manager):
+    with rm.acquireResource("storage", "resource", rm.SHARED):
+        held = locktrace.stats()["held"]
+        assert [(h["kind"], h["name"], h["mode"]) for h in held] == [
+            ("resource", "storage.resource", rm.SHARED)]
+    assert locktrace.stats()["held"] == []
+
+
+def test_resource_timeout(tracing, tmp_manager):
+    with rm.acquireResource("storage", "resource", rm.EXCLUSIVE):
+        with pytest.raises(rm.RequestTimedOutError):
+            rm.acquireResource("storage", "resource", rm.EXCLUSIVE, 0)
+        stats = locktrace.stats()
+        assert stats["waiting"] == []
+        assert stats["kinds"]["resource"]["waits"] == 1
+        assert len(stats["held"]) == 1
+
+
+def test_resource_released_by_other_thread(tracing, tmp_manager):
+    res = rm.acquireResource("storage", "resource", rm.EXCLUSIVE)
+    t = concurrent.thread(res.release)
+    t.start()
+    t.join()
+    assert locktrace.stats()["held"] == []
+
+
+def test_guarded_resource_traced_once(tracing, tmp_manager):
+    with guarded.context([rm.Lock("storage", "resource", rm.EXCLUSIVE)]):
+        held = locktrace.stats()["held"]
+        assert [h["kind"] for h in held] == ["resource"]
+    assert locktrace.stats()["held"] == []
+
+
+def test_guarded(tracing):
+    log = []
+    locks = [FakeGuardedLock("ns", "name", "exclusive", log)]
+    with guarded.context(locks):
+        held = locktrace.stats()["held"]
+        assert [(h["kind"], h["name"]) for h in held] == [
+            ("FakeGuardedLock", "ns.name")]
+    stats = locktrace.stats()
+    assert stats["held"] == []
+    assert stats["kinds"]["FakeGuardedLock"]["acquired"] == 1
+
+
+def test_guarded_acquire_error(tracing):
+    log = []
+    locks = [FakeGuardedLock("ns", "name", "exclusive", log,
+                             acquire=RuntimeError)]
+    with pytest.raises(RuntimeError):
+        with guarded.context(locks):
+            pass
+    stats = locktrace.stats()
+    assert stats["waiting"] == []
+    assert stats["held"] == []
+
+
+def run_rwlock(count):
+    lock = RWLock(name="lock")
+    start = time.monotonic()
+    for i in range(count):
+        lock.acquire_read()
+        lock.release()
+    return time.monotonic() - start
+
+
+def run_resources(count):
+    start = time.monotonic()
+    for i in range(count):
+        rm.acquireResource("storage", "resource", rm.SHARED).release()
+    return time.monotonic() - start
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("run", [run_rwlock, run_resources])
+def test_benchmark(tmp_manager, run):
+    count = 20000
+    disabled = run(count)
+    locktrace.enable()
+    try:
+        enabled = run(count)
+    finally:
+        locktrace.disable()
+    print("%s %d operations: disabled=%.3fs enabled=%.3fs (%+.1f%%)" % (
+        run.__name__, count, disabled, enabled,
+        (enabled - disabled) / disabled * 100))
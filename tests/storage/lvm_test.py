@@ -393,6 +393,22 @@ def test_cmd_read_only_filter_stale_fail(fake_devices, no_delay):
     assert len(fake_runner.calls) == lc.READ_ONLY_RETRIES + 2
 
 
+def test_reload_stale_vgs(fake_devices, no_delay):
+    fake_runner = FakeRunner()
+    lc = lvm.LVMCache(fake_runner)
+    fresh = lvm.VG(*[None] * len(lvm.VG._fields))
+    lc._vgs = {"vg1": lvm.Stale("vg1"), "vg2": fresh}
+
+    # Stale and missing vgs are reloaded using single command.
+    assert lc.reloadStaleVgs(["vg1", "vg2", "vg3"]) == ["vg1", "vg3"]
+    assert len(fake_runner.calls) == 1
+    assert fake_runner.calls[0][-2:] == ["vg1", "vg3"]
+
+    # Fresh vgs are not reloaded.
+    assert lc.reloadStaleVgs(["vg2"]) == []
+    assert len(fake_runner.calls) == 1
+
+
 def test_suppress_warnings(fake_devices, no_delay):
     fake_runner = FakeRunner()
     fake_runner.err = b"""\
@@ -27,10 +27,14 @@ import time
 
 from contextlib import contextmanager
 
+import pytest
+
 from six.moves import queue
 
+from vdsm.common import concurrent
 from vdsm.storage import exception as se
 from vdsm.storage import monitor
+from vdsm.storage import sd
 
 from monkeypatch import MonkeyPatch
 from monkeypatch import MonkeyPatchScope
@@ -100,10 +104,12 @@ class FakeDomain(object):
     monitoring.
     """
 
-    def __init__(self, sdUUID, version=1, iso_dir=None):
+    def __init__(self, sdUUID, version=1, iso_dir=None,
+                 storage_type=sd.NFS_DOMAIN):
         self.sdUUID = sdUUID
         self.version = version
         self.iso_dir = iso_dir
+        self.storage_type = storage_type
         self.state = CREATED
         self.acquired = False
         self.stats = {
@@ -182,6 +188,10 @@ class FakeDomain(object):
     def getIsoDomainImagesDir(self):
         return self.iso_dir
 
+    @maybefail
+    def getStorageType(self):
+        return self.storage_type
+
 
 class UnexpectedError(Exception):
     pass
@@ -218,7 +228,7 @@ class MonitorEnv(object):
 
 
 @contextmanager
-def monitor_env(shutdown=False, refresh=300):
+def monitor_env(shutdown=False, refresh=300, vg_refresh=None):
     config = make_config([
         ("irs", "repo_stats_cache_refresh_timeout", str(refresh))
     ])
@@ -229,7 +239,7 @@ def monitor_env(shutdown=False, refresh=300):
         event = FakeEvent()
         checker = FakeCheckService()
         thread = monitor.MonitorThread('uuid', 'host_id', MONITOR_INTERVAL,
-                                       event, checker)
+                                       event, checker, vgRefresh=vg_refresh)
         try:
             yield MonitorEnv(thread, event, checker)
         finally:
@@ -242,8 +252,10 @@ def monitor_env(shutdown=False, refresh=300):
 
 class FakeMonitorThread(object):
 
-    def __init__(self, sd_uuid, host_id, interval, event, checker):
+    def __init__(self, sd_uuid, host_id, interval, event, checker,
+                 vgRefresh=None):
         self.sdUUID = sd_uuid
+        self.cycleStats = monitor.CycleStats()
 
     def start(self):
         pass
@@ -922,9 +934,236 @@ class TestDomainMonitor:
         sd_uid, status = mon.getDomainsStatus()[0]
         assert sd_uid == "uuid"
         assert status.valid
+        assert list(mon.getCycleStats()) == ["uuid"]
 
         # Stop monitoring SD.
         mon.stopMonitoring(["uuid"])
         assert mon.domains == []
         assert mon.poolDomains == []
         assert mon.getDomainsStatus() == []
+
+
+class FakeVGRefresh(object):
+
+    def __init__(self):
+        self.vgs = set()
+        self.refreshes = 0
+
+    def add(self, vg_name):
+        self.vgs.add(vg_name)
+
+    def remove(self, vg_name):
+        self.vgs.discard(vg_name)
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+class TestMonitorCycle:
+
+    def test_block_domain_refresh(self):
+        vg_refresh = FakeVGRefresh()
+        with monitor_env(vg_refresh=vg_refresh) as env:
+            domain = FakeDomain("uuid", storage_type=sd.ISCSI_DOMAIN)
+            monitor.sdCache.domains["uuid"] = domain
+            env.thread.start()
+            env.wait_for_cycle()
+            assert vg_refresh.vgs == {"uuid"}
+            assert vg_refresh.refreshes == 1
+            assert env.thread.isBlockDomain
+        # Removed when the monitor stops.
+        assert vg_refresh.vgs == set()
+
+    def test_file_domain_no_refresh(self):
+        vg_refresh = FakeVGRefresh()
+        with monitor_env(vg_refresh=vg_refresh) as env:
+            domain = FakeDomain("uuid")
+            monitor.sdCache.domains["uuid"] = domain
+            env.thread.start()
+            env.wait_for_cycle()
+            assert vg_refresh.vgs == set()
+            assert vg_refresh.refreshes == 0
+            assert env.thread.isBlockDomain is False
+
+    def test_storage_type_retry(self):
+        with monitor_env() as env:
+            domain = FakeDomain("uuid")
+            domain.errors["getStorageType"] = UnexpectedError
+            monitor.sdCache.domains["uuid"] = domain
+            env.thread.start()
+            env.wait_for_cycle()
+            status = env.thread.getStatus()
+            assert isinstance(status.error, UnexpectedError)
+            del domain.errors["getStorageType"]
+            env.wait_for_cycle()
+            assert env.thread.isBlockDomain is False
+
+    def test_file_domain_staggered(self):
+        with monitor_env() as env:
+            domain = FakeDomain("uuid")
+            monitor.sdCache.domains["uuid"] = domain
+            # Make the second cycle late enough to measure.
+            env.thread.stagger = 0.5
+            env.thread.start()
+            env.wait_for_cycle()
+            start = time.monotonic()
+            env.wait_for_cycle()
+            elapsed = time.monotonic() - start
+            assert elapsed >= MONITOR_INTERVAL + 0.5
+            # Next cycles are not staggered.
+            start = time.monotonic()
+            env.wait_for_cycle()
+            elapsed = time.monotonic() - start
+            assert elapsed < MONITOR_INTERVAL + 0.5
+
+    def test_cycle_stats(self):
+        with monitor_env() as env:
+            domain = FakeDomain("uuid")
+            monitor.sdCache.domains["uuid"] = domain
+            env.thread.start()
+            env.wait_for_cycle()
+            info = env.thread.cycleStats.info()
+            assert info["count"] == 1
+            assert sum(info["buckets"]) == 1
+            assert info["last"] == info["max"] == info["total"]
+
+
+class TestCycleStats:
+
+    def test_empty(self):
+        info = monitor.CycleStats().info()
+        assert info == {
+            "count": 0,
+            "total": 0.0,
+            "max": 0.0,
+            "last": 0.0,
+            "bounds": list(monitor.CycleStats.BOUNDS),
+            "buckets": [0] * (len(monitor.CycleStats.BOUNDS) + 1),
+        }
+
+    def test_record(self):
+        stats = monitor.CycleStats()
+        for duration in (0.05, 0.1, 0.7, 2.0, 90.0):
+            stats.record(duration)
+        info = stats.info()
+        assert info["count"] == 5
+        assert info["total"] == pytest.approx(92.85)
+        assert info["max"] == 90.0
+        assert info["last"] == 90.0
+        # Bounds: 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0
+        assert info["buckets"] == [2, 0, 1, 1, 0, 0, 0, 1]
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeLVM(object):
+
+    def __init__(self):
+        self.calls = []
+        self.error = None
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+        self.clock = None
+        self.duration = 0
+
+    def reloadStaleVGs(self, vg_names):
+        self.calls.append(vg_names)
+        if self.clock:
+            self.clock.now += self.duration
+        self.started.set()
+        self.proceed.wait(5)
+        if self.error:
+            raise self.error
+        return vg_names
+
+
+class TestVGRefresh:
+
+    @pytest.fixture
+    def fake_lvm(self, monkeypatch):
+        fake = FakeLVM()
+        monkeypatch.setattr(monitor, "lvm", fake)
+        return fake
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def vg_refresh(self, clock):
+        vg_refresh = monitor.VGRefresh(10, clock=clock)
+        vg_refresh.add("vg2")
+        vg_refresh.add("vg1")
+        return vg_refresh
+
+    def test_once_per_interval(self, vg_refresh, fake_lvm, clock):
+        vg_refresh.refresh()
+        assert fake_lvm.calls == [["vg1", "vg2"]]
+
+        clock.now += 9
+        vg_refresh.refresh()
+        assert len(fake_lvm.calls) == 1
+
+        clock.now += 1
+        vg_refresh.refresh()
+        assert len(fake_lvm.calls) == 2
+
+    def test_remove(self, vg_refresh, fake_lvm):
+        vg_refresh.remove("vg2")
+        vg_refresh.remove("no-such-vg")
+        vg_refresh.refresh()
+        assert fake_lvm.calls == [["vg1"]]
+
+    def test_error(self, vg_refresh, fake_lvm, clock):
+        fake_lvm.error = se.LogicalVolumeRefreshError("reason")
+        # Errors are logged, monitors will reload the vgs.
+        vg_refresh.refresh()
+        clock.now += 10
+        fake_lvm.error = None
+        vg_refresh.refresh()
+        assert len(fake_lvm.calls) == 2
+
+    def test_concurrent_refresh_coalesced(self, vg_refresh, fake_lvm):
+        fake_lvm.proceed.clear()
+        threads = [concurrent.thread(vg_refresh.refresh) for _ in range(4)]
+        for t in threads:
+            t.start()
+        fake_lvm.started.wait(5)
+        fake_lvm.proceed.set()
+        for t in threads:
+            t.join()
+        assert len(fake_lvm.calls) == 1
+
+    def test_interval_from_start(self, vg_refresh, fake_lvm, clock):
+        # A slow reload does not delay the next reload.
+        fake_lvm.clock = clock
+        fake_lvm.duration = 8
+        vg_refresh.refresh()
+        clock.now += 2
+        vg_refresh.refresh()
+        assert len(fake_lvm.calls) == 2
+
+    def test_wait_timeout(self, fake_lvm, clock):
+        vg_refresh = monitor.VGRefresh(10, wait_timeout=0.1, clock=clock)
+        vg_refresh.add("vg1")
+        fake_lvm.proceed.clear()
+        t = concurrent.thread(vg_refresh.refresh)
+        t.start()
+        try:
+            fake_lvm.started.wait(5)
+            # A stuck reload does not block other monitors.
+            start = time.monotonic()
+            vg_refresh.refresh()
+            assert time.monotonic() - start < 5
+            assert len(fake_lvm.calls) == 1
+        finally:
+            fake_lvm.proceed.set()
+            t.join()
@@ -27,6 +27,7 @@ import logging
 import os
 import re
 import stat
+import threading
 import time
 import weakref
 
@@ -34,6 +35,7 @@ from contextlib import contextmanager
 
 import pytest
 
+from vdsm.common import concurrent
 from vdsm.common.osutils import get_umask
 from vdsm.storage import constants as sc
 from vdsm.storage import outOfProcess as oop
@@ -1094,6 +1096,238 @@ def test_simple_walk(oop_cleanup, tmpdir):
     assert discovered_files == expected_files
 
 
+# Adaptive pool
+
+class FakeTimeout(Exception):
+    pass
+
+
+class FakeIOProcessModule(object):
+    Timeout = FakeTimeout
+
+
+class SlowIOProcess(object):
+    """
+    Stand-in for an ioprocess serving a slow file system. Calls access the
+    local file system after the gate is opened, and fail with the next
+    error in errors, if any.
+    """
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.gate = threading.Event()
+        self.gate.set()
+        self.errors = []
+        self.closed = False
+
+    def listdir(self, path):
+        self.gate.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return os.listdir(path)
+
+    def close(self):
+        self.closed = True
+
+
+class SlowFileSystem(object):
+
+    def __init__(self):
+        self.procs = []
+
+    def create(self, name, threads):
+        proc = SlowIOProcess(name, threads)
+        self.procs.append(proc)
+        return proc
+
+
+@pytest.fixture
+def slowfs(monkeypatch):
+    fs = SlowFileSystem()
+    monkeypatch.setattr(oop, "ioprocess", FakeIOProcessModule)
+    monkeypatch.setattr(oop, "_create_ioprocess", fs.create)
+    return fs
+
+
+def monitored(threads, max_threads=16):
+    return oop._MonitoredIOProcess(
+        "test", threads, max_threads=max_threads, timeout=60)
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@contextmanager
+def blocked_calls(proc, slowfs, path, count):
+    slowfs.procs[-1].gate.clear()
+    threads = [concurrent.thread(proc.listdir, args=(path,))
+               for _ in range(count)]
+    for t in threads:
+        t.start()
+    wait_for(lambda: proc.stats()["in_flight"] == count)
+    try:
+        yield
+    finally:
+        for fake in slowfs.procs:
+            fake.gate.set()
+        for t in threads:
+            t.join()
+
+
+def test_monitored_stats(slowfs, tmpdir):
+    tmpdir.join("file").write("")
+    proc = monitored(4)
+    assert proc.listdir(str(tmpdir)) == ["file"]
+    stats = proc.stats()
+    assert stats["threads"] == 4
+    assert stats["calls"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["queued"] == 0
+    assert stats["timeouts"] == 0
+    assert stats["rejected"] == 0
+    assert stats["p99"] >= 0
+
+
+def test_monitored_errors(slowfs, tmpdir):
+    proc = monitored(4)
+    slowfs.procs[0].errors = [
+        FakeTimeout(), OSError(errno.EAGAIN, "Queue full")]
+    with pytest.raises(FakeTimeout):
+        proc.listdir(str(tmpdir))
+    with pytest.raises(OSError):
+        proc.listdir(str(tmpdir))
+    stats = proc.stats()
+    assert stats["timeouts"] == 1
+    assert stats["rejected"] == 1
+
+
+def test_adapt_grow_when_queued(slowfs, tmpdir):
+    proc = monitored(2)
+    with blocked_calls(proc, slowfs, str(tmpdir), 4):
+        assert proc.stats()["queued"] == 2
+        proc.adapt()
+        assert proc.stats()["threads"] == 4
+        assert slowfs.procs[-1].threads == 4
+        # The old ioprocess is busy, and will be closed when the calls
+        # complete.
+        assert not slowfs.procs[0].closed
+
+    assert slowfs.procs[0].closed
+    assert not slowfs.procs[-1].closed
+
+    # New calls use the new ioprocess.
+    proc.listdir(str(tmpdir))
+    assert proc.stats()["calls"] == 5
+
+
+def test_adapt_grow_when_rejected(slowfs, tmpdir):
+    proc = monitored(2)
+    slowfs.procs[0].errors = [OSError(errno.EAGAIN, "Queue full")]
+    with pytest.raises(OSError):
+        proc.listdir(str(tmpdir))
+    proc.adapt()
+    assert proc.stats()["threads"] == 4
+    # The old ioprocess was idle, so it was closed immediately.
+    assert slowfs.procs[0].closed
+
+
+def test_adapt_no_grow_when_storage_times_out(slowfs, tmpdir):
+    proc = monitored(2)
+    slowfs.procs[0].errors = [FakeTimeout()]
+    with pytest.raises(FakeTimeout):
+        proc.listdir(str(tmpdir))
+    with blocked_calls(proc, slowfs, str(tmpdir), 4):
+        proc.adapt()
+    assert proc.stats()["threads"] == 2
+    assert len(slowfs.procs) == 1
+
+
+def test_adapt_max_threads(slowfs, tmpdir):
+    proc = monitored(2, max_threads=3)
+    with blocked_calls(proc, slowfs, str(tmpdir), 4):
+        proc.adapt()
+        assert proc.stats()["threads"] == 3
+        proc.adapt()
+        assert proc.stats()["threads"] == 3
+
+
+def test_adapt_shrink_when_idle(slowfs, tmpdir):
+    proc = monitored(2)
+    with blocked_calls(proc, slowfs, str(tmpdir), 8):
+        proc.adapt()
+        proc.adapt()
+        assert proc.stats()["threads"] == 8
+    # The peak of the blocked calls is reported by this call.
+    proc.adapt()
+    assert proc.stats()["threads"] == 8
+    proc.adapt()
+    assert proc.stats()["threads"] == 4
+    proc.adapt()
+    assert proc.stats()["threads"] == 2
+    proc.adapt()
+    assert proc.stats()["threads"] == 2
+    assert [p.threads for p in slowfs.procs] == [2, 4, 8, 4, 2]
+    assert [p.closed for p in slowfs.procs] == [True] * 4 + [False]
+
+
+def test_adapt_never_shrink_below_initial_threads(slowfs, tmpdir):
+    proc = monitored(8)
+    proc.listdir(str(tmpdir))
+    proc.adapt()
+    assert proc.stats()["threads"] == 8
+    assert len(slowfs.procs) == 1
+
+
+def test_adapt_keep_when_busy(slowfs, tmpdir):
+    proc = monitored(4)
+    with blocked_calls(proc, slowfs, str(tmpdir), 3):
+        proc.adapt()
+        assert proc.stats()["threads"] == 4
+
+
+def test_close(slowfs, tmpdir):
+    proc = monitored(2)
+    with blocked_calls(proc, slowfs, str(tmpdir), 4):
+        proc.adapt()
+        proc.close()
+        assert all(p.closed for p in slowfs.procs)
+
+
+def test_background_reaping(slowfs, oop_cleanup, monkeypatch):
+    monkeypatch.setattr(oop, "IOPROC_IDLE_TIME", 0.1)
+    monkeypatch.setattr(oop, "MONITOR_INTERVAL", 0.05)
+    oop.start()
+    ref = weakref.ref(oop.getProcessPool("test"))
+    wait_for(lambda: "test" not in oop._procPool)
+    gc.collect()
+    assert ref() is None
+    assert oop.stats() == {}
+
+
+def test_background_adapt(slowfs, oop_cleanup, monkeypatch, tmpdir):
+    monkeypatch.setattr(oop, "MONITOR_INTERVAL", 0.05)
+    monkeypatch.setattr(oop, "HELPERS_PER_DOMAIN", 2)
+    iop = oop.getProcessPool("test")
+    with blocked_calls(iop._ioproc, slowfs, str(tmpdir), 4):
+        oop.start()
+        wait_for(lambda: oop.stats()["test"]["threads"] == 4)
+
+
+def test_stats_local_directory(oop_cleanup, tmpdir):
+    iop = oop.getProcessPool("test")
+    iop.os.path.isdir(str(tmpdir))
+    iop.fileUtils.pathExists(str(tmpdir))
+    stats = oop.stats()["test"]
+    assert stats["calls"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["threads"] == oop.HELPERS_PER_DOMAIN
+
+
 def verify_file(path, mode=None, size=None, content=None):
     assert os.path.isfile(path)
 
@@ -774,3 +774,118 @@ class TestResourceOwner:
         with pytest.raises(se.ResourceException):
             owner.acquire("storage", "resource", locktype, timeout_ms=1)
         assert owner_object.actions == []
+
+
+class SlowResourceFactory(rm.SimpleResourceFactory):
+    """
+    Simulate a factory looking up the resource on storage.
+    """
+    def createResource(self, name, lockType):
+        time.sleep(0.001)
+        return None
+
+
+class TestContention:
+
+    def test_fast_path_no_request(self, tmp_manager, monkeypatch):
+        def fail(*args):
+            raise AssertionError("Request created")
+
+        monkeypatch.setattr(rm, "Request", fail)
+        with rm.acquireResource("storage", "resource", rm.SHARED):
+            with rm.acquireResource("storage", "resource", rm.SHARED):
+                status = rm._getResourceStatus("storage", "resource")
+                assert status == rm.STATUS_SHARED
+        status = rm._getResourceStatus("storage", "resource")
+        assert status == rm.STATUS_FREE
+
+    def test_fast_path_unique_ref_id(self, tmp_manager):
+        with rm.acquireResource("storage", "resource", rm.SHARED) as ref1:
+            with rm.acquireResource("storage", "resource", rm.SHARED) as ref2:
+                # The log prefix includes the reference id.
+                assert ref1._log.prefix != ref2._log.prefix
+
+    def test_fast_path_factory_error(self, tmp_manager):
+        with pytest.raises(se.ResourceAcqusitionFailed):
+            rm.acquireResource("error", "resource", rm.EXCLUSIVE)
+        status = rm._getResourceStatus("error", "resource")
+        assert status == rm.STATUS_FREE
+
+    def test_stats(self, tmp_manager):
+        shared1 = rm.acquireResource("storage", "resource", rm.SHARED)
+        shared2 = rm.acquireResource("storage", "resource", rm.SHARED)
+        with pytest.raises(rm.RequestTimedOutError):
+            rm.acquireResource("storage", "resource", rm.EXCLUSIVE, 0.1)
+
+        stats = rm.stats()["storage"]
+        assert stats["acquired"] == 2
+        assert stats["queued"] == 1
+        assert stats["locked"] == 1
+        assert stats["waits"] == 1
+        assert stats["wait_time"] >= 0
+        assert stats["max_wait_time"] == stats["wait_time"]
+
+        shared1.release()
+        shared2.release()
+        assert rm.stats()["storage"]["locked"] == 0
+
+    def test_waiter_granted(self, tmp_manager):
+        exclusive = rm.acquireResource("storage", "resource", rm.EXCLUSIVE)
+        acquired = []
+
+        def acquire():
+            res = rm.acquireResource("storage", "resource", rm.SHARED, 5)
+            acquired.append(res)
+
+        t = threading.Thread(target=acquire)
+        t.start()
+        deadline = time.monotonic() + 5
+        while rm.stats()["storage"]["queued"] == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        exclusive.release()
+        t.join()
+
+        acquired.pop().release()
+        stats = rm.stats()["storage"]
+        assert stats["acquired"] == 2
+        assert stats["waits"] == 1
+        assert stats["max_wait_time"] > 0
+
+    @pytest.mark.slow
+    @pytest.mark.parametrize("stripes", [1, 16])
+    def test_benchmark(self, stripes, monkeypatch):
+        """
+        Many threads preparing images, acquiring shared locks on a small set
+        of resources.
+        """
+        manager = rm._ResourceManager(stripes=stripes)
+        manager.registerNamespace("volumes", SlowResourceFactory())
+        monkeypatch.setattr(rm, "_manager", manager)
+        threads = 16
+        per_thread = 250
+        resources = ["vol-%d" % i for i in range(64)]
+
+        def worker(seed):
+            rnd = Random(seed)
+            for i in range(per_thread):
+                name = rnd.choice(resources)
+                res = rm.acquireResource("volumes", name, rm.SHARED)
+                res.release()
+
+        workers = [threading.Thread(target=worker, args=(i,))
+                   for i in range(threads)]
+        start = time.monotonic()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.monotonic() - start
+
+        stats = rm.stats()["volumes"]
+        print("%d acquires from %d threads with %d stripes: %.3fs "
+              "(queued: %d, max wait: %.6fs)" % (
+                  threads * per_thread, threads, stripes, elapsed,
+                  stats["queued"], stats["max_wait_time"]))
+        assert stats["acquired"] == threads * per_thread
+        assert stats["locked"] == 0
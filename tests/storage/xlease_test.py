@@ -22,6 +22,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import errno
 import functools
 import io
 import mmap
@@ -310,6 +311,65 @@ class TestIndex:
         with utils.closing(vol):
             assert vol.leases() == expected
 
+    @pytest.mark.parametrize("max_workers", [1, 4, xlease.REBUILD_WORKERS])
+    def test_rebuild_workers(self, tmp_vol, fake_sanlock, max_workers):
+        # Add resources in all records in the volume.
+        count = xlease._records_in_volume(
+            tmp_vol.backend.size(), tmp_vol.alignment)
+        expected = {}
+        for recnum in range(count):
+            resource = "%04d" % recnum
+            offset = xlease.lease_offset(recnum, tmp_vol.alignment)
+            fake_sanlock.write_resource(
+                tmp_vol.lockspace.encode("utf-8"),
+                resource.encode("utf-8"),
+                [(tmp_vol.path, offset)],
+                align=tmp_vol.alignment,
+                sector=tmp_vol.block_size)
+            expected[resource] = {"offset": offset, "updating": False}
+
+        xlease.rebuild_index(
+            tmp_vol.lockspace,
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size,
+            max_workers=max_workers)
+
+        vol = xlease.LeasesVolume(
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size)
+        with utils.closing(vol):
+            assert vol.leases() == expected
+            # All records beyond the end of the volume are empty.
+            assert vol._index.find_free_record() == count
+
+    def test_rebuild_read_failure(self, tmp_vol, fake_sanlock):
+        fake_sanlock.errors["read_resource"] = fake_sanlock.SanlockException(
+            errno.EIO, "Sanlock resource read failure", "I/O error")
+        with pytest.raises(fake_sanlock.SanlockException):
+            xlease.rebuild_index(
+                tmp_vol.lockspace,
+                tmp_vol.backend,
+                alignment=tmp_vol.alignment,
+                block_size=tmp_vol.block_size)
+
+    @pytest.mark.parametrize("alignment,count", [
+        (sc.ALIGNMENT_1M, 0),
+        (sc.ALIGNMENT_1M, xlease.RESERVED_SLOTS - 1),
+        (sc.ALIGNMENT_1M, xlease.RESERVED_SLOTS),
+        (sc.ALIGNMENT_1M, 1024),
+        (sc.ALIGNMENT_8M, 1024),
+        (sc.ALIGNMENT_1M, 10000),
+    ])
+    def test_records_in_volume(self, alignment, count):
+        for size in (count * alignment, count * alignment + 1):
+            expected = len([
+                recnum for recnum in range(xlease.MAX_RECORDS)
+                if xlease.lease_offset(recnum, alignment) <= size - alignment
+            ])
+            assert xlease._records_in_volume(size, alignment) == expected
+
     def test_create_read_failure(self, tmp_vol):
         file = FailingReader(tmp_vol.path)
         with utils.closing(file):
@@ -646,6 +706,205 @@ def bench():
         print("%d adds in %.6f seconds (%.6f seconds per add)"
               % (count, elapsed, elapsed / count))
 
+    @pytest.mark.slow
+    @pytest.mark.parametrize("max_workers", [1, xlease.REBUILD_WORKERS])
+    def test_time_rebuild(self, tmp_vol, fake_sanlock, max_workers):
+        # Make the volume large enough for all records.
+        with io.open(tmp_vol.path, "r+b") as f:
+            f.truncate(
+                xlease.lease_offset(xlease.MAX_RECORDS, tmp_vol.alignment))
+
+        for recnum in range(xlease.MAX_RECORDS):
+            fake_sanlock.write_resource(
+                tmp_vol.lockspace.encode("utf-8"),
+                make_uuid().encode("utf-8"),
+                [(tmp_vol.path, xlease.lease_offset(
+                    recnum, tmp_vol.alignment))],
+                align=tmp_vol.alignment,
+                sector=tmp_vol.block_size)
+
+        # Real sanlock reads the resource leader from storage.
+        read_resource = fake_sanlock.read_resource
+
+        def read_from_storage(path, offset, **kw):
+            buf = mmap.mmap(-1, tmp_vol.block_size, mmap.MAP_SHARED)
+            with utils.closing(buf):
+                tmp_vol.backend.pread(offset, buf)
+            return read_resource(path, offset, **kw)
+
+        fake_sanlock.read_resource = read_from_storage
+
+        start = timeit.default_timer()
+        xlease.rebuild_index(
+            tmp_vol.lockspace,
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size,
+            max_workers=max_workers)
+        elapsed = timeit.default_timer() - start
+        print("rebuild %d records with %d workers in %.6f seconds"
+              % (xlease.MAX_RECORDS, max_workers, elapsed))
+
+        vol = xlease.LeasesVolume(
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size)
+        with utils.closing(vol):
+            assert len(vol.leases()) == xlease.MAX_RECORDS
+
+
+class TestIndexCache:
+
+    def open_volume(self, tmp_vol):
+        return xlease.LeasesVolume(
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size)
+
+    def create_cache(self, tmp_vol):
+        return xlease.IndexCache(
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size)
+
+    def test_read_metadata(self, tmp_vol):
+        md = xlease.read_metadata(
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size)
+        assert md.lockspace == tmp_vol.lockspace
+        assert not md.updating
+
+    def test_mtime_changes(self, tmp_vol, fake_sanlock, monkeypatch):
+        # Changes in the same second must change the mtime.
+        monkeypatch.setattr("time.time", lambda: 123456789)
+        vol = self.open_volume(tmp_vol)
+        with utils.closing(vol):
+            mtime = vol.mtime
+            vol.add(make_uuid())
+            assert vol.mtime == mtime + 1
+            lease_id = make_uuid()
+            vol.add(lease_id)
+            assert vol.mtime == mtime + 2
+            vol.remove(lease_id)
+            assert vol.mtime == mtime + 3
+
+        # The change is written to storage.
+        vol = self.open_volume(tmp_vol)
+        with utils.closing(vol):
+            assert vol.mtime == mtime + 3
+
+    def test_rebuild_changes_mtime(self, tmp_vol, fake_sanlock):
+        vol = self.open_volume(tmp_vol)
+        with utils.closing(vol):
+            mtime = vol.mtime
+
+        xlease.rebuild_index(
+            tmp_vol.lockspace,
+            tmp_vol.backend,
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size)
+
+        vol = self.open_volume(tmp_vol)
+        with utils.closing(vol):
+            assert vol.mtime > mtime
+
+    def test_hit(self, tmp_vol, fake_sanlock):
+        lease_id = make_uuid()
+        vol = self.open_volume(tmp_vol)
+        with utils.closing(vol):
+            info = vol.add(lease_id)
+
+        xlease.clear_stats()
+        cache = self.create_cache(tmp_vol)
+        with utils.closing(cache):
+            assert cache.lookup(tmp_vol.backend, lease_id) == info
+            assert cache.lookup(tmp_vol.backend, lease_id) == info
+            assert lease_id in cache.leases(tmp_vol.backend)
+
+        stats = xlease.cache_stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 2
+
+    def test_detect_add(self, tmp_vol, fake_sanlock):
+        cache = self.create_cache(tmp_vol)
+        with utils.closing(cache):
+            assert cache.leases(tmp_vol.backend) == {}
+
+            # Simulate the SPM adding a lease on another host.
+            lease_id = make_uuid()
+            vol = self.open_volume(tmp_vol)
+            with utils.closing(vol):
+                info = vol.add(lease_id)
+
+            assert cache.lookup(tmp_vol.backend, lease_id) == info
+
+    def test_detect_remove(self, tmp_vol, fake_sanlock):
+        lease_id = make_uuid()
+        vol = self.open_volume(tmp_vol)
+        with utils.closing(vol):
+            vol.add(lease_id)
+
+        cache = self.create_cache(tmp_vol)
+        with utils.closing(cache):
+            cache.lookup(tmp_vol.backend, lease_id)
+
+            # Simulate the SPM removing the lease on another host.
+            vol = self.open_volume(tmp_vol)
+            with utils.closing(vol):
+                vol.remove(lease_id)
+
+            with pytest.raises(se.NoSuchLease):
+                cache.lookup(tmp_vol.backend, lease_id)
+
+    def test_max_age(self, tmp_vol, fake_sanlock, monkeypatch):
+        now = [0]
+        cache = xlease.IndexCache(
+            alignment=tmp_vol.alignment,
+            block_size=tmp_vol.block_size,
+            max_age=60,
+            clock=lambda: now[0])
+        with utils.closing(cache):
+            assert cache.leases(tmp_vol.backend) == {}
+
+            # Simulate an older SPM adding a lease without changing the
+            # mtime.
+            vol = self.open_volume(tmp_vol)
+            with utils.closing(vol):
+                mtime = vol.mtime
+                monkeypatch.setattr(vol, "_update_mtime", lambda: None)
+                lease_id = make_uuid()
+                info = vol.add(lease_id)
+                assert vol.mtime == mtime
+
+            # Not detected until the cached index expires.
+            now[0] = 59
+            assert cache.leases(tmp_vol.backend) == {}
+            now[0] = 60
+            assert cache.lookup(tmp_vol.backend, lease_id) == info
+
+    def test_invalidate(self, tmp_vol, fake_sanlock):
+        cache = self.create_cache(tmp_vol)
+        with utils.closing(cache):
+            cache.leases(tmp_vol.backend)
+            xlease.clear_stats()
+            cache.invalidate()
+            cache.leases(tmp_vol.backend)
+            assert xlease.cache_stats()["misses"] == 1
+
+    def test_updating(self, tmp_vol):
+        cache = self.create_cache(tmp_vol)
+        with utils.closing(cache):
+            cache.leases(tmp_vol.backend)
+
+            md = xlease.IndexMetadata(
+                xlease.INDEX_VERSION, tmp_vol.lockspace, updating=True)
+            with io.open(tmp_vol.path, "r+b") as f:
+                f.seek(tmp_vol.alignment)
+                f.write(md.bytes())
+
+            with pytest.raises(xlease.IndexIsUpdating):
+                cache.leases(tmp_vol.backend)
+
 
 @pytest.fixture(params=[
     xlease.DirectFile,
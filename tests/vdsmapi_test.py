@@ -665,6 +665,12 @@ class DataVerificationTests(TestCaseBase):
         _schema.verify_retval(
             vdsmapi.MethodRep('Host', 'getCapabilities'), ret)
 
+    def test_unchanged_capabilities_response(self):
+        ret = {'generation': '6f1c2a3b-4', 'lastClientIface': 'ovirtmgmt'}
+
+        _schema.verify_retval(
+            vdsmapi.MethodRep('Host', 'getCapabilities'), ret)
+
     def test_create_complex_params(self):
         complex_type = {'lease': {'sd_id': 'UUID', 'lease_id': 'UUID'}}
         self.assertEqual(
@@ -673,7 +679,7 @@ class DataVerificationTests(TestCaseBase):
 
     def test_no_params(self):
         self.assertEqual(_schema.get_args_dict(
-            'Host', 'getCapabilities'), None)
+            'Host', 'getHardwareInfo'), None)
 
     def test_single_param(self):
         complex_type = {'vmID': {'UUID': 'UUID'}}
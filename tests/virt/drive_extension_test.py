@@ -29,6 +29,7 @@ import libvirt
 
 from vdsm import utils
 from vdsm.common import response
+from vdsm.common.time import monotonic_time
 from vdsm.common.units import MiB, GiB
 from vdsm.virt.vmdevices.storage import Drive, DISK_TYPE, BLOCK_THRESHOLD
 from vdsm.virt.vmdevices import hwclass
@@ -71,12 +72,13 @@ def drive_config(**kw):
 
 
 @contextmanager
-def make_env(events_enabled, drive_infos):
+def make_env(events_enabled, drive_infos, extension_policy='fixed'):
     log = logging.getLogger('test')
 
     cfg = make_config([
         ('irs', 'enable_block_threshold_event',
-            'true' if events_enabled else 'false')])
+            'true' if events_enabled else 'false'),
+        ('irs', 'volume_extension_policy', extension_policy)])
 
     # the Drive class use those two tunables as class constants.
     with MonkeyPatchScope([
@@ -245,6 +247,105 @@ class TestDiskExtensionWithPolling(DiskExtensionTestBase):
         assert testvm.lastStatus == vmstatus.UP
         assert dom.info()[0] == libvirt.VIR_DOMAIN_RUNNING
 
+    def test_extend_using_sampled_block_stats(self):
+        with make_env(
+                events_enabled=False,
+                drive_infos=self.DRIVE_INFOS) as (testvm, dom, drives):
+            vda = dom.block_info['/virtio/0']
+            vda['allocation'] = 0 * MiB
+            vdb = dom.block_info['/virtio/1']
+            vdb['allocation'] = allocation_threshold_for_resize_mb(
+                vdb, drives[1]) + 1 * MiB
+
+            testvm.drive_monitor.update_block_stats(
+                bulk_block_stats(dom), monotonic_time())
+            extended = testvm.monitor_drives()
+
+        assert extended is True
+        assert dom.block_info_calls == []
+        assert len(testvm.cif.irs.extensions) == 1
+        self.check_extension(vdb, drives[1], testvm.cif.irs.extensions[0])
+
+    def test_sampled_block_stats_used_once(self):
+        with make_env(
+                events_enabled=False,
+                drive_infos=self.DRIVE_INFOS) as (testvm, dom, drives):
+            testvm.drive_monitor.update_block_stats(
+                bulk_block_stats(dom), monotonic_time())
+            testvm.monitor_drives()
+            assert dom.block_info_calls == []
+
+            testvm.monitor_drives()
+            assert dom.block_info_calls == ['/virtio/0', '/virtio/1']
+
+    def test_sampled_block_stats_missing_drive(self):
+        with make_env(
+                events_enabled=False,
+                drive_infos=self.DRIVE_INFOS) as (testvm, dom, drives):
+            stats = bulk_block_stats(dom)
+            del stats['block.1.physical']
+            testvm.drive_monitor.update_block_stats(stats, monotonic_time())
+            testvm.monitor_drives()
+
+        assert dom.block_info_calls == ['/virtio/1']
+
+    def test_sampled_block_stats_stale(self):
+        with make_env(
+                events_enabled=False,
+                drive_infos=self.DRIVE_INFOS) as (testvm, dom, drives):
+            testvm.drive_monitor.update_block_stats(
+                bulk_block_stats(dom), monotonic_time() - 60)
+            testvm.monitor_drives()
+
+        assert dom.block_info_calls == ['/virtio/0', '/virtio/1']
+
+    def test_sampled_block_stats_before_resize(self):
+        with make_env(
+                events_enabled=False,
+                drive_infos=self.DRIVE_INFOS) as (testvm, dom, drives):
+            vdb = dom.block_info['/virtio/1']
+            vdb['allocation'] = allocation_threshold_for_resize_mb(
+                vdb, drives[1]) + 1 * MiB
+            testvm.drive_monitor.update_block_stats(
+                bulk_block_stats(dom), monotonic_time())
+
+            # The volume was extended after sampling.
+            vdb['physical'] += CHUNK_SIZE
+            testvm.drive_monitor.volume_resized(drives[0])
+
+            extended = testvm.monitor_drives()
+
+        assert extended is False
+        assert dom.block_info_calls == ['/virtio/0', '/virtio/1']
+
+    def test_extend_using_write_rate(self):
+        clock = FakeClock()
+        with make_env(
+                events_enabled=False,
+                drive_infos=self.DRIVE_INFOS,
+                extension_policy='write-rate') as (testvm, dom, drives), \
+                MonkeyPatchScope([(drivemonitor, 'monotonic_time', clock)]):
+            vdb = dom.block_info['/virtio/1']
+            vdb['allocation'] = 0
+            testvm.monitor_drives()
+
+            # The guest writes 500 MiB/s, more than the configured chunk
+            # during the initial extension latency.
+            clock.now += 1
+            vdb['allocation'] = 500 * MiB
+            extended = testvm.monitor_drives()
+            assert extended is True
+            poolID, volInfo, newSize, func = testvm.cif.irs.extensions[0]
+            assert volInfo['name'] == drives[1].name
+            assert newSize > drives[1].getNextVolumeSize(
+                vdb['physical'], vdb['capacity'])
+
+            assert len(testvm.cif.irs.extensions) == 1
+
+            clock.now += 2
+            simulate_extend_callback(testvm.cif.irs, extension_id=0)
+            assert testvm.drive_monitor._policy.latency < 5.0
+
     # TODO: add test with storage failures in the extension flow
 
 
@@ -591,17 +692,28 @@ class FakeVM(vm.Vm):
         pass
 
 
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
 class FakeDomain(object):
 
     def __init__(self):
         self._state = (libvirt.VIR_DOMAIN_RUNNING, )
         self.block_info = {}
+        self.block_info_calls = []
         self.errors = {}
         self.thresholds = {}
 
     def blockInfo(self, path, flags):
         # TODO: support access by name
         # flags is ignored
+        self.block_info_calls.append(path)
         d = self.block_info[path]
         return d['capacity'], d['allocation'], d['physical']
 
@@ -665,6 +777,18 @@ class FakeIRS(object):
             self.volume_sizes[key] = capacity
 
 
+def bulk_block_stats(dom):
+    """
+    Return libvirt bulk stats for the drives of dom.
+    """
+    stats = {'block.count': len(dom.block_info)}
+    for i, (path, info) in enumerate(sorted(dom.block_info.items())):
+        stats['block.%d.path' % i] = path
+        for key in ('capacity', 'allocation', 'physical'):
+            stats['block.%d.%s' % (i, key)] = info[key]
+    return stats
+
+
 def make_drive(log, dom, irs, index, conf, block_info):
     cfg = utils.picklecopy(conf)
 
@@ -360,6 +360,28 @@ class TestDrivemonitor(VdsmTestCase):
         mon.disable()
         assert mon.enabled() is False
 
+    def test_extension_time_from_first_request(self):
+        clock = FakeClock()
+        policy = FakePolicy()
+        vm = FakeVM()
+        mon = drivemonitor.DriveMonitor(vm, vm.log)
+        mon._policy = policy
+        vda = make_drive(self.log, index=0, iface='virtio')
+        with MonkeyPatchScope([(drivemonitor, 'monotonic_time', clock)]):
+            mon.next_volume_size(vda, GiB, 10 * GiB)
+            clock.now += 5
+            # Extension request repeated while the extension is pending.
+            mon.next_volume_size(vda, GiB, 10 * GiB)
+            clock.now += 5
+            mon.extension_completed(vda)
+            assert policy.completed == [(vda, 10)]
+
+            # The next extension is timed from its own request.
+            mon.next_volume_size(vda, 2 * GiB, 10 * GiB)
+            clock.now += 3
+            mon.extension_completed(vda)
+            assert policy.completed == [(vda, 10), (vda, 3)]
+
     def test_set_threshold(self):
         with make_env(events_enabled=True) as (mon, vm):
             vda = make_drive(self.log, index=0, iface='virtio')
@@ -454,6 +476,9 @@ class FakeVM(object):
     def getDiskDevices(self):
         return self.drives[:]
 
+    def pooled_dom(self, affinity):
+        return self._dom
+
 
 class FakeDomain(object):
     def __init__(self):
@@ -463,6 +488,25 @@ class FakeDomain(object):
         self.thresholds.append((drive_name, threshold))
 
 
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakePolicy(object):
+    def __init__(self):
+        self.completed = []
+
+    def next_size(self, drive, cur_size, capacity):
+        return cur_size + GiB
+
+    def extension_completed(self, drive, elapsed):
+        self.completed.append((drive, elapsed))
+
+
 def make_drive(log, index, **param_dict):
     conf = drive_config(
         index=str(index),
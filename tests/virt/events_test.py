@@ -21,6 +21,13 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import threading
+import time
+
+import libvirt
+import pytest
+
+from vdsm import schedule
 from vdsm.virt import events
 
 from testlib import VdsmTestCase as TestCaseBase
@@ -37,3 +44,242 @@ class TestEventName(TestCaseBase):
         # given unknown events, it must still return a meaningful string)
         assert UNKNOWN_FAKE_EVENT_ID not in events.LIBVIRT_EVENTS
         assert events.event_name(UNKNOWN_FAKE_EVENT_ID)
+
+
+# Recorded event streams: (vm id, event id, event, detail), in the order
+# libvirt sent them.
+
+START_STOP = [
+    ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_STARTED, 0),
+    ("vm2", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_STARTED, 0),
+    ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_RESUMED, 0),
+    ("vm2", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_RESUMED, 0),
+    ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_STOPPED, 0),
+    ("vm2", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_STOPPED, 0),
+]
+
+IO_ERROR_STORM = [
+    ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_BLOCK_THRESHOLD, "vda", 0),
+] + [
+    (vm_id, libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON, "vda", i)
+    for i in range(20)
+    for vm_id in ("vm1", "vm2", "vm3")
+] + [
+    ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+     libvirt.VIR_DOMAIN_EVENT_SUSPENDED, 0),
+]
+
+
+class Recorder(object):
+    """
+    Record the events handled for every vm. Events of vms in slow_vms are
+    handled slowly.
+    """
+
+    def __init__(self, slow_vms=(), delay=0.0):
+        self.slow_vms = slow_vms
+        self.delay = delay
+        self.handled = {}
+        self.running = {}
+        self.overlaps = 0
+        self._lock = threading.Lock()
+
+    def handler(self, event):
+        def handle():
+            vm_id = event[0]
+            with self._lock:
+                if self.running.get(vm_id):
+                    self.overlaps += 1
+                self.running[vm_id] = True
+            if vm_id in self.slow_vms:
+                time.sleep(self.delay)
+            with self._lock:
+                self.running[vm_id] = False
+                self.handled.setdefault(vm_id, []).append(event)
+        return handle
+
+
+class Blocker(object):
+    """
+    Handler blocking until released.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        self.released.wait(5)
+
+
+def block(dispatcher, vm_id):
+    """
+    Block the events of vm_id, returning when the blocking handler runs.
+    """
+    blocker = Blocker()
+    dispatcher.dispatch(vm_id, blocker)
+    blocker.started.wait(5)
+    return blocker
+
+
+def replay(dispatcher, stream, recorder):
+    for event in stream:
+        dispatcher.dispatch(event[0], recorder.handler(event))
+
+
+def wait_for(recorder, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while sum(len(v) for v in recorder.handled.values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def wait_for_vms(dispatcher, count, timeout=5):
+    # Handled events are recorded before the worker completes the task.
+    deadline = time.monotonic() + timeout
+    while dispatcher.stats()["vms"] != count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def per_vm(stream):
+    result = {}
+    for event in stream:
+        result.setdefault(event[0], []).append(event)
+    return result
+
+
+@pytest.fixture
+def scheduler():
+    s = schedule.Scheduler()
+    s.start()
+    yield s
+    s.stop()
+
+
+@pytest.fixture
+def dispatcher(scheduler):
+    d = events.Dispatcher(scheduler, workers=4, max_tasks=100)
+    d.start()
+    yield d
+    d.stop()
+
+
+@pytest.mark.parametrize("stream", [START_STOP, IO_ERROR_STORM])
+def test_replay_order(dispatcher, stream):
+    recorder = Recorder(slow_vms=("vm1",), delay=0.01)
+    replay(dispatcher, stream, recorder)
+    wait_for(recorder, len(stream))
+    assert recorder.handled == per_vm(stream)
+    assert recorder.overlaps == 0
+
+
+def test_slow_vm_does_not_block_others(dispatcher):
+    blocker = block(dispatcher, "vm1")
+    try:
+        recorder = Recorder()
+        stream = [e for e in START_STOP if e[0] == "vm2"]
+        replay(dispatcher, stream, recorder)
+        wait_for(recorder, len(stream))
+        assert recorder.handled == per_vm(stream)
+        wait_for_vms(dispatcher, 1)
+        # The event being handled is not pending.
+        assert dispatcher.stats()["pending"] == 0
+    finally:
+        blocker.released.set()
+
+
+def test_stats(dispatcher):
+    blocker = block(dispatcher, "vm1")
+    recorder = Recorder()
+    try:
+        replay(dispatcher, START_STOP[:2] + START_STOP[2:3], recorder)
+        wait_for(recorder, 1)
+        wait_for_vms(dispatcher, 1)
+        stats = dispatcher.stats()
+        assert stats["pending"] == 2
+        assert stats["max_per_vm"] == 2
+        assert stats["coalesced"] == 0
+        assert stats["inline"] == 0
+    finally:
+        blocker.released.set()
+    wait_for(recorder, 3)
+
+
+def test_never_dropped(scheduler):
+    d = events.Dispatcher(scheduler, workers=1, max_tasks=1)
+    d.start()
+    recorder = Recorder()
+    blocker = block(d, "vm1")
+    try:
+        # Queued behind the blocked event, no matter how many.
+        stream = [e for e in START_STOP if e[0] == "vm1"] * 10
+        replay(d, stream, recorder)
+        assert d.stats()["pending"] == len(stream)
+        # vm2 takes the last task, vm3 events are handled inline.
+        vm2_stream = [e for e in START_STOP if e[0] == "vm2"]
+        replay(d, vm2_stream, recorder)
+        vm3_stream = [("vm3",) + e[1:] for e in vm2_stream]
+        replay(d, vm3_stream, recorder)
+        assert recorder.handled["vm3"] == vm3_stream
+        assert d.stats()["inline"] == len(vm3_stream)
+    finally:
+        blocker.released.set()
+    wait_for(recorder, len(stream) + len(vm2_stream) + len(vm3_stream))
+    assert recorder.handled["vm1"] == stream
+    assert recorder.handled["vm2"] == vm2_stream
+    d.stop()
+
+
+def test_coalesce(dispatcher):
+    blocker = block(dispatcher, "vm1")
+    recorder = Recorder()
+    event = ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON, "vda", 0)
+    other = ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON, "vdb", 0)
+    try:
+        for e in (event, event, other, event):
+            dispatcher.dispatch("vm1", recorder.handler(e), key=e[1:])
+        stats = dispatcher.stats()
+        assert stats["pending"] == 3
+        assert stats["coalesced"] == 1
+    finally:
+        blocker.released.set()
+    wait_for(recorder, 3)
+    assert recorder.handled["vm1"] == [event, other, event]
+
+    # The event was handled, so the next one is not coalesced.
+    dispatcher.dispatch("vm1", recorder.handler(event), key=event[1:])
+    wait_for(recorder, 4)
+
+
+def test_coalesce_keeps_order(dispatcher):
+    blocker = block(dispatcher, "vm1")
+    recorder = Recorder()
+    io_error = ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_IO_ERROR_REASON, "vda", 0)
+    resumed = ("vm1", libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+               libvirt.VIR_DOMAIN_EVENT_RESUMED, 0)
+    try:
+        dispatcher.dispatch("vm1", recorder.handler(io_error),
+                            key=io_error[1:])
+        dispatcher.dispatch("vm1", recorder.handler(resumed))
+        dispatcher.dispatch("vm1", recorder.handler(io_error),
+                            key=io_error[1:])
+        assert dispatcher.stats()["coalesced"] == 0
+    finally:
+        blocker.released.set()
+    wait_for(recorder, 3)
+    assert recorder.handled["vm1"] == [io_error, resumed, io_error]
+
+
+def test_inline_when_not_started():
+    recorder = Recorder()
+    replay(events, START_STOP, recorder)
+    assert recorder.handled == per_vm(START_STOP)
+    assert events.stats() is None
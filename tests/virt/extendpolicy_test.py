@@ -0,0 +1,209 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301  USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+
+import pytest
+
+from vdsm.common.units import MiB, GiB
+from vdsm.virt import extendpolicy
+from vdsm.virt.vmdevices import storage
+
+CAPACITY = 100 * GiB
+MAX_CHUNK = 8 * GiB
+
+log = logging.getLogger("test")
+
+
+@pytest.fixture
+def drive():
+    return storage.Drive(
+        log,
+        device='disk',
+        diskType=storage.DISK_TYPE.BLOCK,
+        format='cow',
+        iface='virtio',
+        index='0',
+        path='/path/to/volume',
+        propagateErrors='off',
+        shared='none',
+        type='disk',
+        readonly=False,
+        domainID='domain',
+        poolID='pool',
+        imageID='image',
+        volumeID='volume')
+
+
+def test_create_unknown():
+    with pytest.raises(ValueError):
+        extendpolicy.create("unknown", MAX_CHUNK)
+
+
+def test_fixed(drive):
+    policy = extendpolicy.create(extendpolicy.FIXED, MAX_CHUNK)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 1 * GiB, 1.0)
+    assert policy.next_size(drive, 2 * GiB, CAPACITY) == (
+        2 * GiB + drive.volExtensionChunk)
+
+
+def test_write_rate_no_samples(drive):
+    policy = extendpolicy.create(extendpolicy.WRITE_RATE, MAX_CHUNK)
+    assert policy.rate(drive) is None
+    assert policy.next_size(drive, 2 * GiB, CAPACITY) == (
+        2 * GiB + drive.volExtensionChunk)
+
+
+def test_write_rate_estimate(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    for i in range(5):
+        policy.sample(drive, i * 100 * MiB, float(i))
+    assert policy.rate(drive) == 100 * MiB
+
+
+def test_write_rate_average(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 100 * MiB, 1.0)
+    policy.sample(drive, 400 * MiB, 2.0)
+    # Weighted average of 100 MiB/s and 300 MiB/s.
+    assert policy.rate(drive) == 200 * MiB
+
+
+def test_write_rate_reset_on_new_volume(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 2 * GiB, 1.0)
+    # Allocation dropped, the top volume was replaced by a snapshot.
+    policy.sample(drive, 0, 2.0)
+    assert policy.rate(drive) is None
+    policy.sample(drive, 10 * MiB, 3.0)
+    assert policy.rate(drive) == 10 * MiB
+
+
+def test_write_rate_slow_writer(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 1 * MiB, 1.0)
+    # Never extend by less than the configured chunk.
+    assert policy.next_size(drive, 2 * GiB, CAPACITY) == (
+        2 * GiB + drive.volExtensionChunk)
+
+
+def test_write_rate_fast_writer(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 300 * MiB, 1.0)
+    # 300 MiB/s during 2 extensions of 5 seconds.
+    assert policy.next_size(drive, 2 * GiB, CAPACITY) == 2 * GiB + 3000 * MiB
+
+
+def test_write_rate_max_chunk(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 2 * GiB, 1.0)
+    assert policy.next_size(drive, 2 * GiB, CAPACITY) == 2 * GiB + MAX_CHUNK
+
+
+def test_write_rate_capacity(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 2 * GiB, 1.0)
+    capacity = 10 * GiB
+    assert policy.next_size(drive, 8 * GiB, capacity) == (
+        drive.getMaxVolumeSize(capacity))
+
+
+def test_write_rate_latency(drive):
+    policy = extendpolicy.WriteRate(MAX_CHUNK, latency=5.0)
+    policy.extension_completed(drive, 1.0)
+    assert policy.latency == 3.0
+    policy.sample(drive, 0, 0.0)
+    policy.sample(drive, 500 * MiB, 1.0)
+    assert policy.next_size(drive, 2 * GiB, CAPACITY) == 2 * GiB + 3000 * MiB
+
+
+def simulate(policy, drive, trace, latency):
+    """
+    Simulate a guest writing to a thin volume, extended by policy.
+
+    trace is a list of write rates in bytes per second, one per second. The
+    volume is checked every second, and extensions complete after latency
+    seconds. If the guest writes beyond the end of the volume, the vm
+    pauses until the extension completes.
+
+    Returns the number of extensions and the number of seconds the vm was
+    paused.
+    """
+    physical = drive.volExtensionChunk
+    alloc = 0
+    extension = None
+    extensions = 0
+    paused = 0
+
+    for now, rate in enumerate(trace):
+        if extension is not None and now >= extension[0]:
+            physical = extension[1]
+            policy.extension_completed(drive, latency)
+            extension = None
+
+        if alloc + rate > physical:
+            alloc = physical
+            paused += 1
+        else:
+            alloc += rate
+
+        policy.sample(drive, alloc, float(now))
+
+        limit = policy.watermark_limit(drive)
+        if extension is None and physical - alloc < limit:
+            new_size = policy.next_size(drive, physical, CAPACITY)
+            extension = (now + latency, new_size)
+            extensions += 1
+
+    return extensions, paused
+
+
+# Idle period, then a burst of fast writes, then steady writes.
+TRACE = [0] * 10 + [400 * MiB] * 60 + [50 * MiB] * 60
+
+
+def test_simulate(drive):
+    results = {}
+    for name in (extendpolicy.FIXED, extendpolicy.WRITE_RATE):
+        policy = extendpolicy.create(name, MAX_CHUNK, latency=5.0)
+        results[name] = simulate(policy, drive, TRACE, latency=4)
+    fixed_extensions, fixed_paused = results[extendpolicy.FIXED]
+    rate_extensions, rate_paused = results[extendpolicy.WRITE_RATE]
+    print("fixed: extensions=%d paused=%d" % results[extendpolicy.FIXED])
+    print("write-rate: extensions=%d paused=%d" % (
+        results[extendpolicy.WRITE_RATE]))
+
+    assert fixed_paused > 0
+    assert rate_extensions < fixed_extensions
+    # Only the first extension of the burst is too late, since the write
+    # rate was not known yet.
+    assert rate_paused < fixed_paused
+    assert rate_paused <= 2
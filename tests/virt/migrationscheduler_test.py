@@ -0,0 +1,389 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+import time
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.common.units import MiB, GiB
+from vdsm.virt import migrationscheduler as ms
+
+
+class FakeMigration(object):
+
+    def __init__(self, vm_id, memory=1024, requested_bandwidth=0):
+        self.vm_id = vm_id
+        self.memory = memory
+        self.requested_bandwidth = requested_bandwidth
+        self.bandwidth = None
+        self.admitted = threading.Event()
+        self.done = threading.Event()
+
+    def apply_bandwidth(self, bandwidth):
+        self.bandwidth = bandwidth
+
+    def run(self, scheduler):
+        with scheduler.admitted(self):
+            self.admitted.set()
+            self.done.wait()
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timeout waiting for %s" % predicate)
+        time.sleep(0.005)
+
+
+def wait_until_stable(scheduler):
+    """
+    Wait until the scheduler admitted all the migrations it can.
+    """
+    def stable():
+        with scheduler._cond:
+            active = len(scheduler._active)
+            queued = len(scheduler._queued)
+        return active >= scheduler.limit or queued == 0
+    wait_for(stable)
+
+
+class Evacuation(object):
+    """
+    Start migrations in order, and run them in separate threads.
+    """
+
+    def __init__(self, scheduler, migrations):
+        self.scheduler = scheduler
+        self.migrations = migrations
+        self.threads = []
+
+    def __enter__(self):
+        for m in self.migrations:
+            t = concurrent.thread(m.run, args=(self.scheduler,))
+            t.start()
+            self.threads.append(t)
+            wait_for(lambda: self._known(m))
+        self.settle()
+        return self
+
+    def __exit__(self, *args):
+        for m in self.migrations:
+            m.done.set()
+        for t in self.threads:
+            t.join()
+
+    def finish(self, m):
+        m.done.set()
+        wait_for(lambda: not self._known(m))
+        self.settle()
+
+    def settle(self):
+        """
+        Wait until the scheduler admitted all the migrations it can, and the
+        admitted migrations are running.
+        """
+        wait_until_stable(self.scheduler)
+        for m in self.migrations:
+            with self.scheduler._cond:
+                active = m.vm_id in self.scheduler._active
+            if active:
+                wait_for(m.admitted.is_set)
+
+    def active(self):
+        return [m for m in self.migrations
+                if m.admitted.is_set() and not m.done.is_set()]
+
+    def _known(self, m):
+        with self.scheduler._cond:
+            return (m.vm_id in self.scheduler._active or
+                    m.vm_id in self.scheduler._queued)
+
+
+def admission_order(scheduler, migrations):
+    order = []
+    with Evacuation(scheduler, migrations) as evac:
+        while len(order) < len(migrations):
+            for m in evac.active():
+                if m.vm_id not in order:
+                    order.append(m.vm_id)
+            for m in evac.active():
+                evac.finish(m)
+    return order
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        ms.MigrationScheduler(1, policy='random')
+
+
+def test_fifo_order():
+    scheduler = ms.MigrationScheduler(1, policy=ms.POLICY_FIFO)
+    migrations = [
+        FakeMigration('vm1', memory=4096),
+        FakeMigration('vm2', memory=1024),
+        FakeMigration('vm3', memory=2048),
+    ]
+    order = admission_order(scheduler, migrations)
+    assert order == ['vm1', 'vm2', 'vm3']
+
+
+def test_memory_order():
+    scheduler = ms.MigrationScheduler(1, policy=ms.POLICY_MEMORY)
+    migrations = [
+        FakeMigration('vm1', memory=4096),
+        FakeMigration('vm2', memory=8192),
+        FakeMigration('vm3', memory=1024),
+        FakeMigration('vm4', memory=2048),
+    ]
+    order = admission_order(scheduler, migrations)
+    # vm1 is admitted before the others are queued.
+    assert order == ['vm1', 'vm3', 'vm4', 'vm2']
+
+
+def test_queue_info():
+    scheduler = ms.MigrationScheduler(1, policy=ms.POLICY_MEMORY)
+    migrations = [
+        FakeMigration('vm1', memory=1024),
+        FakeMigration('vm2', memory=4096),
+        FakeMigration('vm3', memory=2048),
+    ]
+    with Evacuation(scheduler, migrations):
+        assert scheduler.queue_info('vm1') is None
+        assert scheduler.queue_info('vm2') == {
+            'position': 2, 'queued': 2, 'active': 1, 'limit': 1}
+        assert scheduler.queue_info('vm3') == {
+            'position': 1, 'queued': 2, 'active': 1, 'limit': 1}
+
+
+def test_increase_bound_admits_waiting():
+    scheduler = ms.MigrationScheduler(1)
+    migrations = [FakeMigration('vm%d' % i) for i in range(3)]
+    with Evacuation(scheduler, migrations) as evac:
+        assert len(evac.active()) == 1
+        scheduler.bound = 3
+        evac.settle()
+        assert len(evac.active()) == 3
+
+
+def test_decrease_bound_waits_for_running():
+    scheduler = ms.MigrationScheduler(3)
+    migrations = [FakeMigration('vm%d' % i) for i in range(4)]
+    with Evacuation(scheduler, migrations) as evac:
+        assert len(evac.active()) == 3
+        scheduler.bound = 1
+        evac.finish(evac.active()[0])
+        evac.finish(evac.active()[0])
+        assert len(evac.active()) == 1
+        evac.finish(evac.active()[0])
+        assert len(evac.active()) == 1
+
+
+@pytest.mark.parametrize("budget,requested,shares", [
+    # Fair share for unlimited migrations.
+    (300, {'a': 0, 'b': 0, 'c': 0}, {'a': 100, 'b': 100, 'c': 100}),
+    # Unused bandwidth is given to the others.
+    (300, {'a': 50, 'b': 0, 'c': 0}, {'a': 50, 'b': 125, 'c': 125}),
+    # Never more than requested.
+    (300, {'a': 50, 'b': 60}, {'a': 50, 'b': 60}),
+    # Never less than 1 MiBps.
+    (1, {'a': 0, 'b': 0}, {'a': 1, 'b': 1}),
+])
+def test_bandwidth_shares(budget, requested, shares):
+    assert ms.bandwidth_shares(budget, requested) == shares
+
+
+def test_redistribute_host_bandwidth():
+    scheduler = ms.MigrationScheduler(2, host_bandwidth=200)
+    vm1 = FakeMigration('vm1', requested_bandwidth=500)
+    vm2 = FakeMigration('vm2', requested_bandwidth=500)
+    vm3 = FakeMigration('vm3', requested_bandwidth=50)
+    with Evacuation(scheduler, [vm1, vm2, vm3]) as evac:
+        assert vm1.bandwidth == 100
+        assert vm2.bandwidth == 100
+        evac.finish(vm1)
+        assert vm3.bandwidth == 50
+        assert vm2.bandwidth == 150
+        evac.finish(vm2)
+        assert vm3.bandwidth == 50
+
+
+def test_rebalance_after_requested_bandwidth_change():
+    scheduler = ms.MigrationScheduler(2, host_bandwidth=200)
+    vm1 = FakeMigration('vm1')
+    vm2 = FakeMigration('vm2')
+    with Evacuation(scheduler, [vm1, vm2]):
+        vm1.requested_bandwidth = 20
+        scheduler.rebalance()
+        assert vm1.bandwidth == 20
+        assert vm2.bandwidth == 180
+
+
+def test_no_bandwidth_redistribution_by_default():
+    scheduler = ms.MigrationScheduler(2)
+    vm1 = FakeMigration('vm1')
+    with Evacuation(scheduler, [vm1]):
+        assert vm1.bandwidth is None
+
+
+class TestConcurrencyController:
+
+    def feed(self, controller, throughput, samples=2):
+        for _ in range(samples):
+            limit = controller.limit
+            controller.update(limit, throughput(limit))
+
+    def test_grow_while_throughput_scales(self):
+        controller = ms.ConcurrencyController(8)
+        assert controller.limit == 2
+        for _ in range(10):
+            self.feed(controller, lambda n: n * 100 * MiB)
+        assert controller.limit == 8
+
+    def test_stop_when_network_saturated(self):
+        controller = ms.ConcurrencyController(8)
+        for _ in range(10):
+            self.feed(controller, lambda n: min(n, 4) * 100 * MiB)
+        assert controller.limit == 4
+
+    def test_bound(self):
+        controller = ms.ConcurrencyController(8)
+        controller.bound = 1
+        assert controller.limit == 1
+        for _ in range(10):
+            self.feed(controller, lambda n: n * 100 * MiB)
+        assert controller.limit == 1
+
+    def test_probe_again_after_ttl(self):
+        clock = FakeClock()
+        controller = ms.ConcurrencyController(8, ttl=60, clock=clock)
+        for _ in range(10):
+            self.feed(controller, lambda n: min(n, 4) * 100 * MiB)
+        assert controller.limit == 4
+
+        # More bandwidth is available now, but we need to wait until the
+        # old measurements expire.
+        for _ in range(10):
+            self.feed(controller, lambda n: n * 100 * MiB)
+        assert controller.limit == 4
+
+        clock.now += 61
+        for _ in range(10):
+            self.feed(controller, lambda n: n * 100 * MiB)
+        assert controller.limit == 8
+
+    def test_not_saturated(self):
+        controller = ms.ConcurrencyController(8)
+        for _ in range(10):
+            controller.update(1, 100 * MiB)
+        assert controller.limit == 2
+
+
+class FakeDomain(object):
+    """
+    A migrating domain transferring memory over a shared network.
+
+    Dirty pages must be sent again, so the migration converges only if it is
+    sent faster than the guest dirties its memory. The downtime is
+    increased when the migration does not converge, so eventually every
+    migration completes.
+    """
+
+    def __init__(self, vm_id, memory, dirty_rate):
+        self.migration = FakeMigration(vm_id, memory=memory)
+        self.remaining = memory * MiB
+        self.dirty_rate = dirty_rate * MiB
+
+    def transfer(self, rate, seconds):
+        progress = max(rate - self.dirty_rate, rate * 0.1)
+        self.remaining -= progress * seconds
+        return self.remaining <= 0
+
+
+def simulate_evacuation(scheduler, clock, domains, link=1000 * MiB,
+                        max_rate=300 * MiB, step=1):
+    """
+    Run migrations of fake domains over a network link, where a single
+    migration cannot use more than max_rate, and return the time it took to
+    migrate all the domains, in (simulated) seconds.
+    """
+    migrations = [d.migration for d in domains]
+    by_id = {d.migration.vm_id: d for d in domains}
+    with Evacuation(scheduler, migrations) as evac:
+        while True:
+            active = evac.active()
+            if not active:
+                return clock.now
+            rate = min(max_rate, link / len(active))
+            finished = []
+            for m in active:
+                if by_id[m.vm_id].transfer(rate, step):
+                    finished.append(m)
+                else:
+                    scheduler.report_throughput(m.vm_id, rate)
+                    # A report may raise the limit; wait for the admitted
+                    # migration so the next report sees it.
+                    evac.settle()
+            clock.now += step
+            for m in finished:
+                evac.finish(m)
+            evac.settle()
+
+
+def make_domains():
+    # A mix of small and big VMs, some of them busy.
+    sizes = [1, 2, 4, 8, 16]
+    dirty_rates = [10, 40, 80]
+    return [
+        FakeDomain('vm%02d' % i,
+                   sizes[i % len(sizes)] * GiB // MiB,
+                   dirty_rates[i % len(dirty_rates)])
+        for i in range(20)
+    ]
+
+
+@pytest.mark.slow
+def test_adaptive_evacuation_faster():
+    clock = FakeClock()
+    fixed = ms.MigrationScheduler(8, clock=clock)
+    fixed_time = simulate_evacuation(fixed, clock, make_domains())
+
+    clock = FakeClock()
+    adaptive = ms.MigrationScheduler(
+        8, policy=ms.POLICY_MEMORY, adaptive=True, clock=clock)
+    adaptive_time = simulate_evacuation(adaptive, clock, make_domains())
+
+    print("Evacuation time: fixed=%ds adaptive=%ds" % (
+        fixed_time, adaptive_time))
+    assert adaptive_time < fixed_time
@@ -26,6 +26,8 @@ import logging
 import threading
 import time
 
+import libvirt
+
 from vdsm import executor
 from vdsm import schedule
 from vdsm import throttledlog
@@ -400,6 +402,7 @@ class VmDispatcherTests(TestCaseBase):
         self._make_fake_vms()
 
         _Visitor.VMS.clear()
+        _Blocker.VMS = []
 
     @permutations(VM_IDS)
     def test_dispatch(self, failed_ids):
@@ -434,6 +437,197 @@ class VmDispatcherTests(TestCaseBase):
 
         assert set(skipped) == set(self.cif.getVMs().keys())
 
+    def test_dispatch_priority_and_keys(self):
+        vm_id = _fake_vm_id(0)
+        self.cif.vmContainer[vm_id].disk_devices = [
+            _FakeDrive('a', domainID='sd-1')]
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, periodic.UpdateVolumes, 0)
+        op()
+
+        dispatched = {op.vm_id: (priority, keys)
+                      for batch, priority, keys in exc.dispatched
+                      for op in batch.ops}
+        assert dispatched[vm_id] == (executor.PRIORITY_LOW, ('sd-1',))
+        assert dispatched[_fake_vm_id(1)] == (executor.PRIORITY_LOW, ())
+
+    def test_batches(self):
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, _Visitor, 1, batch_size=2,
+            clock=_FakeClock())
+        op()
+
+        assert [len(batch.ops) for batch, _, _ in exc.dispatched] == [2, 2, 1]
+        for vm_id in self.cif.getVMs():
+            assert _Visitor.VMS[vm_id] == 1
+
+        stats = op.stats()
+        assert stats["vms"] == VM_NUM
+        assert stats["tasks"] == 3
+        assert stats["slow"] == 0
+        assert stats["cycle_time"] == 0
+
+    def test_batch_keys(self):
+        self.cif.vmContainer[_fake_vm_id(0)].disk_devices = [
+            _FakeDrive('a', domainID='sd-1')]
+        self.cif.vmContainer[_fake_vm_id(1)].disk_devices = [
+            _FakeDrive('a', domainID='sd-2')]
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, periodic.UpdateVolumes, 1,
+            batch_size=VM_NUM)
+        op()
+
+        [(batch, priority, keys)] = exc.dispatched
+        assert priority == executor.PRIORITY_LOW
+        assert sorted(keys) == ['sd-1', 'sd-2']
+
+    def test_batch_priority(self):
+        vms = self.cif.getVMs()
+        ops = [periodic.UpdateVolumes(vms[_fake_vm_id(0)]),
+               periodic.DriveWatermarkMonitor(vms[_fake_vm_id(1)])]
+        disp = periodic.VmDispatcher(
+            self.cif.getVMs, _FakeExecutor(), periodic.UpdateVolumes, 1)
+        batch = periodic._Batch(disp, ops)
+        # The batch runs with the priority of its most urgent operation.
+        assert batch.priority == executor.PRIORITY_HIGH
+
+    def test_batch_name(self):
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, periodic.UpdateVolumes, 1, batch_size=2)
+        op()
+        # The executor reports queue wait time per operation type.
+        for batch, _, _ in exc.dispatched:
+            task = executor.Task(batch, 1)
+            assert task.name == "UpdateVolumes"
+
+    def test_batch_timeout(self):
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, _Visitor, 1.5, batch_size=2,
+            clock=_FakeClock())
+        op()
+        # The last operation of a batch may start just before the batch
+        # timeout, and needs its own timeout.
+        assert exc.timeouts == [3.0, 3.0, 1.5]
+
+    def test_slow_lane(self):
+        clock = _FakeClock()
+        slow_id = _fake_vm_id(1)
+        _Sleeper.DELAYS = {slow_id: 2}
+        _Sleeper.CLOCK = clock
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, _Sleeper, 1, batch_size=VM_NUM,
+            clock=clock)
+
+        # The slow vm is moved to the slow lane.
+        op()
+        assert op.stats()["slow"] == 1
+        assert op.stats()["cycle_time"] == 2
+
+        # And handled in a separate task.
+        exc.dispatched = []
+        _Sleeper.DELAYS = {}
+        op()
+        ops = [[o.vm_id for o in batch.ops] for batch, _, _ in exc.dispatched]
+        assert ops[0] == [slow_id]
+        assert sorted(ops[1]) == sorted(
+            set(self.cif.getVMs()) - {slow_id})
+
+        # The operation completed in time, so the vm is back.
+        assert op.stats()["slow"] == 0
+        exc.dispatched = []
+        op()
+        assert len(exc.dispatched) == 1
+
+    def test_split_batch(self):
+        clock = _FakeClock()
+        # Every operation takes 0.5 second, the batch timeout expires after
+        # the third vm.
+        _Sleeper.DELAYS = {vm_id: 0.5 for vm_id in self.cif.getVMs()}
+        _Sleeper.CLOCK = clock
+        exc = _FakeExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, _Sleeper, 1, batch_size=VM_NUM,
+            clock=clock)
+        op()
+
+        assert [len(batch.ops) for batch, _, _ in exc.dispatched] == [
+            VM_NUM, VM_NUM - 3]
+        assert op.stats()["slow"] == 0
+        assert op.stats()["cycle_time"] == VM_NUM * 0.5
+
+    def test_blocked_vm(self):
+        clock = _FakeClock()
+        blocked_id = _fake_vm_id(1)
+        _Blocker.BLOCKED = blocked_id
+        _Blocker.started = threading.Event()
+        _Blocker.release = threading.Event()
+        exc = _QueueExecutor()
+        op = periodic.VmDispatcher(
+            self.cif.getVMs, exc, _Blocker, 1, batch_size=VM_NUM,
+            clock=clock)
+        op()
+
+        [batch] = exc.dispatched
+        t = threading.Thread(target=batch)
+        t.start()
+        try:
+            assert _Blocker.started.wait(5)
+
+            # Next cycle, the operation is still blocked.
+            clock.now += 2
+            exc.dispatched = []
+            op()
+            assert op.stats()["slow"] == 1
+            ops = [[o.vm_id for o in b.ops] for b in exc.dispatched]
+            assert ops[0] == [blocked_id]
+            assert blocked_id not in ops[1]
+        finally:
+            _Blocker.release.set()
+            t.join()
+
+        # The blocked batch was cancelled, the rest of the vms are handled
+        # by the new batch.
+        assert _Blocker.VMS == [_fake_vm_id(0), blocked_id]
+
+    @pytest.mark.slow
+    def test_benchmark(self):
+        for i in range(VM_NUM, 500):
+            vm_id = _fake_vm_id(i)
+            self.cif.vmContainer[vm_id] = _FakeVM(vm_id, vm_id)
+        sched = schedule.Scheduler(name="test.Scheduler",
+                                   clock=monotonic_time)
+        sched.start()
+        try:
+            for batch_size in (1, 10, 50):
+                exc = executor.Executor(name="test.Executor",
+                                        workers_count=4,
+                                        max_tasks=1000,
+                                        scheduler=sched)
+                exc.start()
+                try:
+                    op = periodic.VmDispatcher(
+                        self.cif.getVMs, exc, _Nop, 1, batch_size=batch_size)
+                    cycles = 20
+                    start = time.process_time()
+                    for i in range(cycles):
+                        op()
+                        while op.stats()["cycle_time"] is None:
+                            time.sleep(0.001)
+                        op._last_cycle_time = None
+                    cpu_time = time.process_time() - start
+                finally:
+                    exc.stop(wait=True)
+                print("batch_size=%d tasks=%d cpu_time=%.3f" % (
+                    batch_size, op.stats()["tasks"] * cycles, cpu_time))
+        finally:
+            sched.stop(wait=True)
+
     def _check_dispatching(self, skip_ids):
         op = periodic.VmDispatcher(
             self.cif.getVMs, _FakeExecutor(), _Visitor, 0)
@@ -498,13 +692,78 @@ class _Nop(periodic._RunnableOnVm):
         pass
 
 
+class _Sleeper(periodic._RunnableOnVm):
+    """
+    Advance CLOCK by DELAYS[vm_id] seconds.
+    """
+
+    DELAYS = {}
+    CLOCK = None
+
+    @property
+    def required(self):
+        return True
+
+    @property
+    def runnable(self):
+        return True
+
+    def _execute(self):
+        self.CLOCK.now += self.DELAYS.get(self._vm.id, 0)
+
+
+class _Blocker(periodic._RunnableOnVm):
+    """
+    Block on the BLOCKED vm until released.
+    """
+
+    BLOCKED = None
+    VMS = []
+    started = None
+    release = None
+
+    @property
+    def required(self):
+        return True
+
+    @property
+    def runnable(self):
+        return True
+
+    def _execute(self):
+        _Blocker.VMS.append(self._vm.id)
+        if self._vm.id == self.BLOCKED:
+            self.started.set()
+            self.release.wait(5)
+
+
+class _FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class _QueueExecutor(object):
+
+    def __init__(self):
+        self.dispatched = []
+
+    def dispatch(self, func, timeout, discard=True, priority=None,
+                 keys=()):
+        self.dispatched.append(func)
+
+
 class _RecoveringExecutor(object):
 
     def __init__(self, tries_before_success=None):
         self._tries_before_success = max(0, tries_before_success)
         self.attempts = 0
 
-    def dispatch(self, func, timeout, discard=True):
+    def dispatch(self, func, timeout, discard=True, priority=None,
+                 keys=()):
         self.attempts += 1
         exhausted = self._tries_before_success > 0
         if exhausted:
@@ -529,8 +788,13 @@ class _FakeExecutor(object):
         self._max_attempts = max_attempts
         self.attempts = 0
         self.done = threading.Event()
+        self.dispatched = []
+        self.timeouts = []
 
-    def dispatch(self, func, timeout, discard=True):
+    def dispatch(self, func, timeout, discard=True, priority=None,
+                 keys=()):
+        self.dispatched.append((func, priority, keys))
+        self.timeouts.append(timeout)
         if (self._max_attempts is not None and
            self.attempts == self._max_attempts):
             self.done.set()
@@ -556,6 +820,7 @@ class _FakeVM(object):
         self.post_copy = migration.PostCopyPhase.NONE
         self.disk_devices = []
         self.updated_drives = []
+        self.drive_monitor = _FakeDriveMonitor()
 
     def isDomainReadyForCommands(self):
         return True
@@ -573,11 +838,62 @@ class _FakeVM(object):
         self.updated_drives.append(vmDrive)
 
 
+class _FakeDriveMonitor(object):
+
+    def __init__(self):
+        self.needed = False
+        self.block_stats = None
+
+    def enabled(self):
+        return True
+
+    def monitoring_needed(self):
+        return self.needed
+
+    def update_block_stats(self, stats, timestamp):
+        self.block_stats = stats
+
+
+class _FakeDom(object):
+
+    def __init__(self, vm_id):
+        self._dom = self
+        self._vm_id = vm_id
+
+    def UUIDString(self):
+        return self._vm_id
+
+
+class _FakeConnection(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+        self.flags = None
+        self.release = None
+
+    def domainListGetStats(self, doms, stats=0, flags=0):
+        self.calls.append([dom.UUIDString() for dom in doms])
+        self.flags = flags
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return [(dom, {'block.count': 0, 'vm': dom.UUIDString()})
+                for dom in doms]
+
+
 class _FakeDrive(object):
 
-    def __init__(self, name, readonly=False):
+    def __init__(self, name, readonly=False, domainID=None):
         self.name = name
         self.readonly = readonly
+        if domainID is not None:
+            self.domainID = domainID
+            self.imageID = self.poolID = self.volumeID = 'uuid'
+
+    def __contains__(self, attr):
+        return hasattr(self, attr)
 
 
 class PeriodicActionTests(TestCaseBase):
@@ -589,3 +905,122 @@ class PeriodicActionTests(TestCaseBase):
         vm.disk_devices = [ro_drive, rw_drive]
         periodic.UpdateVolumes(vm)._execute()
         assert [d.name for d in vm.updated_drives] == [rw_drive.name]
+
+    def test_update_volumes_keys(self):
+        vm = _FakeVM('123', 'test')
+        vm.disk_devices = [
+            _FakeDrive('a', domainID='sd-1'),
+            _FakeDrive('b', domainID='sd-2'),
+            _FakeDrive('c', domainID='sd-1'),
+            _FakeDrive('ro', readonly=True, domainID='sd-3'),
+            _FakeDrive('cdrom'),
+        ]
+        op = periodic.UpdateVolumes(vm)
+        assert sorted(op.keys) == ['sd-1', 'sd-2']
+        assert op.priority == executor.PRIORITY_LOW
+
+    def test_drive_watermark_sampler(self):
+        vms = {}
+        for vm_id, needed in (('1', True), ('2', False), ('3', True)):
+            vm = _FakeVM(vm_id, vm_id)
+            vm._dom = _FakeDom(vm_id)
+            vm.drive_monitor.needed = needed
+            vms[vm_id] = vm
+        conn = _FakeConnection()
+        dispatched = []
+
+        sampler = periodic.DriveWatermarkSampler(
+            conn, lambda: vms, lambda: dispatched.append(True))
+        sampler()
+
+        # One libvirt call for all vms needing monitoring.
+        assert [sorted(ids) for ids in conn.calls] == [['1', '3']]
+        assert vms['1'].drive_monitor.block_stats['vm'] == '1'
+        assert vms['2'].drive_monitor.block_stats is None
+        assert vms['3'].drive_monitor.block_stats['vm'] == '3'
+        assert dispatched == [True]
+
+    def test_drive_watermark_sampler_no_vms(self):
+        conn = _FakeConnection()
+        dispatched = []
+        sampler = periodic.DriveWatermarkSampler(
+            conn, lambda: {}, lambda: dispatched.append(True))
+        sampler()
+        assert conn.calls == []
+        assert dispatched == [True]
+
+    def test_drive_watermark_sampler_error(self):
+        vm = _FakeVM('1', '1')
+        vm._dom = _FakeDom('1')
+        vm.drive_monitor.needed = True
+        conn = _FakeConnection(error=libvirt.libvirtError("error"))
+        dispatched = []
+        sampler = periodic.DriveWatermarkSampler(
+            conn, lambda: {'1': vm}, lambda: dispatched.append(True))
+        sampler()
+        # Drive monitoring is dispatched, falling back to blockInfo().
+        assert vm.drive_monitor.block_stats is None
+        assert dispatched == [True]
+
+    def test_drive_watermark_sampler_nowait(self):
+        vm = _FakeVM('1', '1')
+        vm._dom = _FakeDom('1')
+        vm.drive_monitor.needed = True
+        conn = _FakeConnection()
+        sampler = periodic.DriveWatermarkSampler(
+            conn, lambda: {'1': vm}, lambda: None)
+        with MonkeyPatchScope([(periodic, '_NOWAIT_ENABLED', True)]):
+            sampler()
+        assert conn.flags & libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_NOWAIT
+
+    def test_drive_watermark_sampler_skip_not_ready(self):
+        vms = {}
+        for vm_id in ('1', '2'):
+            vm = _FakeVM(vm_id, vm_id)
+            vm._dom = _FakeDom(vm_id)
+            vm.drive_monitor.needed = True
+            vms[vm_id] = vm
+        vms['2'].isDomainReadyForCommands = lambda: False
+        conn = _FakeConnection()
+        sampler = periodic.DriveWatermarkSampler(
+            conn, lambda: vms, lambda: None)
+        sampler()
+        # Skipped for a while, even if ready now.
+        vms['2'].isDomainReadyForCommands = lambda: True
+        sampler()
+        assert conn.calls == [['1'], ['1']]
+
+    def test_drive_watermark_sampler_stuck(self):
+        vm = _FakeVM('1', '1')
+        vm._dom = _FakeDom('1')
+        vm.drive_monitor.needed = True
+        conn = _FakeConnection()
+        conn.release = threading.Event()
+        dispatched = []
+        sampler = periodic.DriveWatermarkSampler(
+            conn, lambda: {'1': vm}, lambda: dispatched.append(True),
+            timeout=0.05)
+        try:
+            # Drive monitoring is dispatched while sampling is stuck.
+            sampler()
+            assert dispatched == [True]
+            # Sampling is skipped until the stuck call returns.
+            sampler()
+            assert dispatched == [True, True]
+            assert len(conn.calls) == 1
+        finally:
+            conn.release.set()
+
+        # Sampling resumes when the stuck call returns.
+        conn.release = None
+        deadline = time.monotonic() + 5
+        while len(conn.calls) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+            sampler()
+
+    def test_priorities(self):
+        vm = _FakeVM('123', 'test')
+        assert (periodic.DriveWatermarkMonitor(vm).priority <
+                periodic.BlockjobMonitor(vm).priority <
+                periodic.UpdateVolumes(vm).priority)
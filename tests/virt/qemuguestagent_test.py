@@ -163,6 +163,9 @@ class FakeVM(object):
         return libvirt_qemu.qemuAgentCommand(
             self._dom, command, timeout, flags)
 
+    def pooled_dom(self, affinity):
+        return self._dom
+
     @contextmanager
     def qga_context(self, timeout=-1):
         yield
@@ -24,6 +24,7 @@ from contextlib import contextmanager
 import io
 import subprocess
 import tarfile
+import tempfile
 import time
 import uuid
 import zipfile
@@ -88,6 +89,14 @@ class FakeIRS(object):
         return 0
 
 
+class FakeProc(object):
+
+    def __init__(self, output):
+        self.stdout = tempfile.TemporaryFile()
+        self.stdout.write(output)
+        self.stdout.seek(0)
+
+
 def read_ovf(ovf_path):
     return u"""<?xml version="1.0" encoding="UTF-8"?>
 <Envelope xmlns="http://schemas.dmtf.org/ovf/envelope/1"
@@ -338,6 +347,69 @@ class v2vTests(TestCaseBase):
             (v2v.DiskProgress(50)),
             (v2v.DiskProgress(100))]
 
+    def testOutputParserParallel(self):
+        output = (b'[   0.0] preparing for copy\n'
+                  b'[   0.0] Copying 3 disks, 2 in parallel\n'
+                  b'[   0.1] Copying disk 1/3 to /tmp/v2v/0000000...\n'
+                  b'    (disk 1/3: 0/100%)\r'
+                  b'[   0.1] Copying disk 2/3 to /tmp/v2v/1000000...\n'
+                  b'    (disk 2/3: 0/100%)\r'
+                  b'    (disk 1/3: 50/100%)\r'
+                  b'    (disk 2/3: 100/100%)\r'
+                  b'[   2.0] Copying disk 3/3 to /tmp/v2v/2000000...\n'
+                  b'    (disk 3/3: 0/100%)\r'
+                  b'    (disk 1/3: 100/100%)\r'
+                  b'    (disk 3/3: 100/100%)\r'
+                  b'[   4.0] Finishing off\n')
+
+        parser = v2v.OutputParser()
+        events = list(parser.parse(io.BytesIO(output)))
+        assert events == [
+            v2v.ImportProgress(1, 3, b'Copying disk 1/3'),
+            v2v.ParallelDiskProgress(1, 0),
+            v2v.ImportProgress(2, 3, b'Copying disk 2/3'),
+            v2v.ParallelDiskProgress(2, 0),
+            v2v.ParallelDiskProgress(1, 50),
+            v2v.ParallelDiskProgress(2, 100),
+            v2v.ImportProgress(3, 3, b'Copying disk 3/3'),
+            v2v.ParallelDiskProgress(3, 0),
+            v2v.ParallelDiskProgress(1, 100),
+            v2v.ParallelDiskProgress(3, 100)]
+
+    def testOutputParserParallelClosed(self):
+        output = (b'[   0.1] Copying disk 1/2 to /tmp/v2v/0000000...\n'
+                  b'    (disk 1/2: 0/100%)\r'
+                  b'[   0.1] Copying disk 2/2 to /tmp/v2v/1000000...\n'
+                  b'    (disk 1/2: 100/100%)\r')
+
+        parser = v2v.OutputParser()
+        with pytest.raises(v2v.OutputParserError):
+            list(parser.parse(io.BytesIO(output)))
+
+    def testImportProgressParallel(self):
+        output = (b'[   0.1] Copying disk 1/2 to /tmp/v2v/0000000...\n'
+                  b'    (disk 1/2: 40/100%)\r'
+                  b'[   0.1] Copying disk 2/2 to /tmp/v2v/1000000...\n'
+                  b'    (disk 2/2: 20/100%)\r')
+        job = v2v.ImportVm(self.job_id, None)
+        job._proc = FakeProc(output)
+        with pytest.raises(v2v.OutputParserError):
+            job._watch_process_output()
+        assert job.progress == 30
+        assert job.disks_progress == [40, 20]
+
+    def testImportProgressSequential(self):
+        output = (b'[  88.0] Copying disk 1/3 to /tmp/v2v/0000000...\n'
+                  b'    (100/100%)\r'
+                  b'[ 180.0] Copying disk 2/3 to /tmp/v2v/100000-...\n'
+                  b'    (50/100%)\r')
+        job = v2v.ImportVm(self.job_id, None)
+        job._proc = FakeProc(output)
+        with pytest.raises(v2v.OutputParserError):
+            job._watch_process_output()
+        assert job.progress == 50
+        assert job.disks_progress == [100, 50, 0]
+
     def testGetExternalVMsWithoutDisksInfo(self):
         def internal_error(name):
             raise fake.Error(libvirt.VIR_ERR_INTERNAL_ERROR)
@@ -1381,6 +1381,63 @@ class FreezingUnexpectedErrorTests(TestCaseBase):
         assert res == response.error("thawErr", message="fake error")
 
 
+class FakePooledConnection(object):
+
+    class stats:
+        name = "monitoring/0"
+
+    def __init__(self):
+        self.lookups = []
+
+    def lookupByUUIDString(self, vm_id):
+        self.lookups.append(vm_id)
+        return fake.Domain()
+
+
+class TestPooledDom(TestCaseBase):
+
+    def test_pool_disabled(self):
+        with fake.VM() as testvm:
+            testvm._dom = fake.Domain()
+            with MonkeyPatchScope([
+                (libvirtconnection, 'pooled', lambda affinity: None),
+            ]):
+                dom = testvm.pooled_dom(libvirtconnection.MONITORING)
+            assert dom is testvm._dom
+
+    def test_pool_enabled(self):
+        conn = FakePooledConnection()
+        with fake.VM() as testvm:
+            testvm._dom = fake.Domain()
+            with MonkeyPatchScope([
+                (libvirtconnection, 'pooled', lambda affinity: conn),
+            ]):
+                dom = testvm.pooled_dom(libvirtconnection.MONITORING)
+                assert dom is not testvm._dom
+                assert isinstance(dom, virdomain.Notifying)
+
+                # The domain is looked up once.
+                same = testvm.pooled_dom(libvirtconnection.MONITORING)
+                assert same is dom
+                assert conn.lookups == [testvm.id]
+
+                # Until the vm domain is replaced.
+                testvm._dom = fake.Domain()
+                testvm.pooled_dom(libvirtconnection.MONITORING)
+                assert conn.lookups == [testvm.id, testvm.id]
+
+    def test_not_connected(self):
+        conn = FakePooledConnection()
+        with fake.VM() as testvm:
+            testvm._dom = virdomain.Disconnected(testvm.id)
+            with MonkeyPatchScope([
+                (libvirtconnection, 'pooled', lambda affinity: conn),
+            ]):
+                dom = testvm.pooled_dom(libvirtconnection.MONITORING)
+            assert dom is testvm._dom
+            assert conn.lookups == []
+
+
 def err_no_domain():
     error = libvirt.libvirtError("No such domain")
     error.err = [libvirt.VIR_ERR_NO_DOMAIN]
@@ -0,0 +1,243 @@
+#
+# Copyright 2020 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301  USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import threading
+import time
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.virt import vmcreation
+
+log = logging.getLogger("test")
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Concurrency(object):
+    """
+    Track the maximum number of concurrent calls by key.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.running = {}
+        self.max = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, key):
+        with self._lock:
+            self.calls.append(key)
+            self.running[key] = self.running.get(key, 0) + 1
+            self.max[key] = max(self.max.get(key, 0), self.running[key])
+        time.sleep(self.delay)
+        with self._lock:
+            self.running[key] -= 1
+
+
+def test_stage_limit():
+    stage = vmcreation.Stage("test", 2, target=60)
+    tracker = Concurrency()
+
+    def run(i):
+        with stage.run(log):
+            tracker("stage")
+
+    list(concurrent.tmap(run, range(6), max_workers=6))
+    assert tracker.max["stage"] == 2
+    stats = stage.stats()
+    assert stats["count"] == 6
+    assert stats["limit"] == 2
+
+
+def test_stage_adaptive():
+    clock = FakeClock()
+    stage = vmcreation.Stage("test", 8, target=60, clock=clock)
+
+    def run(elapsed):
+        with stage.run(log):
+            clock.now += elapsed
+
+    run(61)
+    assert stage.limit == 4
+    run(120)
+    assert stage.limit == 2
+    run(120)
+    run(120)
+    assert stage.limit == 1
+
+    # Recover slowly when the stage is fast again.
+    for expected in range(2, 9):
+        run(10)
+        assert stage.limit == expected
+    run(10)
+    assert stage.limit == 8
+
+    stats = stage.stats()
+    assert stats["count"] == 12
+    assert stats["max"] == 120
+
+
+def test_stage_adaptive_min_concurrency():
+    clock = FakeClock()
+    stage = vmcreation.Stage("test", 8, target=60, min_concurrency=3,
+                             clock=clock)
+
+    def run(elapsed):
+        with stage.run(log):
+            clock.now += elapsed
+
+    run(61)
+    assert stage.limit == 4
+    # Slow vms do not lower the limit below the minimum.
+    run(120)
+    assert stage.limit == 3
+    run(120)
+    assert stage.limit == 3
+
+
+def test_stage_limit_lowered_while_running():
+    clock = FakeClock()
+    stage = vmcreation.Stage("test", 2, target=60, clock=clock)
+    with stage.run(log):
+        with stage.run(log):
+            clock.now += 61
+        assert stage.limit == 1
+    # All slots were released, the stage is usable.
+    with stage.run(log):
+        pass
+    assert stage.limit == 2
+
+
+def test_stages_overlap():
+    prepare = vmcreation.Stage("prepare", 1, target=60)
+    create = vmcreation.Stage("create", 1, target=60)
+    creating = threading.Event()
+    release = threading.Event()
+    prepared = []
+
+    def start_vm(i):
+        with prepare.run(log):
+            prepared.append(i)
+        with create.run(log):
+            creating.set()
+            release.wait(5)
+
+    t = concurrent.thread(start_vm, args=(1,))
+    t.start()
+    try:
+        assert creating.wait(5)
+        # The next vm is prepared while the first is created.
+        with prepare.run(log):
+            prepared.append(2)
+        assert prepared == [1, 2]
+    finally:
+        release.set()
+        t.join()
+
+
+def test_prepare_drives_concurrently():
+    drives = [{"domainID": "sd%d" % i} for i in range(4)]
+    barrier = threading.Barrier(4, timeout=5)
+
+    def prepare(drive):
+        # Fails unless all drives are prepared concurrently.
+        barrier.wait()
+        drive["path"] = "/path/" + drive["domainID"]
+
+    vmcreation.prepare_drives(
+        drives, prepare, log, limiter=vmcreation.DriveLimiter(4))
+    assert [d["path"] for d in drives] == [
+        "/path/sd0", "/path/sd1", "/path/sd2", "/path/sd3"]
+
+
+def test_prepare_drives_per_domain_limit():
+    drives = ([{"domainID": "sd1"} for _ in range(4)] +
+              [{"domainID": "sd2"} for _ in range(4)] +
+              [{"path": "/payload"}])
+    tracker = Concurrency()
+
+    def prepare(drive):
+        tracker(drive.get("domainID"))
+
+    vmcreation.prepare_drives(
+        drives, prepare, log, limiter=vmcreation.DriveLimiter(2))
+    assert tracker.max["sd1"] == 2
+    assert tracker.max["sd2"] == 2
+    assert len(tracker.calls) == len(drives)
+
+
+def test_prepare_drives_first_error():
+    drives = [{"domainID": "sd%d" % i, "index": i} for i in range(3)]
+    started = threading.Event()
+
+    def prepare(drive):
+        if drive["index"] == 1:
+            started.set()
+            time.sleep(0.05)
+            raise RuntimeError("drive 1")
+        if drive["index"] == 2:
+            started.wait(5)
+            raise ValueError("drive 2")
+
+    # The error of the first drive is raised, even if it failed last.
+    with pytest.raises(RuntimeError):
+        vmcreation.prepare_drives(
+            drives, prepare, log, limiter=vmcreation.DriveLimiter(1))
+
+
+def test_prepare_drives_error_skips_waiting_drives():
+    drives = [{"domainID": "sd1"} for _ in range(4)]
+    calls = []
+
+    def prepare(drive):
+        calls.append(drive)
+        raise RuntimeError("storage failure")
+
+    with pytest.raises(RuntimeError):
+        vmcreation.prepare_drives(
+            drives, prepare, log, limiter=vmcreation.DriveLimiter(1))
+
+    # The drives waiting for the storage domain are not prepared.
+    assert len(calls) == 1
+
+
+def test_prepare_drives_empty():
+    vmcreation.prepare_drives([], None, log)
+
+
+def test_stats():
+    stats = vmcreation.stats()
+    assert set(stats) == {"prepare", "create", "drives"}
+    assert stats["prepare"]["limit"] >= 1
+    assert stats["create"]["limit"] >= 1
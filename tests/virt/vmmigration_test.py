@@ -23,9 +23,11 @@ from __future__ import division
 from __future__ import print_function
 
 from itertools import tee, product
+import copy
 import logging
 import socket
 import threading
+import time
 import uuid
 
 import libvirt
@@ -320,6 +322,9 @@ class FakeVM(object):
     def min_cluster_version(self, major, minor):
         return False
 
+    def pooled_dom(self, affinity):
+        return self._dom
+
     def status(self):
         return self.conf
 
@@ -489,6 +494,129 @@ class SourceThreadTests(TestCaseBase):
         assert src.tunneled
 
 
+class FakeDowntimeDomain(FakeMigratingDomain):
+
+    def __init__(self):
+        super(FakeDowntimeDomain, self).__init__()
+        self.downtimes = []
+
+    def migrateSetMaxDowntime(self, value, flags):
+        self.downtimes.append(value)
+
+
+class FakeMonitoredVM(FakeVM):
+
+    def __init__(self, dom):
+        super(FakeMonitoredVM, self).__init__(dom)
+        self.job_stats_calls = 0
+        self.iteration = 0
+
+    def job_stats(self):
+        self.job_stats_calls += 1
+        return {
+            'type': libvirt.VIR_DOMAIN_JOB_UNBOUNDED,
+            'operation': libvirt.VIR_DOMAIN_JOB_OPERATION_MIGRATION_OUT,
+            libvirt.VIR_DOMAIN_JOB_TIME_ELAPSED: 42,
+            libvirt.VIR_DOMAIN_JOB_DATA_TOTAL: 8192,
+            libvirt.VIR_DOMAIN_JOB_DATA_PROCESSED: 0,
+            libvirt.VIR_DOMAIN_JOB_DATA_REMAINING: 8192,
+            libvirt.VIR_DOMAIN_JOB_MEMORY_TOTAL: 1024,
+            libvirt.VIR_DOMAIN_JOB_MEMORY_PROCESSED: 512,
+            libvirt.VIR_DOMAIN_JOB_MEMORY_REMAINING: 512,
+            'memory_dirty_rate': 2,
+            'memory_iteration': self.iteration,
+        }
+
+    def send_migration_status_event(self):
+        pass
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timeout waiting for %s' % predicate)
+        time.sleep(0.01)
+
+
+class TestMonitorThreadEvents(TestCaseBase):
+
+    SCHEDULE = {
+        'init': [{'name': 'setDowntime', 'params': ['100']}],
+        'stalling': [
+            {'limit': 1, 'action': {'name': 'setDowntime',
+                                    'params': ['200']}},
+            {'limit': 2, 'action': {'name': 'setDowntime',
+                                    'params': ['300']}},
+            {'limit': -1, 'action': {'name': 'abort', 'params': []}},
+        ],
+    }
+
+    def setUp(self):
+        self.dom = FakeDowntimeDomain()
+        self.vm = FakeMonitoredVM(self.dom)
+        self.monitor = migration.MonitorThread(
+            self.vm, time.time(), copy.deepcopy(self.SCHEDULE))
+
+    def _iterations(self):
+        return len(self.monitor.timeline.entries)
+
+    def test_iteration_event_drives_schedule(self):
+        # Polling is practically disabled, only events should wake up the
+        # monitor thread.
+        with MonkeyPatchScope([
+            (migration.MonitorThread, '_MIGRATION_MONITOR_INTERVAL', 600),
+        ]):
+            self.monitor.start()
+            try:
+                _wait_for(lambda: self.dom.downtimes == [100])
+
+                # The first event triggers a poll establishing the
+                # initial iteration.
+                self.vm.iteration = 5
+                self.monitor.on_iteration(5)
+                _wait_for(lambda: self.vm.job_stats_calls == 1)
+
+                for iteration in (6, 7, 8):
+                    self.monitor.on_iteration(iteration)
+                    _wait_for(lambda: self._iterations() == iteration - 5)
+            finally:
+                self.monitor.stop()
+                self.monitor.join()
+
+        assert self.dom.downtimes == [100, 200, 300]
+        # Iterations were handled without polling libvirt again.
+        assert self.vm.job_stats_calls == 1
+
+    def test_timeline_records_downtime(self):
+        with MonkeyPatchScope([
+            (migration.MonitorThread, '_MIGRATION_MONITOR_INTERVAL', 600),
+        ]):
+            self.monitor.start()
+            try:
+                self.monitor.on_iteration(0)
+                _wait_for(lambda: self.vm.job_stats_calls == 1)
+                for iteration in (1, 2, 3):
+                    self.monitor.on_iteration(iteration)
+                    _wait_for(lambda: self._iterations() == iteration)
+            finally:
+                self.monitor.stop()
+                self.monitor.join()
+
+        info = self.monitor.timeline.info()
+        assert [e['iteration'] for e in info] == [1, 2, 3]
+        # Downtime in effect when the iteration was reported.
+        assert [e['downtime'] for e in info] == [100, 100, 200]
+        assert info[0]['dirty_rate'] == 2
+        assert str(self.monitor.timeline)
+
+    def test_old_iteration_event_ignored(self):
+        # The monitor thread is not running, so events are not consumed.
+        self.monitor.on_iteration(5)
+        self.monitor.on_iteration(3)
+        assert self.monitor._reported_iteration == 5
+
+
 # stolen^Wborrowed from itertools recipes
 def pairwise(iterable):
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
@@ -505,6 +633,17 @@ def _linear_downtime(downtime, steps):
         yield max(1, downtime * (i + 1) / steps)
 
 
+@pytest.mark.parametrize("policy,expected", [
+    ("memory", "memory"),
+    ("fifo", "fifo"),
+    ("no-such-policy", "fifo"),
+])
+def test_scheduling_policy(policy, expected):
+    cfg = make_config([('vars', 'migration_scheduling_policy', policy)])
+    with MonkeyPatchScope([(migration, 'config', cfg)]):
+        assert migration._scheduling_policy() == expected
+
+
 class CannonizeHostPortTest(TestCaseBase):
 
     def test_no_arguments(self):